@@ -24,8 +24,6 @@ from nova.api.openstack import extensions
 from nova.api.openstack import wsgi
 from nova.api.openstack import xmlutil
 from nova.compute import api
-from nova.compute import flavors
-from nova import exception
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import timeutils
 
@@ -69,108 +67,69 @@ class SimpleTenantUsagesTemplate(xmlutil.TemplateBuilder):
 
 
 class SimpleTenantUsageController(object):
-    def _hours_for(self, instance, period_start, period_stop):
-        launched_at = instance['launched_at']
-        terminated_at = instance['terminated_at']
-        if terminated_at is not None:
-            if not isinstance(terminated_at, datetime.datetime):
-                terminated_at = timeutils.parse_strtime(terminated_at,
-                                                        "%Y-%m-%d %H:%M:%S.%f")
-
-        if launched_at is not None:
-            if not isinstance(launched_at, datetime.datetime):
-                launched_at = timeutils.parse_strtime(launched_at,
-                                                      "%Y-%m-%d %H:%M:%S.%f")
-
-        if terminated_at and terminated_at < period_start:
-            return 0
-        # nothing if it started after the usage report ended
-        if launched_at and launched_at > period_stop:
-            return 0
-        if launched_at:
-            # if instance launched after period_started, don't charge for first
-            start = max(launched_at, period_start)
-            if terminated_at:
-                # if instance stopped before period_stop, don't charge after
-                stop = min(period_stop, terminated_at)
-            else:
-                # instance is still running, so charge them up to current time
-                stop = period_stop
-            dt = stop - start
-            seconds = (dt.days * 3600 * 24 + dt.seconds +
-                       dt.microseconds / 100000.0)
-
-            return seconds / 3600.0
-        else:
-            # instance hasn't launched, so no charge
-            return 0
-
-    def _get_flavor(self, context, compute_api, instance, flavors_cache):
-        """Get flavor information from the instance's system_metadata,
-        allowing a fallback to lookup by-id for deleted instances only.
-        """
-        try:
-            return flavors.extract_flavor(instance)
-        except KeyError:
-            if not instance['deleted']:
-                # Only support the fallback mechanism for deleted instances
-                # that would have been skipped by migration #153
-                raise
-
-        flavor_type = instance['instance_type_id']
-        if flavor_type in flavors_cache:
-            return flavors_cache[flavor_type]
-
-        try:
-            it_ref = compute_api.get_instance_type(context, flavor_type)
-            flavors_cache[flavor_type] = it_ref
-        except exception.FlavorNotFound:
-            # can't bill if there is no instance type
-            it_ref = None
-
-        return it_ref
+    def _make_summary(self, tenant_id, period_start, period_stop, detailed):
+        summary = {}
+        summary['tenant_id'] = tenant_id
+        if detailed:
+            summary['server_usages'] = []
+        summary['total_local_gb_usage'] = 0
+        summary['total_vcpus_usage'] = 0
+        summary['total_memory_mb_usage'] = 0
+        summary['total_hours'] = 0
+        summary['start'] = period_start
+        summary['stop'] = period_stop
+        return summary
 
     def _tenant_usages_for_period(self, context, period_start,
                                   period_stop, tenant_id=None, detailed=True):
 
         compute_api = api.API()
-        instances = compute_api.get_active_by_window(context,
-                                                     period_start,
-                                                     period_stop,
-                                                     tenant_id)
+        if not detailed:
+            # The database sums the usage of the instances.
+            usages = []
+            for totals in compute_api.get_usage_totals_by_window(context,
+                                                                 period_start,
+                                                                 period_stop,
+                                                                 tenant_id):
+                summary = self._make_summary(totals.pop('project_id'),
+                                             period_start, period_stop,
+                                             detailed)
+                summary.update(totals)
+                usages.append(summary)
+            return usages
+
+        usages = compute_api.get_usage_by_window(context,
+                                                 period_start,
+                                                 period_stop,
+                                                 tenant_id)
         rval = {}
-        flavors = {}
+        now = timeutils.utcnow()
+
+        for usage in usages:
+            flavor = usage['flavor']
 
-        for instance in instances:
             info = {}
-            info['hours'] = self._hours_for(instance,
-                                            period_start,
-                                            period_stop)
-            flavor = self._get_flavor(context, compute_api, instance, flavors)
-            if not flavor:
-                continue
+            info['hours'] = usage['hours']
 
-            info['instance_id'] = instance['uuid']
-            info['name'] = instance['display_name']
+            info['instance_id'] = usage['uuid']
+            info['name'] = usage['display_name']
 
             info['memory_mb'] = flavor['memory_mb']
             info['local_gb'] = flavor['root_gb'] + flavor['ephemeral_gb']
             info['vcpus'] = flavor['vcpus']
 
-            info['tenant_id'] = instance['project_id']
+            info['tenant_id'] = usage['project_id']
 
             info['flavor'] = flavor['name']
 
-            info['started_at'] = instance['launched_at']
+            info['started_at'] = usage['launched_at']
 
-            info['ended_at'] = instance['terminated_at']
+            info['ended_at'] = usage['terminated_at']
 
             if info['ended_at']:
                 info['state'] = 'terminated'
             else:
-                info['state'] = instance['vm_state']
-
-            now = timeutils.utcnow()
+                info['state'] = usage['vm_state']
 
             if info['state'] == 'terminated':
                 delta = info['ended_at'] - info['started_at']
@@ -180,17 +139,8 @@ class SimpleTenantUsageController(object):
             info['uptime'] = delta.days * 24 * 3600 + delta.seconds
 
             if info['tenant_id'] not in rval:
-                summary = {}
-                summary['tenant_id'] = info['tenant_id']
-                if detailed:
-                    summary['server_usages'] = []
-                summary['total_local_gb_usage'] = 0
-                summary['total_vcpus_usage'] = 0
-                summary['total_memory_mb_usage'] = 0
-                summary['total_hours'] = 0
-                summary['start'] = period_start
-                summary['stop'] = period_stop
-                rval[info['tenant_id']] = summary
+                rval[info['tenant_id']] = self._make_summary(
+                    info['tenant_id'], period_start, period_stop, detailed)
 
             summary = rval[info['tenant_id']]
             summary['total_local_gb_usage'] += info['local_gb'] * info['hours']
@@ -199,8 +149,7 @@ class SimpleTenantUsageController(object):
                                                  info['hours'])
 
             summary['total_hours'] += info['hours']
-            if detailed:
-                summary['server_usages'].append(info)
+            summary['server_usages'].append(info)
 
         return rval.values()
 
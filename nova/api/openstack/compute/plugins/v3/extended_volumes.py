@@ -15,6 +15,8 @@
 #   under the License.
 
 """The Extended Volumes API extension."""
+import functools
+
 import webob
 from webob import exc
 
@@ -46,8 +48,7 @@ class ExtendedVolumesController(wsgi.Controller):
         self.compute_api = compute.API()
         self.volume_api = volume.API()
 
-    def _extend_server(self, context, server, instance):
-        bdms = self.compute_api.get_instance_bdms(context, instance)
+    def _extend_server(self, context, server, bdms):
         volume_ids = [bdm['volume_id'] for bdm in bdms if bdm['volume_id']]
         key = "%s:volumes_attached" % ExtendedVolumes.alias
         server[key] = [{'id': volume_id} for volume_id in volume_ids]
@@ -114,7 +115,8 @@ class ExtendedVolumesController(wsgi.Controller):
             db_instance = req.get_db_instance(server['id'])
             # server['id'] is guaranteed to be in the cache due to
             # the core API adding it in its 'show' method.
-            self._extend_server(context, server, db_instance)
+            bdms = self.compute_api.get_instance_bdms(context, db_instance)
+            self._extend_server(context, server, bdms)
 
     @wsgi.extends
     def detail(self, req, resp_obj):
@@ -123,11 +125,15 @@ class ExtendedVolumesController(wsgi.Controller):
             # Attach our slave template to the response object
             resp_obj.attach(xml=ExtendedVolumesServersTemplate())
             servers = list(resp_obj.obj['servers'])
+            # Get the block device mappings of all the servers at once.
+            instances_bdms = req.prefetch_db_items(
+                'block_device_mappings',
+                [server['id'] for server in servers],
+                functools.partial(self.compute_api.get_instances_bdms,
+                                  context))
             for server in servers:
-                db_instance = req.get_db_instance(server['id'])
-                # server['id'] is guaranteed to be in the cache due to
-                # the core API adding it in its 'detail' method.
-                self._extend_server(context, server, db_instance)
+                self._extend_server(context, server,
+                                    instances_bdms[server['id']])
 
     def _validate_volume_id(self, volume_id):
         if not uuidutils.is_uuid_like(volume_id):
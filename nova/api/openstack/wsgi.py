@@ -117,6 +117,24 @@ class Request(webob.Request):
         """
         return self.get_db_items(key).get(item_key)
 
+    def prefetch_db_items(self, key, item_keys, fetch_func):
+        """
+        Allow an API extension to get the objects related to several
+        items, like the instances of a server listing, with a single
+        call instead of one call per item, and to store them for the
+        other extensions within the same API request.
+
+        fetch_func is called with the list of the item keys which were
+        not stored yet, and returns a dictionary of their objects by
+        item key.
+        """
+        db_items = self._extension_data['db_items'].setdefault(key, {})
+        missing = [item_key for item_key in item_keys
+                   if item_key not in db_items]
+        if missing:
+            db_items.update(fetch_func(missing))
+        return db_items
+
     def cache_db_instances(self, instances):
         self.cache_db_items('instances', instances, 'uuid')
 
@@ -22,8 +22,11 @@ reached.
 
 The interface into this module is the MessageRunner class.
 """
+import copy
 import sys
+import time
 
+from eventlet import greenthread
 from eventlet import queue
 from oslo.config import cfg
 
@@ -58,11 +61,17 @@ cell_messaging_opts = [
             help='Maximum number of hops for cells routing.'),
     cfg.StrOpt('scheduler',
             default='nova.cells.scheduler.CellsScheduler',
-            help='Cells scheduler to use')]
+            help='Cells scheduler to use'),
+    cfg.IntOpt('capacity_full_update_interval',
+            default=600,
+            help='Seconds between two updates of the parent cells with '
+                 'all our capacities, when batch_window is set and the '
+                 'other updates only carry the capacities that changed.')]
 
 CONF = cfg.CONF
 CONF.import_opt('name', 'nova.cells.opts', group='cells')
 CONF.import_opt('call_timeout', 'nova.cells.opts', group='cells')
+CONF.import_opt('batch_window', 'nova.cells.opts', group='cells')
 CONF.register_opts(cell_messaging_opts, group='cells')
 
 LOG = logging.getLogger(__name__)
@@ -72,6 +81,26 @@ LOG = logging.getLogger(__name__)
 _PATH_CELL_SEP = cells_utils.PATH_CELL_SEP
 
 
+def _dict_delta(old, new):
+    """Return the items of the nested dict new that differ from the ones
+    of old, or None if some keys of old are no longer in new.
+    """
+    if set(old) - set(new):
+        return None
+    delta = {}
+    for key, value in new.iteritems():
+        old_value = old.get(key)
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            value_delta = _dict_delta(old_value, value)
+            if value_delta is None:
+                return None
+            if value_delta:
+                delta[key] = value_delta
+        elif key not in old or old_value != value:
+            delta[key] = value
+    return delta
+
+
 def _reverse_path(path):
     """Reverse a path.  Used for sending responses upstream."""
     path_parts = path.split(_PATH_CELL_SEP)
@@ -719,6 +748,16 @@ class _TargetedMessageMethods(_BaseMessageMethods):
         # Go ahead and update our parents now that a child updated us
         self.msg_runner.tell_parents_our_capacities(message.ctxt)
 
+    def update_capacity_deltas(self, message, cell_name, capacities):
+        """A child cell told us about the changes of their capacity."""
+        LOG.debug(_("Received capacity changes from child cell "
+                    "%(cell_name)s: %(capacities)s"),
+                  {'cell_name': cell_name, 'capacities': capacities})
+        self.state_manager.update_cell_capacity_deltas(cell_name,
+                capacities)
+        # Go ahead and update our parents now that a child updated us
+        self.msg_runner.tell_parents_our_capacities(message.ctxt)
+
     def announce_capabilities(self, message):
         """A parent cell has told us to send our capabilities, so let's
         do so.
@@ -729,6 +768,8 @@ class _TargetedMessageMethods(_BaseMessageMethods):
         """A parent cell has told us to send our capacity, so let's
         do so.
         """
+        # The parent may have lost the capacities we sent it before.
+        self.msg_runner.forget_sent_capacities()
         self.msg_runner.tell_parents_our_capacities(message.ctxt)
 
     def service_get_by_compute_host(self, message, host_name):
@@ -1256,6 +1297,12 @@ class MessageRunner(object):
         for msg_type, cls in _CELL_MESSAGE_TYPE_TO_METHODS_CLS.iteritems():
             self.methods_by_type[msg_type] = cls(self)
         self.serializer = objects_base.NovaObjectSerializer()
+        # Updates of the parent cells waiting for the end of the batch
+        # window, and the last capacities sent to each parent cell.
+        self._pending_parent_updates = set()
+        self._capacities_sent = {}
+        self.stats = {'parent_updates': 0, 'coalesced_parent_updates': 0,
+                      'capacity_deltas': 0}
 
     def _process_message_locally(self, message):
         """Message processing will call this when its determined that
@@ -1362,8 +1409,33 @@ class MessageRunner(object):
                                         dict(), 'down', child_cell)
             message.process()
 
+    def _coalesce_parent_update(self, ctxt, method):
+        """Call method after CONF.cells.batch_window seconds, unless it is
+        already going to be called by then.
+        """
+        if method in self._pending_parent_updates:
+            self.stats['coalesced_parent_updates'] += 1
+            return
+        self._pending_parent_updates.add(method)
+
+        def _update_parents():
+            self._pending_parent_updates.discard(method)
+            try:
+                method(ctxt)
+            except Exception:
+                LOG.exception(_("Error updating our parent cells"))
+
+        greenthread.spawn_after(CONF.cells.batch_window, _update_parents)
+
     def tell_parents_our_capabilities(self, ctxt):
         """Send our capabilities to parent cells."""
+        if CONF.cells.batch_window > 0:
+            self._coalesce_parent_update(ctxt,
+                                         self._tell_parents_our_capabilities)
+        else:
+            self._tell_parents_our_capabilities(ctxt)
+
+    def _tell_parents_our_capabilities(self, ctxt):
         parent_cells = self.state_manager.get_parent_cells()
         if not parent_cells:
             return
@@ -1377,6 +1449,7 @@ class MessageRunner(object):
             capabs[key] = list(values)
         method_kwargs = {'cell_name': my_cell_info.name,
                          'capabilities': capabs}
+        self.stats['parent_updates'] += 1
         for cell in parent_cells:
             message = _TargetedMessage(self, ctxt, 'update_capabilities',
                     method_kwargs, 'up', cell, fanout=True)
@@ -1384,6 +1457,19 @@ class MessageRunner(object):
 
     def tell_parents_our_capacities(self, ctxt):
         """Send our capacities to parent cells."""
+        if CONF.cells.batch_window > 0:
+            self._coalesce_parent_update(ctxt,
+                                         self._tell_parents_our_capacities)
+        else:
+            self._tell_parents_our_capacities(ctxt)
+
+    def forget_sent_capacities(self):
+        """Send all our capacities with the next update of each parent
+        cell.
+        """
+        self._capacities_sent.clear()
+
+    def _tell_parents_our_capacities(self, ctxt):
         parent_cells = self.state_manager.get_parent_cells()
         if not parent_cells:
             return
@@ -1391,10 +1477,31 @@ class MessageRunner(object):
         capacities = self.state_manager.get_our_capacities()
         LOG.debug(_("Updating parents with our capacities: %(capacities)s"),
                   {'capacities': capacities})
-        method_kwargs = {'cell_name': my_cell_info.name,
-                         'capacities': capacities}
+        self.stats['parent_updates'] += 1
+        now = time.time()
         for cell in parent_cells:
-            message = _TargetedMessage(self, ctxt, 'update_capacities',
+            method_name = 'update_capacities'
+            method_kwargs = {'cell_name': my_cell_info.name,
+                             'capacities': capacities}
+            if CONF.cells.batch_window > 0:
+                # Only send what changed since the last update, with a
+                # full update from time to time in case one got lost.
+                sent, full_update_time = self._capacities_sent.get(
+                        cell.name, (None, 0))
+                if (sent is not None and now - full_update_time <
+                        CONF.cells.capacity_full_update_interval):
+                    delta = _dict_delta(sent, capacities)
+                else:
+                    delta = None
+                if delta is None:
+                    full_update_time = now
+                else:
+                    method_name = 'update_capacity_deltas'
+                    method_kwargs['capacities'] = delta
+                    self.stats['capacity_deltas'] += 1
+                self._capacities_sent[cell.name] = (
+                        copy.deepcopy(capacities), full_update_time)
+            message = _TargetedMessage(self, ctxt, method_name,
                     method_kwargs, 'up', cell, fanout=True)
             message.process()
 
@@ -55,6 +55,16 @@ cells_opts = [
     cfg.IntOpt('bandwidth_update_interval',
                 default=600,
                 help='Seconds between bandwidth updates for cells.'),
+    cfg.FloatOpt('batch_window',
+                 default=0.0,
+                 help='Seconds during which the messages cast to each '
+                      'neighbor cell are queued, to be sent together in a '
+                      'single RPC cast.  The capability and capacity '
+                      'updates for the parent cells are coalesced over '
+                      'the same period, and the capacity updates only '
+                      'carry what changed.  0 disables batching.  Every '
+                      'cell must support the 1.1 intercell API to enable '
+                      'it.'),
 ]
 
 CONF = cfg.CONF
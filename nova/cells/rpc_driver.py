@@ -16,13 +16,18 @@
 """
 Cells RPC Communication Driver
 """
+import base64
 import urllib
 import urlparse
+import zlib
 
+from eventlet import greenthread
 from oslo.config import cfg
 
 from nova.cells import driver
 from nova.openstack.common.gettextutils import _
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
 from nova.openstack.common import rpc
 from nova.openstack.common.rpc import dispatcher as rpc_dispatcher
 from nova import rpcclient
@@ -32,11 +37,18 @@ cell_rpc_driver_opts = [
                    default='cells.intercell',
                    help="Base queue name to use when communicating between "
                         "cells.  Various topics by message type will be "
-                        "appended to this.")]
+                        "appended to this."),
+        cfg.IntOpt('rpc_driver_compress_threshold',
+                   default=0,
+                   help="Compress the messages sent to other cells when "
+                        "their JSON is larger than this number of bytes.  "
+                        "0 disables compression.  Every cell must support "
+                        "the 1.1 intercell API to enable it.")]
 
 CONF = cfg.CONF
 CONF.register_opts(cell_rpc_driver_opts, group='cells')
 CONF.import_opt('call_timeout', 'nova.cells.opts', group='cells')
+CONF.import_opt('batch_window', 'nova.cells.opts', group='cells')
 CONF.import_opt('rpc_backend', 'nova.openstack.common.rpc')
 
 rpcapi_cap_opt = cfg.StrOpt('intercell',
@@ -45,6 +57,8 @@ CONF.register_opt(rpcapi_cap_opt, 'upgrade_levels')
 
 _CELL_TO_CELL_RPC_API_VERSION = '1.0'
 
+LOG = logging.getLogger(__name__)
+
 
 class CellsRPCDriver(driver.BaseCellsDriver):
     """Driver for cell<->cell communication via RPC.  This is used to
@@ -64,6 +78,10 @@ class CellsRPCDriver(driver.BaseCellsDriver):
         self.rpc_connections = []
         self.intercell_rpcapi = InterCellRPCAPI(
                 self.BASE_RPC_API_VERSION)
+        # Messages waiting for the end of the batch window, by cell name,
+        # message type and fanout.
+        self._batches = {}
+        self.stats = {'messages': 0, 'casts': 0, 'bytes': 0}
 
     def _start_consumer(self, dispatcher, topic):
         """Start an RPC consumer."""
@@ -104,8 +122,55 @@ class CellsRPCDriver(driver.BaseCellsDriver):
             conn.close()
 
     def send_message_to_cell(self, cell_state, message):
-        """Use the IntercellRPCAPI to send a message to a cell."""
-        self.intercell_rpcapi.send_message_to_cell(cell_state, message)
+        """Use the IntercellRPCAPI to send a message to a cell.
+
+        When CONF.cells.batch_window is set, the messages that neither wait
+        for a response nor are one are queued and sent to the cell together
+        at the end of the window.
+        """
+        self.stats['messages'] += 1
+        json_message = message.to_json()
+        if (CONF.cells.batch_window <= 0 or message.need_response or
+                message.message_type == 'response'):
+            # Keep the messages to this cell in order.
+            for batch_key in self._batches.keys():
+                if batch_key[0] == cell_state.name:
+                    self._send_batch(batch_key)
+            self._send(cell_state, message.ctxt, message.message_type,
+                       message.fanout, [json_message])
+            return
+        key = (cell_state.name, message.message_type, bool(message.fanout))
+        if key not in self._batches:
+            self._batches[key] = (cell_state, message.ctxt, [])
+            greenthread.spawn_after(CONF.cells.batch_window,
+                                    self._send_batch, key)
+        self._batches[key][2].append(json_message)
+
+    def _send_batch(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            # Already sent
+            return
+        cell_state, ctxt, json_messages = batch
+        cell_name, message_type, fanout = key
+        try:
+            self._send(cell_state, ctxt, message_type, fanout, json_messages)
+        except Exception:
+            LOG.exception(_("Error sending %(num_messages)d messages to "
+                            "cell %(cell_name)s"),
+                          {'num_messages': len(json_messages),
+                           'cell_name': cell_name})
+
+    def _send(self, cell_state, ctxt, message_type, fanout, json_messages):
+        self.stats['casts'] += 1
+        if (len(json_messages) == 1 and
+                not CONF.cells.rpc_driver_compress_threshold):
+            self.stats['bytes'] += len(json_messages[0])
+            self.intercell_rpcapi.send_json_message_to_cell(cell_state,
+                    ctxt, message_type, fanout, json_messages[0])
+        else:
+            self.stats['bytes'] += self.intercell_rpcapi.send_messages_to_cell(
+                    cell_state, ctxt, message_type, fanout, json_messages)
 
 
 class InterCellRPCAPI(rpcclient.RpcProxy):
@@ -115,6 +180,7 @@ class InterCellRPCAPI(rpcclient.RpcProxy):
 
     API version history:
         1.0 - Initial version.
+        1.1 - Adds process_messages()
 
         ... Grizzly supports message version 1.0.  So, any changes to existing
         methods in 2.x after that point should be done such that they can
@@ -151,13 +217,46 @@ class InterCellRPCAPI(rpcclient.RpcProxy):
         fanout, do it.  The topic that is used will be
         'CONF.rpc_driver_queue_base.<message_type>'.
         """
+        return self.send_json_message_to_cell(cell_state, message.ctxt,
+                message.message_type, message.fanout, message.to_json())
+
+    def _get_client_for_message_type(self, cell_state, message_type,
+                                     fanout):
         topic_base = CONF.cells.rpc_driver_queue_base
-        topic = '%s.%s' % (topic_base, message.message_type)
+        topic = '%s.%s' % (topic_base, message_type)
         cctxt = self._get_client(cell_state, topic)
-        if message.fanout:
-            cctxt = cctxt.prepare(fanout=message.fanout)
-        return cctxt.cast(message.ctxt, 'process_message',
-                          message=message.to_json())
+        if fanout:
+            cctxt = cctxt.prepare(fanout=fanout)
+        return cctxt
+
+    def send_json_message_to_cell(self, cell_state, ctxt, message_type,
+                                  fanout, json_message):
+        """Send a JSON-ified message to another cell."""
+        cctxt = self._get_client_for_message_type(cell_state, message_type,
+                                                  fanout)
+        return cctxt.cast(ctxt, 'process_message', message=json_message)
+
+    def send_messages_to_cell(self, cell_state, ctxt, message_type, fanout,
+                              json_messages):
+        """Send a list of JSON-ified messages of the same type to another
+        cell, in a single RPC cast to 'process_messages'.  The list is
+        compressed when its JSON is larger than
+        CONF.cells.rpc_driver_compress_threshold bytes.
+
+        Returns the number of bytes of messages sent.
+        """
+        cctxt = self._get_client_for_message_type(cell_state, message_type,
+                                                  fanout)
+        messages = jsonutils.dumps(json_messages)
+        compressed = False
+        threshold = CONF.cells.rpc_driver_compress_threshold
+        if threshold and len(messages) > threshold:
+            messages = base64.b64encode(zlib.compress(messages))
+            compressed = True
+        cctxt = cctxt.prepare(version='1.1')
+        cctxt.cast(ctxt, 'process_messages', messages=messages,
+                   compressed=compressed)
+        return len(messages)
 
 
 class InterCellRPCDispatcher(object):
@@ -169,6 +268,7 @@ class InterCellRPCDispatcher(object):
     logic is defined by the message class in the messaging module.
     """
     BASE_RPC_API_VERSION = _CELL_TO_CELL_RPC_API_VERSION
+    RPC_API_VERSION = '1.1'
 
     def __init__(self, msg_runner):
         """Init the Intercell RPC Dispatcher."""
@@ -182,6 +282,19 @@ class InterCellRPCDispatcher(object):
         message = self.msg_runner.message_from_json(message)
         message.process()
 
+    def process_messages(self, _ctxt, messages, compressed=False):
+        """We received a batch of messages from another cell, as the JSON
+        of the list of their JSON, maybe compressed.  Process them in
+        order.
+        """
+        if compressed:
+            messages = zlib.decompress(base64.b64decode(messages))
+        for message in jsonutils.loads(messages):
+            try:
+                self.process_message(_ctxt, message)
+            except Exception:
+                LOG.exception(_("Error processing message from batch"))
+
 
 def parse_transport_url(url):
     """
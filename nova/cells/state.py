@@ -41,6 +41,18 @@ cell_state_manager_opts = [
                    help='Configuration file from which to read cells '
                    'configuration.  If given, overrides reading cells '
                    'from the database.'),
+        cfg.BoolOpt('incremental_capacity',
+                default=False,
+                help='Only load the compute nodes that were created, '
+                     'updated or deleted since the last update of our '
+                     'capacities, instead of every compute node on every '
+                     'update.'),
+        cfg.IntOpt('capacity_full_refresh_interval',
+                default=600,
+                help='Seconds between recomputing our capacities from all '
+                     'compute nodes when incremental_capacity is enabled. '
+                     'Services being disabled or enabled are only noticed '
+                     'then.'),
 ]
 
 
@@ -84,6 +96,22 @@ class CellState(object):
         self.last_seen = timeutils.utcnow()
         self.capacities = capacities
 
+    def update_capacity_deltas(self, deltas):
+        """Update the capacity information of a cell with the values that
+        changed since its last update.
+        """
+        def _merge(target, src):
+            for key, value in src.iteritems():
+                if isinstance(value, dict) and isinstance(target.get(key),
+                                                          dict):
+                    _merge(target[key], value)
+                else:
+                    target[key] = value
+
+        capacities = copy.deepcopy(self.capacities)
+        _merge(capacities, deltas)
+        self.update_capacities(capacities)
+
     def get_cell_info(self):
         """Return subset of cell information for OS API use."""
         db_fields_to_return = ['is_parent', 'weight_scale', 'weight_offset']
@@ -165,6 +193,14 @@ class CellStateManager(base.Base):
         self.parent_cells = {}
         self.child_cells = {}
         self.last_cell_db_check = datetime.datetime.min
+        # What every compute node adds to our capacities, keyed by
+        # compute node id, and their sum.
+        self._node_capacities = {}
+        self._capacity_totals = {}
+        self._capacity_flavor_sizes = []
+        self._capacity_reserve_level = None
+        self.capacity_changes_since = None
+        self.last_full_capacity_update = None
 
         self._cell_data_sync(force=True)
 
@@ -241,36 +277,102 @@ class CellStateManager(base.Base):
 
         NOTE(comstud): Perhaps we should only report a single number
         available per instance_type.
+
+        When CONF.cells.incremental_capacity is set, only the compute
+        nodes changed since the last update are loaded, and what they
+        add to our capacities replaces what they added before.  All the
+        compute nodes are loaded again every
+        CONF.cells.capacity_full_refresh_interval seconds, or when the
+        instance_types or the reserve change.
         """
 
         if not ctxt:
             ctxt = context.get_admin_context()
 
         reserve_level = CONF.cells.reserve_percent / 100.0
-        compute_hosts = {}
-
-        def _get_compute_hosts():
+        now = timeutils.utcnow()
+        full_refresh_interval = CONF.cells.capacity_full_refresh_interval
+        compute_nodes = None
+        if (CONF.cells.incremental_capacity and
+                self.last_full_capacity_update and
+                reserve_level == self._capacity_reserve_level and
+                timeutils.delta_seconds(self.last_full_capacity_update,
+                                        now) < full_refresh_interval):
+            compute_nodes = self.db.compute_node_get_all(ctxt,
+                    updated_since=self.capacity_changes_since)
+            if (compute_nodes and self._get_flavor_sizes(ctxt) !=
+                    self._capacity_flavor_sizes):
+                # The units of every compute node need to be recomputed.
+                compute_nodes = None
+
+        if compute_nodes is None:
+            self._node_capacities = {}
+            self._capacity_totals = {
+                    'ram_free': {'total_mb': 0, 'units_by_mb': {}},
+                    'disk_free': {'total_mb': 0, 'units_by_mb': {}}}
+            self._capacity_reserve_level = reserve_level
+            self.capacity_changes_since = None
             compute_nodes = self.db.compute_node_get_all(ctxt)
-            for compute in compute_nodes:
-                service = compute['service']
-                if not service or service['disabled']:
-                    continue
-                host = service['host']
-                compute_hosts[host] = {
-                        'free_ram_mb': compute['free_ram_mb'],
-                        'free_disk_mb': compute['free_disk_gb'] * 1024,
-                        'total_ram_mb': compute['memory_mb'],
-                        'total_disk_mb': compute['local_gb'] * 1024}
-
-        _get_compute_hosts()
-        if not compute_hosts:
-            self.my_cell_state.update_capacities({})
-            return
+            if compute_nodes:
+                self._capacity_flavor_sizes = self._get_flavor_sizes(ctxt)
+            self.last_full_capacity_update = now
+
+        for compute in compute_nodes:
+            self._track_capacity_changes_since(compute)
+            self._update_node_capacity(compute)
+
+        if self._node_capacities:
+            capacities = copy.deepcopy(self._capacity_totals)
+        else:
+            capacities = {}
+        self.my_cell_state.update_capacities(capacities)
 
-        ram_mb_free_units = {}
-        disk_mb_free_units = {}
-        total_ram_mb_free = 0
-        total_disk_mb_free = 0
+    def _get_flavor_sizes(self, ctxt):
+        """Return the (memory_mb, disk_mb) of every instance_type."""
+        return [(instance_type['memory_mb'],
+                 (instance_type['root_gb'] +
+                  instance_type['ephemeral_gb']) * 1024)
+                for instance_type in self.db.flavor_get_all(ctxt)]
+
+    def _track_capacity_changes_since(self, compute):
+        """Advance the incremental update marker past a compute node."""
+        for key in ('updated_at', 'created_at', 'deleted_at'):
+            timestamp = compute.get(key)
+            if timestamp and (self.capacity_changes_since is None or
+                              timestamp > self.capacity_changes_since):
+                self.capacity_changes_since = timestamp
+
+    def _update_node_capacity(self, compute):
+        """Replace what a compute node adds to our capacities."""
+        old_capacity = self._node_capacities.pop(compute['id'], None)
+        if old_capacity:
+            self._add_capacity(old_capacity, -1)
+        capacity = self._node_capacity(compute)
+        if capacity:
+            self._node_capacities[compute['id']] = capacity
+            self._add_capacity(capacity, 1)
+
+    def _add_capacity(self, capacity, sign):
+        for resource, values in capacity.iteritems():
+            totals = self._capacity_totals[resource]
+            totals['total_mb'] += sign * values['total_mb']
+            units_by_mb = totals['units_by_mb']
+            for size, units in values['units_by_mb'].iteritems():
+                units_by_mb[size] = units_by_mb.get(size, 0) + sign * units
+
+    def _node_capacity(self, compute):
+        """Return what a compute node adds to our capacities, or None if
+        it is deleted or its service is disabled.
+        """
+        service = compute['service']
+        if compute.get('deleted') or not service or service['disabled']:
+            return None
+
+        reserve_level = self._capacity_reserve_level
+        free_ram_mb = compute['free_ram_mb']
+        free_disk_mb = compute['free_disk_gb'] * 1024
+        total_ram_mb = compute['memory_mb']
+        total_disk_mb = compute['local_gb'] * 1024
 
         def _free_units(total, free, per_inst):
             if per_inst:
@@ -280,32 +382,20 @@ class CellStateManager(base.Base):
             else:
                 return 0
 
-        def _update_from_values(values, instance_type):
-            memory_mb = instance_type['memory_mb']
-            disk_mb = (instance_type['root_gb'] +
-                    instance_type['ephemeral_gb']) * 1024
+        ram_mb_free_units = {}
+        disk_mb_free_units = {}
+        for memory_mb, disk_mb in self._capacity_flavor_sizes:
             ram_mb_free_units.setdefault(str(memory_mb), 0)
             disk_mb_free_units.setdefault(str(disk_mb), 0)
-            ram_free_units = _free_units(compute_values['total_ram_mb'],
-                    compute_values['free_ram_mb'], memory_mb)
-            disk_free_units = _free_units(compute_values['total_disk_mb'],
-                    compute_values['free_disk_mb'], disk_mb)
-            ram_mb_free_units[str(memory_mb)] += ram_free_units
-            disk_mb_free_units[str(disk_mb)] += disk_free_units
-
-        instance_types = self.db.flavor_get_all(ctxt)
-
-        for compute_values in compute_hosts.values():
-            total_ram_mb_free += compute_values['free_ram_mb']
-            total_disk_mb_free += compute_values['free_disk_mb']
-            for instance_type in instance_types:
-                _update_from_values(compute_values, instance_type)
-
-        capacities = {'ram_free': {'total_mb': total_ram_mb_free,
-                                   'units_by_mb': ram_mb_free_units},
-                      'disk_free': {'total_mb': total_disk_mb_free,
-                                    'units_by_mb': disk_mb_free_units}}
-        self.my_cell_state.update_capacities(capacities)
+            ram_mb_free_units[str(memory_mb)] += _free_units(total_ram_mb,
+                    free_ram_mb, memory_mb)
+            disk_mb_free_units[str(disk_mb)] += _free_units(total_disk_mb,
+                    free_disk_mb, disk_mb)
+
+        return {'ram_free': {'total_mb': free_ram_mb,
+                             'units_by_mb': ram_mb_free_units},
+                'disk_free': {'total_mb': free_disk_mb,
+                              'units_by_mb': disk_mb_free_units}}
 
     @sync_before
     def get_cell_info_for_neighbors(self):
@@ -366,6 +456,18 @@ class CellStateManager(base.Base):
             return
         cell.update_capacities(capacities)
 
+    @sync_before
+    def update_cell_capacity_deltas(self, cell_name, capacities):
+        """Update capacities for a cell with the ones that changed."""
+        cell = (self.child_cells.get(cell_name) or
+                self.parent_cells.get(cell_name))
+        if not cell:
+            LOG.error(_("Unknown cell '%(cell_name)s' when trying to "
+                        "update capacities"),
+                      {'cell_name': cell_name})
+            return
+        cell.update_capacity_deltas(capacities)
+
     @sync_before
     def get_our_capabilities(self, include_children=True):
         capabs = copy.deepcopy(self.my_cell_state.capabilities)
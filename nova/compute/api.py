@@ -116,6 +116,12 @@ compute_opts = [
                      'in a local image being created on the hypervisor node. '
                      'Setting this to 0 means nova will allow only '
                      'boot from volume. A negative number means unlimited.'),
+    cfg.BoolOpt('use_ip_address_index',
+                default=False,
+                help='Filter the instances listed by IP address in the '
+                     'database, from the index of the addresses of their '
+                     'network info caches, instead of asking the network '
+                     'API for the matching instances'),
 ]
 
 
@@ -1699,6 +1705,17 @@ class API(base.Base):
         return self.db.instance_get_active_by_window_joined(context, begin,
                                                      end, project_id)
 
+    def get_usage_by_window(self, context, begin, end, project_id=None):
+        """Get the usage of the instances active over a window."""
+        return self.db.instance_usage_get_by_window(context, begin, end,
+                                                    project_id)
+
+    def get_usage_totals_by_window(self, context, begin, end,
+                                   project_id=None):
+        """Get the usage of the instances active over a window by project."""
+        return self.db.instance_usage_get_totals_by_window(context, begin,
+                                                           end, project_id)
+
     #NOTE(bcwaldon): this doesn't really belong in this class
     def get_instance_type(self, context, instance_type_id):
         """Get an instance type by instance type id."""
@@ -1817,13 +1834,16 @@ class API(base.Base):
                                   sort_key, sort_dir,
                                   limit=None,
                                   marker=None):
-        if 'ip6' in filters or 'ip' in filters:
+        if ('ip6' in filters or 'ip' in filters) and \
+                not CONF.use_ip_address_index:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
             # NOTE(jkoelker) It is possible that we will get the same
             #                instance uuid twice (one for ipv4 and ipv6)
             uuids = set([r['instance_uuid'] for r in res])
             filters['uuid'] = uuids
+            filters.pop('ip', None)
+            filters.pop('ip6', None)
 
         fields = ['metadata', 'system_metadata', 'info_cache',
                   'security_groups']
@@ -2903,6 +2923,16 @@ class API(base.Base):
             return block_device.legacy_mapping(bdms)
         return bdms
 
+    def get_instances_bdms(self, context, instance_uuids, legacy=True):
+        """Get all bdm tables for the specified instances, by uuid."""
+        bdms = self.db.block_device_mapping_get_by_instance_uuids(
+                context, instance_uuids)
+        if legacy:
+            return dict((instance_uuid, block_device.legacy_mapping(
+                             instance_bdms))
+                        for instance_uuid, instance_bdms in bdms.iteritems())
+        return bdms
+
     def is_volume_backed_instance(self, context, instance, bdms=None):
         if not instance['image_ref']:
             return True
@@ -77,6 +77,7 @@ from nova.openstack.common import timeutils
 from nova import paths
 from nova import safe_utils
 from nova.scheduler import rpcapi as scheduler_rpcapi
+from nova import unit
 from nova import utils
 from nova.virt import block_device as driver_block_device
 from nova.virt import driver
@@ -115,6 +116,19 @@ compute_opts = [
     cfg.IntOpt('network_allocate_retries',
                default=0,
                help="Number of times to retry network allocation on failures"),
+    cfg.BoolOpt('sync_power_state_on_events',
+                default=False,
+                help='Sync the power state of an instance to the database '
+                     'when the hypervisor reports a lifecycle event for it, '
+                     'and only sync all the instances every '
+                     'sync_power_state_full_interval seconds. Only useful '
+                     'with drivers emitting lifecycle events (libvirt)'),
+    cfg.FloatOpt('sync_power_state_event_delay',
+                 default=5.0,
+                 help='Number of seconds the power state of an instance '
+                      'has to stay the same after a lifecycle event before '
+                      'it is synced to the database, when '
+                      'sync_power_state_on_events is set'),
     ]
 
 interval_opts = [
@@ -125,6 +139,11 @@ interval_opts = [
                default=600,
                help='interval to sync power states between '
                     'the database and the hypervisor'),
+    cfg.IntOpt('sync_power_state_full_interval',
+               default=3600,
+               help='interval to sync the power states of all the instances '
+                    'between the database and the hypervisor when '
+                    'sync_power_state_on_events is set'),
     cfg.IntOpt("heal_instance_info_cache_interval",
                default=60,
                help="Number of seconds between instance info_cache self "
@@ -212,6 +231,10 @@ CONF.import_opt('enabled', 'nova.spice', group='spice')
 CONF.import_opt('enable', 'nova.cells.opts', group='cells')
 CONF.import_opt('image_cache_subdirectory_name', 'nova.virt.imagecache')
 CONF.import_opt('image_cache_manager_interval', 'nova.virt.imagecache')
+CONF.import_opt('image_prefetch_interval', 'nova.virt.imagecache')
+CONF.import_opt('image_prefetch_count', 'nova.virt.imagecache')
+CONF.import_opt('image_prefetch_window', 'nova.virt.imagecache')
+CONF.import_opt('image_prefetch_disk_budget_gb', 'nova.virt.imagecache')
 
 LOG = logging.getLogger(__name__)
 
@@ -427,6 +450,12 @@ class ComputeManager(manager.Manager):
         self._last_vol_usage_poll = 0
         self._last_info_cache_heal = 0
         self._last_bw_usage_cell_update = 0
+        self._last_full_power_state_sync = 0
+        # The power states last reported by the hypervisor, and the time
+        # of the last lifecycle event of the instances waiting for their
+        # power state to be synced, by instance uuid.
+        self._vm_power_states = {}
+        self._power_state_events = {}
         self.compute_api = compute.API()
         self.compute_rpcapi = compute_rpcapi.ComputeAPI()
         self.conductor_api = conductor.API()
@@ -751,9 +780,6 @@ class ComputeManager(manager.Manager):
         LOG.info(_("Lifecycle event %(state)d on VM %(uuid)s") %
                   {'state': event.get_transition(),
                    'uuid': event.get_instance_uuid()})
-        context = nova.context.get_admin_context()
-        instance = instance_obj.Instance.get_by_uuid(
-            context, event.get_instance_uuid())
         vm_power_state = None
         if event.get_transition() == virtevent.EVENT_LIFECYCLE_STOPPED:
             vm_power_state = power_state.SHUTDOWN
@@ -766,11 +792,58 @@ class ComputeManager(manager.Manager):
         else:
             LOG.warning(_("Unexpected power state %d") %
                         event.get_transition())
+            return
+
+        if CONF.sync_power_state_on_events:
+            self._queue_power_state_sync(event.get_instance_uuid(),
+                                         vm_power_state)
+            return
+
+        context = nova.context.get_admin_context()
+        instance = instance_obj.Instance.get_by_uuid(
+            context, event.get_instance_uuid())
+        self._sync_instance_power_state(context,
+                                        instance,
+                                        vm_power_state)
+
+    def _queue_power_state_sync(self, instance_uuid, vm_power_state):
+        """Sync the power state of an instance once it stopped changing.
+
+        The events of an instance arriving within
+        CONF.sync_power_state_event_delay seconds of each other are
+        coalesced into a single sync of the last power state reported.
+        """
+        self._vm_power_states[instance_uuid] = vm_power_state
+        queued = instance_uuid in self._power_state_events
+        self._power_state_events[instance_uuid] = time.time()
+        if not queued:
+            greenthread.spawn_after(CONF.sync_power_state_event_delay,
+                                    self._sync_queued_power_state,
+                                    instance_uuid)
+
+    def _sync_queued_power_state(self, instance_uuid):
+        last_event = self._power_state_events[instance_uuid]
+        wait = last_event + CONF.sync_power_state_event_delay - time.time()
+        if wait > 0:
+            # More events came in, wait for the power state to settle.
+            greenthread.spawn_after(wait, self._sync_queued_power_state,
+                                    instance_uuid)
+            return
+        del self._power_state_events[instance_uuid]
 
-        if vm_power_state is not None:
-            self._sync_instance_power_state(context,
-                                            instance,
-                                            vm_power_state)
+        context = nova.context.get_admin_context()
+        try:
+            instance = instance_obj.Instance.get_by_uuid(context,
+                                                         instance_uuid)
+            self._sync_instance_power_state(
+                context, instance, self._vm_power_states[instance_uuid])
+        except exception.InstanceNotFound:
+            LOG.debug(_("Instance %s was deleted before its power state "
+                        "was synced.") % instance_uuid)
+            self._vm_power_states.pop(instance_uuid, None)
+        except Exception:
+            LOG.exception(_("Failed to sync the power state of instance "
+                            "%s.") % instance_uuid)
 
     def handle_events(self, event):
         if isinstance(event, virtevent.LifecycleEvent):
@@ -4751,12 +4824,24 @@ class ComputeManager(manager.Manager):
     def _sync_power_states(self, context):
         """Align power states between the database and the hypervisor.
 
-        To sync power state data we make a DB call to get the number of
-        virtual machines known by the hypervisor and if the number matches the
-        number of virtual machines known by the database, we proceed in a lazy
-        loop, one database record at a time, checking if the hypervisor has the
-        same power state as is in the database.
+        To sync power state data we make a DB call to get the instances on
+        this host and a single driver call to get the power state of all of
+        them, and compare the two views in one pass. Only the instances
+        whose power state needs to be handled are reloaded from the
+        database and synced, one database record at a time.
+
+        When CONF.sync_power_state_on_events is set, the power states are
+        synced as the hypervisor reports lifecycle events, and this only
+        runs every CONF.sync_power_state_full_interval seconds to catch the
+        changes the events missed.
         """
+        if CONF.sync_power_state_on_events:
+            curr_time = time.time()
+            if (self._last_full_power_state_sync +
+                    CONF.sync_power_state_full_interval > curr_time):
+                return
+            self._last_full_power_state_sync = curr_time
+
         db_instances = instance_obj.InstanceList.get_by_host(context,
                                                              self.host,
                                                              use_slave=True)
@@ -4770,34 +4855,62 @@ class ComputeManager(manager.Manager):
                      {'num_db_instances': num_db_instances,
                       'num_vm_instances': num_vm_instances})
 
+        vm_instances = self.driver.get_info_many(db_instances)
+        vm_power_states = dict(
+            (uuid, vm_instance['state'])
+            for uuid, vm_instance in vm_instances.iteritems())
+        # Keep the states still waiting for their lifecycle event sync.
+        for uuid in self._power_state_events:
+            vm_power_states[uuid] = self._vm_power_states[uuid]
+        self._vm_power_states = vm_power_states
+
         for db_instance in db_instances:
             if db_instance['task_state'] is not None:
                 LOG.info(_("During sync_power_state the instance has a "
                            "pending task. Skip."), instance=db_instance)
                 continue
-            # No pending tasks. Now try to figure out the real vm_power_state.
+            # No pending tasks. Now figure out the real vm_power_state.
+            vm_instance = vm_instances.get(db_instance['uuid'])
+            if vm_instance is None:
+                vm_power_state = power_state.NOSTATE
+            else:
+                vm_power_state = vm_instance['state']
+            if self._power_state_in_sync(db_instance, vm_power_state):
+                continue
             try:
-                try:
-                    vm_instance = self.driver.get_info(db_instance)
-                    vm_power_state = vm_instance['state']
-                except exception.InstanceNotFound:
-                    vm_power_state = power_state.NOSTATE
-                # Note(maoy): the above get_info call might take a long time,
-                # for example, because of a broken libvirt driver.
-                try:
-                    self._sync_instance_power_state(context,
-                                                    db_instance,
-                                                    vm_power_state,
-                                                    use_slave=True)
-                except exception.InstanceNotFound:
-                    # NOTE(hanlind): If the instance gets deleted during sync,
-                    # silently ignore and move on to next instance.
-                    continue
+                self._sync_instance_power_state(context,
+                                                db_instance,
+                                                vm_power_state,
+                                                use_slave=True)
+            except exception.InstanceNotFound:
+                # NOTE(hanlind): If the instance gets deleted during sync,
+                # silently ignore and move on to next instance.
+                continue
             except Exception:
                 LOG.exception(_("Periodic sync_power_state task had an error "
                                 "while processing an instance."),
                                 instance=db_instance)
 
+    @staticmethod
+    def _power_state_in_sync(db_instance, vm_power_state):
+        """Return True if _sync_instance_power_state() has nothing to do
+        for the instance, without reloading it from the database.
+        """
+        if vm_power_state != db_instance['power_state']:
+            return False
+        vm_state = db_instance['vm_state']
+        if vm_state == vm_states.ACTIVE:
+            return vm_power_state == power_state.RUNNING
+        elif vm_state == vm_states.STOPPED:
+            return vm_power_state in (power_state.NOSTATE,
+                                      power_state.SHUTDOWN,
+                                      power_state.CRASHED)
+        elif vm_state in (vm_states.SOFT_DELETED,
+                          vm_states.DELETED):
+            return vm_power_state in (power_state.NOSTATE,
+                                      power_state.SHUTDOWN)
+        return True
+
     def _sync_instance_power_state(self, context, db_instance, vm_power_state,
                                    use_slave=False):
         """Align instance power state between the database and hypervisor.
@@ -5177,6 +5290,58 @@ class ComputeManager(manager.Manager):
 
         self.driver.manage_image_cache(context, filtered_instances)
 
+    def _get_popular_images(self, context, limit):
+        """Return the limit images booted the most recently, most booted
+        first.
+        """
+        return self.conductor_api.instance_get_popular_image_refs(
+            context, CONF.image_prefetch_window, limit)
+
+    @periodic_task.periodic_task(spacing=CONF.image_prefetch_interval,
+                                 external_process_ok=True)
+    def _prefetch_popular_images(self, context):
+        """Pre-fetch the images booted the most recently.
+
+        The images are fetched into the image cache of the driver, most
+        booted first, as long as they fit in the disk budget.
+        """
+        if not self.driver.capabilities["has_imagecache"]:
+            return
+        if CONF.image_prefetch_interval == 0:
+            return
+
+        budget = CONF.image_prefetch_disk_budget_gb * unit.Gi
+        image_ids = []
+        # Leave room for the images that are skipped below.
+        popular = self._get_popular_images(context,
+                                           CONF.image_prefetch_count * 2)
+        for image_ref in popular:
+            if len(image_ids) >= CONF.image_prefetch_count:
+                break
+            try:
+                image = _get_image_meta(context, image_ref)
+            except Exception as e:
+                LOG.debug(_('Not pre-fetching image %(image_ref)s: '
+                            '%(error)s'),
+                          {'image_ref': image_ref, 'error': e})
+                continue
+            size = image.get('size') or 0
+            if size > budget:
+                LOG.debug(_('Not pre-fetching image %(image_id)s, its '
+                            '%(size)d bytes do not fit in the disk budget'),
+                          {'image_id': image['id'], 'size': size})
+                continue
+            budget -= size
+            image_ids.append(image['id'])
+
+        try:
+            cached = self.driver.prefetch_images(context, image_ids)
+        except NotImplementedError:
+            return
+        LOG.debug(_('Pre-fetched images %(image_ids)s, %(cached)d images '
+                    'cached'),
+                  {'image_ids': image_ids, 'cached': len(cached)})
+
     @periodic_task.periodic_task(spacing=CONF.instance_delete_interval)
     def _run_pending_deletes(self, context):
         """Retry any pending instance file deletes."""
@@ -306,6 +306,7 @@ class ResourceTracker(object):
             self.compute_node = None
             return
         resources['host_ip'] = CONF.my_ip
+        cached_images = resources.pop('cached_images', [])
 
         self._verify_resources(resources)
 
@@ -323,6 +324,8 @@ class ResourceTracker(object):
 
         # Now calculate usage based on instance utilization:
         self._update_usage_from_instances(resources, instances)
+        self.stats.update_cached_images(cached_images)
+        resources['stats'] = self.stats
 
         # Grab all in-progress migrations:
         capi = self.conductor_api
@@ -114,6 +114,13 @@ class Stats(dict):
         # save updated I/O workload in stats:
         self["io_workload"] = self.io_workload
 
+    def update_cached_images(self, image_ids):
+        """Update stats with the images in the image cache of the host."""
+        for key in [k for k in self if k.startswith("cached_image_")]:
+            del self[key]
+        for image_id in image_ids:
+            self["cached_image_%s" % image_id] = 1
+
     def update_stats_for_migration(self, instance_type, sign=1):
         x = self.get("num_vcpus_used", 0)
         self["num_vcpus_used"] = x + (sign * instance_type['vcpus'])
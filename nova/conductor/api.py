@@ -98,6 +98,10 @@ class LocalAPI(object):
         return self._manager.instance_get_active_by_window_joined(
             context, begin, end, project_id, host)
 
+    def instance_get_popular_image_refs(self, context, window, limit):
+        return self._manager.instance_get_popular_image_refs(context, window,
+                                                             limit)
+
     def instance_info_cache_delete(self, context, instance):
         return self._manager.instance_info_cache_delete(context, instance)
 
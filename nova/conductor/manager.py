@@ -76,7 +76,7 @@ class ConductorManager(manager.Manager):
     namespace.  See the ComputeTaskManager class for details.
     """
 
-    RPC_API_VERSION = '1.62'
+    RPC_API_VERSION = '1.63'
 
     def __init__(self, *args, **kwargs):
         super(ConductorManager, self).__init__(service_name='conductor',
@@ -370,6 +370,10 @@ class ConductorManager(manager.Manager):
             context, begin, end, project_id, host)
         return jsonutils.to_primitive(result)
 
+    def instance_get_popular_image_refs(self, context, window, limit):
+        return self.db.instance_get_popular_image_refs(context, window,
+                                                       limit)
+
     def instance_destroy(self, context, instance):
         result = self.db.instance_destroy(context, instance['uuid'])
         return jsonutils.to_primitive(result)
@@ -121,6 +121,7 @@ class ConductorAPI(rpcclient.RpcProxy):
            security_group_rule_get_by_security_group()
     1.61 - Return deleted instance from instance_destroy()
     1.62 - Added object_backport()
+    1.63 - Added instance_get_popular_image_refs()
     """
 
     BASE_RPC_API_VERSION = '1.0'
@@ -285,6 +286,11 @@ class ConductorAPI(rpcclient.RpcProxy):
                           begin=begin, end=end, project_id=project_id,
                           host=host)
 
+    def instance_get_popular_image_refs(self, context, window, limit):
+        cctxt = self.client.prepare(version='1.63')
+        return cctxt.call(context, 'instance_get_popular_image_refs',
+                          window=window, limit=limit)
+
     def instance_destroy(self, context, instance):
         instance_p = jsonutils.to_primitive(instance)
         cctxt = self.client.prepare(version='1.61')
@@ -176,7 +176,8 @@ def compute_node_get_by_service_id(context, service_id):
     return IMPL.compute_node_get_by_service_id(context, service_id)
 
 
-def compute_node_get_all(context, no_date_fields=False):
+def compute_node_get_all(context, no_date_fields=False,
+                         updated_since=None):
     """Get all computeNodes.
 
     :param context: The security context
@@ -184,11 +185,18 @@ def compute_node_get_all(context, no_date_fields=False):
                            'deleted_at' and 'deleted' fields from the output,
                            thus significantly reducing its size.
                            Set to False by default
+    :param updated_since: If set, only compute nodes created, updated or
+                          deleted at or after this time are returned.
+                          Deleted compute nodes are included (with a
+                          non-zero 'deleted' field) so that callers
+                          can drop them from their caches.
+                          Set to None by default
 
     :returns: List of dictionaries each containing compute node properties,
               including corresponding service and stats
     """
-    return IMPL.compute_node_get_all(context, no_date_fields)
+    return IMPL.compute_node_get_all(context, no_date_fields,
+                                     updated_since=updated_since)
 
 
 def compute_node_search_by_hypervisor(context, hypervisor_match):
@@ -666,6 +674,23 @@ def instance_get_active_by_window_joined(context, begin, end=None,
                                               project_id, host)
 
 
+def instance_usage_get_by_window(context, begin, end, project_id=None):
+    """Get the usage of the instances active during a window.
+
+    Yields the hours within the window and the flavor of every instance.
+    """
+    return IMPL.instance_usage_get_by_window(context, begin, end, project_id)
+
+
+def instance_usage_get_totals_by_window(context, begin, end,
+                                        project_id=None):
+    """Get the hour weighted usage of the instances active during a window,
+    summed by project.
+    """
+    return IMPL.instance_usage_get_totals_by_window(context, begin, end,
+                                                    project_id)
+
+
 def instance_get_all_by_host(context, host,
                              columns_to_join=None, use_slave=False):
     """Get all instances belonging to a host."""
@@ -698,6 +723,13 @@ def instance_get_all_hung_in_rebooting(context, reboot_window):
     return IMPL.instance_get_all_hung_in_rebooting(context, reboot_window)
 
 
+def instance_get_popular_image_refs(context, window, limit):
+    """Get the limit image_refs booted the most in the last window seconds,
+    most booted first.
+    """
+    return IMPL.instance_get_popular_image_refs(context, window, limit)
+
+
 def instance_update(context, instance_uuid, values, update_cells=True):
     """Set the given properties on an instance and update it.
 
@@ -1182,6 +1214,12 @@ def block_device_mapping_get_all_by_instance(context, instance_uuid):
                                                          instance_uuid)
 
 
+def block_device_mapping_get_by_instance_uuids(context, instance_uuids):
+    """Get all block device mappings of the instances, by instance uuid."""
+    return IMPL.block_device_mapping_get_by_instance_uuids(context,
+                                                           instance_uuids)
+
+
 def block_device_mapping_get_by_volume_id(context, volume_id,
         columns_to_join=None):
     """Get block device mapping for a given volume."""
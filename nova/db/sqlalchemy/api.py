@@ -24,6 +24,7 @@ import copy
 import datetime
 import functools
 import itertools
+import re
 import sys
 import time
 import uuid
@@ -32,12 +33,16 @@ from oslo.config import cfg
 import six
 from sqlalchemy import and_
 from sqlalchemy import Boolean
+from sqlalchemy import case
+from sqlalchemy import cast
+from sqlalchemy import DateTime
 from sqlalchemy.exc import DataError
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.exc import NoSuchTableError
 from sqlalchemy import Integer
 from sqlalchemy import MetaData
 from sqlalchemy import or_
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
@@ -45,6 +50,9 @@ from sqlalchemy.orm import noload
 from sqlalchemy.schema import Table
 from sqlalchemy.sql.expression import asc
 from sqlalchemy.sql.expression import desc
+from sqlalchemy.sql.expression import extract
+from sqlalchemy.sql.expression import literal
+from sqlalchemy.sql.expression import literal_column
 from sqlalchemy.sql.expression import select
 from sqlalchemy.sql import func
 from sqlalchemy import String
@@ -60,6 +68,7 @@ from nova.openstack.common.db.sqlalchemy import session as db_session
 from nova.openstack.common.db.sqlalchemy import utils as sqlalchemyutils
 from nova.openstack.common import excutils
 from nova.openstack.common.gettextutils import _
+from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova.openstack.common import uuidutils
@@ -70,11 +79,20 @@ db_opts = [
                help='When set, compute API will consider duplicate hostnames '
                     'invalid within the specified scope, regardless of case. '
                     'Should be empty, "project" or "global".'),
+    cfg.BoolOpt('instance_list_fast_path',
+                default=False,
+                help='Load the instances listed by '
+                     'instance_get_all_by_filters with a column query and '
+                     'batched queries for their info cache and security '
+                     'groups, instead of building ORM objects. The info '
+                     'cache and security groups of the listed instances are '
+                     'then plain dicts'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(db_opts)
 CONF.import_opt('compute_topic', 'nova.compute.rpcapi')
+CONF.import_opt('instance_name_template', 'nova.db.api')
 CONF.import_opt('connection',
                 'nova.openstack.common.db.sqlalchemy.session',
                 group='database')
@@ -531,7 +549,7 @@ def compute_node_get_by_service_id(context, service_id):
 
 
 @require_admin_context
-def compute_node_get_all(context, no_date_fields):
+def compute_node_get_all(context, no_date_fields, updated_since=None):
 
     # NOTE(msdubov): Using lower-level 'select' queries and joining the tables
     #                manually here allows to gain 3x speed-up and to have 5x
@@ -551,8 +569,18 @@ def compute_node_get_all(context, no_date_fields):
         def filter_columns(table):
             return [c for c in table.c if c.name not in redundant_columns]
 
+        if updated_since is None:
+            compute_node_filter = compute_node.c.deleted == 0
+        else:
+            # NOTE: Deleted rows are returned as well, so that
+            # incremental callers learn about removed nodes.
+            compute_node_filter = or_(
+                compute_node.c.updated_at >= updated_since,
+                compute_node.c.created_at >= updated_since,
+                compute_node.c.deleted_at >= updated_since)
+
         compute_node_query = select(filter_columns(compute_node)).\
-                                where(compute_node.c.deleted == 0).\
+                                where(compute_node_filter).\
                                 order_by(compute_node.c.service_id)
         compute_node_rows = conn.execute(compute_node_query).fetchall()
 
@@ -562,8 +590,14 @@ def compute_node_get_all(context, no_date_fields):
                             order_by(service.c.id)
         service_rows = conn.execute(service_query).fetchall()
 
+        stat_filter = stat.c.deleted == 0
+        if updated_since is not None:
+            changed_ids = select([compute_node.c.id]).\
+                              where(compute_node_filter)
+            stat_filter &= stat.c.compute_node_id.in_(changed_ids)
+
         stat_query = select(filter_columns(stat)).\
-                        where(stat.c.deleted == 0).\
+                        where(stat_filter).\
                         order_by(stat.c.compute_node_id)
         stat_rows = conn.execute(stat_query).fetchall()
 
@@ -1678,6 +1712,8 @@ def instance_destroy(context, instance_uuid, constraint=None):
         model_query(context, models.InstanceInfoCache, session=session).\
                 filter_by(instance_uuid=instance_uuid).\
                 soft_delete()
+        _instance_ip_addresses_update(context, instance_uuid, None,
+                                      session=session)
         model_query(context, models.InstanceMetadata, session=session).\
                 filter_by(instance_uuid=instance_uuid).\
                 soft_delete()
@@ -1865,9 +1901,15 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     else:
         manual_joins, columns_to_join = _manual_join_columns(columns_to_join)
 
-    query_prefix = session.query(models.Instance)
-    for column in columns_to_join:
-        query_prefix = query_prefix.options(joinedload(column))
+    if CONF.instance_list_fast_path:
+        # NOTE: Querying the columns instead of the model skips building
+        # the ORM objects. The joins are done by _instances_fill_joins().
+        query_prefix = session.query(*[getattr(models.Instance, column.name)
+                for column in models.Instance.__table__.columns])
+    else:
+        query_prefix = session.query(models.Instance)
+        for column in columns_to_join:
+            query_prefix = query_prefix.options(joinedload(column))
 
     query_prefix = query_prefix.order_by(sort_fn[sort_dir](
             getattr(models.Instance, sort_key)))
@@ -1926,6 +1968,7 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     query_prefix = exact_filter(query_prefix, models.Instance,
                                 filters, exact_match_filter_names)
 
+    query_prefix = ip_filter(query_prefix, filters)
     query_prefix = regex_filter(query_prefix, models.Instance, filters)
     query_prefix = tag_filter(context, query_prefix, models.Instance,
                               models.InstanceMetadata,
@@ -1933,18 +1976,93 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                               filters)
 
     # paginate query
+    sort_keys = [sort_key, 'created_at', 'id']
     if marker is not None:
         try:
-            marker = _instance_get_by_uuid(context, marker, session=session)
+            marker = _instance_get_sort_values(context, marker, sort_keys,
+                                               session=session)
         except exception.InstanceNotFound:
             raise exception.MarkerNotFound(marker)
     query_prefix = sqlalchemyutils.paginate_query(query_prefix,
                            models.Instance, limit,
-                           [sort_key, 'created_at', 'id'],
+                           sort_keys,
                            marker=marker,
                            sort_dir=sort_dir)
 
-    return _instances_fill_metadata(context, query_prefix.all(), manual_joins)
+    if CONF.instance_list_fast_path:
+        instances = [dict(zip(row.keys(), row)) for row in query_prefix]
+        _instances_fill_joins(instances, columns_to_join, session)
+    else:
+        instances = query_prefix.all()
+    return _instances_fill_metadata(context, instances, manual_joins)
+
+
+def _instance_get_sort_values(context, uuid, sort_keys, session=None):
+    """Return the sort_keys columns of an instance, enough to use it as a
+    pagination marker without loading the whole instance.
+    """
+    columns = [getattr(models.Instance, key) for key in set(sort_keys)]
+    result = model_query(context, *columns, session=session,
+                         base_model=models.Instance, project_only=True).\
+                filter(models.Instance.uuid == uuid).\
+                first()
+
+    if not result:
+        raise exception.InstanceNotFound(instance_id=uuid)
+
+    return result
+
+
+def _instance_name(instance):
+    """Same as models.Instance.name, for an instance loaded as a dict."""
+    try:
+        return CONF.instance_name_template % instance['id']
+    except TypeError:
+        # Support templates like "uuid-%(uuid)s", etc.
+        info = dict((key, value) for key, value in instance.iteritems()
+                    if key != 'name')
+        try:
+            return CONF.instance_name_template % info
+        except KeyError:
+            return instance['uuid']
+
+
+def _instances_fill_joins(instances, columns_to_join, session):
+    """Fill instances loaded as dicts with the same info_cache and
+    security_groups as the model relationships, from one query per table.
+    """
+    uuids = [inst['uuid'] for inst in instances]
+
+    info_caches = {}
+    if uuids and 'info_cache' in columns_to_join:
+        info_cache = models.InstanceInfoCache.__table__
+        query = select([info_cache]).\
+                    where(info_cache.c.instance_uuid.in_(uuids))
+        for row in session.execute(query):
+            info_caches[row['instance_uuid']] = dict(row.items())
+
+    security_groups = collections.defaultdict(list)
+    # NOTE: Like the relationship, deleted instances have no security groups.
+    live_uuids = [inst['uuid'] for inst in instances if not inst['deleted']]
+    if live_uuids and 'security_groups' in columns_to_join:
+        group = models.SecurityGroup.__table__
+        association = models.SecurityGroupInstanceAssociation.__table__
+        query = select([group, association.c.instance_uuid]).\
+                    select_from(group.join(association,
+                            group.c.id == association.c.security_group_id)).\
+                    where(and_(association.c.instance_uuid.in_(live_uuids),
+                               association.c.deleted == 0,
+                               group.c.deleted == 0))
+        for row in session.execute(query):
+            values = dict(row.items())
+            security_groups[values.pop('instance_uuid')].append(values)
+
+    for inst in instances:
+        inst['name'] = _instance_name(inst)
+        if 'info_cache' in columns_to_join:
+            inst['info_cache'] = info_caches.get(inst['uuid'])
+        if 'security_groups' in columns_to_join:
+            inst['security_groups'] = security_groups[inst['uuid']]
 
 
 def tag_filter(context, query, model, model_metadata,
@@ -2015,13 +2133,6 @@ def regex_filter(query, model, filters):
     :param filters: dictionary of filters with regex values
     """
 
-    regexp_op_map = {
-        'postgresql': '~',
-        'mysql': 'REGEXP',
-        'sqlite': 'REGEXP'
-    }
-    db_string = CONF.database.connection.split(':')[0].split('+')[0]
-    db_regexp_op = regexp_op_map.get(db_string, 'LIKE')
     for filter_name in filters.iterkeys():
         try:
             column_attr = getattr(model, filter_name)
@@ -2029,15 +2140,111 @@ def regex_filter(query, model, filters):
             continue
         if 'property' == type(column_attr).__name__:
             continue
-        if db_regexp_op == 'LIKE':
-            query = query.filter(column_attr.op(db_regexp_op)(
-                                 '%' + str(filters[filter_name]) + '%'))
-        else:
-            query = query.filter(column_attr.op(db_regexp_op)(
-                                 str(filters[filter_name])))
+        query = query.filter(_regex_clause(column_attr,
+                                           str(filters[filter_name])))
     return query
 
 
+def ip_filter(query, filters):
+    """Applies the 'ip' and 'ip6' regular expression filters to a query on
+    instances, from the index of the addresses of their info caches.
+
+    Returns the updated query.  This method alters filters to remove the
+    keys it applies.  Like the network API, the regular expressions match
+    from the start of the addresses.
+
+    :param query: query to apply filters to
+    :param filters: dictionary of filters
+    """
+    for filter_name, version in (('ip', 4), ('ip6', 6)):
+        if filter_name not in filters:
+            continue
+        regex = str(filters.pop(filter_name))
+        if not regex.startswith('^'):
+            regex = '^' + regex
+        address = models.InstanceIpAddress.address
+        instance_uuids = select([models.InstanceIpAddress.instance_uuid]).\
+                where(and_(models.InstanceIpAddress.version == version,
+                           _regex_clause(address, regex)))
+        query = query.filter(models.Instance.uuid.in_(instance_uuids))
+    return query
+
+
+def _regex_clause(column_attr, regex):
+    """Return a clause matching column_attr against a regular expression.
+
+    Simple regular expressions are turned into LIKE (GLOB on sqlite)
+    predicates, which can use the indexes when they are anchored at the
+    start.  The other ones use the REGEXP operator of the database.
+    """
+    regexp_op_map = {
+        'postgresql': '~',
+        'mysql': 'REGEXP',
+        'sqlite': 'REGEXP'
+    }
+    db_string = CONF.database.connection.split(':')[0].split('+')[0]
+    db_regexp_op = regexp_op_map.get(db_string, 'LIKE')
+    if db_regexp_op == 'LIKE':
+        return column_attr.op(db_regexp_op)('%' + regex + '%')
+
+    parts = _regex_to_wildcards(regex)
+    if parts is None:
+        return column_attr.op(db_regexp_op)(regex)
+    if db_string == 'sqlite':
+        # NOTE: LIKE is case insensitive on sqlite, unlike its REGEXP.
+        return column_attr.op('GLOB')(''.join(
+                '*' if part is None else re.sub(r'([*?[])', r'[\1]', part)
+                for part in parts))
+    # NOTE: Backslash is the default LIKE escape character of both MySQL
+    # and PostgreSQL, and LIKE is as case sensitive as their REGEXP.
+    return column_attr.like(''.join(
+            '%' if part is None else re.sub(r'([\\%_])', r'\\\1', part)
+            for part in parts))
+
+
+_REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+def _regex_to_wildcards(regex):
+    """Split a regular expression made only of literal characters and
+    '.*', maybe anchored with '^' and '$', into a list of its literal
+    strings and None for each (implicit or explicit) '.*'.
+
+    Returns None if the regular expression is not that simple.
+    """
+    parts = [] if regex.startswith('^') else [None]
+    literal = []
+    i = 1 if regex.startswith('^') else 0
+    anchored = False
+    while i < len(regex):
+        char = regex[i]
+        if char == '\\':
+            if i + 1 == len(regex) or regex[i + 1].isalnum():
+                return None
+            literal.append(regex[i + 1])
+            i += 2
+        elif regex.startswith('.*', i):
+            if literal:
+                parts.append(''.join(literal))
+                literal = []
+            if not parts or parts[-1] is not None:
+                parts.append(None)
+            i += 2
+        elif char == '$' and i == len(regex) - 1:
+            anchored = True
+            i += 1
+        elif char in _REGEX_SPECIAL_CHARS:
+            return None
+        else:
+            literal.append(char)
+            i += 1
+    if literal:
+        parts.append(''.join(literal))
+    if not anchored and (not parts or parts[-1] is not None):
+        parts.append(None)
+    return parts
+
+
 @require_context
 def instance_get_active_by_window_joined(context, begin, end=None,
                                          project_id=None, host=None):
@@ -2059,6 +2266,133 @@ def instance_get_active_by_window_joined(context, begin, end=None,
     return _instances_fill_metadata(context, query.all())
 
 
+def _seconds_between(session, start, stop):
+    """Return an expression of the seconds from start to stop."""
+    dialect = session.bind.dialect.name
+    if dialect == 'mysql':
+        return func.timestampdiff(literal_column('SECOND'), start, stop)
+    if dialect == 'postgresql':
+        return extract('epoch', stop - start)
+    # SQLite date and time functions are precise to the millisecond.
+    return func.round((func.julianday(stop) - func.julianday(start)) *
+                      86400.0, 3)
+
+
+def _instance_usage_query(context, session, begin, end, project_id=None):
+    """Build the query of the instances active during the window.
+
+    Returns the query, the expression of the hours of an instance within
+    the window, and the expressions of its flavor properties. Like for the
+    API, the flavor is the one saved in the instance system metadata, or
+    for deleted instances without it, the one of its instance_type_id.
+    Instances without a flavor are left out.
+    """
+    instance = models.Instance
+    flavor = models.InstanceTypes
+    read_deleted = context.read_deleted == 'no'
+
+    flavor_on = and_(flavor.id == instance.instance_type_id,
+                     instance.deleted != 0)
+    if read_deleted:
+        flavor_on = and_(flavor_on, flavor.deleted == 0)
+    query = session.query(instance).outerjoin(flavor, flavor_on)
+
+    flavor_props = {}
+    for prop in ('name', 'memory_mb', 'vcpus', 'root_gb', 'ephemeral_gb'):
+        sys_meta = aliased(models.InstanceSystemMetadata)
+        sys_meta_on = and_(sys_meta.instance_uuid == instance.uuid,
+                           sys_meta.key == 'instance_type_%s' % prop)
+        if read_deleted:
+            sys_meta_on = and_(sys_meta_on, sys_meta.deleted == 0)
+        query = query.outerjoin(sys_meta, sys_meta_on)
+        value = sys_meta.value
+        if prop != 'name':
+            value = cast(value, Integer)
+        flavor_props[prop] = func.coalesce(value, getattr(flavor, prop))
+
+    query = query.filter(or_(instance.terminated_at == None,
+                             instance.terminated_at > begin)).\
+                  filter(instance.launched_at < end).\
+                  filter(flavor_props['name'] != None)
+    if project_id:
+        query = query.filter(instance.project_id == project_id)
+
+    # Clamp the lifetime of the instances to the window.
+    start = case([(instance.launched_at > begin, instance.launched_at)],
+                 else_=literal(begin, DateTime))
+    stop = case([(and_(instance.terminated_at != None,
+                       instance.terminated_at < end),
+                  instance.terminated_at)],
+                else_=literal(end, DateTime))
+    hours = _seconds_between(session, start, stop) / 3600.0
+
+    return query, hours, flavor_props
+
+
+@require_context
+def instance_usage_get_by_window(context, begin, end, project_id=None):
+    """Yield the usage of the instances active during the window.
+
+    The rows are read from the database as they are used, instead of
+    being loaded at once.
+    """
+    session = get_session()
+    query, hours, flavor_props = _instance_usage_query(context, session,
+                                                       begin, end,
+                                                       project_id)
+    instance = models.Instance
+    query = query.with_entities(instance.uuid,
+                                instance.display_name,
+                                instance.project_id,
+                                instance.vm_state,
+                                instance.launched_at,
+                                instance.terminated_at,
+                                hours,
+                                flavor_props['name'],
+                                flavor_props['memory_mb'],
+                                flavor_props['vcpus'],
+                                flavor_props['root_gb'],
+                                flavor_props['ephemeral_gb'])
+
+    for row in query.yield_per(1000):
+        yield {'uuid': row[0],
+               'display_name': row[1],
+               'project_id': row[2],
+               'vm_state': row[3],
+               'launched_at': row[4],
+               'terminated_at': row[5],
+               'hours': float(row[6]),
+               'flavor': {'name': row[7],
+                          'memory_mb': row[8],
+                          'vcpus': row[9],
+                          'root_gb': row[10],
+                          'ephemeral_gb': row[11]}}
+
+
+@require_context
+def instance_usage_get_totals_by_window(context, begin, end,
+                                        project_id=None):
+    """Sum the usage of the instances active during the window by project."""
+    session = get_session()
+    query, hours, flavor_props = _instance_usage_query(context, session,
+                                                       begin, end,
+                                                       project_id)
+    local_gb = flavor_props['root_gb'] + flavor_props['ephemeral_gb']
+    query = query.with_entities(models.Instance.project_id,
+                                func.sum(hours),
+                                func.sum(hours * flavor_props['vcpus']),
+                                func.sum(hours * flavor_props['memory_mb']),
+                                func.sum(hours * local_gb)).\
+                  group_by(models.Instance.project_id)
+
+    return [{'project_id': row[0],
+             'total_hours': float(row[1] or 0),
+             'total_vcpus_usage': float(row[2] or 0),
+             'total_memory_mb_usage': float(row[3] or 0),
+             'total_local_gb_usage': float(row[4] or 0)}
+            for row in query.all()]
+
+
 def _instance_get_all_query(context, project_only=False,
                             joins=None, use_slave=False):
     if joins is None:
@@ -2173,6 +2507,26 @@ def instance_get_all_hung_in_rebooting(context, reboot_window):
         manual_joins=[])
 
 
+@require_admin_context
+def instance_get_popular_image_refs(context, window, limit):
+    """Return the image_refs of the instances created in the last window
+    seconds, deleted or not, most booted first.
+    """
+    since = timeutils.utcnow() - datetime.timedelta(seconds=window)
+    image_ref = models.Instance.image_ref
+    boots = func.count(models.Instance.id)
+    result = model_query(context, image_ref, boots, read_deleted='yes',
+                         base_model=models.Instance).\
+                filter(models.Instance.created_at > since).\
+                filter(image_ref != None).\
+                filter(image_ref != '').\
+                group_by(image_ref).\
+                order_by(desc(boots), asc(image_ref)).\
+                limit(limit).\
+                all()
+    return [row[0] for row in result]
+
+
 @require_context
 def instance_update(context, instance_uuid, values):
     instance_ref = _instance_update(context, instance_uuid, values)[1]
@@ -2359,6 +2713,11 @@ def instance_info_cache_update(context, instance_uuid, values):
             # wins.
             pass
 
+        if 'network_info' in values:
+            _instance_ip_addresses_update(context, instance_uuid,
+                                          values['network_info'],
+                                          session=session)
+
     return info_cache
 
 
@@ -2369,9 +2728,47 @@ def instance_info_cache_delete(context, instance_uuid):
     :param instance_uuid: = uuid of the instance tied to the cache record
     :param session: = optional session object
     """
-    model_query(context, models.InstanceInfoCache).\
-                         filter_by(instance_uuid=instance_uuid).\
-                         soft_delete()
+    session = get_session()
+    with session.begin():
+        model_query(context, models.InstanceInfoCache, session=session).\
+                             filter_by(instance_uuid=instance_uuid).\
+                             soft_delete()
+        _instance_ip_addresses_update(context, instance_uuid, None,
+                                      session=session)
+
+
+def _network_info_addresses(network_info):
+    """Return the IP addresses of a network_info, with their versions."""
+    if isinstance(network_info, six.string_types):
+        try:
+            network_info = jsonutils.loads(network_info)
+        except ValueError:
+            return []
+    addresses = []
+    for vif in network_info or []:
+        for subnet in (vif.get('network') or {}).get('subnets') or []:
+            for ip in subnet.get('ips') or []:
+                ips = [ip] + (ip.get('floating_ips') or [])
+                for address in [ip['address'] for ip in ips]:
+                    addresses.append((address, 6 if ':' in address else 4))
+    return addresses
+
+
+def _instance_ip_addresses_update(context, instance_uuid, network_info,
+                                  session):
+    """Replace the indexed IP addresses of an instance with the ones of
+    network_info.
+    """
+    model_query(context, models.InstanceIpAddress, session=session,
+                read_deleted='yes').\
+            filter_by(instance_uuid=instance_uuid).\
+            delete(synchronize_session=False)
+    for address, version in _network_info_addresses(network_info):
+        ip_address_ref = models.InstanceIpAddress()
+        ip_address_ref.update({'instance_uuid': instance_uuid,
+                               'address': address,
+                               'version': version})
+        session.add(ip_address_ref)
 
 
 ###################
@@ -3554,6 +3951,26 @@ def block_device_mapping_get_all_by_instance(context, instance_uuid):
                  all()
 
 
+@require_context
+def block_device_mapping_get_by_instance_uuids(context, instance_uuids):
+    if not instance_uuids:
+        return {}
+
+    rows = _block_device_mapping_get_query(context).\
+                 filter(models.BlockDeviceMapping.instance_uuid.in_(
+                     instance_uuids)).\
+                 all()
+
+    output = {}
+    for instance_uuid in instance_uuids:
+        output[instance_uuid] = []
+
+    for row in rows:
+        output[row['instance_uuid']].append(row)
+
+    return output
+
+
 @require_context
 def block_device_mapping_get_by_volume_id(context, volume_id,
         columns_to_join=None):
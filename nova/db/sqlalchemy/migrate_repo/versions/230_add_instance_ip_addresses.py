@@ -0,0 +1,122 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Index
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import select
+from sqlalchemy import String
+from sqlalchemy import Table
+
+from nova.db.sqlalchemy import api
+from nova.db.sqlalchemy import utils
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+# Number of instance_info_caches rows loaded at once.
+PAGE_SIZE = 1000
+
+
+def _addresses(network_info):
+    """Return the (address, version) pairs of a network_info."""
+    try:
+        vifs = jsonutils.loads(network_info or '[]')
+    except ValueError:
+        return []
+    addresses = []
+    for vif in vifs:
+        for subnet in (vif.get('network') or {}).get('subnets') or []:
+            for ip in subnet.get('ips') or []:
+                ips = [ip] + (ip.get('floating_ips') or [])
+                for address in [ip['address'] for ip in ips]:
+                    addresses.append((address, 6 if ':' in address else 4))
+    return addresses
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+
+    instance_ip_addresses = Table('instance_ip_addresses', meta,
+            Column('created_at', DateTime(timezone=False)),
+            Column('updated_at', DateTime(timezone=False)),
+            Column('deleted_at', DateTime(timezone=False)),
+            Column('deleted', Integer, default=0),
+            Column('id', Integer, primary_key=True, nullable=False),
+            Column('instance_uuid', String(36), nullable=False),
+            Column('address', String(39), nullable=False),
+            Column('version', Integer, nullable=False),
+            Index('instance_ip_addresses_address_idx', 'address'),
+            Index('instance_ip_addresses_instance_uuid_idx',
+                  'instance_uuid'),
+            mysql_engine='InnoDB',
+            mysql_charset='utf8')
+
+    try:
+        instance_ip_addresses.create()
+        utils.create_shadow_table(migrate_engine,
+                                  table=instance_ip_addresses)
+    except Exception:
+        LOG.exception(_("Exception while creating table "
+                        "'instance_ip_addresses'."))
+        raise
+
+    # Index the addresses of the existing info caches, a page of rows at
+    # a time.
+    info_caches = Table('instance_info_caches', meta, autoload=True)
+    last_id = 0
+    while True:
+        query = select([info_caches.c.id,
+                        info_caches.c.instance_uuid,
+                        info_caches.c.network_info]).\
+                    where(info_caches.c.deleted == 0).\
+                    where(info_caches.c.id > last_id).\
+                    order_by(info_caches.c.id).\
+                    limit(PAGE_SIZE)
+        info_caches_page = migrate_engine.execute(query).fetchall()
+        if not info_caches_page:
+            break
+        rows = []
+        for info_cache in info_caches_page:
+            for address, version in _addresses(info_cache['network_info']):
+                rows.append({'instance_uuid': info_cache['instance_uuid'],
+                             'address': address,
+                             'version': version,
+                             'deleted': 0})
+        if rows:
+            migrate_engine.execute(instance_ip_addresses.insert(), rows)
+        last_id = info_caches_page[-1]['id']
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+
+    try:
+        instance_ip_addresses = Table('instance_ip_addresses', meta,
+                                      autoload=True)
+        instance_ip_addresses.drop()
+        shadow_instance_ip_addresses = Table(
+                api._SHADOW_TABLE_PREFIX + 'instance_ip_addresses', meta,
+                autoload=True)
+        shadow_instance_ip_addresses.drop()
+    except Exception:
+        LOG.exception(_("Exception while dropping 'instance_ip_addresses' "
+                        "tables."))
+        raise
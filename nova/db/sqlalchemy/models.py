@@ -327,6 +327,24 @@ class InstanceInfoCache(BASE, NovaBase):
                             primaryjoin=instance_uuid == Instance.uuid)
 
 
+class InstanceIpAddress(BASE, NovaBase):
+    """Represents an IP address of an instance, as found in its info cache.
+
+    This is an index of the info caches for filtering instances on their IP
+    addresses. Its rows are replaced, not soft deleted, whenever the info
+    cache is updated.
+    """
+    __tablename__ = 'instance_ip_addresses'
+    __table_args__ = (
+        Index('instance_ip_addresses_address_idx', 'address'),
+        Index('instance_ip_addresses_instance_uuid_idx', 'instance_uuid'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    instance_uuid = Column(String(36), nullable=False)
+    address = Column(String(39), nullable=False)
+    version = Column(Integer, nullable=False)
+
+
 class InstanceTypes(BASE, NovaBase):
     """Represents possible flavors for instances.
 
@@ -469,6 +469,11 @@ class ImageUnacceptable(Invalid):
     msg_fmt = _("Image %(image_id)s is unacceptable: %(reason)s")
 
 
+class ImageChecksumMismatch(Invalid):
+    msg_fmt = _("Image %(image_id)s has checksum %(checksum)s, expected "
+                "%(expected)s")
+
+
 class InstanceUnacceptable(Invalid):
     msg_fmt = _("Instance %(instance_id)s is unacceptable: %(reason)s")
 
@@ -47,6 +47,11 @@ class BaseFilter(object):
     # for each request rather than for each instance
     run_filter_once_per_request = False
 
+    # Set to false in a subclass if whether an object passes the filter
+    # can change when other objects are chosen for earlier instances of
+    # the same request, rather than only when the object itself changes
+    run_filter_batched = True
+
     def run_filter_for_index(self, index):
         """Return True if the filter needs to be run for the "index-th"
         instance in a request.  Only need to override this if a filter
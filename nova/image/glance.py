@@ -20,6 +20,7 @@
 from __future__ import absolute_import
 
 import copy
+import hashlib
 import itertools
 import json
 import random
@@ -27,6 +28,7 @@ import sys
 import time
 import urlparse
 
+from eventlet import event
 import glanceclient
 import glanceclient.exc
 from oslo.config import cfg
@@ -34,6 +36,7 @@ import six
 
 from nova import exception
 import nova.image.download as image_xfers
+from nova.openstack.common import excutils
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
@@ -69,6 +72,11 @@ glance_opts = [
                 help='A list of url scheme that can be downloaded directly '
                      'via the direct_url.  Currently supported schemes: '
                      '[file].'),
+    cfg.IntOpt('glance_metadata_cache_ttl',
+               default=0,
+               help='Number of seconds the image metadata shown by glance '
+                    'is cached in the process, including the images not '
+                    'found. 0 to disable the cache'),
     ]
 
 LOG = logging.getLogger(__name__)
@@ -229,6 +237,153 @@ class GlanceClientWrapper(object):
                 time.sleep(1)
 
 
+class ImageDigest(object):
+    """Checksums of the image data streamed by GlanceImageService.download.
+
+    The md5 is checked against expected_md5, the checksum Glance keeps for
+    the image, once all the data went through. The sha1 is the checksum
+    the libvirt image cache stores for its base images, so that the
+    downloaded file does not need to be read again.
+    """
+
+    def __init__(self, expected_md5=None):
+        self.expected_md5 = expected_md5
+        self.md5 = hashlib.md5()
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        # Only set once all the data went through, image data copied by a
+        # direct url transfer module is not seen.
+        self.complete = False
+
+    def update(self, chunk):
+        self.md5.update(chunk)
+        self.sha1.update(chunk)
+        self.size += len(chunk)
+
+    def verify(self, image_id):
+        checksum = self.md5.hexdigest()
+        if self.expected_md5 and checksum != self.expected_md5:
+            raise exception.ImageChecksumMismatch(image_id=image_id,
+                                                  checksum=checksum,
+                                                  expected=self.expected_md5)
+        self.complete = True
+
+
+class ImageMetadataCache(object):
+    """Process local cache of the image metadata shown by Glance.
+
+    What Glance shows of an image depends on who asks, so the metadata is
+    cached by image and by tenant visibility. The images not found are
+    cached too. The requests for an image that is not cached wait for the
+    request already calling Glance for it, if any, rather than calling
+    Glance again.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # The cached metadata by image id, then by visibility, as
+        # (expires, image_meta) with image_meta None for the images
+        # not found.
+        self._images = {}
+        # The calls to Glance in progress, by image id and visibility.
+        self._pending = {}
+        self._next_purge = timeutils.utcnow_ts() + ttl
+        self.stats = {'hits': 0,
+                      'misses': 0,
+                      'shared': 0,
+                      'invalidations': 0}
+
+    @staticmethod
+    def _visibility(context):
+        return (context.project_id, bool(context.is_admin))
+
+    def get(self, context, image_id, show_func):
+        """Return the metadata of image_id, calling show_func on misses.
+
+        :raises: ImageNotFound if show_func raised it, or if it did for
+                 the same visibility less than ttl seconds ago.
+        """
+        visibility = self._visibility(context)
+        now = timeutils.utcnow_ts()
+        entry = self._images.get(image_id, {}).get(visibility)
+        if entry is not None and entry[0] > now:
+            self.stats['hits'] += 1
+            return self._copy(image_id, entry[1])
+
+        key = (image_id, visibility)
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.stats['shared'] += 1
+            return self._copy(image_id, pending.wait())
+
+        self.stats['misses'] += 1
+        pending = event.Event()
+        self._pending[key] = pending
+        try:
+            try:
+                image_meta = show_func(context, image_id)
+            except exception.ImageNotFound:
+                image_meta = None
+            self._set(image_id, visibility, image_meta)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                pending.send_exception(*sys.exc_info())
+        else:
+            pending.send(image_meta)
+        finally:
+            del self._pending[key]
+        return self._copy(image_id, image_meta)
+
+    def _set(self, image_id, visibility, image_meta):
+        now = timeutils.utcnow_ts()
+        if now >= self._next_purge:
+            self._purge(now)
+        self._images.setdefault(image_id, {})[visibility] = (
+            now + self.ttl, image_meta)
+
+    def _purge(self, now):
+        """Drop the expired entries."""
+        for image_id, entries in self._images.items():
+            for visibility, (expires, _image_meta) in entries.items():
+                if expires <= now:
+                    del entries[visibility]
+            if not entries:
+                del self._images[image_id]
+        self._next_purge = now + self.ttl
+
+    @staticmethod
+    def _copy(image_id, image_meta):
+        if image_meta is None:
+            raise exception.ImageNotFound(image_id=image_id)
+        # The callers are free to change the metadata they get.
+        return copy.deepcopy(image_meta)
+
+    def invalidate(self, image_id):
+        """Forget image_id, for every visibility."""
+        if self._images.pop(image_id, None) is not None:
+            self.stats['invalidations'] += 1
+
+
+_metadata_cache = None
+
+
+def get_metadata_cache():
+    """Return the image metadata cache, None when it is disabled."""
+    global _metadata_cache
+    if CONF.glance_metadata_cache_ttl <= 0:
+        return None
+    if (_metadata_cache is None or
+            _metadata_cache.ttl != CONF.glance_metadata_cache_ttl):
+        _metadata_cache = ImageMetadataCache(CONF.glance_metadata_cache_ttl)
+    return _metadata_cache
+
+
+def reset_metadata_cache():
+    """Empty the image metadata cache, mainly for testing purposes."""
+    global _metadata_cache
+    _metadata_cache = None
+
+
 class GlanceImageService(object):
     """Provides storage and retrieval of disk image objects within Glance."""
 
@@ -285,6 +440,12 @@ class GlanceImageService(object):
 
     def show(self, context, image_id):
         """Returns a dict with image data for the given opaque image id."""
+        cache = get_metadata_cache()
+        if cache is not None:
+            return cache.get(context, image_id, self._show)
+        return self._show(context, image_id)
+
+    def _show(self, context, image_id):
         try:
             image = self._client.call(context, 1, 'get', image_id)
         except Exception:
@@ -325,8 +486,13 @@ class GlanceImageService(object):
                 "for %(scheme)s") % {'scheme': scheme})
         return
 
-    def download(self, context, image_id, data=None, dst_path=None):
-        """Calls out to Glance for data and writes data."""
+    def download(self, context, image_id, data=None, dst_path=None,
+                 digest=None):
+        """Calls out to Glance for data and writes data.
+
+        If an ImageDigest is given, the data written is fed to it and
+        verified against its expected checksum.
+        """
         if CONF.allowed_direct_url_schemes and dst_path is not None:
             locations = self._get_locations(context, image_id)
             for entry in locations:
@@ -360,9 +526,13 @@ class GlanceImageService(object):
             try:
                 for chunk in image_chunks:
                     data.write(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
             finally:
                 if close_file:
                     data.close()
+            if digest is not None:
+                digest.verify(image_id)
 
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
@@ -396,6 +566,8 @@ class GlanceImageService(object):
             _reraise_translated_image_exception(image_id)
         else:
             return self._translate_from_glance(image_meta)
+        finally:
+            _invalidate_metadata(image_id)
 
     def delete(self, context, image_id):
         """Delete the given image.
@@ -411,6 +583,8 @@ class GlanceImageService(object):
             raise exception.ImageNotFound(image_id=image_id)
         except glanceclient.exc.HTTPForbidden:
             raise exception.ImageNotAuthorized(image_id=image_id)
+        finally:
+            _invalidate_metadata(image_id)
         return True
 
     @staticmethod
@@ -457,6 +631,12 @@ class GlanceImageService(object):
         return str(user_id) == str(context.user_id)
 
 
+def _invalidate_metadata(image_id):
+    cache = get_metadata_cache()
+    if cache is not None:
+        cache.invalidate(image_id)
+
+
 def _convert_timestamps_to_datetimes(image_meta):
     """Returns image with timestamp fields converted to datetime objects."""
     for attr in ['created_at', 'updated_at', 'deleted_at']:
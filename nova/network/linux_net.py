@@ -23,7 +23,9 @@ import calendar
 import inspect
 import os
 import re
+import time
 
+from eventlet import greenthread
 import netaddr
 from oslo.config import cfg
 import six
@@ -123,6 +125,13 @@ linux_net_opts = [
                default='DROP',
                help=('The table that iptables to jump to when a packet is '
                      'to be dropped.')),
+    cfg.FloatOpt('iptables_apply_coalesce_delay',
+                 default=0.0,
+                 help='Number of seconds an iptables apply waits for other '
+                      'changes before running iptables-save and '
+                      'iptables-restore, so that the applies of a burst of '
+                      'changes are coalesced into one.  Applies that are '
+                      'waiting for the iptables lock are always coalesced.'),
     cfg.IntOpt('ovs_vsctl_timeout',
                default=120,
                help='Amount of time, in seconds, that ovs_vsctl should wait '
@@ -170,6 +179,9 @@ class IptablesRule(object):
     def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        return hash((self.chain, self.rule, self.wrap, self.top))
+
     def __str__(self):
         if self.wrap:
             chain = '%s-%s' % (binary_name, self.chain)
@@ -184,6 +196,8 @@ class IptablesTable(object):
 
     def __init__(self):
         self.rules = []
+        # Hashed index of self.rules, to find duplicates in O(1)
+        self._rule_index = set()
         self.remove_rules = []
         self.chains = set()
         self.unwrapped_chains = set()
@@ -235,7 +249,7 @@ class IptablesTable(object):
         chain_set.remove(name)
         if not wrap:
             self.remove_rules += filter(lambda r: r.chain == name, self.rules)
-        self.rules = filter(lambda r: r.chain != name, self.rules)
+        self._set_rules(filter(lambda r: r.chain != name, self.rules))
 
         if wrap:
             jump_snippet = '-j %s-%s' % (binary_name, name)
@@ -245,7 +259,12 @@ class IptablesTable(object):
         if not wrap:
             self.remove_rules += filter(lambda r: jump_snippet in r.rule,
                                         self.rules)
-        self.rules = filter(lambda r: jump_snippet not in r.rule, self.rules)
+        self._set_rules(filter(lambda r: jump_snippet not in r.rule,
+                               self.rules))
+
+    def _set_rules(self, rules):
+        self.rules = rules
+        self._rule_index = set(rules)
 
     def add_rule(self, chain, rule, wrap=True, top=False):
         """Add a rule to the table.
@@ -265,10 +284,11 @@ class IptablesTable(object):
             rule = ' '.join(map(self._wrap_target_chain, rule.split(' ')))
 
         rule_obj = IptablesRule(chain, rule, wrap, top)
-        if rule_obj in self.rules:
+        if rule_obj in self._rule_index:
             LOG.debug(_("Skipping duplicate iptables rule addition"))
         else:
-            self.rules.append(IptablesRule(chain, rule, wrap, top))
+            self.rules.append(rule_obj)
+            self._rule_index.add(rule_obj)
             self.dirty = True
 
     def _wrap_target_chain(self, s):
@@ -284,12 +304,14 @@ class IptablesTable(object):
         CLI tool.
 
         """
+        rule_obj = IptablesRule(chain, rule, wrap, top)
         try:
-            self.rules.remove(IptablesRule(chain, rule, wrap, top))
+            self._rule_index.remove(rule_obj)
+            self.rules.remove(rule_obj)
             if not wrap:
-                self.remove_rules.append(IptablesRule(chain, rule, wrap, top))
+                self.remove_rules.append(rule_obj)
             self.dirty = True
-        except ValueError:
+        except KeyError:
             LOG.warn(_('Tried to remove rule that was not there:'
                        ' %(chain)r %(rule)r %(wrap)r %(top)r'),
                      {'chain': chain, 'rule': rule,
@@ -300,7 +322,7 @@ class IptablesTable(object):
         if isinstance(regex, six.string_types):
             regex = re.compile(regex)
         num_rules = len(self.rules)
-        self.rules = filter(lambda r: not regex.match(str(r)), self.rules)
+        self._set_rules(filter(lambda r: not regex.match(str(r)), self.rules))
         removed = num_rules - len(self.rules)
         if removed > 0:
             self.dirty = True
@@ -312,8 +334,8 @@ class IptablesTable(object):
                               if rule.chain == chain and rule.wrap == wrap]
         if chained_rules:
             self.dirty = True
-        for rule in chained_rules:
-            self.rules.remove(rule)
+            self._set_rules([rule for rule in self.rules
+                             if rule.chain != chain or rule.wrap != wrap])
 
 
 class IptablesManager(object):
@@ -352,6 +374,14 @@ class IptablesManager(object):
 
         self.iptables_apply_deferred = False
 
+        # Applies are numbered, an apply is done by the first one that
+        # gets the iptables lock after it was requested.
+        self._apply_requests = 0
+        self._applied_requests = 0
+        self.apply_stats = {'requested': 0, 'applied': 0, 'coalesced': 0,
+                            'save_time': 0.0, 'modify_time': 0.0,
+                            'restore_time': 0.0}
+
         # Add a nova-filter-top chain. It's intended to be shared
         # among the various nova components. It sits at the very top
         # of FORWARD and OUTPUT.
@@ -422,12 +452,13 @@ class IptablesManager(object):
     def apply(self):
         if self.iptables_apply_deferred:
             return
-        if self.dirty():
+        # NOTE: The tables are no longer dirty while another greenthread
+        # restores them, wait for it too.
+        if self.dirty() or self._applied_requests < self._apply_requests:
             self._apply()
         else:
             LOG.debug(_("Skipping apply due to lack of new rules"))
 
-    @utils.synchronized('iptables', external=True)
     def _apply(self):
         """Apply the current in-memory set of iptables rules.
 
@@ -435,25 +466,59 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        Applies requested by other greenthreads while this one waits for
+        the iptables lock are done together, by the first one to get it.
+
         """
+        self._apply_requests += 1
+        self.apply_stats['requested'] += 1
+        request = self._apply_requests
+        if CONF.iptables_apply_coalesce_delay > 0:
+            greenthread.sleep(CONF.iptables_apply_coalesce_delay)
+        self._apply_requested(request)
+
+    @utils.synchronized('iptables', external=True)
+    def _apply_requested(self, request):
+        if request <= self._applied_requests or not self.dirty():
+            self._applied_requests = max(request, self._applied_requests)
+            self.apply_stats['coalesced'] += 1
+            LOG.debug(_("IPTablesManager.apply coalesced with a previous "
+                        "one"))
+            return
+        # Every apply requested so far is covered by the rules read below.
+        requests = self._apply_requests
+
         s = [('iptables', self.ipv4)]
         if CONF.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
+        timings = {'save_time': 0.0, 'modify_time': 0.0, 'restore_time': 0.0}
         for cmd, tables in s:
+            phase_start = time.time()
             all_tables, _err = self.execute('%s-save' % (cmd,), '-c',
                                                 run_as_root=True,
                                                 attempts=5)
+            timings['save_time'] += time.time() - phase_start
+            phase_start = time.time()
             all_lines = all_tables.split('\n')
             for table_name, table in tables.iteritems():
                 start, end = self._find_table(all_lines, table_name)
                 all_lines[start:end] = self._modify_rules(
                         all_lines[start:end], table, table_name)
                 table.dirty = False
+            timings['modify_time'] += time.time() - phase_start
+            phase_start = time.time()
             self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
                          process_input='\n'.join(all_lines),
                          attempts=5)
-        LOG.debug(_("IPTablesManager.apply completed with success"))
+            timings['restore_time'] += time.time() - phase_start
+        self._applied_requests = requests
+        self.apply_stats['applied'] += 1
+        for phase, elapsed in timings.iteritems():
+            self.apply_stats[phase] += elapsed
+        LOG.debug(_("IPTablesManager.apply completed with success "
+                    "(save %(save_time).3fs, modify %(modify_time).3fs, "
+                    "restore %(restore_time).3fs)"), timings)
 
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
@@ -489,19 +554,17 @@ class IptablesManager(object):
 
         if CONF.iptables_top_regex:
             regex = re.compile(CONF.iptables_top_regex)
-            temp_filter = filter(lambda line: regex.search(line), new_filter)
-            for rule_str in temp_filter:
-                new_filter = filter(lambda s: s.strip() != rule_str.strip(),
-                                    new_filter)
-            top_rules = temp_filter
+            top_rules = filter(lambda line: regex.search(line), new_filter)
+            top_strs = set(line.strip() for line in top_rules)
+            new_filter = filter(lambda s: s.strip() not in top_strs,
+                                new_filter)
 
         if CONF.iptables_bottom_regex:
             regex = re.compile(CONF.iptables_bottom_regex)
-            temp_filter = filter(lambda line: regex.search(line), new_filter)
-            for rule_str in temp_filter:
-                new_filter = filter(lambda s: s.strip() != rule_str.strip(),
-                    new_filter)
-            bottom_rules = temp_filter
+            bottom_rules = filter(lambda line: regex.search(line), new_filter)
+            bottom_strs = set(line.strip() for line in bottom_rules)
+            new_filter = filter(lambda s: s.strip() not in bottom_strs,
+                                new_filter)
 
         seen_chains = False
         rules_index = 0
@@ -566,6 +629,13 @@ class IptablesManager(object):
         new_filter[commit_index:commit_index] = bottom_rules
         seen_lines = set()
 
+        # Index the removes by the text iptables-save shows for them, so
+        # that each line is looked up in O(1).
+        remove_rule_strs = {}
+        for rule in remove_rules:
+            # ignore [packet:byte] counts at beginning of rules
+            remove_rule_strs[str(rule).split(' ', 1)[1].strip()] = rule
+
         def _weed_out_duplicates(line):
             # ignore [packet:byte] counts at beginning of lines
             if line.startswith('['):
@@ -585,23 +655,17 @@ class IptablesManager(object):
                 line = line.split(':')[1]
                 line = line.split('- [')[0]
                 line = line.strip()
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
+                if line in remove_chains:
+                    remove_chains.remove(line)
+                    return False
             elif line.startswith('['):
                 # it's a rule
                 # ignore [packet:byte] counts at beginning of lines
                 line = line.split(']', 1)[1]
                 line = line.strip()
-                for rule in remove_rules:
-                    # ignore [packet:byte] counts at beginning of rules
-                    rule_str = str(rule)
-                    rule_str = rule_str.split(' ', 1)[1]
-                    rule_str = rule_str.strip()
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+                if line in remove_rule_strs:
+                    del remove_rule_strs[line]
+                    return False
 
             # Leave it alone
             return True
@@ -616,8 +680,7 @@ class IptablesManager(object):
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
 
         return new_filter
 
@@ -18,6 +18,8 @@
 
 """Super simple fake memcache client."""
 
+import heapq
+
 from oslo.config import cfg
 
 from nova.openstack.common import timeutils
@@ -26,6 +28,11 @@ memcache_opts = [
     cfg.ListOpt('memcached_servers',
                 default=None,
                 help='Memcached servers or None for in process cache.'),
+    cfg.IntOpt('memorycache_max_items',
+               default=100000,
+               help='Maximum number of keys kept by the in process cache, '
+                    'the least recently used keys are evicted first. '
+                    '0 for no limit.'),
 ]
 
 CONF = cfg.CONF
@@ -48,11 +55,69 @@ def get_client(memcached_servers=None):
 
 
 class Client(object):
-    """Replicates a tiny subset of memcached client interface."""
+    """Replicates a tiny subset of memcached client interface.
+
+    The keys are kept in least recently used order in a doubly linked
+    list, and their expiry times in a heap, so that the expired and
+    evicted keys are found without looking at the other keys.
+    """
 
     def __init__(self, *args, **kwargs):
-        """Ignores the passed in args."""
+        """Ignores the passed in args, but max_items."""
+        self.max_items = kwargs.get('max_items',
+                                    CONF.memorycache_max_items)
+        # key -> (timeout, value)
         self.cache = {}
+        # key -> [previous link, next link, key], in a circular list
+        # of the keys around self._root, least recently used first.
+        self._root = []
+        self._root[:] = [self._root, self._root, None]
+        self._links = {}
+        # (timeout, key) of the keys set with a timeout. Keys set again
+        # leave their former timeout behind, which is skipped when it
+        # comes out.
+        self._timeouts = []
+        self.stats = {'hits': 0,
+                      'misses': 0,
+                      'evictions': 0,
+                      'expirations': 0}
+
+    def _expire(self, now):
+        """Drop the keys which timed out."""
+        timeouts = self._timeouts
+        while timeouts and timeouts[0][0] <= now:
+            timeout, key = heapq.heappop(timeouts)
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] == timeout:
+                self._remove(key)
+                self.stats['expirations'] += 1
+
+        # Rebuild the heap when it is mostly left behind timeouts.
+        if len(timeouts) > 2 * len(self.cache) + 64:
+            self._timeouts = [(timeout, key)
+                              for key, (timeout, _value)
+                              in self.cache.iteritems() if timeout]
+            heapq.heapify(self._timeouts)
+
+    def _link(self, key):
+        """Add key as the most recently used."""
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = self._links[key] = [last, root, key]
+
+    def _unlink(self, key):
+        previous, next_, _key = self._links.pop(key)
+        previous[1] = next_
+        next_[0] = previous
+
+    def _touch(self, key):
+        """Mark key as the most recently used."""
+        self._unlink(key)
+        self._link(key)
+
+    def _remove(self, key):
+        del self.cache[key]
+        self._unlink(key)
 
     def get(self, key):
         """Retrieves the value for a key or None.
@@ -60,20 +125,30 @@ class Client(object):
         This expunges expired keys during each get.
         """
 
-        now = timeutils.utcnow_ts()
-        for k in self.cache.keys():
-            (timeout, _value) = self.cache[k]
-            if timeout and now >= timeout:
-                del self.cache[k]
-
-        return self.cache.get(key, (0, None))[1]
+        self._expire(timeutils.utcnow_ts())
+        if key not in self.cache:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self._touch(key)
+        return self.cache[key][1]
 
     def set(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key."""
+        now = timeutils.utcnow_ts()
+        self._expire(now)
         timeout = 0
         if time != 0:
-            timeout = timeutils.utcnow_ts() + time
+            timeout = now + time
+            heapq.heappush(self._timeouts, (timeout, key))
+        if key in self.cache:
+            self._unlink(key)
         self.cache[key] = (timeout, value)
+        self._link(key)
+        if self.max_items:
+            while len(self.cache) > self.max_items:
+                self._remove(self._root[1][2])
+                self.stats['evictions'] += 1
         return True
 
     def add(self, key, value, time=0, min_compress_len=0):
@@ -94,4 +169,9 @@ class Client(object):
     def delete(self, key, time=0):
         """Deletes the value associated with a key."""
         if key in self.cache:
-            del self.cache[key]
+            self._remove(key)
+
+    def get_stats(self):
+        """Returns the stats of the cache, like memcache clients do."""
+        stats = dict(self.stats, curr_items=len(self.cache))
+        return [('memorycache', stats)]
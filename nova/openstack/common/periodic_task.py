@@ -14,8 +14,11 @@
 #    under the License.
 
 import datetime
+import random
+import sys
 import time
 
+from eventlet import greenpool
 from oslo.config import cfg
 import six
 
@@ -29,6 +32,21 @@ periodic_opts = [
                 default=True,
                 help=('Some periodic tasks can be run in a separate process. '
                       'Should we run them here?')),
+    cfg.FloatOpt('periodic_task_jitter',
+                 default=0.0,
+                 help=('Delay the first run of every periodic task by a '
+                       'random part of its spacing, up to this fraction of '
+                       'it, so that hosts started together do not run their '
+                       'tasks at the same time. 0 disables the jitter.')),
+    cfg.IntOpt('periodic_task_concurrency',
+               default=1,
+               help=('Number of due periodic tasks run at the same time. '
+                     'Only raise it if the tasks do not depend on running '
+                     'one after another.')),
+    cfg.IntOpt('periodic_task_stats_interval',
+               default=3600,
+               help=('Seconds between the summaries of the runs of every '
+                     'periodic task written in the log. 0 disables them.')),
 ]
 
 CONF = cfg.CONF
@@ -38,6 +56,9 @@ LOG = logging.getLogger(__name__)
 
 DEFAULT_INTERVAL = 60.0
 
+# Upper bounds, in seconds, of the buckets of the task duration histograms.
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, float('inf'))
+
 
 class InvalidPeriodicTaskArg(Exception):
     message = _("Unexpected argument for periodic task creation: %(arg)s.")
@@ -151,15 +172,160 @@ class _PeriodicTasksMeta(type):
                 cls._periodic_last_run[name] = task._periodic_last_run
 
 
+class PeriodicTaskStats(object):
+    """How long the runs of a periodic task took."""
+
+    def __init__(self, spacing):
+        self.spacing = spacing
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.histogram = [0] * len(DURATION_BUCKETS)
+
+    def record(self, duration, failed=False):
+        self.runs += 1
+        if failed:
+            self.errors += 1
+        # The task took longer than the time it had until its next run.
+        overrun = self.spacing is not None and duration > self.spacing
+        if overrun:
+            self.overruns += 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                self.histogram[i] += 1
+                break
+        return overrun
+
+    def summary(self):
+        """Describe the runs in one line for the log."""
+        buckets = ', '.join('<=%gs: %d' % (bound, runs)
+                            for bound, runs in zip(DURATION_BUCKETS,
+                                                   self.histogram)
+                            if runs)
+        return (_('%(runs)d runs, %(errors)d errors, %(overruns)d overruns, '
+                  'average %(average).2fs, max %(max).2fs, durations '
+                  '%(buckets)s') %
+                {'runs': self.runs, 'errors': self.errors,
+                 'overruns': self.overruns,
+                 'average': self.total_duration / max(self.runs, 1),
+                 'max': self.max_duration, 'buckets': buckets})
+
+    def to_dict(self):
+        return {'spacing': self.spacing,
+                'runs': self.runs,
+                'errors': self.errors,
+                'overruns': self.overruns,
+                'last_duration': self.last_duration,
+                'max_duration': self.max_duration,
+                'total_duration': self.total_duration,
+                'histogram': zip(DURATION_BUCKETS, self.histogram)}
+
+
 @six.add_metaclass(_PeriodicTasksMeta)
 class PeriodicTasks(object):
 
+    def get_periodic_task_stats(self):
+        """Return the run statistics of the periodic tasks.
+
+        The statistics are keyed by the full name of the tasks which ran,
+        the histogram is a list of (bucket upper bound, runs) pairs.
+        """
+        stats = getattr(self, '_periodic_task_stats', {})
+        return dict((name, task_stats.to_dict())
+                    for name, task_stats in stats.items())
+
+    def _log_periodic_task_stats(self):
+        """Log the run statistics every periodic_task_stats_interval."""
+        interval = CONF.periodic_task_stats_interval
+        if interval <= 0:
+            return
+        now = timeutils.utcnow()
+        logged_at = getattr(self, '_periodic_stats_logged_at', None)
+        if logged_at is None:
+            self._periodic_stats_logged_at = now
+            return
+        if timeutils.delta_seconds(logged_at, now) < interval:
+            return
+        self._periodic_stats_logged_at = now
+        stats = getattr(self, '_periodic_task_stats', {})
+        for full_task_name in sorted(stats):
+            LOG.info(_("Periodic task %(full_task_name)s: %(summary)s"),
+                     {"full_task_name": full_task_name,
+                      "summary": stats[full_task_name].summary()})
+
+    def _jitter_periodic_tasks(self):
+        """Move the first run of the spaced tasks by a random delay."""
+        self._periodic_jittered = True
+        if CONF.periodic_task_jitter <= 0:
+            return
+        now = timeutils.utcnow()
+        for task_name, task in self._periodic_tasks:
+            spacing = self._periodic_spacing[task_name]
+            if spacing is None:
+                continue
+            last_run = self._periodic_last_run[task_name]
+            if last_run is None:
+                # Due now, make it due after the jitter.
+                last_run = now - datetime.timedelta(seconds=spacing)
+            jitter = random.uniform(0, CONF.periodic_task_jitter * spacing)
+            self._periodic_last_run[task_name] = (
+                last_run + datetime.timedelta(seconds=jitter))
+
+    def _run_periodic_task(self, context, task_name, task, raise_on_error):
+        full_task_name = '.'.join([self.__class__.__name__, task_name])
+        if not hasattr(self, '_periodic_task_stats'):
+            self._periodic_task_stats = {}
+        stats = self._periodic_task_stats.get(full_task_name)
+        if stats is None:
+            stats = PeriodicTaskStats(self._periodic_spacing[task_name])
+            self._periodic_task_stats[full_task_name] = stats
+
+        LOG.debug(_("Running periodic task %(full_task_name)s"),
+                  {"full_task_name": full_task_name})
+        start = time.time()
+        failed = False
+        try:
+            task(self, context)
+        except Exception as e:
+            failed = True
+            if raise_on_error:
+                raise
+            LOG.exception(_("Error during %(full_task_name)s: %(e)s"),
+                          {"full_task_name": full_task_name, "e": e})
+        finally:
+            duration = time.time() - start
+            if stats.record(duration, failed=failed):
+                LOG.warn(_("Periodic task %(full_task_name)s took "
+                           "%(duration).2f seconds, longer than its "
+                           "%(spacing)s seconds spacing"),
+                         {"full_task_name": full_task_name,
+                          "duration": duration,
+                          "spacing": stats.spacing})
+
+    def _run_concurrent_task(self, context, task_name, task,
+                             raise_on_error):
+        """Run a task in a greenthread, returning what it raised."""
+        try:
+            self._run_periodic_task(context, task_name, task, raise_on_error)
+        except Exception:
+            return sys.exc_info()
+
     def run_periodic_tasks(self, context, raise_on_error=False):
         """Tasks to be run at a periodic interval."""
         idle_for = DEFAULT_INTERVAL
+        if not getattr(self, '_periodic_jittered', False):
+            self._jitter_periodic_tasks()
+        pool = None
+        if CONF.periodic_task_concurrency > 1:
+            pool = greenpool.GreenPool(CONF.periodic_task_concurrency)
+            threads = []
         for task_name, task in self._periodic_tasks:
-            full_task_name = '.'.join([self.__class__.__name__, task_name])
-
             now = timeutils.utcnow()
             spacing = self._periodic_spacing[task_name]
             last_run = self._periodic_last_run[task_name]
@@ -174,17 +340,22 @@ class PeriodicTasks(object):
             if spacing is not None:
                 idle_for = min(idle_for, spacing)
 
-            LOG.debug(_("Running periodic task %(full_task_name)s"),
-                      {"full_task_name": full_task_name})
             self._periodic_last_run[task_name] = timeutils.utcnow()
 
-            try:
-                task(self, context)
-            except Exception as e:
-                if raise_on_error:
-                    raise
-                LOG.exception(_("Error during %(full_task_name)s: %(e)s"),
-                              {"full_task_name": full_task_name, "e": e})
-            time.sleep(0)
-
+            if pool is None:
+                self._run_periodic_task(context, task_name, task,
+                                        raise_on_error)
+                time.sleep(0)
+            else:
+                threads.append(pool.spawn(self._run_concurrent_task, context,
+                                          task_name, task, raise_on_error))
+
+        if pool is not None:
+            pool.waitall()
+            for thread in threads:
+                exc_info = thread.wait()
+                if exc_info is not None:
+                    six.reraise(*exc_info)
+
+        self._log_periodic_task_stats()
         return idle_for
@@ -0,0 +1,105 @@
+# Copyright (c) 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Client of the root wrapper daemon."""
+
+import socket
+import subprocess
+import threading
+
+from multiprocessing import connection
+
+from nova.openstack.common.rootwrap import daemon
+
+
+class DaemonStartError(Exception):
+    """Raised when the rootwrap daemon could not be started."""
+    pass
+
+
+class Client(object):
+    """Runs commands through a rootwrap daemon, started on first use.
+
+    The daemon is started with daemon_cmd, and started again if it exits.
+    The connections to it are kept open and reused, one per command in
+    progress.
+    """
+
+    def __init__(self, daemon_cmd):
+        self._daemon_cmd = daemon_cmd
+        self._lock = threading.Lock()
+        self._process = None
+        self._address = None
+        self._authkey = None
+        self._idle = []
+
+    def _ensure_daemon(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return
+            self._idle = []
+            process = subprocess.Popen(self._daemon_cmd,
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       close_fds=True)
+            address = process.stdout.readline().strip()
+            authkey = process.stdout.readline().strip()
+            if not address or not authkey:
+                raise DaemonStartError('%s exited with %s' % (
+                    ' '.join(self._daemon_cmd), process.wait()))
+            process.stdout.close()
+            self._process = process
+            self._address = address
+            self._authkey = authkey.decode('hex')
+
+    def _connect(self):
+        self._ensure_daemon()
+        if self._idle:
+            return self._idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._address)
+            conn = daemon.Connection(sock)
+            connection.answer_challenge(conn, self._authkey)
+        except Exception:
+            sock.close()
+            raise
+        return conn
+
+    def execute(self, cmd, stdin=None):
+        """Run cmd through the daemon filters.
+
+        Returns a (returncode, stdout, stderr) tuple.
+        """
+        conn = self._connect()
+        try:
+            conn.send(([str(arg) for arg in cmd], stdin))
+            result = conn.recv()
+        except Exception:
+            conn.close()
+            raise
+        self._idle.append(conn)
+        return result
+
+    def stop(self):
+        """Stop the daemon, it exits once its stdin is closed."""
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+            if self._process is not None:
+                self._process.stdin.close()
+                self._process.wait()
+                self._process = None
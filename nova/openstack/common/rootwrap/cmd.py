@@ -30,6 +30,11 @@
 
    Service packaging should deploy .filters files only on nodes where
    they are needed, to avoid allowing more than is necessary.
+
+   The nova-rootwrap-daemon variant serves the commands from a single
+   long lived process instead, which needs its own sudoers entry:
+   nova ALL = (root) NOPASSWD: /usr/bin/nova-rootwrap-daemon
+                                   /etc/nova/rootwrap.conf
 """
 
 from __future__ import print_function
@@ -71,15 +76,7 @@ def _getlogin():
                 os.getenv('LOGNAME'))
 
 
-def main():
-    # Split arguments, require at least a command
-    execname = sys.argv.pop(0)
-    if len(sys.argv) < 2:
-        _exit_error(execname, "No command specified", RC_NOCOMMAND, log=False)
-
-    configfile = sys.argv.pop(0)
-    userargs = sys.argv[:]
-
+def _load_config(execname, configfile):
     # Add ../ to sys.path to allow running from branch
     possible_topdir = os.path.normpath(os.path.join(os.path.abspath(execname),
                                                     os.pardir, os.pardir))
@@ -104,6 +101,20 @@ def main():
         wrapper.setup_syslog(execname,
                              config.syslog_log_facility,
                              config.syslog_log_level)
+    return config
+
+
+def main():
+    # Split arguments, require at least a command
+    execname = sys.argv.pop(0)
+    if len(sys.argv) < 2:
+        _exit_error(execname, "No command specified", RC_NOCOMMAND, log=False)
+
+    configfile = sys.argv.pop(0)
+    userargs = sys.argv[:]
+
+    config = _load_config(execname, configfile)
+    from nova.openstack.common.rootwrap import wrapper
 
     # Execute command if it matches any of the loaded filters
     filters = wrapper.load_filters(config.filters_path)
@@ -136,3 +147,18 @@ def main():
         msg = ("Unauthorized command: %s (no filter matched)"
                % ' '.join(userargs))
         _exit_error(execname, msg, RC_UNAUTHORIZED, log=config.use_syslog)
+
+
+def daemon():
+    execname = sys.argv.pop(0)
+    if len(sys.argv) != 1:
+        _exit_error(execname, "No configuration file specified",
+                    RC_BADCONFIG, log=False)
+
+    config = _load_config(execname, sys.argv[0])
+    from nova.openstack.common.rootwrap import daemon as rootwrap_daemon
+    from nova.openstack.common.rootwrap import wrapper
+
+    # Load the filters once, for all the commands
+    filters = wrapper.load_filters(config.filters_path)
+    rootwrap_daemon.daemon_start(config, filters)
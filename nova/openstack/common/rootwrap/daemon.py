@@ -0,0 +1,220 @@
+# Copyright (c) 2013 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Root wrapper daemon
+
+   Runs the commands of a service through the rootwrap filters, like
+   nova-rootwrap does, but from a single long lived process. The filters
+   are loaded once, and the commands are received over a unix socket
+   only the user who started the daemon can open, from clients which
+   have to know the key the daemon generated at startup.
+
+   The daemon writes the address of its socket and its key on stdout,
+   and exits once its stdin is closed, that is when the process which
+   started it exits.
+"""
+
+import logging
+import marshal
+import os
+import pwd
+import shutil
+import signal
+import SocketServer
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+from multiprocessing import connection
+
+from nova.openstack.common.rootwrap import wrapper
+
+RC_UNAUTHORIZED = 99
+RC_NOEXECFOUND = 96
+
+AUTHKEY_SIZE = 32
+SOCKET_NAME = 'rootwrap.sock'
+
+
+class Connection(object):
+    """Length prefixed messages over a stream socket.
+
+    This has the send_bytes and recv_bytes methods the authentication of
+    multiprocessing connections needs, and works with green sockets.
+    """
+
+    HEADER = struct.Struct('!I')
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def _recv_exactly(self, size):
+        chunks = []
+        while size:
+            chunk = self.sock.recv(size)
+            if not chunk:
+                raise EOFError()
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
+    def send_bytes(self, data):
+        self.sock.sendall(self.HEADER.pack(len(data)) + data)
+
+    def recv_bytes(self, maxlength=None):
+        size, = self.HEADER.unpack(self._recv_exactly(self.HEADER.size))
+        if maxlength is not None and size > maxlength:
+            raise IOError('Message too long: %d bytes' % size)
+        return self._recv_exactly(size)
+
+    def send(self, obj):
+        # marshal only serializes plain data, and does not run code when
+        # loading it like pickle does.
+        self.send_bytes(marshal.dumps(obj))
+
+    def recv(self):
+        return marshal.loads(self.recv_bytes())
+
+    def close(self):
+        self.sock.close()
+
+
+def _subprocess_setup():
+    # Python installs a SIGPIPE handler by default. This is usually not what
+    # non-Python subprocesses expect.
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def _getlogin():
+    return os.getenv('SUDO_USER') or os.getenv('USER') or 'unknown'
+
+
+class RootwrapClass(object):
+    """Runs the commands the loaded filters allow."""
+
+    def __init__(self, config, filters):
+        self.config = config
+        self.filters = filters
+
+    def run_one_command(self, userargs, stdin=None):
+        """Run userargs if a filter allows it.
+
+        Returns a (returncode, stdout, stderr) tuple, with the same return
+        codes as nova-rootwrap for the commands which are not allowed.
+        """
+        try:
+            filtermatch = wrapper.match_filter(
+                self.filters, userargs, exec_dirs=self.config.exec_dirs)
+        except wrapper.FilterMatchNotExecutable as exc:
+            msg = ("Executable not found: %s (filter match = %s)"
+                   % (exc.match.exec_path, exc.match.name))
+            if self.config.use_syslog:
+                logging.error(msg)
+            return RC_NOEXECFOUND, '', msg
+        except wrapper.NoFilterMatched:
+            msg = ("Unauthorized command: %s (no filter matched)"
+                   % ' '.join(userargs))
+            if self.config.use_syslog:
+                logging.error(msg)
+            return RC_UNAUTHORIZED, '', msg
+
+        command = filtermatch.get_command(userargs,
+                                          exec_dirs=self.config.exec_dirs)
+        if self.config.use_syslog:
+            logging.info("(%s > %s) Executing %s (filter match = %s)" % (
+                _getlogin(), pwd.getpwuid(os.getuid())[0],
+                command, filtermatch.name))
+
+        obj = subprocess.Popen(command,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               close_fds=True,
+                               preexec_fn=_subprocess_setup,
+                               env=filtermatch.get_environment(userargs))
+        out, err = obj.communicate(stdin)
+        return obj.returncode, out, err
+
+
+class RootwrapHandler(SocketServer.BaseRequestHandler):
+    """Runs the commands of a client, one after the other."""
+
+    def handle(self):
+        conn = Connection(self.request)
+        try:
+            connection.deliver_challenge(conn, self.server.authkey)
+        except (connection.AuthenticationError, EOFError, IOError):
+            return
+
+        while True:
+            try:
+                userargs, stdin = conn.recv()
+            except (EOFError, IOError, ValueError, TypeError):
+                return
+            conn.send(self.server.rootwrap.run_one_command(
+                [str(arg) for arg in userargs], stdin))
+
+
+class RootwrapServer(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, address, authkey, rootwrap):
+        SocketServer.ThreadingUnixStreamServer.__init__(self, address,
+                                                        RootwrapHandler)
+        self.authkey = authkey
+        self.rootwrap = rootwrap
+
+
+def _owner_uid():
+    """Return the uid of the user who started the daemon through sudo."""
+    try:
+        return int(os.environ['SUDO_UID'])
+    except (KeyError, ValueError):
+        return os.getuid()
+
+
+def _shutdown_on_stdin_close(server):
+    sys.stdin.read()
+    server.shutdown()
+
+
+def daemon_start(config, filters):
+    """Serve the commands of the clients until stdin is closed."""
+    temp_dir = tempfile.mkdtemp(prefix='rootwrap-')
+    try:
+        # Only the owner of the directory can open the socket in it.
+        os.chmod(temp_dir, stat.S_IRWXU)
+        os.chown(temp_dir, _owner_uid(), -1)
+        address = os.path.join(temp_dir, SOCKET_NAME)
+        authkey = os.urandom(AUTHKEY_SIZE)
+
+        server = RootwrapServer(address, authkey,
+                                RootwrapClass(config, filters))
+        os.chown(address, _owner_uid(), -1)
+
+        sys.stdout.write('%s\n%s\n' % (address, authkey.encode('hex')))
+        sys.stdout.flush()
+        sys.stdout.close()
+
+        watcher = threading.Thread(target=_shutdown_on_stdin_close,
+                                   args=(server,))
+        watcher.daemon = True
+        watcher.start()
+        server.serve_forever()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
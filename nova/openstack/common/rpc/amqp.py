@@ -30,7 +30,9 @@ import inspect
 import sys
 import uuid
 
+from eventlet import event
 from eventlet import greenpool
+from eventlet import greenthread
 from eventlet import pools
 from eventlet import queue
 from eventlet import semaphore
@@ -69,6 +71,7 @@ class Pool(pools.Pool):
         kwargs.setdefault("order_as_stack", True)
         super(Pool, self).__init__(*args, **kwargs)
         self.reply_proxy = None
+        self.cast_pipeline = None
 
     # TODO(comstud): Timeout connections not used in a while
     def create(self):
@@ -540,6 +543,76 @@ class MulticallProxyWaiter(object):
             yield result
 
 
+class CastPipeline(object):
+    """Publishes the casts of several greenthreads together.
+
+    The casts are queued by the callers and published in order by a
+    single greenthread, which takes one connection from the pool and
+    publishes every cast queued until it is done before putting the
+    connection back.  Each caller waits until its own cast is published
+    and gets the exception raised if publishing it failed.
+    """
+    def __init__(self, conf, connection_pool):
+        self.conf = conf
+        self.connection_pool = connection_pool
+        self.queue = collections.deque()
+        self.sender = None
+
+    def add(self, send_method, topic, msg):
+        """Queue a message for conn.<send_method>(topic, msg).
+
+        Returns an event sent once the message is published.
+        """
+        done = event.Event()
+        self.queue.append((send_method, topic, msg, done))
+        if self.sender is None:
+            self.sender = greenthread.spawn(self._send)
+        return done
+
+    def _send(self):
+        try:
+            while self.queue:
+                self._send_queued()
+        finally:
+            self.sender = None
+
+    def _send_queued(self):
+        """Publish the queued casts on one connection, until the queue is
+        empty or a cast fails.
+        """
+        send_method, topic, msg, done = self.queue.popleft()
+        try:
+            with ConnectionContext(self.conf, self.connection_pool) as conn:
+                while True:
+                    getattr(conn, send_method)(topic, msg)
+                    done.send()
+                    done = None
+                    if not self.queue:
+                        break
+                    send_method, topic, msg, done = self.queue.popleft()
+        except Exception:
+            if done is None:
+                # All the casts were published.
+                LOG.exception(_('Failed to reset the connection used to '
+                                'publish the queued casts'))
+            else:
+                # The next casts are published on a fresh channel.
+                done.send_exception(*sys.exc_info())
+
+    def wait(self):
+        """Wait until the queued casts are published."""
+        if self.sender is not None:
+            self.sender.wait()
+
+
+def _get_cast_pipeline(conf, connection_pool):
+    # NOTE: No yield between the check and the assignment, the
+    # pipeline can't be created twice.
+    if not connection_pool.cast_pipeline:
+        connection_pool.cast_pipeline = CastPipeline(conf, connection_pool)
+    return connection_pool.cast_pipeline
+
+
 def create_connection(conf, new, connection_pool):
     """Create a connection."""
     return ConnectionContext(conf, connection_pool, pooled=not new)
@@ -577,20 +650,36 @@ def call(conf, context, topic, msg, timeout, connection_pool):
     return rv[-1]
 
 
-def cast(conf, context, topic, msg, connection_pool):
-    """Sends a message on a topic without waiting for a response."""
+def cast(conf, context, topic, msg, connection_pool, pipelined=False):
+    """Sends a message on a topic without waiting for a response.
+
+    If pipelined is True, the message is published together with the
+    pipelined casts of the other greenthreads.
+    """
     LOG.debug(_('Making asynchronous cast on %s...'), topic)
     _add_unique_id(msg)
     pack_context(msg, context)
+    if pipelined:
+        _get_cast_pipeline(conf, connection_pool).add(
+            'topic_send', topic, rpc_common.serialize_msg(msg)).wait()
+        return
     with ConnectionContext(conf, connection_pool) as conn:
         conn.topic_send(topic, rpc_common.serialize_msg(msg))
 
 
-def fanout_cast(conf, context, topic, msg, connection_pool):
-    """Sends a message on a fanout exchange without waiting for a response."""
+def fanout_cast(conf, context, topic, msg, connection_pool, pipelined=False):
+    """Sends a message on a fanout exchange without waiting for a response.
+
+    If pipelined is True, the message is published together with the
+    pipelined casts of the other greenthreads.
+    """
     LOG.debug(_('Making asynchronous fanout cast...'))
     _add_unique_id(msg)
     pack_context(msg, context)
+    if pipelined:
+        _get_cast_pipeline(conf, connection_pool).add(
+            'fanout_send', topic, rpc_common.serialize_msg(msg)).wait()
+        return
     with ConnectionContext(conf, connection_pool) as conn:
         conn.fanout_send(topic, rpc_common.serialize_msg(msg))
 
@@ -629,6 +718,8 @@ def notify(conf, context, topic, msg, connection_pool, envelope):
 
 def cleanup(connection_pool):
     if connection_pool:
+        if connection_pool.cast_pipeline:
+            connection_pool.cast_pipeline.wait()
         connection_pool.empty()
 
 
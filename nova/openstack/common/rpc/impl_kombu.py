@@ -91,6 +91,17 @@ kombu_opts = [
                 help='use H/A queues in RabbitMQ (x-ha-policy: all).'
                      'You need to wipe RabbitMQ database when '
                      'changing this option.'),
+    cfg.IntOpt('rabbit_publisher_cache_size',
+               default=256,
+               help='Number of publishers kept by each connection, so '
+                    'that their exchanges are not declared again for '
+                    'every message sent to them (0 disables the cache)'),
+    cfg.BoolOpt('rabbit_pipeline_casts',
+                default=False,
+                help='Publish the casts made at the same time by several '
+                     'greenthreads together, on one connection from the '
+                     'pool, instead of taking a connection for every cast. '
+                     'Each cast still returns once it is published'),
 
 ]
 
@@ -416,6 +427,9 @@ class Connection(object):
         self.consumers = []
         self.consumer_thread = None
         self.proxy_callbacks = []
+        # Cached publishers, by key: [last use, publisher]
+        self.publishers = {}
+        self.publisher_uses = itertools.count()
         self.conf = conf
         self.max_retries = self.conf.rabbit_max_retries
         # Try forever?
@@ -510,6 +524,7 @@ class Connection(object):
         self.consumer_num = itertools.count(1)
         self.connection.connect()
         self.channel = self.connection.channel()
+        self.publishers.clear()
         # work around 'memory' transport bug in 1.1.3
         if self.memory_transport:
             self.channel._new_queue('ae.undeliver')
@@ -606,11 +621,15 @@ class Connection(object):
         """Reset a connection so it can be used again."""
         self.cancel_consumer_thread()
         self.wait_on_proxy_callbacks()
-        self.channel.close()
-        self.channel = self.connection.channel()
-        # work around 'memory' transport bug in 1.1.3
-        if self.memory_transport:
-            self.channel._new_queue('ae.undeliver')
+        # NOTE: A channel that was only used to publish is kept, along
+        # with the publishers declared on it.
+        if self.consumers or not self.publishers:
+            self.channel.close()
+            self.channel = self.connection.channel()
+            self.publishers.clear()
+            # work around 'memory' transport bug in 1.1.3
+            if self.memory_transport:
+                self.channel._new_queue('ae.undeliver')
         self.consumers = []
 
     def declare_consumer(self, consumer_cls, topic, callback):
@@ -676,6 +695,34 @@ class Connection(object):
         for proxy_cb in self.proxy_callbacks:
             proxy_cb.wait()
 
+    def get_publisher(self, cls, topic, **kwargs):
+        """Return a publisher of the publisher class for topic.
+
+        The publishers are cached, so that the exchange of a publisher is
+        only declared once per channel.  The publisher class and the topic
+        determine the exchange and the routing key of a publisher.  The
+        publishers of auto_delete exchanges are not cached: the broker
+        deletes such an exchange with its last queue, and a cached
+        publisher would not declare it again.
+        """
+        cache_size = self.conf.rabbit_publisher_cache_size
+        if cache_size <= 0:
+            return cls(self.conf, self.channel, topic, **kwargs)
+        key = (cls, topic, tuple(sorted(kwargs.items())))
+        entry = self.publishers.get(key)
+        if entry is None:
+            publisher = cls(self.conf, self.channel, topic, **kwargs)
+            if publisher.exchange.auto_delete:
+                return publisher
+            if len(self.publishers) >= cache_size:
+                # Evict the least recently used publisher.
+                oldest = min(self.publishers,
+                             key=lambda key: self.publishers[key][0])
+                del self.publishers[oldest]
+            entry = self.publishers[key] = [None, publisher]
+        entry[0] = next(self.publisher_uses)
+        return entry[1]
+
     def publisher_send(self, cls, topic, msg, timeout=None, **kwargs):
         """Send to a publisher based on the publisher class."""
 
@@ -685,10 +732,16 @@ class Connection(object):
                           "'%(topic)s': %(err_str)s") % log_info)
 
         def _publish():
-            publisher = cls(self.conf, self.channel, topic, **kwargs)
+            publisher = self.get_publisher(cls, topic, **kwargs)
             publisher.send(msg, timeout)
 
-        self.ensure(_error_callback, _publish)
+        try:
+            self.ensure(_error_callback, _publish)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                # The channel may not be usable anymore, make reset()
+                # replace it.
+                self.publishers.clear()
 
     def declare_direct_consumer(self, topic, callback):
         """Create a 'direct' queue.
@@ -820,14 +873,16 @@ def cast(conf, context, topic, msg):
     """Sends a message on a topic without waiting for a response."""
     return rpc_amqp.cast(
         conf, context, topic, msg,
-        rpc_amqp.get_connection_pool(conf, Connection))
+        rpc_amqp.get_connection_pool(conf, Connection),
+        pipelined=conf.rabbit_pipeline_casts)
 
 
 def fanout_cast(conf, context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     return rpc_amqp.fanout_cast(
         conf, context, topic, msg,
-        rpc_amqp.get_connection_pool(conf, Connection))
+        rpc_amqp.get_connection_pool(conf, Connection),
+        pipelined=conf.rabbit_pipeline_casts)
 
 
 def cast_to_server(conf, context, server_params, topic, msg):
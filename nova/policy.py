@@ -18,12 +18,14 @@
 """Policy Engine For Nova."""
 
 import os.path
+import re
 
 from oslo.config import cfg
 
 from nova import exception
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import policy
+from nova.openstack.common import timeutils
 from nova import utils
 
 
@@ -34,6 +36,16 @@ policy_opts = [
     cfg.StrOpt('policy_default_rule',
                default='default',
                help=_('Rule checked when requested rule is not found')),
+    cfg.IntOpt('policy_file_check_interval',
+               default=0,
+               help=_('Seconds between two checks of the policy file for '
+                      'changes, 0 to check it on every policy check')),
+    cfg.BoolOpt('policy_compiled_rules',
+                default=False,
+                help=_('Compile the policy rules into plain functions, and '
+                       'remember the credentials and the results of the '
+                       'policy checks of a request context for its '
+                       'lifetime')),
     ]
 
 CONF = cfg.CONF
@@ -41,27 +53,39 @@ CONF.register_opts(policy_opts)
 
 _POLICY_PATH = None
 _POLICY_CACHE = {}
+_POLICY_CHECKED_AT = None
+_COMPILED_RULES = None
 
 
 def reset():
     global _POLICY_PATH
     global _POLICY_CACHE
+    global _POLICY_CHECKED_AT
+    global _COMPILED_RULES
     _POLICY_PATH = None
     _POLICY_CACHE = {}
+    _POLICY_CHECKED_AT = None
+    _COMPILED_RULES = None
     policy.reset()
 
 
 def init():
     global _POLICY_PATH
     global _POLICY_CACHE
+    global _POLICY_CHECKED_AT
     if not _POLICY_PATH:
         _POLICY_PATH = CONF.policy_file
         if not os.path.exists(_POLICY_PATH):
             _POLICY_PATH = CONF.find_file(_POLICY_PATH)
         if not _POLICY_PATH:
             raise exception.ConfigNotFound(path=CONF.policy_file)
+    now = timeutils.utcnow_ts()
+    if (_POLICY_CACHE and _POLICY_CHECKED_AT is not None and
+            now - _POLICY_CHECKED_AT < CONF.policy_file_check_interval):
+        return
     utils.read_cached_file(_POLICY_PATH, _POLICY_CACHE,
                            reload_func=_set_rules)
+    _POLICY_CHECKED_AT = now
 
 
 def _set_rules(data):
@@ -69,6 +93,222 @@ def _set_rules(data):
     policy.set_rules(policy.Rules.load_json(data, default_rule))
 
 
+# The keys of the target a match like "project_id:%(project_id)s" formats.
+_TARGET_KEY_RE = re.compile(r'%\(([^)]*)\)s')
+
+_MISSING = object()
+
+
+def _always(result):
+    def check(target, request):
+        return result
+    return check
+
+
+def _fail_closed(evaluator):
+    """Make a missing rule or target key deny the rule, like policy.check."""
+
+    def check(target, request):
+        try:
+            return evaluator(target, request)
+        except KeyError:
+            return False
+    return check
+
+
+def _union(keys, other):
+    # None means the target keys the evaluator reads are unknown.
+    if keys is None or other is None:
+        return None
+    return keys | other
+
+
+class _CompiledRules(object):
+    """The policy rules, compiled into plain functions.
+
+    An evaluator is called with the target and the _RequestCache of the
+    context, and returns what calling the Check tree of the rule does.
+    Each rule also comes with the keys of the target its result depends
+    on, or None when they are not known, so that the results can be
+    remembered for a request.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._compiled = {}
+        self._compiling = set()
+
+    def get(self, name):
+        """Return the (evaluator, target keys) of the named rule."""
+        compiled = self._compiled.get(name)
+        if compiled is not None:
+            return compiled
+
+        if name in self._compiling:
+            # A rule which references itself, resolve it at call time.
+            def check(target, request):
+                return self.get(name)[0](target, request)
+            return check, None
+
+        try:
+            rule = self.rules[name]
+        except KeyError:
+            compiled = _always(False), frozenset()
+        else:
+            self._compiling.add(name)
+            try:
+                evaluator, keys = self._compile(rule)
+            finally:
+                self._compiling.discard(name)
+            compiled = _fail_closed(evaluator), keys
+        self._compiled[name] = compiled
+        return compiled
+
+    def _compile(self, rule):
+        if isinstance(rule, policy.TrueCheck):
+            return _always(True), frozenset()
+        if isinstance(rule, policy.FalseCheck):
+            return _always(False), frozenset()
+        if isinstance(rule, policy.NotCheck):
+            return self._compile_not(rule)
+        if isinstance(rule, (policy.AndCheck, policy.OrCheck)):
+            return self._compile_and_or(rule)
+        if type(rule) is policy.RuleCheck:
+            return self.get(rule.match)
+        if type(rule) is policy.RoleCheck:
+            return self._compile_role(rule)
+        if type(rule) is policy.GenericCheck:
+            return self._compile_generic(rule)
+        if type(rule) is IsAdminCheck:
+            return self._compile_is_admin(rule)
+
+        # Checks which may look at anything, like http: ones.
+        def check(target, request):
+            return rule(target, request.creds)
+        return check, None
+
+    def _compile_not(self, rule):
+        evaluator, keys = self._compile(rule.rule)
+
+        def check(target, request):
+            return not evaluator(target, request)
+        return check, keys
+
+    def _compile_and_or(self, rule):
+        evaluators = []
+        keys = frozenset()
+        for sub_rule in rule.rules:
+            evaluator, sub_keys = self._compile(sub_rule)
+            evaluators.append(evaluator)
+            keys = _union(keys, sub_keys)
+
+        if isinstance(rule, policy.AndCheck):
+            def check(target, request):
+                for evaluator in evaluators:
+                    if not evaluator(target, request):
+                        return False
+                return True
+        else:
+            def check(target, request):
+                for evaluator in evaluators:
+                    if evaluator(target, request):
+                        return True
+                return False
+        return check, keys
+
+    def _compile_role(self, rule):
+        role = rule.match.lower()
+
+        def check(target, request):
+            return role in request.roles
+        return check, frozenset()
+
+    def _compile_generic(self, rule):
+        kind = rule.kind
+        match = rule.match
+        target_keys = _TARGET_KEY_RE.findall(match)
+
+        if '%' not in match:
+            def check(target, request):
+                creds = request.creds
+                return kind in creds and match == unicode(creds[kind])
+            return check, frozenset()
+
+        def check(target, request):
+            value = match % target
+            creds = request.creds
+            return kind in creds and value == unicode(creds[kind])
+        if match.count('%') != len(target_keys):
+            # Something else than %(key)s, the target may be used whole.
+            return check, None
+        return check, frozenset(target_keys)
+
+    def _compile_is_admin(self, rule):
+        expected = rule.expected
+
+        def check(target, request):
+            return request.creds['is_admin'] == expected
+        return check, frozenset()
+
+
+def _get_compiled_rules():
+    global _COMPILED_RULES
+    # The rules may also be replaced with policy.set_rules() directly.
+    if _COMPILED_RULES is None or _COMPILED_RULES.rules is not policy._rules:
+        _COMPILED_RULES = _CompiledRules(policy._rules)
+    return _COMPILED_RULES
+
+
+class _RequestCache(object):
+    """The credentials of a context, and the results of its checks."""
+
+    def __init__(self, context, compiled_rules):
+        self.fingerprint = self.get_fingerprint(context)
+        self.compiled_rules = compiled_rules
+        self.creds = context.to_dict()
+        self.roles = frozenset(role.lower() for role in self.creds['roles'])
+        self.results = {}
+
+    @staticmethod
+    def get_fingerprint(context):
+        return (context.user_id, context.project_id, context.is_admin,
+                tuple(context.roles), context.read_deleted,
+                context.quota_class)
+
+    def check(self, action, target):
+        """Check action on target like policy.check, with memoization."""
+        if not self.compiled_rules.rules:
+            # No rules to reference means we're going to fail closed
+            return False
+
+        evaluator, keys = self.compiled_rules.get(action)
+        if keys is None or not isinstance(target, dict):
+            return evaluator(target, self)
+
+        key = (action,) + tuple(target.get(k, _MISSING) for k in keys)
+        try:
+            return self.results[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable target values
+            return evaluator(target, self)
+        result = evaluator(target, self)
+        self.results[key] = result
+        return result
+
+
+def _get_request_cache(context):
+    """Return the _RequestCache of context, made again if it changed."""
+    compiled_rules = _get_compiled_rules()
+    cache = getattr(context, '_policy_cache', None)
+    if (cache is None or cache.compiled_rules is not compiled_rules or
+            cache.fingerprint != _RequestCache.get_fingerprint(context)):
+        cache = _RequestCache(context, compiled_rules)
+        context._policy_cache = cache
+    return cache
+
+
 def enforce(context, action, target, do_raise=True):
     """Verifies that the action is valid on the target in this context.
 
@@ -93,6 +333,12 @@ def enforce(context, action, target, do_raise=True):
     """
     init()
 
+    if CONF.policy_compiled_rules:
+        result = _get_request_cache(context).check(action, target)
+        if do_raise and result is False:
+            raise exception.PolicyNotAuthorized(action=action)
+        return result
+
     credentials = context.to_dict()
 
     # Add the exception arguments if asked to do a raise
@@ -109,6 +355,11 @@ def check_is_admin(context):
     """
     init()
 
+    if CONF.policy_compiled_rules:
+        # Called while the context is built, its cache would not last.
+        cache = _RequestCache(context, _get_compiled_rules())
+        return cache.check('context_is_admin', cache.creds)
+
     #the target is user-self
     credentials = context.to_dict()
     target = credentials
@@ -0,0 +1,91 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Array-backed view of host states for vectorized filters and weighers.
+
+Filters and weighers may implement filter_columns() and weigh_columns()
+respectively, in which case the scheduler runs them as a single array
+operation across all hosts instead of once per host.  Those methods must
+return exactly what the per-host code path would, including any side
+effects on the host states (such as HostState.limits).
+"""
+
+from oslo.config import cfg
+
+from nova.openstack.common import importutils
+
+numpy = importutils.try_import('numpy')
+
+columns_opts = [
+    cfg.BoolOpt('scheduler_use_vectorized_engine',
+                default=False,
+                help='Run the filters and weighers which support it as '
+                     'array operations over all hosts at once. Requires '
+                     'NumPy, the per-host code path is used without it'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(columns_opts)
+
+
+def enabled():
+    """Return True if filters and weighers should use HostStateColumns."""
+    return CONF.scheduler_use_vectorized_engine and numpy is not None
+
+
+class HostStateColumns(object):
+    """The numeric fields of a list of HostStates, one array per field.
+
+    The arrays are a snapshot: they are not updated when the host states
+    are, so a new instance must be built for each filtering pass.
+    """
+
+    fields = ('free_ram_mb', 'total_usable_ram_mb', 'free_disk_mb',
+              'total_usable_disk_gb', 'vcpus_total', 'vcpus_used',
+              'num_io_ops', 'num_instances')
+
+    def __init__(self, host_states):
+        """Raise ValueError if a field is unset on any of the hosts."""
+        self.host_states = list(host_states)
+        for field in self.fields:
+            values = [getattr(host_state, field, None)
+                      for host_state in self.host_states]
+            if None in values:
+                raise ValueError(field)
+            setattr(self, field, numpy.array(values, dtype=numpy.float64))
+
+    def __len__(self):
+        return len(self.host_states)
+
+    def set_limits(self, key, indices, values):
+        """Set HostState.limits[key] on the hosts at positions 'indices'."""
+        for i, value in zip(indices.tolist(), values.tolist()):
+            self.host_states[i].limits[key] = value
+
+
+def normalize(weights, minval=None, maxval=None):
+    """Array version of nova.weights.normalize()."""
+    if not len(weights):
+        return weights
+    if maxval is None:
+        maxval = weights.max()
+    if minval is None:
+        minval = weights.min()
+    minval = float(minval)
+    maxval = float(maxval)
+    if minval == maxval:
+        return numpy.zeros(len(weights))
+    return (weights - minval) / (maxval - minval)
@@ -150,3 +150,10 @@ class Scheduler(object):
         """Must override select_hosts method for scheduler to work."""
         msg = _("Driver must implement select_hosts")
         raise NotImplementedError(msg)
+
+    def report_placement_stats(self, context):
+        """Report statistics about the recent scheduling requests.
+
+        Drivers that keep no statistics do not need to override this.
+        """
+        pass
@@ -19,7 +19,9 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import heapq
 import random
+import time
 
 from oslo.config import cfg
 
@@ -28,9 +30,11 @@ from nova import exception
 from nova import notifier
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
 from nova.pci import pci_request
 from nova.scheduler import driver
 from nova.scheduler import scheduler_options
+from nova.scheduler import shards
 from nova.scheduler import utils as scheduler_utils
 
 
@@ -47,10 +51,37 @@ filter_scheduler_opts = [
                     'chosen from. A value of 1 chooses the '
                     'first host returned by the weighing functions. '
                     'This value must be at least 1. Any value less than 1 '
-                    'will be ignored, and 1 will be used instead')
+                    'will be ignored, and 1 will be used instead'),
+    cfg.BoolOpt('scheduler_batch_placement',
+                default=False,
+                help='When scheduling several instances in one request, '
+                     'filter and weigh all hosts only once. After each '
+                     'instance only the chosen host is filtered and weighed '
+                     'again. Not used if a filter does not support it, such '
+                     'as the group affinity filters'),
+    cfg.BoolOpt('scheduler_sharding',
+                default=False,
+                help='Split the compute hosts between the running '
+                     'schedulers with a consistent hash ring. Each '
+                     'scheduler places instances on its own hosts first, '
+                     'and on the hosts of the other schedulers only when '
+                     'its own have no room, so that concurrent requests '
+                     'rarely claim resources on the same host'),
+    cfg.IntOpt('scheduler_shard_replicas',
+               default=100,
+               help='Number of points of each scheduler on the hash ring '
+                    'used by scheduler_sharding'),
+    cfg.IntOpt('scheduler_shard_ring_refresh_interval',
+               default=10,
+               help='Number of seconds during which the hash ring of the '
+                    'schedulers is used without checking which schedulers '
+                    'are up. A value of 0 checks on every scheduling '
+                    'request'),
 ]
 
 CONF.register_opts(filter_scheduler_opts)
+CONF.import_opt('host', 'nova.netconf')
+CONF.import_opt('scheduler_topic', 'nova.scheduler.rpcapi')
 
 
 class FilterScheduler(driver.Scheduler):
@@ -60,6 +91,10 @@ class FilterScheduler(driver.Scheduler):
         self.options = scheduler_options.SchedulerOptions()
         self.compute_rpcapi = compute_rpcapi.ComputeAPI()
         self.notifier = notifier.get_notifier('scheduler')
+        self._shard_ring = None
+        self._shard_ring_checked_at = None
+        self._shard_owners = {}
+        self._reset_placement_stats()
 
     def schedule_run_instance(self, context, request_spec,
                               admin_password, injected_files,
@@ -279,6 +314,7 @@ class FilterScheduler(driver.Scheduler):
         """Returns a list of hosts that meet the required specs,
         ordered by their fitness.
         """
+        start = time.time()
         elevated = context.elevated()
         instance_properties = request_spec['instance_properties']
         instance_type = request_spec.get("instance_type", None)
@@ -313,21 +349,55 @@ class FilterScheduler(driver.Scheduler):
         self.populate_filter_properties(request_spec,
                                         filter_properties)
 
-        # Find our local list of acceptable hosts by repeatedly
-        # filtering and weighing our options. Each time we choose a
-        # host, we virtually consume resources on it so subsequent
-        # selections can adjust accordingly.
-
         # Note: remember, we are using an iterator here. So only
         # traverse this list once. This can bite you if the hosts
         # are being scanned in a filter or weighing function.
         hosts = self.host_manager.get_all_host_states(elevated)
 
-        selected_hosts = []
         if instance_uuids:
             num_instances = len(instance_uuids)
         else:
             num_instances = request_spec.get('num_instances', 1)
+
+        if not CONF.scheduler_sharding:
+            selected_hosts = self._choose_hosts(hosts, filter_properties,
+                    instance_properties, num_instances, update_group_hosts)
+        else:
+            own_hosts, other_hosts = self._split_shard(elevated, hosts)
+            selected_hosts = self._choose_hosts(own_hosts, filter_properties,
+                    instance_properties, num_instances, update_group_hosts)
+            if len(selected_hosts) < num_instances and other_hosts:
+                LOG.debug(_("No room left for %(num)d instance(s) on the "
+                            "hosts of this scheduler, trying the hosts of "
+                            "the other schedulers"),
+                          {'num': num_instances - len(selected_hosts)})
+                self.placement_stats['spills'] += 1
+                selected_hosts += self._choose_hosts(other_hosts,
+                        filter_properties, instance_properties,
+                        num_instances - len(selected_hosts),
+                        update_group_hosts)
+
+        retry = filter_properties.get('retry') or {}
+        self._record_placement(start, num_instances, len(selected_hosts),
+                               retry.get('num_attempts', 1) > 1)
+        return selected_hosts
+
+    def _choose_hosts(self, hosts, filter_properties, instance_properties,
+                      num_instances, update_group_hosts):
+        """Returns a list of num_instances hosts chosen from hosts, or
+        fewer if there is not enough room for all of them.
+        """
+        # Find our local list of acceptable hosts by repeatedly
+        # filtering and weighing our options. Each time we choose a
+        # host, we virtually consume resources on it so subsequent
+        # selections can adjust accordingly.
+        if (CONF.scheduler_batch_placement and num_instances > 1 and
+                self.host_manager.can_filter_batched()):
+            return self._schedule_batched(hosts, filter_properties,
+                                          instance_properties, num_instances,
+                                          update_group_hosts)
+
+        selected_hosts = []
         for num in xrange(num_instances):
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.get_filtered_hosts(hosts,
@@ -343,12 +413,8 @@ class FilterScheduler(driver.Scheduler):
 
             LOG.debug(_("Weighed %(hosts)s"), {'hosts': weighed_hosts})
 
-            scheduler_host_subset_size = CONF.scheduler_host_subset_size
-            if scheduler_host_subset_size > len(weighed_hosts):
-                scheduler_host_subset_size = len(weighed_hosts)
-            if scheduler_host_subset_size < 1:
-                scheduler_host_subset_size = 1
-
+            scheduler_host_subset_size = self._get_host_subset_size(
+                    len(weighed_hosts))
             chosen_host = random.choice(
                 weighed_hosts[0:scheduler_host_subset_size])
             selected_hosts.append(chosen_host)
@@ -359,3 +425,181 @@ class FilterScheduler(driver.Scheduler):
             if update_group_hosts is True:
                 filter_properties['group_hosts'].append(chosen_host.obj.host)
         return selected_hosts
+
+    def _get_host_subset_size(self, num_hosts):
+        """Return how many of the best hosts to choose a host from."""
+        scheduler_host_subset_size = CONF.scheduler_host_subset_size
+        if scheduler_host_subset_size > num_hosts:
+            scheduler_host_subset_size = num_hosts
+        if scheduler_host_subset_size < 1:
+            scheduler_host_subset_size = 1
+        return scheduler_host_subset_size
+
+    def _schedule_batched(self, hosts, filter_properties, instance_properties,
+                          num_instances, update_group_hosts):
+        """Returns a list of hosts for all the instances of a request, like
+        _schedule(), from a single filtering and weighing pass.
+
+        The weighed hosts are kept in a heap keyed on their weight.  After
+        each instance, only the host chosen for it is filtered again.  With
+        a single weigher counting, only that host is weighed again, against
+        the weight bounds of the first pass, which keeps the order of the
+        hosts.  With several, the weights of the other hosts change with the
+        bounds of each weigher, so all the hosts left are weighed again.
+        """
+        hosts = self.host_manager.get_filtered_hosts(hosts,
+                filter_properties, index=0)
+        if not hosts:
+            return []
+
+        LOG.debug(_("Filtered %(hosts)s"), {'hosts': hosts})
+
+        weighers = self.host_manager.get_weighers()
+        weighed_hosts = self.host_manager.get_weighed_hosts(hosts,
+                filter_properties, weighers=weighers)
+        reweigh_all = len([weigher for weigher in weighers
+                           if weigher.weight_multiplier()]) > 1
+
+        LOG.debug(_("Weighed %(hosts)s"), {'hosts': weighed_hosts})
+
+        # NOTE: The position of a host in the filtered list breaks ties the
+        # same way as the stable sort of the weight handler does.
+        positions = dict((id(host), position)
+                         for position, host in enumerate(hosts))
+        heap = [(-weighed_host.weight, positions[id(weighed_host.obj)],
+                 weighed_host) for weighed_host in weighed_hosts]
+        heapq.heapify(heap)
+
+        selected_hosts = []
+        for num in xrange(num_instances):
+            if not heap:
+                # Can't get any more locally.
+                break
+
+            subset_size = self._get_host_subset_size(len(heap))
+            subset = [heapq.heappop(heap) for i in xrange(subset_size)]
+            chosen = random.choice(subset)
+            for entry in subset:
+                if entry is not chosen:
+                    heapq.heappush(heap, entry)
+            chosen_host = chosen[2]
+            selected_hosts.append(chosen_host)
+
+            # Now consume the resources so the filter/weights
+            # will change for the next instance.
+            chosen_host.obj.consume_from_instance(instance_properties)
+            if update_group_hosts is True:
+                filter_properties['group_hosts'].append(chosen_host.obj.host)
+
+            if num + 1 == num_instances:
+                break
+            passes = self.host_manager.get_filtered_hosts([chosen_host.obj],
+                    filter_properties, index=num + 1)
+            if reweigh_all:
+                entries = heap + [chosen] if passes else heap
+                # Weighed in the order of the filtered list, like _schedule()
+                entries.sort(key=lambda entry: entry[1])
+                weighed_hosts = self.host_manager.get_weighed_hosts(
+                        [entry[2].obj for entry in entries],
+                        filter_properties)
+                heap = [(-weighed_host.weight,
+                         positions[id(weighed_host.obj)], weighed_host)
+                        for weighed_host in weighed_hosts]
+                heapq.heapify(heap)
+            elif passes:
+                chosen_host = self.host_manager.reweigh_host(weighers,
+                        chosen_host.obj, filter_properties)
+                heapq.heappush(heap, (-chosen_host.weight, chosen[1],
+                                      chosen_host))
+        return selected_hosts
+
+    def _get_shard_ring(self, context):
+        """Return the hash ring of the schedulers which are up, rebuilt
+        only when one of them joins or leaves.
+
+        The schedulers which are up are only looked up again once
+        scheduler_shard_ring_refresh_interval has passed.
+        """
+        now = timeutils.utcnow()
+        refresh_interval = CONF.scheduler_shard_ring_refresh_interval
+        if (refresh_interval > 0 and self._shard_ring is not None and
+                timeutils.delta_seconds(self._shard_ring_checked_at, now) <
+                refresh_interval):
+            return self._shard_ring
+        self._shard_ring_checked_at = now
+
+        schedulers = set(self.hosts_up(context, CONF.scheduler_topic))
+        # NOTE: This scheduler is running even if its service record has
+        # not been updated yet.
+        schedulers.add(CONF.host)
+        if self._shard_ring is None or self._shard_ring.members != schedulers:
+            LOG.info(_("Splitting the compute hosts between %(num)d "
+                       "scheduler(s)"), {'num': len(schedulers)})
+            self._shard_ring = shards.HashRing(schedulers,
+                    replicas=CONF.scheduler_shard_replicas)
+            self._shard_owners = {}
+        return self._shard_ring
+
+    def _split_shard(self, context, hosts):
+        """Split hosts into the ones this scheduler owns on the hash ring
+        and the ones owned by the other schedulers.
+        """
+        ring = self._get_shard_ring(context)
+        own_hosts = []
+        other_hosts = []
+        for host_state in hosts:
+            owner = self._shard_owners.get(host_state.host)
+            if owner is None:
+                owner = ring.get_member(host_state.host)
+                self._shard_owners[host_state.host] = owner
+            if owner == CONF.host:
+                own_hosts.append(host_state)
+            else:
+                other_hosts.append(host_state)
+        return own_hosts, other_hosts
+
+    def _reset_placement_stats(self):
+        self.placement_stats = {'requests': 0,
+                                'retries': 0,
+                                'spills': 0,
+                                'instances': 0,
+                                'placed': 0,
+                                'placement_time': 0.0,
+                                'max_placement_time': 0.0}
+
+    def _record_placement(self, start, num_instances, num_placed, retry):
+        elapsed = time.time() - start
+        stats = self.placement_stats
+        stats['requests'] += 1
+        stats['instances'] += num_instances
+        stats['placed'] += num_placed
+        if retry:
+            stats['retries'] += 1
+        stats['placement_time'] += elapsed
+        stats['max_placement_time'] = max(stats['max_placement_time'],
+                                          elapsed)
+
+    def report_placement_stats(self, context):
+        """Log and notify the placement statistics since the last report,
+        then reset them.
+        """
+        stats = self.placement_stats
+        self._reset_placement_stats()
+        if not stats['requests']:
+            return
+
+        payload = dict(stats,
+                       host=CONF.host,
+                       schedulers=len(self.hosts_up(context,
+                                                    CONF.scheduler_topic)),
+                       sharding=CONF.scheduler_sharding,
+                       retry_rate=float(stats['retries']) / stats['requests'],
+                       avg_placement_time=(stats['placement_time'] /
+                                           stats['requests']))
+        LOG.info(_("Placed %(placed)d of %(instances)d instance(s) in "
+                   "%(requests)d request(s) with %(schedulers)d "
+                   "scheduler(s): retry rate %(retry_rate).3f, "
+                   "%(spills)d request(s) spilled to other shards, "
+                   "placement time avg %(avg_placement_time).3fs "
+                   "max %(max_placement_time).3fs"), payload)
+        self.notifier.info(context, 'scheduler.placement.stats', payload)
@@ -18,6 +18,11 @@ Scheduler host filters
 """
 
 from nova import filters
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.scheduler import columns
+
+LOG = logging.getLogger(__name__)
 
 
 class BaseHostFilter(filters.BaseFilter):
@@ -32,11 +37,66 @@ class BaseHostFilter(filters.BaseFilter):
         """
         raise NotImplementedError()
 
+    # Set to True in a subclass which implements filter_columns()
+    vectorized = False
+
+    def filter_columns(self, host_columns, indices, filter_properties):
+        """Return a boolean array telling which of the hosts at positions
+        'indices' of a HostStateColumns pass the filter.  Override this
+        in a subclass, along with setting vectorized to True.
+        """
+        raise NotImplementedError()
+
 
 class HostFilterHandler(filters.BaseFilterHandler):
     def __init__(self):
         super(HostFilterHandler, self).__init__(BaseHostFilter)
 
+    def get_filtered_objects(self, filter_classes, objs,
+            filter_properties, index=0):
+        """Filter hosts, running the filters which support it over arrays
+        of host state fields when the vectorized engine is enabled.
+        """
+        if not columns.enabled():
+            return super(HostFilterHandler, self).get_filtered_objects(
+                    filter_classes, objs, filter_properties, index)
+        list_objs = list(objs)
+        try:
+            host_columns = columns.HostStateColumns(list_objs)
+        except ValueError:
+            return super(HostFilterHandler, self).get_filtered_objects(
+                    filter_classes, list_objs, filter_properties, index)
+
+        LOG.debug(_("Starting with %d host(s)"), len(list_objs))
+        positions = dict((id(obj), i) for i, obj in enumerate(list_objs))
+        indices = columns.numpy.arange(len(list_objs))
+        for filter_cls in filter_classes:
+            cls_name = filter_cls.__name__
+            filter = filter_cls()
+
+            if not filter.run_filter_for_index(index):
+                continue
+            if filter.vectorized:
+                passes = filter.filter_columns(host_columns, indices,
+                                               filter_properties)
+                indices = indices[passes]
+            else:
+                objs = filter.filter_all([list_objs[i] for i in indices],
+                                         filter_properties)
+                if objs is None:
+                    LOG.debug(_("Filter %(cls_name)s says to stop filtering"),
+                          {'cls_name': cls_name})
+                    return
+                indices = columns.numpy.array(
+                        [positions[id(obj)] for obj in objs], dtype=int)
+            if not len(indices):
+                LOG.info(_("Filter %s returned 0 hosts"), cls_name)
+                break
+            LOG.debug(_("Filter %(cls_name)s returned "
+                        "%(obj_len)d host(s)"),
+                      {'cls_name': cls_name, 'obj_len': len(indices)})
+        return [list_objs[i] for i in indices]
+
 
 def all_filters():
     """Return a list of filter classes found in this directory.
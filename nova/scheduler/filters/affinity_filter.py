@@ -104,6 +104,9 @@ class GroupAntiAffinityFilter(AffinityFilter):
     hosts.
     """
 
+    # The group hosts change as each instance of a request is scheduled
+    run_filter_batched = False
+
     def host_passes(self, host_state, filter_properties):
         group_hosts = filter_properties.get('group_hosts') or []
         LOG.debug(_("Group anti affinity: check if %(host)s not "
@@ -120,6 +123,9 @@ class GroupAffinityFilter(AffinityFilter):
     """Schedule the instance on to host from a set of group hosts.
     """
 
+    # The group hosts change as each instance of a request is scheduled
+    run_filter_batched = False
+
     def host_passes(self, host_state, filter_properties):
         group_hosts = filter_properties.get('group_hosts', [])
         LOG.debug(_("Group affinity: check if %(host)s in "
@@ -20,6 +20,7 @@ from oslo.config import cfg
 from nova import db
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
+from nova.scheduler import columns
 from nova.scheduler import filters
 
 LOG = logging.getLogger(__name__)
@@ -67,9 +68,35 @@ class BaseCoreFilter(filters.BaseHostFilter):
 class CoreFilter(BaseCoreFilter):
     """CoreFilter filters based on CPU core utilization."""
 
+    vectorized = True
+
     def _get_cpu_allocation_ratio(self, host_state, filter_properties):
         return CONF.cpu_allocation_ratio
 
+    def filter_columns(self, host_columns, indices, filter_properties):
+        """Return True for the hosts with sufficient CPU cores."""
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return columns.numpy.ones(len(indices), dtype=bool)
+
+        host_vcpus_total = host_columns.vcpus_total[indices]
+        # Fail safe
+        vcpus_unset = host_vcpus_total == 0
+        if vcpus_unset.any():
+            LOG.warning(_("VCPUs not set; assuming CPU collection broken"))
+
+        instance_vcpus = instance_type['vcpus']
+        vcpus_total = host_vcpus_total * CONF.cpu_allocation_ratio
+
+        # Only provide a VCPU limit to compute if the virt driver is reporting
+        # an accurate count of installed VCPUs. (XenServer driver does not)
+        has_limit = ~vcpus_unset & (vcpus_total > 0)
+        host_columns.set_limits('vcpu', indices[has_limit],
+                                vcpus_total[has_limit])
+
+        vcpus_used = host_columns.vcpus_used[indices]
+        return vcpus_unset | ((vcpus_total - vcpus_used) >= instance_vcpus)
+
 
 class AggregateCoreFilter(BaseCoreFilter):
     """AggregateCoreFilter with per-aggregate CPU subscription flag.
@@ -32,6 +32,8 @@ CONF.register_opt(max_instances_per_host_opt)
 class NumInstancesFilter(filters.BaseHostFilter):
     """Filter out hosts with too many instances."""
 
+    vectorized = True
+
     def host_passes(self, host_state, filter_properties):
         num_instances = host_state.num_instances
         max_instances = CONF.max_instances_per_host
@@ -42,3 +44,7 @@ class NumInstancesFilter(filters.BaseHostFilter):
                         {'host_state': host_state,
                          'max_instances': max_instances})
         return passes
+
+    def filter_columns(self, host_columns, indices, filter_properties):
+        max_instances = CONF.max_instances_per_host
+        return host_columns.num_instances[indices] < max_instances
@@ -56,6 +56,22 @@ host_manager_opts = [
     cfg.ListOpt('scheduler_weight_classes',
                 default=['nova.scheduler.weights.all_weighers'],
                 help='Which weight class names to use for weighing hosts'),
+    cfg.BoolOpt('scheduler_incremental_host_state',
+                default=False,
+                help='Only load compute node records that were created, '
+                     'updated or deleted since the last refresh of the '
+                     'host states, instead of every compute node on every '
+                     'scheduling request'),
+    cfg.IntOpt('scheduler_host_state_refresh_interval',
+               default=0,
+               help='Number of seconds during which the cached host states '
+                    'are used without checking the database for changes. '
+                    'A value of 0 checks on every scheduling request'),
+    cfg.IntOpt('scheduler_host_state_full_refresh_interval',
+               default=600,
+               help='Number of seconds between full reloads of all compute '
+                    'nodes when scheduler_incremental_host_state is '
+                    'enabled'),
     ]
 
 CONF = cfg.CONF
@@ -128,6 +144,7 @@ class HostState(object):
         self.num_instances_by_project = {}
         self.num_instances_by_os_type = {}
         self.num_io_ops = 0
+        self.cached_images = set()
 
         # Other information
         self.host_ip = None
@@ -242,6 +259,10 @@ class HostState(object):
             task_state = key[9:]
             self.task_states[task_state] = int(self.stats[key])
 
+        # Track the images in the image cache of the host
+        self.cached_images = set(k[13:] for k in self.stats.keys() if
+                k.startswith("cached_image_"))
+
         # Track number of instances by host_type
         os_keys = [k for k in self.stats.keys() if
                 k.startswith("num_os_type_")]
@@ -322,6 +343,17 @@ class HostManager(object):
         # { (host, hypervisor_hostname) : { <service> : { cap k : v }}}
         self.service_states = {}
         self.host_state_map = {}
+        # { compute node id : (host, hypervisor_hostname) }
+        self.compute_node_map = {}
+        # { (host, hypervisor_hostname) : compute node id }
+        self.compute_node_ids = {}
+        # Time of the last database refresh of host_state_map, and of the
+        # last full (non-incremental) one.
+        self.last_refresh = None
+        self.last_full_refresh = None
+        # Most recent compute node timestamp seen so far. Compute nodes
+        # changed at or after this time are loaded by incremental refreshes.
+        self.changes_since = None
         self.filter_handler = filters.HostFilterHandler()
         self.filter_classes = self.filter_handler.get_matching_classes(
                 CONF.scheduler_available_filters)
@@ -426,11 +458,34 @@ class HostManager(object):
         return self.filter_handler.get_filtered_objects(filter_classes,
                 hosts, filter_properties, index)
 
-    def get_weighed_hosts(self, hosts, weight_properties):
+    def can_filter_batched(self, filter_class_names=None):
+        """Return True if all the filters allow re-filtering only the host
+        chosen for the previous instance of a request.
+        """
+        filter_classes = self._choose_host_filters(filter_class_names)
+        return all(cls.run_filter_batched for cls in filter_classes)
+
+    def get_weighers(self):
+        """Return instances of the weighers, for get_weighed_hosts() and
+        reweigh_host().
+        """
+        return [weigher_cls() for weigher_cls in self.weight_classes]
+
+    def get_weighed_hosts(self, hosts, weight_properties, weighers=None):
         """Weigh the hosts."""
+        if weighers is not None:
+            return self.weight_handler.weigh_with(weighers, hosts,
+                                                  weight_properties)
         return self.weight_handler.get_weighed_objects(self.weight_classes,
                 hosts, weight_properties)
 
+    def reweigh_host(self, weighers, host, weight_properties):
+        """Weigh again a host previously weighed by get_weighed_hosts() with
+        the same weighers, after resources have been consumed on it.
+        """
+        return self.weight_handler.reweigh_object(weighers, host,
+                                                  weight_properties)
+
     def update_service_capabilities(self, service_name, host, capabilities):
         """Update the per-service capabilities based on this notification."""
 
@@ -449,42 +504,127 @@ class HostManager(object):
         capab_copy["timestamp"] = timeutils.utcnow()  # Reported time
         self.service_states[state_key] = capab_copy
 
-    def get_all_host_states(self, context):
-        """Returns a list of HostStates that represents all the hosts
-        the HostManager knows about. Also, each of the consumable resources
-        in HostState are pre-populated and adjusted based on data in the db.
-        """
-
-        # Get resource usage across the available compute nodes:
+    def _update_host_state(self, compute, service):
+        """Create or update the HostState for a compute node."""
+        host = service['host']
+        node = compute.get('hypervisor_hostname')
+        state_key = (host, node)
+        capabilities = self.service_states.get(state_key, None)
+        host_state = self.host_state_map.get(state_key)
+        if host_state:
+            host_state.update_capabilities(capabilities,
+                                           dict(service.iteritems()))
+        else:
+            host_state = self.host_state_cls(host, node,
+                    capabilities=capabilities,
+                    service=dict(service.iteritems()))
+            self.host_state_map[state_key] = host_state
+        host_state.update_from_compute_node(compute)
+        # A node recreated under a new id keeps its state key; forget the
+        # old id, so that its deleted row does not remove the node.
+        old_id = self.compute_node_ids.get(state_key)
+        if old_id is not None and old_id != compute['id']:
+            self.compute_node_map.pop(old_id, None)
+        self.compute_node_map[compute['id']] = state_key
+        self.compute_node_ids[state_key] = compute['id']
+        return state_key
+
+    def _remove_host_state(self, state_key):
+        host, node = state_key
+        LOG.info(_("Removing dead compute node %(host)s:%(node)s "
+                   "from scheduler") % {'host': host, 'node': node})
+        del self.host_state_map[state_key]
+        compute_id = self.compute_node_ids.pop(state_key, None)
+        self.compute_node_map.pop(compute_id, None)
+
+    def _track_changes_since(self, compute):
+        """Advance the incremental refresh marker past a compute node."""
+        for key in ('updated_at', 'created_at', 'deleted_at'):
+            timestamp = compute.get(key)
+            if timestamp and (self.changes_since is None or
+                              timestamp > self.changes_since):
+                self.changes_since = timestamp
+
+    def _refresh_all_host_states(self, context):
+        """Rebuild host_state_map from every compute node in the db."""
         compute_nodes = db.compute_node_get_all(context)
         seen_nodes = set()
+        self.compute_node_map = {}
+        self.compute_node_ids = {}
+        self.changes_since = None
         for compute in compute_nodes:
+            self._track_changes_since(compute)
             service = compute['service']
             if not service:
                 LOG.warn(_("No service for compute ID %s") % compute['id'])
                 continue
-            host = service['host']
-            node = compute.get('hypervisor_hostname')
-            state_key = (host, node)
-            capabilities = self.service_states.get(state_key, None)
-            host_state = self.host_state_map.get(state_key)
-            if host_state:
-                host_state.update_capabilities(capabilities,
-                                               dict(service.iteritems()))
-            else:
-                host_state = self.host_state_cls(host, node,
-                        capabilities=capabilities,
-                        service=dict(service.iteritems()))
-                self.host_state_map[state_key] = host_state
-            host_state.update_from_compute_node(compute)
-            seen_nodes.add(state_key)
+            seen_nodes.add(self._update_host_state(compute, service))
 
         # remove compute nodes from host_state_map if they are not active
         dead_nodes = set(self.host_state_map.keys()) - seen_nodes
         for state_key in dead_nodes:
-            host, node = state_key
-            LOG.info(_("Removing dead compute node %(host)s:%(node)s "
-                       "from scheduler") % {'host': host, 'node': node})
-            del self.host_state_map[state_key]
+            self._remove_host_state(state_key)
+
+    def _refresh_changed_host_states(self, context):
+        """Update host_state_map with the compute nodes changed since the
+        last refresh.
+
+        Services are reloaded in full, as their heartbeats and disabled
+        flags are needed to filter every host, but they are a small
+        fraction of the compute node and stats rows.
+        """
+        services = dict((service['host'], dict(service.iteritems()))
+                        for service in db.service_get_all(context)
+                        if service['binary'] == 'nova-compute')
+        compute_nodes = db.compute_node_get_all(context,
+                updated_since=self.changes_since)
+        for compute in compute_nodes:
+            self._track_changes_since(compute)
+            if compute.get('deleted'):
+                state_key = self.compute_node_map.get(compute['id'])
+                if (state_key in self.host_state_map and
+                        self.compute_node_ids.get(state_key) ==
+                        compute['id']):
+                    self._remove_host_state(state_key)
+                continue
+            service = compute['service']
+            if not service:
+                LOG.warn(_("No service for compute ID %s") % compute['id'])
+                continue
+            self._update_host_state(compute, service)
+
+        for state_key, host_state in self.host_state_map.items():
+            service = services.get(host_state.host)
+            if not service:
+                self._remove_host_state(state_key)
+                continue
+            capabilities = self.service_states.get(state_key, None)
+            host_state.update_capabilities(capabilities, service)
+
+    def get_all_host_states(self, context):
+        """Returns a list of HostStates that represents all the hosts
+        the HostManager knows about. Also, each of the consumable resources
+        in HostState are pre-populated and adjusted based on data in the db.
+
+        Resources consumed locally through HostState.consume_from_instance()
+        are kept until the compute node reports newer usage.
+        """
+        now = timeutils.utcnow()
+        refresh_interval = CONF.scheduler_host_state_refresh_interval
+        if (refresh_interval > 0 and self.last_refresh and
+                timeutils.delta_seconds(self.last_refresh, now) <
+                refresh_interval):
+            return self.host_state_map.itervalues()
+
+        full_refresh_interval = CONF.scheduler_host_state_full_refresh_interval
+        if (CONF.scheduler_incremental_host_state and
+                self.last_full_refresh and
+                timeutils.delta_seconds(self.last_full_refresh, now) <
+                full_refresh_interval):
+            self._refresh_changed_host_states(context)
+        else:
+            self._refresh_all_host_states(context)
+            self.last_full_refresh = now
+        self.last_refresh = now
 
         return self.host_state_map.itervalues()
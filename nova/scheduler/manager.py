@@ -48,8 +48,16 @@ scheduler_driver_opt = cfg.StrOpt('scheduler_driver',
         default='nova.scheduler.filter_scheduler.FilterScheduler',
         help='Default driver to use for the scheduler')
 
+placement_stats_interval_opt = cfg.IntOpt(
+        'scheduler_placement_stats_interval',
+        default=-1,
+        help='Interval in seconds between reports of the scheduling '
+             'requests, retry rate and placement time of this scheduler. '
+             'A negative value disables the reports')
+
 CONF = cfg.CONF
 CONF.register_opt(scheduler_driver_opt)
+CONF.register_opt(placement_stats_interval_opt)
 
 QUOTAS = quota.QUOTAS
 
@@ -272,6 +280,11 @@ class SchedulerManager(manager.Manager):
     def _expire_reservations(self, context):
         QUOTAS.expire(context)
 
+    @periodic_task.periodic_task(
+            spacing=CONF.scheduler_placement_stats_interval)
+    def _report_placement_stats(self, context):
+        self.driver.report_placement_stats(context)
+
     # NOTE(russellb) This method can be removed in 3.0 of this API.  It is
     # deprecated in favor of the method in the base API.
     def get_backdoor_port(self, context):
@@ -0,0 +1,53 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Consistent hash ring used to split the compute hosts between the running
+schedulers.
+"""
+
+import bisect
+import hashlib
+
+from nova.openstack.common import strutils
+
+
+class HashRing(object):
+    """Maps keys (compute host names) onto a set of members (schedulers).
+
+    Every member is placed on the ring 'replicas' times and a key belongs
+    to the member owning the first point that follows the hash of the key.
+    When a member joins or leaves the ring, only the keys next to its own
+    points move to another member.
+    """
+
+    def __init__(self, members, replicas=100):
+        self.members = frozenset(members)
+        points = sorted((self._hash('%s-%d' % (member, replica)), member)
+                        for member in self.members
+                        for replica in xrange(replicas))
+        self._hashes = [point[0] for point in points]
+        self._owners = [point[1] for point in points]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(strutils.safe_encode(key)).hexdigest()[:8], 16)
+
+    def get_member(self, key):
+        """Return the member owning key, or None if the ring is empty."""
+        if not self._hashes:
+            return None
+        position = bisect.bisect(self._hashes, self._hash(key))
+        return self._owners[position % len(self._owners)]
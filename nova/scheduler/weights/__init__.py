@@ -19,6 +19,7 @@ Scheduler host weights
 
 from oslo.config import cfg
 
+from nova.scheduler import columns
 from nova import weights
 
 CONF = cfg.CONF
@@ -37,7 +38,28 @@ class WeighedHost(weights.WeighedObject):
 
 class BaseHostWeigher(weights.BaseWeigher):
     """Base class for host weights."""
-    pass
+
+    # Set to True in a subclass which implements weigh_columns()
+    vectorized = False
+
+    def weigh_columns(self, host_columns, weight_properties):
+        """Return an array with the weight of each host of a
+        HostStateColumns.  Like weigh_objects(), this must record the
+        minval and maxval of the weights.  Override this in a subclass,
+        along with setting vectorized to True.
+        """
+        raise NotImplementedError()
+
+    def _record_bounds(self, weights):
+        """Update minval and maxval from an array of weights."""
+        if not len(weights):
+            return
+        lowest = weights.min()
+        highest = weights.max()
+        if self.minval is None or lowest < self.minval:
+            self.minval = lowest
+        if self.maxval is None or highest > self.maxval:
+            self.maxval = highest
 
 
 class HostWeightHandler(weights.BaseWeightHandler):
@@ -46,6 +68,43 @@ class HostWeightHandler(weights.BaseWeightHandler):
     def __init__(self):
         super(HostWeightHandler, self).__init__(BaseHostWeigher)
 
+    def weigh_with(self, weighers, obj_list, weighing_properties):
+        """Return a sorted (descending), normalized list of WeighedHosts,
+        running the weighers which support it over arrays of host state
+        fields when the vectorized engine is enabled.
+        """
+        if not columns.enabled() or not obj_list:
+            return super(HostWeightHandler, self).weigh_with(
+                    weighers, obj_list, weighing_properties)
+        try:
+            host_columns = columns.HostStateColumns(obj_list)
+        except ValueError:
+            return super(HostWeightHandler, self).weigh_with(
+                    weighers, obj_list, weighing_properties)
+
+        weighed_objs = [self.object_class(obj, 0.0)
+                        for obj in host_columns.host_states]
+        totals = columns.numpy.zeros(len(weighed_objs))
+        for weigher in weighers:
+            if weigher.vectorized:
+                weights = weigher.weigh_columns(host_columns,
+                                                weighing_properties)
+            else:
+                weights = columns.numpy.array(
+                        weigher.weigh_objects(weighed_objs,
+                                              weighing_properties),
+                        dtype=columns.numpy.float64)
+
+            # Normalize the weights
+            weights = columns.normalize(weights,
+                                        minval=weigher.minval,
+                                        maxval=weigher.maxval)
+            totals += weigher.weight_multiplier() * weights
+
+        for obj, weight in zip(weighed_objs, totals.tolist()):
+            obj.weight = weight
+        return sorted(weighed_objs, key=lambda x: x.weight, reverse=True)
+
 
 def all_weighers():
     """Return a list of weight plugin classes found in this directory."""
@@ -0,0 +1,54 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Image Cache Weigher.  Weigh hosts by whether they have the image of the
+instance in their image cache.
+
+Booting from an image in the image cache of a host saves downloading it.
+This weigher is disabled by default, set the 'image_cache_weight_multiplier'
+option to a positive number to prefer these hosts.
+"""
+
+from oslo.config import cfg
+
+from nova.scheduler import weights
+
+image_cache_weight_opts = [
+        cfg.FloatOpt('image_cache_weight_multiplier',
+                     default=0.0,
+                     help='Multiplier used for weighing the hosts having '
+                          'the image of the instance in their image cache. '
+                          'Positive numbers mean to prefer these hosts.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(image_cache_weight_opts)
+
+
+class ImageCacheWeigher(weights.BaseHostWeigher):
+    minval = 0
+    maxval = 1
+
+    def weight_multiplier(self):
+        """Override the weight multiplier."""
+        return CONF.image_cache_weight_multiplier
+
+    def _weigh_object(self, host_state, weight_properties):
+        """Higher weights win.  1 if the image is cached, else 0."""
+        request_spec = weight_properties.get('request_spec') or {}
+        image_id = (request_spec.get('image') or {}).get('id')
+        if image_id and image_id in host_state.cached_images:
+            return 1
+        return 0
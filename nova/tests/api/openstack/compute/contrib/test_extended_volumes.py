@@ -47,6 +47,11 @@ def fake_compute_get_instance_bdms(*args, **kwargs):
     return [{'volume_id': UUID1}, {'volume_id': UUID2}]
 
 
+def fake_compute_get_instances_bdms(self, context, instance_uuids):
+    return dict((instance_uuid, fake_compute_get_instance_bdms())
+                for instance_uuid in instance_uuids)
+
+
 class ExtendedVolumesTest(test.TestCase):
     content_type = 'application/json'
     prefix = 'os-extended-volumes:'
@@ -58,6 +63,8 @@ class ExtendedVolumesTest(test.TestCase):
         self.stubs.Set(compute.api.API, 'get_all', fake_compute_get_all)
         self.stubs.Set(compute.api.API, 'get_instance_bdms',
                        fake_compute_get_instance_bdms)
+        self.stubs.Set(compute.api.API, 'get_instances_bdms',
+                       fake_compute_get_instances_bdms)
         self.flags(
             osapi_compute_extension=[
                 'nova.api.openstack.compute.contrib.select_extensions'],
@@ -105,6 +112,23 @@ class ExtendedVolumesTest(test.TestCase):
                           server.findall('%svolume_attached' % self.prefix)]
             self.assertEqual(exp_volumes, actual)
 
+    def test_detail_gets_bdms_at_once(self):
+        calls = []
+
+        def fake_get_instances_bdms(_self, context, instance_uuids):
+            calls.append(instance_uuids)
+            return fake_compute_get_instances_bdms(_self, context,
+                                                   instance_uuids)
+
+        self.stubs.Set(compute.api.API, 'get_instances_bdms',
+                       fake_get_instances_bdms)
+        self.stubs.Set(compute.api.API, 'get_instance_bdms', None)
+        res = self._make_request('/v2/fake/servers/detail')
+
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(2, len(calls[0]))
+
 
 class ExtendedVolumesXmlTest(ExtendedVolumesTest):
     content_type = 'application/xml'
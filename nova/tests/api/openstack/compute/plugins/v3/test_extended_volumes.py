@@ -56,6 +56,11 @@ def fake_compute_get_instance_bdms(*args, **kwargs):
     return [{'volume_id': UUID1}, {'volume_id': UUID2}]
 
 
+def fake_compute_get_instances_bdms(self, context, instance_uuids):
+    return dict((instance_uuid, fake_compute_get_instance_bdms())
+                for instance_uuid in instance_uuids)
+
+
 def fake_attach_volume(self, context, instance, volume_id, device):
     pass
 
@@ -124,6 +129,8 @@ class ExtendedVolumesTest(test.TestCase):
         self.stubs.Set(compute.api.API, 'get_all', fake_compute_get_all)
         self.stubs.Set(compute.api.API, 'get_instance_bdms',
                        fake_compute_get_instance_bdms)
+        self.stubs.Set(compute.api.API, 'get_instances_bdms',
+                       fake_compute_get_instances_bdms)
         self.stubs.Set(volume.cinder.API, 'get', fake_volume_get)
         self.stubs.Set(compute.api.API, 'detach_volume', fake_detach_volume)
         self.stubs.Set(compute.api.API, 'attach_volume', fake_attach_volume)
@@ -176,6 +183,23 @@ class ExtendedVolumesTest(test.TestCase):
                           server.findall('%svolume_attached' % self.prefix)]
             self.assertEqual(exp_volumes, actual)
 
+    def test_detail_gets_bdms_at_once(self):
+        calls = []
+
+        def fake_get_instances_bdms(_self, context, instance_uuids):
+            calls.append(instance_uuids)
+            return fake_compute_get_instances_bdms(_self, context,
+                                                   instance_uuids)
+
+        self.stubs.Set(compute.api.API, 'get_instances_bdms',
+                       fake_get_instances_bdms)
+        self.stubs.Set(compute.api.API, 'get_instance_bdms', None)
+        res = self._make_request('/v3/servers/detail')
+
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(2, len(calls[0]))
+
     def test_detach(self):
         url = "/v3/servers/%s/action" % UUID1
         res = self._make_request(url, {"detach": {"volume_id": UUID1}})
@@ -21,17 +21,15 @@ from lxml import etree
 import webob
 
 from nova.api.openstack.compute.plugins.v3 import simple_tenant_usage
-from nova.compute import api
 from nova.compute import flavors
 from nova import context
-from nova import exception
+from nova import db
 from nova.openstack.common import jsonutils
 from nova.openstack.common import policy as common_policy
 from nova.openstack.common import timeutils
 from nova import policy
 from nova import test
 from nova.tests.api.openstack import fakes
-from nova import utils
 
 SERVERS = 5
 TENANTS = 2
@@ -57,36 +55,26 @@ FAKE_INST_TYPE = {'id': 1,
                   'swap': 0}
 
 
-def get_fake_db_instance(start, end, instance_id, tenant_id):
-    sys_meta = utils.dict_to_metadata(
-        flavors.save_flavor_info({}, FAKE_INST_TYPE))
-    return {'id': instance_id,
-            'uuid': '00000000-0000-0000-0000-00000000000000%02d' % instance_id,
-            'image_ref': '1',
-            'project_id': tenant_id,
-            'user_id': 'fakeuser',
-            'display_name': 'name',
-            'state_description': 'state',
-            'instance_type_id': 1,
-            'launched_at': start,
-            'terminated_at': end,
-            'system_metadata': sys_meta}
-
-
-def fake_instance_get_active_by_window_joined(self, context, begin, end,
-        project_id):
-            return [get_fake_db_instance(START,
-                                         STOP,
-                                         x,
-                                         "faketenant_%s" % (x / SERVERS))
-                                         for x in xrange(TENANTS * SERVERS)]
+def create_fake_db_instance(start, end, instance_id, tenant_id):
+    sys_meta = flavors.save_flavor_info({}, FAKE_INST_TYPE)
+    return db.instance_create(context.get_admin_context(), {
+        'uuid': '00000000-0000-0000-0000-00000000000000%02d' % instance_id,
+        'image_ref': '1',
+        'project_id': tenant_id,
+        'user_id': 'fakeuser',
+        'display_name': 'name',
+        'instance_type_id': 1,
+        'launched_at': start,
+        'terminated_at': end,
+        'system_metadata': sys_meta})
 
 
 class SimpleTenantUsageTest(test.TestCase):
     def setUp(self):
         super(SimpleTenantUsageTest, self).setUp()
-        self.stubs.Set(api.API, "get_active_by_window",
-                       fake_instance_get_active_by_window_joined)
+        for x in xrange(TENANTS * SERVERS):
+            create_fake_db_instance(START, STOP, x,
+                                    "faketenant_%s" % (x / SERVERS))
         self.admin_context = context.RequestContext('fakeadmin_0',
                                                     'faketenant_0',
                                                     is_admin=True)
@@ -438,66 +426,3 @@ class SimpleTenantUsageSerializerTest(test.TestCase):
         self.assertEqual(len(raw_usages), len(tree))
         for idx, child in enumerate(tree):
             self._verify_tenant_usage(raw_usages[idx], child)
-
-
-class SimpleTenantUsageControllerTest(test.TestCase):
-    def setUp(self):
-        super(SimpleTenantUsageControllerTest, self).setUp()
-        self.controller = simple_tenant_usage.SimpleTenantUsageController()
-
-        class FakeComputeAPI:
-            def get_instance_type(self, context, flavor_type):
-                if flavor_type == 1:
-                    return flavors.get_default_flavor()
-                else:
-                    raise exception.FlavorNotFound(flavor_id=flavor_type)
-
-        self.compute_api = FakeComputeAPI()
-        self.context = None
-
-        now = timeutils.utcnow()
-        self.baseinst = dict(display_name='foo',
-                             launched_at=now - datetime.timedelta(1),
-                             terminated_at=now,
-                             instance_type_id=1,
-                             vm_state='deleted',
-                             deleted=0)
-        basetype = flavors.get_default_flavor()
-        sys_meta = utils.dict_to_metadata(
-            flavors.save_flavor_info({}, basetype))
-        self.baseinst['system_metadata'] = sys_meta
-        self.basetype = flavors.extract_flavor(self.baseinst)
-
-    def test_get_flavor_from_sys_meta(self):
-        # Non-deleted instances get their type information from their
-        # system_metadata
-        flavor = self.controller._get_flavor(self.context, self.compute_api,
-                                             self.baseinst, {})
-        self.assertEqual(flavor, self.basetype)
-
-    def test_get_flavor_from_non_deleted_with_id_fails(self):
-        # If an instance is not deleted and missing type information from
-        # system_metadata, then that's a bug
-        inst_without_sys_meta = dict(self.baseinst, system_metadata=[])
-        self.assertRaises(KeyError,
-                          self.controller._get_flavor, self.context,
-                          self.compute_api, inst_without_sys_meta, {})
-
-    def test_get_flavor_from_deleted_with_id(self):
-        # Deleted instances may not have type info in system_metadata,
-        # so verify that they get their type from a lookup of their
-        # instance_type_id
-        inst_without_sys_meta = dict(self.baseinst, system_metadata=[],
-                                     deleted=1)
-        flavor = self.controller._get_flavor(self.context, self.compute_api,
-                                             inst_without_sys_meta, {})
-        self.assertEqual(flavor, flavors.get_default_flavor())
-
-    def test_get_flavor_from_deleted_with_id_of_deleted(self):
-        # Verify the legacy behavior of instance_type_id pointing to a
-        # missing type being non-fatal
-        inst_without_sys_meta = dict(self.baseinst, system_metadata=[],
-                                     deleted=1, instance_type_id=2)
-        flavor = self.controller._get_flavor(self.context, self.compute_api,
-                                             inst_without_sys_meta, {})
-        self.assertIsNone(flavor)
@@ -132,6 +132,23 @@ class RequestTest(test.NoDBTestCase):
                  'id1': compute_nodes[1],
                  'id2': compute_nodes[2]})
 
+    def test_prefetch_db_items(self):
+        request = wsgi.Request.blank('/foo')
+        calls = []
+
+        def fetch(item_keys):
+            calls.append(item_keys)
+            return dict((item_key, [item_key]) for item_key in item_keys)
+
+        items = request.prefetch_db_items('things', ['a', 'b'], fetch)
+        self.assertEqual({'a': ['a'], 'b': ['b']}, items)
+        # Only the items which were not stored yet are fetched.
+        items = request.prefetch_db_items('things', ['b', 'c'], fetch)
+        self.assertEqual({'a': ['a'], 'b': ['b'], 'c': ['c']}, items)
+        request.prefetch_db_items('things', ['a', 'c'], fetch)
+        self.assertEqual([['a', 'b'], ['c']], calls)
+        self.assertEqual(['b'], request.get_db_item('things', 'b'))
+
     def test_from_request(self):
         self.stubs.Set(gettextutils, 'get_available_languages',
                        fakes.fake_get_available_languages)
@@ -15,6 +15,8 @@
 Tests For Cells Messaging module
 """
 
+import functools
+
 from oslo.config import cfg
 
 from nova.cells import messaging
@@ -56,6 +58,19 @@ class CellsMessageClassesTestCase(test.TestCase):
         self.msg_runner = fakes.get_message_runner(self.our_name)
         self.state_manager = self.msg_runner.state_manager
 
+    def test_dict_delta(self):
+        old = {'ram_free': {'total_mb': 10, 'units_by_mb': {'512': 2}},
+               'disk_free': {'total_mb': 20}}
+        new = {'ram_free': {'total_mb': 8, 'units_by_mb': {'512': 2,
+                                                           '1024': 1}},
+               'disk_free': {'total_mb': 20}}
+        self.assertEqual({'ram_free': {'total_mb': 8,
+                                       'units_by_mb': {'1024': 1}}},
+                         messaging._dict_delta(old, new))
+        self.assertEqual({}, messaging._dict_delta(new, new))
+        # Removed keys need a full update
+        self.assertIsNone(messaging._dict_delta(new, old))
+
     def test_reverse_path(self):
         path = 'a!b!c!d'
         expected = 'd!c!b!a'
@@ -818,6 +833,67 @@ class CellsTargetedMethodsTestCase(test.TestCase):
 
         self.src_msg_runner.tell_parents_our_capacities(self.ctxt)
 
+    def _run_spawn_after(self, calls):
+        def fake_spawn_after(seconds, func, *args, **kwargs):
+            calls.append(seconds)
+            self.spawned.append(functools.partial(func, *args, **kwargs))
+
+        self.spawned = []
+        self.stubs.Set(messaging.greenthread, 'spawn_after',
+                       fake_spawn_after)
+
+    def test_update_capacities_coalesced(self):
+        self.flags(batch_window=0.5, group='cells')
+        self._setup_attrs('child-cell2', 'child-cell2!api-cell')
+        calls = []
+        self._run_spawn_after(calls)
+        self.mox.StubOutWithMock(self.src_state_manager,
+                                 'get_our_capacities')
+        self.mox.StubOutWithMock(self.tgt_state_manager,
+                                 'update_cell_capacities')
+        self.mox.StubOutWithMock(self.tgt_msg_runner,
+                                 'tell_parents_our_capacities')
+        self.src_state_manager.get_our_capacities().AndReturn('fake_capacs')
+        self.tgt_state_manager.update_cell_capacities('child-cell2',
+                                                      'fake_capacs')
+        self.tgt_msg_runner.tell_parents_our_capacities(self.ctxt)
+
+        self.mox.ReplayAll()
+
+        for i in xrange(3):
+            self.src_msg_runner.tell_parents_our_capacities(self.ctxt)
+        self.assertEqual([0.5], calls)
+        self.assertEqual(2, self.src_msg_runner.stats[
+                'coalesced_parent_updates'])
+        self.spawned[0]()
+
+    def test_update_capacity_deltas(self):
+        self.flags(batch_window=0.5, group='cells')
+        self._setup_attrs('child-cell2', 'child-cell2!api-cell')
+        self._run_spawn_after([])
+        capacs = {'ram_free': {'total_mb': 10, 'units_by_mb': {'512': 2}},
+                  'disk_free': {'total_mb': 20}}
+        new_capacs = {'ram_free': {'total_mb': 8, 'units_by_mb': {'512': 2}},
+                      'disk_free': {'total_mb': 20}}
+        self.mox.StubOutWithMock(self.src_state_manager,
+                                 'get_our_capacities')
+        self.mox.StubOutWithMock(self.tgt_msg_runner,
+                                 'tell_parents_our_capacities')
+        self.src_state_manager.get_our_capacities().AndReturn(capacs)
+        self.tgt_msg_runner.tell_parents_our_capacities(self.ctxt)
+        self.src_state_manager.get_our_capacities().AndReturn(new_capacs)
+        self.tgt_msg_runner.tell_parents_our_capacities(self.ctxt)
+
+        self.mox.ReplayAll()
+
+        self.src_msg_runner.tell_parents_our_capacities(self.ctxt)
+        self.spawned.pop()()
+        self.src_msg_runner.tell_parents_our_capacities(self.ctxt)
+        self.spawned.pop()()
+        self.assertEqual(1, self.src_msg_runner.stats['capacity_deltas'])
+        cell = self.tgt_state_manager.child_cells['child-cell2']
+        self.assertEqual(new_capacs, cell.capacities)
+
     def test_announce_capabilities(self):
         self._setup_attrs('api-cell', 'api-cell!child-cell1')
         # To make this easier to test, make us only have 1 child cell.
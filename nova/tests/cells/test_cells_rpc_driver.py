@@ -16,13 +16,16 @@
 Tests For Cells RPC Communication Driver
 """
 
+import base64
 import urlparse
+import zlib
 
 from oslo.config import cfg
 
 from nova.cells import messaging
 from nova.cells import rpc_driver
 from nova import context
+from nova.openstack.common import jsonutils
 from nova.openstack.common import rpc
 from nova.openstack.common.rpc import dispatcher as rpc_dispatcher
 from nova import test
@@ -196,6 +199,151 @@ class CellsRPCDriverTestCase(test.NoDBTestCase):
         self.assertEqual('cells.intercell42.fake-message-type',
                          call_info['topic'])
 
+    def _stub_batches(self):
+        sent = []
+        spawned = []
+
+        def _fake_send_json_message(cell_state, ctxt, message_type, fanout,
+                                    json_message):
+            sent.append((cell_state.name, message_type, fanout,
+                         [json_message]))
+
+        def _fake_send_messages(cell_state, ctxt, message_type, fanout,
+                                json_messages):
+            sent.append((cell_state.name, message_type, fanout,
+                         json_messages))
+            return 42
+
+        def _fake_spawn_after(seconds, func, *args):
+            self.assertEqual(0.5, seconds)
+            spawned.append(lambda: func(*args))
+
+        self.stubs.Set(self.driver.intercell_rpcapi,
+                       'send_json_message_to_cell', _fake_send_json_message)
+        self.stubs.Set(self.driver.intercell_rpcapi, 'send_messages_to_cell',
+                       _fake_send_messages)
+        self.stubs.Set(rpc_driver.greenthread, 'spawn_after',
+                       _fake_spawn_after)
+        return sent, spawned
+
+    def test_send_message_to_cell_batched(self):
+        self.flags(batch_window=0.5, group='cells')
+        sent, spawned = self._stub_batches()
+        msg_runner = fakes.get_message_runner('api-cell')
+        cell_state = fakes.get_cell_state('api-cell', 'child-cell2')
+        messages = [messaging._BroadcastMessage(msg_runner, self.ctxt,
+                                                'fake%d' % i, {}, 'up')
+                    for i in xrange(3)]
+        for message in messages:
+            self.driver.send_message_to_cell(cell_state, message)
+        self.assertEqual([], sent)
+        self.assertEqual(1, len(spawned))
+
+        spawned[0]()
+        self.assertEqual([('child-cell2', 'broadcast', False,
+                           [message.to_json() for message in messages])],
+                         sent)
+        self.assertEqual({'messages': 3, 'casts': 1, 'bytes': 42},
+                         self.driver.stats)
+
+    def test_send_message_to_cell_waiting_for_response_not_batched(self):
+        self.flags(batch_window=0.5, group='cells')
+        sent, spawned = self._stub_batches()
+        msg_runner = fakes.get_message_runner('api-cell')
+        cell_state = fakes.get_cell_state('api-cell', 'child-cell2')
+        broadcast = messaging._BroadcastMessage(msg_runner, self.ctxt,
+                                                'fake', {}, 'up')
+        call = messaging._TargetedMessage(msg_runner, self.ctxt, 'fake', {},
+                                          'down', cell_state,
+                                          need_response=True)
+        self.driver.send_message_to_cell(cell_state, broadcast)
+        self.driver.send_message_to_cell(cell_state, call)
+        # The queued message is sent first
+        self.assertEqual([('child-cell2', 'broadcast', False,
+                           [broadcast.to_json()]),
+                          ('child-cell2', 'targeted', False,
+                           [call.to_json()])], sent)
+        spawned[0]()
+        self.assertEqual(2, len(sent))
+
+    def test_send_message_to_cell_batched_by_cell(self):
+        self.flags(batch_window=0.5, group='cells')
+        sent, spawned = self._stub_batches()
+        msg_runner = fakes.get_message_runner('api-cell')
+        cell_state1 = fakes.get_cell_state('api-cell', 'child-cell1')
+        cell_state2 = fakes.get_cell_state('api-cell', 'child-cell2')
+        broadcast1 = messaging._BroadcastMessage(msg_runner, self.ctxt,
+                                                 'fake1', {}, 'down')
+        broadcast2 = messaging._BroadcastMessage(msg_runner, self.ctxt,
+                                                 'fake2', {}, 'down')
+        call = messaging._TargetedMessage(msg_runner, self.ctxt, 'fake', {},
+                                          'down', cell_state2,
+                                          need_response=True)
+        self.driver.send_message_to_cell(cell_state1, broadcast1)
+        self.driver.send_message_to_cell(cell_state2, broadcast1)
+        self.driver.send_message_to_cell(cell_state2, broadcast2)
+        self.assertEqual([], sent)
+        self.assertEqual(2, len(spawned))
+
+        # Only the batch of the cell waiting for a response is sent
+        self.driver.send_message_to_cell(cell_state2, call)
+        self.assertEqual([('child-cell2', 'broadcast', False,
+                           [broadcast1.to_json(), broadcast2.to_json()]),
+                          ('child-cell2', 'targeted', False,
+                           [call.to_json()])], sent)
+
+        for send_batch in spawned:
+            send_batch()
+        self.assertEqual(('child-cell1', 'broadcast', False,
+                          [broadcast1.to_json()]), sent[2])
+        self.assertEqual(3, len(sent))
+
+    def test_send_messages_to_cell_compressed(self):
+        self.flags(rpc_driver_compress_threshold=100, group='cells')
+        cell_state = fakes.get_cell_state('api-cell', 'child-cell2')
+        json_messages = ['{"fake": "%s"}' % ('x' * 100)] * 10
+        call_info = {}
+
+        def _fake_make_msg(method, namespace, **kwargs):
+            call_info['rpc_method'] = method
+            call_info['rpc_kwargs'] = kwargs
+            return 'fake-message'
+
+        def _fake_cast_to_server(*args, **kwargs):
+            call_info['cast_kwargs'] = kwargs
+
+        self.stubs.Set(self.driver.intercell_rpcapi, 'make_namespaced_msg',
+                       _fake_make_msg)
+        self.stubs.Set(self.driver.intercell_rpcapi, 'cast_to_server',
+                       _fake_cast_to_server)
+
+        num_bytes = self.driver.intercell_rpcapi.send_messages_to_cell(
+                cell_state, self.ctxt, 'broadcast', False, json_messages)
+        rpc_kwargs = call_info['rpc_kwargs']
+        self.assertEqual('process_messages', call_info['rpc_method'])
+        self.assertEqual({'topic': 'cells.intercell.broadcast',
+                          'version': '1.1'}, call_info['cast_kwargs'])
+        self.assertTrue(rpc_kwargs['compressed'])
+        self.assertEqual(len(rpc_kwargs['messages']), num_bytes)
+        self.assertTrue(num_bytes < len(jsonutils.dumps(json_messages)))
+        self.assertEqual(json_messages, jsonutils.loads(zlib.decompress(
+                base64.b64decode(rpc_kwargs['messages']))))
+
+    def test_process_messages(self):
+        msg_runner = fakes.get_message_runner('api-cell')
+        dispatcher = rpc_driver.InterCellRPCDispatcher(msg_runner)
+        processed = []
+
+        def _fake_process_message(_ctxt, message):
+            processed.append(message)
+
+        self.stubs.Set(dispatcher, 'process_message', _fake_process_message)
+        json_messages = ['{"fake": 1}', '{"fake": 2}']
+        dispatcher.process_messages(self.ctxt, base64.b64encode(
+                zlib.compress(jsonutils.dumps(json_messages))),
+                compressed=True)
+        self.assertEqual(json_messages, processed)
+
     def test_process_message(self):
         msg_runner = fakes.get_message_runner('api-cell')
         dispatcher = rpc_driver.InterCellRPCDispatcher(msg_runner)
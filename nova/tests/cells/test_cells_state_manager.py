@@ -15,6 +15,7 @@
 """
 Tests For CellStateManager
 """
+import datetime
 
 from oslo.config import cfg
 
@@ -22,6 +23,7 @@ from nova.cells import state
 from nova import db
 from nova.db.sqlalchemy import models
 from nova import exception
+from nova.openstack.common import timeutils
 from nova import test
 
 
@@ -38,16 +40,20 @@ FAKE_ITYPES = [
 ]
 
 
-def _fake_compute_node_get_all(context):
-    def _node(host, total_mem, total_disk, free_mem, free_disk):
-        service = {'host': host, 'disabled': False}
-        return {'service': service,
-                'memory_mb': total_mem,
-                'local_gb': total_disk,
-                'free_ram_mb': free_mem,
-                'free_disk_gb': free_disk}
+def _fake_compute_node(compute_id, host, total_mem, total_disk, free_mem,
+                       free_disk):
+    service = {'host': host, 'disabled': False}
+    return {'id': compute_id,
+            'service': service,
+            'memory_mb': total_mem,
+            'local_gb': total_disk,
+            'free_ram_mb': free_mem,
+            'free_disk_gb': free_disk}
 
-    return [_node(*fake) for fake in FAKE_COMPUTES]
+
+def _fake_compute_node_get_all(context, updated_since=None):
+    return [_fake_compute_node(i + 1, *fake)
+            for i, fake in enumerate(FAKE_COMPUTES)]
 
 
 def _fake_instance_type_all(context):
@@ -130,6 +136,82 @@ class TestCellsStateManager(test.TestCase):
         units = 2  # 2 on host 3
         self.assertEqual(units, cap['disk_free']['units_by_mb'][str(sz)])
 
+    def _stub_changed_compute_nodes(self, changed_nodes):
+        calls = []
+
+        def _fake_get_all(context, **kwargs):
+            calls.append(kwargs)
+            if 'updated_since' not in kwargs:
+                return _fake_compute_node_get_all(context)
+            return changed_nodes
+
+        self.stubs.Set(db, 'compute_node_get_all', _fake_get_all)
+        return calls
+
+    def test_capacity_incremental(self):
+        self.flags(incremental_capacity=True, group='cells')
+        state_manager = self._get_state_manager()
+        updated_at = datetime.datetime(2013, 1, 1)
+        # host3 got an instance, host4 was disabled, host1 was deleted
+        host3 = _fake_compute_node(3, 'host3', 1024, 100, 512, 50)
+        host3['updated_at'] = updated_at
+        host4 = _fake_compute_node(4, 'host4', 1024, 100, 300, 30)
+        host4['service']['disabled'] = True
+        host1 = _fake_compute_node(1, 'host1', 1024, 100, 0, 0)
+        host1['deleted'] = 1
+        calls = self._stub_changed_compute_nodes([host3, host4, host1])
+
+        state_manager._update_our_capacity()
+        state_manager._update_our_capacity()
+        self.assertEqual([{'updated_since': None},
+                          {'updated_since': updated_at}], calls)
+
+        cap = state_manager.get_my_state().capacities
+        self.assertEqual(511, cap['ram_free']['total_mb'])
+        self.assertEqual(49 * 1024, cap['disk_free']['total_mb'])
+        self.assertEqual(10, cap['ram_free']['units_by_mb']['50'])
+        self.assertEqual(2, cap['disk_free']['units_by_mb'][str(25 * 1024)])
+
+        # The full recompute agrees with the incremental updates.
+        def _fake_get_all(context, updated_since=None):
+            return [_fake_compute_node(2, 'host2', 1024, 100, -1, -1), host3]
+
+        self.stubs.Set(db, 'compute_node_get_all', _fake_get_all)
+        state_manager.last_full_capacity_update = None
+        state_manager._update_our_capacity()
+        self.assertEqual(cap, state_manager.get_my_state().capacities)
+
+    def test_capacity_incremental_full_refresh(self):
+        self.flags(incremental_capacity=True,
+                   capacity_full_refresh_interval=600, group='cells')
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        state_manager = self._get_state_manager()
+        calls = self._stub_changed_compute_nodes([])
+
+        state_manager._update_our_capacity()
+        timeutils.advance_time_seconds(601)
+        state_manager._update_our_capacity()
+        state_manager._update_our_capacity()
+        # A full recompute is also done when the reserve changes.
+        self.flags(reserve_percent=50.0, group='cells')
+        state_manager._update_our_capacity()
+        self.assertEqual([{'updated_since': None}, {},
+                          {'updated_since': None}, {}], calls)
+
+    def test_capacity_incremental_flavor_change(self):
+        self.flags(incremental_capacity=True, group='cells')
+        state_manager = self._get_state_manager()
+        calls = self._stub_changed_compute_nodes(
+                [_fake_compute_node(3, 'host3', 1024, 100, 512, 50)])
+        FAKE_ITYPES.append((100, 0, 0))
+        self.addCleanup(FAKE_ITYPES.pop)
+
+        state_manager._update_our_capacity()
+        self.assertEqual([{'updated_since': None}, {}], calls)
+        cap = state_manager.get_my_state().capacities
+        self.assertEqual(10 + 3, cap['ram_free']['units_by_mb']['100'])
+
     def _get_state_manager(self, reserve_percent=0.0):
         self.flags(reserve_percent=reserve_percent, group='cells')
         return state.CellStateManager()
@@ -5930,32 +5930,50 @@ class ComputeTestCase(BaseTestCase):
 
     def test_sync_power_states(self):
         ctxt = self.context.elevated()
-        self._create_fake_instance({'host': self.compute.host})
-        self._create_fake_instance({'host': self.compute.host})
-        self._create_fake_instance({'host': self.compute.host})
-        self.mox.StubOutWithMock(self.compute.driver, 'get_info')
+        params = {'host': self.compute.host,
+                  'power_state': power_state.RUNNING}
+        missing = self._create_fake_instance(params)
+        running = self._create_fake_instance(params)
+        stopped = self._create_fake_instance(params)
+        self.mox.StubOutWithMock(self.compute.driver, 'get_info_many')
         self.mox.StubOutWithMock(self.compute, '_sync_instance_power_state')
 
+        self.compute.driver.get_info_many(mox.IgnoreArg()).AndReturn(
+            {running['uuid']: {'state': power_state.RUNNING},
+             stopped['uuid']: {'state': power_state.SHUTDOWN}})
         # Check to make sure task continues on error.
-        self.compute.driver.get_info(mox.IgnoreArg()).AndRaise(
+        self.compute._sync_instance_power_state(ctxt,
+                mox.ContainsKeyValue('uuid', missing['uuid']),
+                power_state.NOSTATE, use_slave=True).AndRaise(
             exception.InstanceNotFound(instance_id='fake-uuid'))
-        self.compute._sync_instance_power_state(ctxt, mox.IgnoreArg(),
-                                                power_state.NOSTATE).AndRaise(
-            exception.InstanceNotFound(instance_id='fake-uuid'))
-
-        self.compute.driver.get_info(mox.IgnoreArg()).AndReturn(
-            {'state': power_state.RUNNING})
-        self.compute._sync_instance_power_state(ctxt, mox.IgnoreArg(),
-                                                power_state.RUNNING,
-                                                use_slave=True)
-        self.compute.driver.get_info(mox.IgnoreArg()).AndReturn(
-            {'state': power_state.SHUTDOWN})
-        self.compute._sync_instance_power_state(ctxt, mox.IgnoreArg(),
-                                                power_state.SHUTDOWN,
-                                                use_slave=True)
+        # The running instance is in sync and skipped.
+        self.compute._sync_instance_power_state(ctxt,
+                mox.ContainsKeyValue('uuid', stopped['uuid']),
+                power_state.SHUTDOWN, use_slave=True)
         self.mox.ReplayAll()
         self.compute._sync_power_states(ctxt)
 
+    def test_power_state_in_sync(self):
+        def _in_sync(vm_state, db_power_state, vm_power_state):
+            instance = {'vm_state': vm_state, 'power_state': db_power_state}
+            return self.compute._power_state_in_sync(instance,
+                                                     vm_power_state)
+
+        self.assertTrue(_in_sync(vm_states.ACTIVE, power_state.RUNNING,
+                                 power_state.RUNNING))
+        self.assertFalse(_in_sync(vm_states.ACTIVE, power_state.RUNNING,
+                                  power_state.SHUTDOWN))
+        self.assertFalse(_in_sync(vm_states.ACTIVE, power_state.PAUSED,
+                                  power_state.PAUSED))
+        self.assertTrue(_in_sync(vm_states.STOPPED, power_state.SHUTDOWN,
+                                 power_state.SHUTDOWN))
+        self.assertFalse(_in_sync(vm_states.STOPPED, power_state.RUNNING,
+                                  power_state.RUNNING))
+        self.assertTrue(_in_sync(vm_states.DELETED, power_state.NOSTATE,
+                                 power_state.NOSTATE))
+        self.assertTrue(_in_sync(vm_states.PAUSED, power_state.PAUSED,
+                                 power_state.PAUSED))
+
     def _test_lifecycle_event(self, lifecycle_event, power_state):
         instance = self._create_fake_instance()
         uuid = instance['uuid']
@@ -5989,6 +6007,128 @@ class ComputeTestCase(BaseTestCase):
                 event.EVENT_LIFECYCLE_STOPPED)
         self.compute.handle_events(event_instance)
 
+    def test_lifecycle_events_coalesced(self):
+        self.flags(sync_power_state_on_events=True,
+                   sync_power_state_event_delay=5.0)
+        instance = self._create_fake_instance()
+        uuid = instance['uuid']
+        spawned = []
+
+        def fake_spawn_after(seconds, func, *args):
+            spawned.append((seconds, func, args))
+
+        self.stubs.Set(compute_manager.greenthread, 'spawn_after',
+                       fake_spawn_after)
+        now = [100]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        self.mox.StubOutWithMock(self.compute, '_sync_instance_power_state')
+        self.compute._sync_instance_power_state(
+            mox.IgnoreArg(), mox.ContainsKeyValue('uuid', uuid),
+            power_state.RUNNING)
+        self.mox.ReplayAll()
+
+        self.compute.handle_events(
+            event.LifecycleEvent(uuid, event.EVENT_LIFECYCLE_STOPPED))
+        now[0] = 102
+        self.compute.handle_events(
+            event.LifecycleEvent(uuid, event.EVENT_LIFECYCLE_STARTED))
+        # A single sync is queued for both events.
+        self.assertEqual([(5.0, self.compute._sync_queued_power_state,
+                           (uuid,))], spawned)
+        # The power state changed 3 seconds ago, wait 2 more seconds.
+        now[0] = 105
+        spawned.pop()[1](uuid)
+        self.assertEqual([(2.0, self.compute._sync_queued_power_state,
+                           (uuid,))], spawned)
+        now[0] = 107
+        spawned.pop()[1](uuid)
+        self.assertEqual([], spawned)
+        self.assertEqual({}, self.compute._power_state_events)
+        self.assertEqual(power_state.RUNNING,
+                         self.compute._vm_power_states[uuid])
+
+    def test_queued_power_state_sync_non_existent_instance(self):
+        self.flags(sync_power_state_on_events=True,
+                   sync_power_state_event_delay=0)
+        self.stubs.Set(compute_manager.greenthread, 'spawn_after',
+                       lambda seconds, func, *args: func(*args))
+        self.compute.handle_events(event.LifecycleEvent(
+            'does-not-exist', event.EVENT_LIFECYCLE_STOPPED))
+        self.assertEqual({}, self.compute._power_state_events)
+        self.assertEqual({}, self.compute._vm_power_states)
+
+    def test_sync_power_states_on_events(self):
+        self.flags(sync_power_state_on_events=True,
+                   sync_power_state_full_interval=3600)
+        ctxt = self.context.elevated()
+        instance = self._create_fake_instance(
+            {'host': self.compute.host, 'power_state': power_state.RUNNING})
+        now = [10000]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        self.mox.StubOutWithMock(self.compute.driver, 'get_info_many')
+        self.compute.driver.get_info_many(mox.IgnoreArg()).AndReturn(
+            {instance['uuid']: {'state': power_state.RUNNING}})
+        self.mox.ReplayAll()
+
+        self.compute._sync_power_states(ctxt)
+        self.assertEqual({instance['uuid']: power_state.RUNNING},
+                         self.compute._vm_power_states)
+        # The next full sync is not due yet.
+        now[0] += 3599
+        self.compute._sync_power_states(ctxt)
+
+    def test_get_popular_images(self):
+        self.flags(image_prefetch_window=3600)
+        ctxt = self.context.elevated()
+        self.mox.StubOutWithMock(self.compute.conductor_api,
+                                 'instance_get_popular_image_refs')
+        self.compute.conductor_api.instance_get_popular_image_refs(
+            ctxt, 3600, 4).AndReturn(['image-b', 'image-a'])
+        self.mox.ReplayAll()
+
+        self.assertEqual(['image-b', 'image-a'],
+                         self.compute._get_popular_images(ctxt, 4))
+
+    def _test_prefetch_popular_images(self, sizes, expected):
+        self.flags(image_prefetch_interval=600, image_prefetch_count=2,
+                   image_prefetch_disk_budget_gb=2)
+        ctxt = self.context.elevated()
+
+        def fake_get_image_meta(context, image_ref):
+            if sizes[image_ref] is None:
+                raise exception.ImageNotFound(image_id=image_ref)
+            return {'id': image_ref, 'size': sizes[image_ref]}
+
+        self.stubs.Set(compute_manager, '_get_image_meta',
+                       fake_get_image_meta)
+        self.mox.StubOutWithMock(self.compute, '_get_popular_images')
+        self.mox.StubOutWithMock(self.compute.driver, 'prefetch_images')
+        self.compute._get_popular_images(ctxt, 4).AndReturn(
+            sorted(sizes, key=lambda image_ref: sizes[image_ref] or 0))
+        self.compute.driver.prefetch_images(ctxt, expected).AndReturn(
+            expected)
+        self.mox.ReplayAll()
+
+        self.compute._prefetch_popular_images(ctxt)
+
+    def test_prefetch_popular_images(self):
+        self._test_prefetch_popular_images(
+            {'image-a': 1, 'image-b': 2, 'image-c': 3},
+            ['image-a', 'image-b'])
+
+    def test_prefetch_popular_images_budget(self):
+        self._test_prefetch_popular_images(
+            {'image-a': None, 'image-b': 3 * 1024 ** 3,
+             'image-c': 4 * 1024 ** 3, 'image-d': 1024 ** 3},
+            ['image-d'])
+
+    def test_prefetch_popular_images_disabled(self):
+        self.flags(image_prefetch_interval=0)
+        self.mox.StubOutWithMock(self.compute, '_get_popular_images')
+        self.mox.ReplayAll()
+
+        self.compute._prefetch_popular_images(self.context.elevated())
+
     def test_allow_confirm_resize_on_instance_in_deleting_task_state(self):
         instance = self._create_fake_instance_obj()
         old_type = flavors.extract_flavor(instance)
@@ -8488,6 +8628,22 @@ class ComputeAPITestCase(BaseTestCase):
         self.assertEqual(expected,
                          self.compute_api.get_instance_bdms({}, instance))
 
+    def test_get_instances_bdms_default(self):
+        new_bdm = object()
+        legacy_bdm = object()
+
+        self.mox.StubOutWithMock(self.compute_api.db,
+                       'block_device_mapping_get_by_instance_uuids')
+        self.compute_api.db.block_device_mapping_get_by_instance_uuids(
+                {}, ['fake-instance']).AndReturn({'fake-instance': new_bdm})
+        self.mox.StubOutWithMock(block_device, 'legacy_mapping')
+        block_device.legacy_mapping(new_bdm).AndReturn(legacy_bdm)
+        self.mox.ReplayAll()
+
+        self.assertEqual({'fake-instance': legacy_bdm},
+                         self.compute_api.get_instances_bdms(
+                             {}, ['fake-instance']))
+
 
 def fake_rpc_method(context, topic, msg, do_cast=True):
     pass
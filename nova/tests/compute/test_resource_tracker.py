@@ -521,6 +521,22 @@ class TrackerTestCase(BaseTrackerTestCase):
         self.assertEqual(0, self.tracker.compute_node['current_workload'])
         self._assert('{}', 'pci_stats')
 
+    def test_cached_images(self):
+        get_available_resource = self.tracker.driver.get_available_resource
+
+        def fake_get_available_resource(nodename):
+            resources = get_available_resource(nodename)
+            resources['cached_images'] = ['image-a', 'image-b']
+            return resources
+
+        self.stubs.Set(self.tracker.driver, 'get_available_resource',
+                       fake_get_available_resource)
+        self.tracker.update_available_resource(self.context)
+
+        self.assertEqual(1, self.tracker.stats['cached_image_image-a'])
+        self.assertEqual(1, self.tracker.stats['cached_image_image-b'])
+        self.assertNotIn('cached_images', self.tracker.compute_node)
+
 
 class TrackerPciStatsTestCase(BaseTrackerTestCase):
 
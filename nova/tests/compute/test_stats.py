@@ -189,6 +189,14 @@ class StatsTestCase(test.NoDBTestCase):
         self.stats.update_stats_for_instance(instance)
         self.assertEqual(2, self.stats["io_workload"])
 
+    def test_update_cached_images(self):
+        self.stats.update_cached_images(['image-a', 'image-b'])
+        self.stats.update_cached_images(['image-b', 'image-c'])
+
+        self.assertNotIn('cached_image_image-a', self.stats)
+        self.assertEqual(1, self.stats['cached_image_image-b'])
+        self.assertEqual(1, self.stats['cached_image_image-c'])
+
     def test_clear(self):
         instance = self._create_instance()
         self.stats.update_stats_for_instance(instance)
@@ -262,6 +262,15 @@ class _BaseTestCase(object):
         self.conductor.instance_get_active_by_window_joined(
             self.context, 'fake-begin', 'fake-end', 'fake-proj', 'fake-host')
 
+    def test_instance_get_popular_image_refs(self):
+        self.mox.StubOutWithMock(db, 'instance_get_popular_image_refs')
+        db.instance_get_popular_image_refs(self.context, 3600, 10).AndReturn(
+            ['fake-image'])
+        self.mox.ReplayAll()
+        result = self.conductor.instance_get_popular_image_refs(
+            self.context, 3600, 10)
+        self.assertEqual(['fake-image'], result)
+
     def test_instance_destroy(self):
         self.mox.StubOutWithMock(db, 'instance_destroy')
         db.instance_destroy(self.context, 'fake-uuid').AndReturn('fake-result')
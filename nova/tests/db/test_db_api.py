@@ -38,6 +38,7 @@ from sqlalchemy.orm import query
 from sqlalchemy.sql.expression import select
 
 from nova import block_device
+from nova.compute import flavors
 from nova.compute import vm_states
 from nova import context
 from nova import db
@@ -47,6 +48,7 @@ from nova.db.sqlalchemy import utils as db_utils
 from nova import exception
 from nova.openstack.common.db import exception as db_exc
 from nova.openstack.common.db.sqlalchemy import session as db_session
+from nova.openstack.common import jsonutils
 from nova.openstack.common import timeutils
 from nova.openstack.common import uuidutils
 from nova import quota
@@ -724,6 +726,23 @@ class SqlAlchemyDbApiTestCase(DbTestCase):
             ctxt, begin=now2, end=now3)
         self.assertEqual(2, len(result))
 
+    def test_regex_to_wildcards(self):
+        self.assertEqual([None, 'test', None],
+                         sqlalchemy_api._regex_to_wildcards('test'))
+        self.assertEqual(['test', None],
+                         sqlalchemy_api._regex_to_wildcards('^test'))
+        self.assertEqual(['10.0.1'],
+                         sqlalchemy_api._regex_to_wildcards('^10\\.0\\.1$'))
+        self.assertEqual(['a', None, 'b'],
+                         sqlalchemy_api._regex_to_wildcards('^a.*b$'))
+        self.assertEqual([None, '1'],
+                         sqlalchemy_api._regex_to_wildcards('.*1$'))
+
+    def test_regex_to_wildcards_not_simple(self):
+        for regex in ('t.st', 'te+st', '^test|foo', '\\d', 'te[s]t$',
+                      'test\\'):
+            self.assertIsNone(sqlalchemy_api._regex_to_wildcards(regex))
+
 
 class MigrationTestCase(test.TestCase):
 
@@ -1593,6 +1612,60 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
                                                 {'display_name': u'test'})
         self._assertEqualListsOfInstances([instance], result)
 
+    def test_instance_get_all_by_filters_simple_regex(self):
+        i1 = self.create_instance_with_args(display_name='test1')
+        i2 = self.create_instance_with_args(display_name='a[test]%_*')
+        self.create_instance_with_args(display_name='Test3')
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'display_name': '^test'})
+        self._assertEqualListsOfInstances([i1], result)
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'display_name': '^test$'})
+        self._assertEqualListsOfInstances([], result)
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'display_name': 'test'})
+        self._assertEqualListsOfInstances([i1, i2], result)
+        result = db.instance_get_all_by_filters(self.ctxt,
+                {'display_name': '\\[test\\]%_\\*$'})
+        self._assertEqualListsOfInstances([i2], result)
+
+    def _network_info(self, *addresses):
+        ips = [{'address': address} for address in addresses]
+        return jsonutils.dumps([{'network': {'subnets': [{'ips': ips}]}}])
+
+    def test_instance_get_all_by_filters_ip(self):
+        i1 = self.create_instance_with_args()
+        i2 = self.create_instance_with_args()
+        db.instance_info_cache_update(self.ctxt, i1['uuid'],
+                {'network_info': self._network_info('10.0.0.1', 'fe80::1')})
+        db.instance_info_cache_update(self.ctxt, i2['uuid'],
+                {'network_info': self._network_info('10.0.0.12')})
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'ip': '10\\.0\\.0\\.1$'})
+        self._assertEqualListsOfInstances([i1], result)
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'ip': '10.0.0.1'})
+        self._assertEqualListsOfInstances([i1, i2], result)
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'ip': '0\\.0'})
+        self._assertEqualListsOfInstances([], result)
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'ip6': 'fe80:'})
+        self._assertEqualListsOfInstances([i1], result)
+
+    def test_instance_get_all_by_filters_ip_updated(self):
+        instance = self.create_instance_with_args()
+        db.instance_info_cache_update(self.ctxt, instance['uuid'],
+                {'network_info': self._network_info('10.0.0.1')})
+        db.instance_info_cache_update(self.ctxt, instance['uuid'],
+                {'network_info': self._network_info('10.0.0.2')})
+        result = db.instance_get_all_by_filters(self.ctxt,
+                                                {'ip': '10.0.0.1'})
+        self._assertEqualListsOfInstances([], result)
+        db.instance_destroy(self.ctxt, instance['uuid'])
+        self.assertEqual([], sqlalchemy_api.model_query(self.ctxt,
+                models.InstanceIpAddress, read_deleted='yes').all())
+
     def test_instance_get_all_by_filters_tags(self):
         instance = self.create_instance_with_args(
             metadata={'foo': 'bar'})
@@ -1755,6 +1828,26 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
         results = db.instance_get_all_hung_in_rebooting(self.ctxt, 10)
         self.assertEqual([], results)
 
+    def test_instance_get_popular_image_refs(self):
+        for image_ref in ['image-a', 'image-b', 'image-b', 'image-c', '']:
+            self.create_instance_with_args(image_ref=image_ref)
+        old = timeutils.utcnow() - datetime.timedelta(seconds=7200)
+        for i in range(3):
+            self.create_instance_with_args(image_ref='image-old',
+                                           created_at=old)
+        deleted = self.create_instance_with_args(image_ref='image-c')
+        db.instance_destroy(self.ctxt, deleted['uuid'])
+
+        self.assertEqual(['image-b', 'image-c', 'image-a'],
+                         db.instance_get_popular_image_refs(self.ctxt,
+                                                            3600, 10))
+        self.assertEqual(['image-b', 'image-c'],
+                         db.instance_get_popular_image_refs(self.ctxt,
+                                                            3600, 2))
+        self.assertEqual(['image-old', 'image-b'],
+                         db.instance_get_popular_image_refs(self.ctxt,
+                                                            10800, 2))
+
     def test_instance_update_with_expected_vm_state(self):
         instance = self.create_instance_with_args(vm_state='foo')
         db.instance_update(self.ctxt, instance['uuid'], {'host': 'h1',
@@ -1988,6 +2081,166 @@ class InstanceTestCase(test.TestCase, ModelsObjectComparatorMixin):
                           db.instance_destroy, ctxt, instance['uuid'])
 
 
+class InstanceFastPathTestCase(InstanceTestCase):
+
+    """Runs the db.api.instance_* tests with instance_list_fast_path."""
+
+    def setUp(self):
+        super(InstanceFastPathTestCase, self).setUp()
+        self.flags(instance_list_fast_path=True)
+
+    def _get_all_both_ways(self, *args, **kwargs):
+        self.flags(instance_list_fast_path=False)
+        expected = db.instance_get_all_by_filters(self.ctxt, *args, **kwargs)
+        self.flags(instance_list_fast_path=True)
+        result = db.instance_get_all_by_filters(self.ctxt, *args, **kwargs)
+        return expected, result
+
+    def test_instance_get_all_by_filters_same_as_orm(self):
+        group = db.security_group_create(self.ctxt, {'name': 'group1',
+                                                     'project_id': 'project1'})
+        instances = [self.create_instance_with_args() for i in range(3)]
+        db.instance_add_security_group(self.ctxt, instances[0]['uuid'],
+                                       group['id'])
+        db.instance_destroy(self.ctxt, instances[1]['uuid'])
+
+        expected, result = self._get_all_both_ways({}, sort_dir='asc')
+        self.assertEqual(3, len(result))
+        self.assertEqual(['group1'],
+                         [g['name'] for g in result[0]['security_groups']])
+        self.assertEqual([], result[1]['security_groups'])
+        for inst, expected_inst in zip(result, expected):
+            self.assertIsInstance(inst['info_cache'], dict)
+            self._assertEqualObjects(inst, expected_inst,
+                    ignored_keys=['metadata', 'system_metadata',
+                                  'info_cache', 'security_groups'])
+            self._assertEqualObjects(inst['info_cache'],
+                                     expected_inst['info_cache'])
+            self._assertEqualListsOfObjects(inst['security_groups'],
+                                            expected_inst['security_groups'],
+                                            ignored_keys=['instances'])
+            self.assertEqual(utils.metadata_to_dict(inst['metadata']),
+                    utils.metadata_to_dict(expected_inst['metadata']))
+
+    def test_instance_get_all_by_filters_paginate(self):
+        instances = [self.create_instance_with_args() for i in range(5)]
+        for marker in [None] + [inst['uuid'] for inst in instances]:
+            expected, result = self._get_all_both_ways({}, 'created_at',
+                                                       'asc', limit=2,
+                                                       marker=marker,
+                                                       columns_to_join=[])
+            self.assertEqual([inst['uuid'] for inst in expected],
+                             [inst['uuid'] for inst in result])
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters, self.ctxt, {},
+                          marker=str(stdlib_uuid.uuid4()))
+
+
+class InstanceUsageTestCase(test.TestCase):
+
+    """Tests for db.api.instance_usage_* methods."""
+
+    def setUp(self):
+        super(InstanceUsageTestCase, self).setUp()
+        self.ctxt = context.RequestContext('fake', 'project1')
+        self.admin_ctxt = context.get_admin_context()
+        self.begin = datetime.datetime(2013, 10, 1, 0, 0, 0)
+        self.end = datetime.datetime(2013, 10, 2, 0, 0, 0)
+        self.flavor = db.flavor_create(self.admin_ctxt, {
+            'name': 'usage', 'flavorid': 'usage', 'memory_mb': 512,
+            'vcpus': 2, 'root_gb': 10, 'ephemeral_gb': 5, 'swap': 0,
+            'rxtx_factor': 1.0, 'vcpu_weight': None, 'disabled': False,
+            'is_public': True})
+
+    def _create_instance(self, launched_hours, terminated_hours=None,
+                         project_id='project1', flavor=None, **kwargs):
+        flavor = flavor or self.flavor
+        values = {'project_id': project_id,
+                  'instance_type_id': flavor['id'],
+                  'vm_state': vm_states.ACTIVE,
+                  'system_metadata': flavors.save_flavor_info({}, flavor),
+                  'launched_at': (self.begin +
+                                  datetime.timedelta(hours=launched_hours))}
+        if terminated_hours is not None:
+            values['terminated_at'] = (self.begin +
+                    datetime.timedelta(hours=terminated_hours))
+        values.update(kwargs)
+        return db.instance_create(self.admin_ctxt, values)
+
+    def _get_usages(self, project_id=None):
+        return dict((usage['uuid'], usage)
+                    for usage in db.instance_usage_get_by_window(
+                        self.ctxt, self.begin, self.end, project_id))
+
+    def test_usage_clamped_to_window(self):
+        running = self._create_instance(-12)
+        in_window = self._create_instance(1, 4.5)
+        self._create_instance(-12, -1)
+        self._create_instance(25)
+        self._create_instance(6, 30, project_id='project2')
+
+        usages = self._get_usages()
+        self.assertEqual(set([running['uuid'], in_window['uuid']]),
+                         set(usage['uuid'] for usage in usages.values()
+                             if usage['project_id'] == 'project1'))
+        self.assertEqual(24, usages[running['uuid']]['hours'])
+        self.assertEqual(3.5, usages[in_window['uuid']]['hours'])
+        self.assertEqual({'name': 'usage', 'memory_mb': 512, 'vcpus': 2,
+                          'root_gb': 10, 'ephemeral_gb': 5},
+                         usages[in_window['uuid']]['flavor'])
+        self.assertEqual(2, len(self._get_usages(project_id='project1')))
+
+    def test_totals(self):
+        self._create_instance(-12)
+        self._create_instance(1, 4.5)
+        self._create_instance(6, 30, project_id='project2')
+
+        totals = db.instance_usage_get_totals_by_window(
+            self.ctxt, self.begin, self.end)
+        totals = dict((total['project_id'], total) for total in totals)
+        self.assertEqual({'project_id': 'project1',
+                          'total_hours': 27.5,
+                          'total_vcpus_usage': 55.0,
+                          'total_memory_mb_usage': 14080.0,
+                          'total_local_gb_usage': 412.5},
+                         totals['project1'])
+        self.assertEqual(18, totals['project2']['total_hours'])
+
+        totals = db.instance_usage_get_totals_by_window(
+            self.ctxt, self.begin, self.end, project_id='project2')
+        self.assertEqual(['project2'],
+                         [total['project_id'] for total in totals])
+
+    def test_flavor_from_system_metadata(self):
+        flavor = dict(self.flavor, name='resized', vcpus=8)
+        instance = self._create_instance(
+            1, 2, system_metadata=flavors.save_flavor_info({}, flavor))
+        usage = self._get_usages()[instance['uuid']]
+        self.assertEqual('resized', usage['flavor']['name'])
+        self.assertEqual(8, usage['flavor']['vcpus'])
+
+    def test_flavor_of_deleted_instance_by_id(self):
+        # Deleted instances may not have their flavor in their system
+        # metadata, they get the one of their instance_type_id then.
+        instance = self._create_instance(1, 2, system_metadata={})
+        db.instance_destroy(self.admin_ctxt, instance['uuid'])
+        usage = self._get_usages()[instance['uuid']]
+        self.assertEqual('usage', usage['flavor']['name'])
+        self.assertEqual(512, usage['flavor']['memory_mb'])
+
+    def test_instances_without_flavor_left_out(self):
+        # A deleted instance with a deleted flavor, and an instance which
+        # is not deleted and has no flavor in its system metadata.
+        deleted = self._create_instance(1, 2, system_metadata={})
+        db.instance_destroy(self.admin_ctxt, deleted['uuid'])
+        db.flavor_destroy(self.admin_ctxt, self.flavor['name'])
+        self._create_instance(1, 2, system_metadata={})
+
+        self.assertEqual({}, self._get_usages())
+        self.assertEqual([], db.instance_usage_get_totals_by_window(
+            self.ctxt, self.begin, self.end))
+
+
 class InstanceMetadataTestCase(test.TestCase):
 
     """Tests for db.api.instance_metadata_* methods."""
@@ -4479,6 +4732,36 @@ class BlockDeviceMappingTestCase(test.TestCase):
         bmd = db.block_device_mapping_get_all_by_instance(self.ctxt, uuid2)
         self.assertEqual(len(bmd), 2)
 
+    def test_block_device_mapping_get_by_instance_uuids(self):
+        uuid1 = self.instance['uuid']
+        uuid2 = db.instance_create(self.ctxt, {})['uuid']
+        uuid3 = db.instance_create(self.ctxt, {})['uuid']
+
+        bmds_values = [{'instance_uuid': uuid1,
+                        'device_name': 'first'},
+                       {'instance_uuid': uuid2,
+                        'device_name': 'second'},
+                       {'instance_uuid': uuid2,
+                        'device_name': 'third'},
+                       {'instance_uuid': uuid3,
+                        'device_name': 'fourth'}]
+
+        for bdm in bmds_values:
+            self._create_bdm(bdm)
+
+        bdms = db.block_device_mapping_get_by_instance_uuids(
+            self.ctxt, [uuid1, uuid2, 'fake-uuid'])
+        self.assertEqual(set([uuid1, uuid2, 'fake-uuid']), set(bdms))
+        self.assertEqual(['first'],
+                         [bdm['device_name'] for bdm in bdms[uuid1]])
+        self.assertEqual(set(['second', 'third']),
+                         set(bdm['device_name'] for bdm in bdms[uuid2]))
+        self.assertEqual([], bdms['fake-uuid'])
+
+    def test_block_device_mapping_get_by_instance_uuids_empty(self):
+        self.assertEqual({}, db.block_device_mapping_get_by_instance_uuids(
+            self.ctxt, []))
+
     def test_block_device_mapping_destroy(self):
         bdm = self._create_bdm({})
         db.block_device_mapping_destroy(self.ctxt, bdm['id'])
@@ -5483,6 +5766,28 @@ class ComputeNodeTestCase(test.TestCase, ModelsObjectComparatorMixin):
         self._assertEqualListsOfObjects(expected, result,
                                         ignored_keys=['stats'])
 
+    def test_compute_node_get_all_updated_since(self):
+        past = timeutils.utcnow() - datetime.timedelta(hours=1)
+        future = timeutils.utcnow() + datetime.timedelta(hours=1)
+
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=past)
+        self.assertEqual(1, len(nodes))
+        self.assertEqual(self.item['id'], nodes[0]['id'])
+        self._stats_equal(self.stats, self._stats_as_dict(nodes[0]['stats']))
+
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=future)
+        self.assertEqual([], nodes)
+
+    def test_compute_node_get_all_updated_since_deleted(self):
+        since = timeutils.utcnow() - datetime.timedelta(hours=1)
+        db.compute_node_delete(self.ctxt, self.item['id'])
+
+        self.assertEqual([], db.compute_node_get_all(self.ctxt))
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=since)
+        self.assertEqual(1, len(nodes))
+        self.assertEqual(self.item['id'], nodes[0]['id'])
+        self.assertTrue(nodes[0]['deleted'])
+
     def test_compute_node_get(self):
         compute_node_id = self.item['id']
         node = db.compute_node_get(self.ctxt, compute_node_id)
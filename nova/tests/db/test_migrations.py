@@ -56,6 +56,7 @@ import sqlalchemy.exc
 import nova.db.sqlalchemy.migrate_repo
 from nova.db.sqlalchemy import utils as db_utils
 from nova.openstack.common.gettextutils import _
+from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import processutils
 from nova.openstack.common import timeutils
@@ -2458,6 +2459,51 @@ class TestNovaMigrations(BaseWalkMigrationTestCase, CommonTestsMixIn):
     def _post_downgrade_229(self, engine):
         self.assertColumnNotExists(engine, 'compute_nodes', 'extra_resources')
 
+    def _pre_upgrade_230(self, engine):
+        instances = db_utils.get_table(engine, 'instances')
+        info_caches = db_utils.get_table(engine, 'instance_info_caches')
+        network_info = jsonutils.dumps([{'network': {'subnets': [{'ips': [
+            {'address': '10.0.0.2',
+             'floating_ips': [{'address': '172.16.0.2'}]},
+            {'address': 'fe80::2'}]}]}}])
+        data = [
+            {'uuid': 'm230-uuid1', 'deleted': 0,
+             'network_info': network_info},
+            {'uuid': 'm230-uuid2', 'deleted': 0, 'network_info': None},
+            {'uuid': 'm230-uuid3', 'deleted': 1,
+             'network_info': network_info},
+        ]
+        for item in data:
+            instances.insert().values(uuid=item['uuid']).execute()
+            info_caches.insert().values(
+                instance_uuid=item['uuid'], deleted=item['deleted'],
+                network_info=item['network_info']).execute()
+        return data
+
+    def _check_230(self, engine, data):
+        self.assertTrue(db_utils.check_shadow_table(engine,
+                                                    'instance_ip_addresses'))
+        self.assertIndexMembers(engine, 'instance_ip_addresses',
+                                'instance_ip_addresses_address_idx',
+                                ['address'])
+
+        ip_addresses = db_utils.get_table(engine, 'instance_ip_addresses')
+        rows = ip_addresses.select().where(
+                ip_addresses.c.instance_uuid.in_(
+                    [item['uuid'] for item in data])).execute().fetchall()
+        self.assertEqual([('m230-uuid1', '10.0.0.2', 4),
+                          ('m230-uuid1', '172.16.0.2', 4),
+                          ('m230-uuid1', 'fe80::2', 6)],
+                         sorted((row['instance_uuid'], row['address'],
+                                 row['version']) for row in rows))
+
+    def _post_downgrade_230(self, engine):
+        self.assertRaises(sqlalchemy.exc.NoSuchTableError,
+                          db_utils.get_table, engine, 'instance_ip_addresses')
+        self.assertRaises(sqlalchemy.exc.NoSuchTableError,
+                          db_utils.get_table, engine,
+                          'shadow_instance_ip_addresses')
+
 
 class TestBaremetalMigrations(BaseWalkMigrationTestCase, CommonTestsMixIn):
     """Test sqlalchemy-migrate migrations."""
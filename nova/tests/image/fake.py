@@ -161,13 +161,20 @@ class _FakeImageService(object):
         """Return list of detailed image information."""
         return copy.deepcopy(self.images.values())
 
-    def download(self, context, image_id, dst_path=None, data=None):
+    def download(self, context, image_id, dst_path=None, data=None,
+                 digest=None):
         self.show(context, image_id)
+        image_data = self._imagedata.get(image_id, '')
         if data:
-            data.write(self._imagedata.get(image_id, ''))
+            data.write(image_data)
         elif dst_path:
             with open(dst_path, 'wb') as data:
-                data.write(self._imagedata.get(image_id, ''))
+                data.write(image_data)
+        else:
+            return
+        if digest is not None:
+            digest.update(image_data)
+            digest.verify(image_id)
 
     def show(self, context, image_id):
         """Get data about specified image.
@@ -18,6 +18,7 @@
 
 import datetime
 import filecmp
+import hashlib
 import os
 import random
 import tempfile
@@ -29,12 +30,14 @@ import testtools
 import mock
 import mox
 
+import eventlet
 import glanceclient.exc
 from oslo.config import cfg
 
 from nova import context
 from nova import exception
 from nova.image import glance
+from nova.openstack.common import timeutils
 from nova import test
 from nova.tests.api.openstack import fakes
 from nova.tests.glance import stubs as glance_stubs
@@ -511,6 +514,29 @@ class TestGlanceImageService(test.NoDBTestCase):
         self.flags(glance_num_retries=1)
         service.download(self.context, image_id, data=writer)
 
+    def _test_download_digest(self, expected_md5):
+        class MyGlanceStubClient(glance_stubs.StubGlanceClient):
+            def data(self, image_id):
+                return ['QFI\xfb', 'x' * 1024]
+
+        service = self._create_image_service(MyGlanceStubClient())
+        digest = glance.ImageDigest(expected_md5=expected_md5)
+        service.download(self.context, 1, data=NullWriter(), digest=digest)
+        return digest
+
+    def test_download_digest(self):
+        image_data = 'QFI\xfb' + 'x' * 1024
+        digest = self._test_download_digest(
+            hashlib.md5(image_data).hexdigest())
+        self.assertTrue(digest.complete)
+        self.assertEqual(1028, digest.size)
+        self.assertEqual(hashlib.sha1(image_data).hexdigest(),
+                         digest.sha1.hexdigest())
+
+    def test_download_digest_checksum_mismatch(self):
+        self.assertRaises(exception.ImageChecksumMismatch,
+                          self._test_download_digest, 'bad-checksum')
+
     def test_download_file_url(self):
         self.flags(allowed_direct_url_schemes=['file'])
 
@@ -771,6 +797,109 @@ def _create_failing_glance_client(info):
     return MyGlanceStubClient()
 
 
+class TestGlanceMetadataCache(test.NoDBTestCase):
+    def setUp(self):
+        super(TestGlanceMetadataCache, self).setUp()
+        self.flags(glance_metadata_cache_ttl=60)
+        glance.reset_metadata_cache()
+        self.addCleanup(glance.reset_metadata_cache)
+        self.addCleanup(timeutils.clear_time_override)
+        timeutils.set_time_override()
+
+        self.client = glance_stubs.StubGlanceClient()
+        self.stubs.Set(glance, '_create_glance_client',
+                       lambda context, host, port, use_ssl, version:
+                       self.client)
+        self.service = glance.GlanceImageService(
+            client=glance.GlanceClientWrapper('fake', 'fake_host', 9292))
+        self.context = context.RequestContext('fake', 'fake', auth_token=True)
+        self.image_id = self.service.create(
+            self.context, {'name': 'image1', 'is_public': True})['id']
+
+        self.gets = []
+
+        def fake_get(image_id):
+            self.gets.append(image_id)
+            return self.client.get(image_id)
+
+        self.stubs.Set(self.client.images, 'get', fake_get)
+
+    def test_show_cached(self):
+        image_meta = self.service.show(self.context, self.image_id)
+        image_meta['name'] = 'changed'
+        image_meta = self.service.show(self.context, self.image_id)
+
+        self.assertEqual('image1', image_meta['name'])
+        self.assertEqual([self.image_id], self.gets)
+        stats = glance.get_metadata_cache().stats
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_show_cached_by_visibility(self):
+        other = context.RequestContext('fake', 'other', auth_token=True)
+        self.service.show(self.context, self.image_id)
+        self.service.show(other, self.image_id)
+        self.service.show(self.context.elevated(), self.image_id)
+        self.service.show(other, self.image_id)
+
+        self.assertEqual([self.image_id] * 3, self.gets)
+
+    def test_show_expired(self):
+        self.service.show(self.context, self.image_id)
+        timeutils.advance_time_seconds(60)
+        self.service.show(self.context, self.image_id)
+
+        self.assertEqual([self.image_id] * 2, self.gets)
+
+    def test_show_not_found_cached(self):
+        for i in range(2):
+            self.assertRaises(exception.ImageNotFound, self.service.show,
+                              self.context, 'missing')
+        self.assertEqual(['missing'], self.gets)
+
+    def test_show_shared(self):
+        client_get = self.client.images.get
+
+        def slow_get(image_id):
+            eventlet.sleep(0.01)
+            return client_get(image_id)
+
+        self.stubs.Set(self.client.images, 'get', slow_get)
+        threads = [eventlet.spawn(self.service.show, self.context,
+                                  self.image_id) for i in range(3)]
+
+        self.assertEqual(['image1'] * 3,
+                         [thread.wait()['name'] for thread in threads])
+        self.assertEqual([self.image_id], self.gets)
+        stats = glance.get_metadata_cache().stats
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(2, stats['shared'])
+
+    def test_update_invalidates(self):
+        self.service.show(self.context, self.image_id)
+        self.service.update(self.context, self.image_id, {'name': 'image2'})
+        image_meta = self.service.show(self.context, self.image_id)
+
+        self.assertEqual('image2', image_meta['name'])
+        self.assertEqual([self.image_id] * 2, self.gets)
+
+    def test_delete_invalidates(self):
+        self.service.show(self.context, self.image_id)
+        self.service.delete(self.context, self.image_id)
+        image_meta = self.service.show(self.context, self.image_id)
+
+        self.assertTrue(image_meta['deleted'])
+        self.assertEqual([self.image_id] * 2, self.gets)
+
+    def test_disabled(self):
+        self.flags(glance_metadata_cache_ttl=0)
+        self.service.show(self.context, self.image_id)
+        self.service.show(self.context, self.image_id)
+
+        self.assertIsNone(glance.get_metadata_cache())
+        self.assertEqual([self.image_id] * 2, self.gets)
+
+
 class TestGlanceClientWrapper(test.NoDBTestCase):
 
     def setUp(self):
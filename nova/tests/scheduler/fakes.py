@@ -23,6 +23,7 @@ from nova import db
 from nova.openstack.common import jsonutils
 from nova.scheduler import filter_scheduler
 from nova.scheduler import host_manager
+from nova.scheduler import weights
 
 
 COMPUTE_NODES = [
@@ -182,6 +183,12 @@ class FakeHostState(host_manager.HostState):
             setattr(self, key, val)
 
 
+class FakeNumInstancesWeigher(weights.BaseHostWeigher):
+    """Prefer the hosts with the fewest instances."""
+    def _weigh_object(self, host_state, weight_properties):
+        return -host_state.num_instances
+
+
 class FakeInstance(object):
     def __init__(self, context=None, params=None):
         """Create a test instance. Returns uuid."""
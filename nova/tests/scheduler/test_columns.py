@@ -0,0 +1,121 @@
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the vectorized filter and weigher engine.
+"""
+
+import random
+
+from nova.scheduler import columns
+from nova.scheduler import filters
+from nova.scheduler import weights
+from nova import test
+from nova.tests.scheduler import fakes
+
+VECTORIZED_FILTERS = ['RamFilter', 'CoreFilter', 'DiskFilter',
+                      'IoOpsFilter', 'NumInstancesFilter']
+
+
+def _fake_hosts(count):
+    rand = random.Random(42)
+    hosts = []
+    for i in xrange(count):
+        total_ram_mb = rand.choice([2048, 4096, 8192, 16384])
+        total_disk_gb = rand.choice([10, 20, 40, 80])
+        hosts.append(fakes.FakeHostState('host%d' % i, 'node%d' % i,
+                {'total_usable_ram_mb': total_ram_mb,
+                 'free_ram_mb': rand.randint(-1024, total_ram_mb),
+                 'total_usable_disk_gb': total_disk_gb,
+                 'free_disk_mb': rand.randint(0, total_disk_gb * 1024),
+                 'vcpus_total': rand.choice([0, 1, 2, 4, 8]),
+                 'vcpus_used': rand.randint(0, 16),
+                 'num_io_ops': rand.randint(0, 10),
+                 'num_instances': rand.randint(0, 60)}))
+    return hosts
+
+
+class HostStateColumnsTestCase(test.NoDBTestCase):
+    """Test case for the vectorized filter and weigher engine."""
+
+    def setUp(self):
+        super(HostStateColumnsTestCase, self).setUp()
+        if columns.numpy is None:
+            self.skipTest('NumPy is not installed')
+        self.filter_handler = filters.HostFilterHandler()
+        self.filter_classes = [cls for cls in filters.all_filters()
+                               if cls.__name__ in VECTORIZED_FILTERS]
+        self.weight_handler = weights.HostWeightHandler()
+        self.weight_classes = self.weight_handler.get_matching_classes(
+                ['nova.scheduler.weights.ram.RAMWeigher'])
+        self.filter_properties = {'instance_type': {'memory_mb': 1024,
+                                                    'root_gb': 5,
+                                                    'ephemeral_gb': 5,
+                                                    'swap': 512,
+                                                    'vcpus': 2}}
+
+    def _filter_and_weigh(self, vectorized):
+        self.flags(scheduler_use_vectorized_engine=vectorized)
+        hosts = _fake_hosts(500)
+        filtered = self.filter_handler.get_filtered_objects(
+                self.filter_classes, hosts, self.filter_properties)
+        weighed = self.weight_handler.get_weighed_objects(
+                self.weight_classes, filtered, {})
+        return ([(host.obj.host, host.weight, host.obj.limits)
+                 for host in weighed],
+                [host.limits for host in hosts])
+
+    def test_all_vectorized_filters_found(self):
+        self.assertEqual(len(VECTORIZED_FILTERS), len(self.filter_classes))
+        for cls in self.filter_classes:
+            self.assertTrue(cls.vectorized)
+
+    def test_same_results_as_per_host_path(self):
+        expected = self._filter_and_weigh(False)
+        self.assertTrue(expected[0])
+        self.assertEqual(expected, self._filter_and_weigh(True))
+
+    def test_mixed_with_per_host_filters(self):
+        hosts = _fake_hosts(50)
+        hosts[3].service = {'disabled': True}
+
+        class FakeDisabledFilter(filters.BaseHostFilter):
+            def host_passes(self, host_state, filter_properties):
+                return not host_state.service.get('disabled')
+
+        self.flags(scheduler_use_vectorized_engine=True)
+        filtered = self.filter_handler.get_filtered_objects(
+                [FakeDisabledFilter] + self.filter_classes, hosts,
+                self.filter_properties)
+        self.assertNotIn(hosts[3], filtered)
+
+        self.flags(scheduler_use_vectorized_engine=False)
+        self.assertEqual(self.filter_handler.get_filtered_objects(
+                [FakeDisabledFilter] + self.filter_classes, hosts,
+                self.filter_properties), filtered)
+
+    def test_unset_field_falls_back_to_per_host_path(self):
+        self.flags(scheduler_use_vectorized_engine=True)
+        hosts = _fake_hosts(2)
+        hosts[0].free_ram_mb = None
+        for host in hosts:
+            host.num_io_ops = 0
+        self.assertRaises(ValueError, columns.HostStateColumns, hosts)
+
+        io_ops_filter = [cls for cls in self.filter_classes
+                         if cls.__name__ == 'IoOpsFilter']
+        self.mox.StubOutWithMock(io_ops_filter[0], 'filter_columns')
+        self.mox.ReplayAll()
+        self.assertEqual(hosts, self.filter_handler.get_filtered_objects(
+                io_ops_filter, hosts, {}))
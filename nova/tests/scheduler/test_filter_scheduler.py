@@ -16,6 +16,8 @@
 Tests For Filter Scheduler.
 """
 
+import time
+
 import mox
 
 from nova.compute import rpcapi as compute_rpcapi
@@ -25,10 +27,12 @@ from nova.conductor import api as conductor_api
 from nova import context
 from nova import db
 from nova import exception
+from nova.openstack.common import timeutils
 from nova.pci import pci_request
 from nova.scheduler import driver
 from nova.scheduler import filter_scheduler
 from nova.scheduler import host_manager
+from nova.scheduler import shards
 from nova.scheduler import utils as scheduler_utils
 from nova.scheduler import weights
 from nova.tests.scheduler import fakes
@@ -533,6 +537,135 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
 
         self.assertEqual(50, hosts[0].weight)
 
+    def _schedule_many(self, num_instances, batched, weight_classes=None):
+        self.flags(scheduler_batch_placement=batched,
+                   scheduler_default_filters=['RamFilter'],
+                   scheduler_weight_classes=weight_classes or [
+                        'nova.scheduler.weights.ram.RAMWeigher'])
+        sched = fakes.FakeFilterScheduler()
+
+        instance_properties = {'project_id': 1,
+                               'root_gb': 0,
+                               'memory_mb': 512,
+                               'ephemeral_gb': 0,
+                               'vcpus': 1,
+                               'os_type': 'Linux'}
+        request_spec = dict(instance_properties=instance_properties,
+                            instance_type={'memory_mb': 512})
+        instance_uuids = ['fake-uuid%d' % i for i in xrange(num_instances)]
+        hosts = sched._schedule(self.context, request_spec,
+                filter_properties={}, instance_uuids=instance_uuids)
+        return [host.obj.host for host in hosts]
+
+    def test_schedule_batched_same_hosts(self):
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(mox.IgnoreArg()).MultipleTimes().AndReturn(
+                fakes.COMPUTE_NODES)
+        self.mox.ReplayAll()
+
+        expected = self._schedule_many(45, False)
+        self.assertEqual(expected, self._schedule_many(45, True))
+        # Not all instances fit
+        self.assertTrue(len(expected) < 45)
+        self.assertEqual(set(['host1', 'host2', 'host3', 'host4']),
+                         set(expected))
+
+    def test_schedule_batched_same_hosts_several_weighers(self):
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(mox.IgnoreArg()).MultipleTimes().AndReturn(
+                fakes.COMPUTE_NODES)
+        self.mox.ReplayAll()
+
+        weight_classes = [
+            'nova.scheduler.weights.ram.RAMWeigher',
+            'nova.tests.scheduler.fakes.FakeNumInstancesWeigher']
+        expected = self._schedule_many(20, False, weight_classes)
+        self.assertEqual(expected,
+                         self._schedule_many(20, True, weight_classes))
+        self.assertEqual(set(['host1', 'host2', 'host3', 'host4']),
+                         set(expected))
+
+    def test_schedule_batched_not_supported_by_filters(self):
+        self.flags(scheduler_batch_placement=True,
+                   scheduler_default_filters=['RamFilter',
+                                              'GroupAntiAffinityFilter'])
+        sched = fakes.FakeFilterScheduler()
+        self.stubs.Set(sched.host_manager, 'get_filtered_hosts',
+                fake_get_filtered_hosts)
+        self.mox.StubOutWithMock(sched, '_schedule_batched')
+        fakes.mox_host_manager_db_calls(self.mox, self.context)
+        self.mox.ReplayAll()
+
+        instance_properties = {'project_id': 1,
+                               'root_gb': 0,
+                               'memory_mb': 512,
+                               'ephemeral_gb': 0,
+                               'vcpus': 1,
+                               'os_type': 'Linux'}
+        request_spec = dict(instance_properties=instance_properties,
+                            instance_type={'memory_mb': 512})
+        hosts = sched._schedule(self.context, request_spec,
+                filter_properties={},
+                instance_uuids=['fake-uuid1', 'fake-uuid2'])
+        self.assertEqual(2, len(hosts))
+
+    def test_schedule_sharded_spills_to_other_shards(self):
+        self.flags(scheduler_sharding=True, host='sched1')
+        self.stubs.Set(driver.Scheduler, 'hosts_up',
+                       lambda *args: ['sched1', 'sched2'])
+
+        def fake_get_member(_self, key):
+            return 'sched1' if key == 'host3' else 'sched2'
+
+        self.stubs.Set(shards.HashRing, 'get_member', fake_get_member)
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(mox.IgnoreArg()).AndReturn(
+                fakes.COMPUTE_NODES)
+        self.mox.ReplayAll()
+
+        hosts = self._schedule_many(30, False)
+        # host3 has room for 10 instances, the others go to other shards
+        self.assertEqual(['host3'] * 10, hosts[:10])
+        self.assertIn('host4', hosts[10:])
+        self.assertNotIn('host3', hosts[10:])
+
+    def test_shard_ring_refresh_interval(self):
+        self.flags(scheduler_shard_ring_refresh_interval=10, host='sched1')
+        sched = fakes.FakeFilterScheduler()
+        self.mox.StubOutWithMock(sched, 'hosts_up')
+        sched.hosts_up(self.context, 'scheduler').AndReturn(['sched2'])
+        sched.hosts_up(self.context, 'scheduler').AndReturn(['sched3'])
+        self.mox.ReplayAll()
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        ring = sched._get_shard_ring(self.context)
+        self.assertEqual(frozenset(['sched1', 'sched2']), ring.members)
+        timeutils.advance_time_seconds(9)
+        self.assertIs(ring, sched._get_shard_ring(self.context))
+        timeutils.advance_time_seconds(1)
+        ring = sched._get_shard_ring(self.context)
+        self.assertEqual(frozenset(['sched1', 'sched3']), ring.members)
+
+    def test_report_placement_stats(self):
+        self.flags(host='sched1')
+        sched = fakes.FakeFilterScheduler()
+        self.stubs.Set(sched, 'hosts_up', lambda *args: ['sched1', 'sched2'])
+        self.mox.StubOutWithMock(sched.notifier, 'info')
+        sched.notifier.info(self.context, 'scheduler.placement.stats',
+                mox.Func(lambda payload: payload['requests'] == 2 and
+                         payload['placed'] == 3 and
+                         payload['retry_rate'] == 0.5 and
+                         payload['schedulers'] == 2))
+        self.mox.ReplayAll()
+
+        sched._record_placement(time.time(), 2, 2, False)
+        sched._record_placement(time.time(), 2, 1, True)
+        sched.report_placement_stats(self.context)
+        self.assertEqual(0, sched.placement_stats['requests'])
+        # Nothing to report
+        sched.report_placement_stats(self.context)
+
     def test_select_hosts_happy_day(self):
         """select_hosts is basically a wrapper around the _select() method.
 
@@ -68,6 +68,16 @@ class HostManagerTestCase(test.NoDBTestCase):
         self.assertEqual(len(filter_classes), 1)
         self.assertEqual(filter_classes[0].__name__, 'FakeFilterClass2')
 
+    def test_can_filter_batched(self):
+        self.host_manager.filter_classes = [FakeFilterClass1,
+                FakeFilterClass2]
+        self.assertTrue(self.host_manager.can_filter_batched(
+                ['FakeFilterClass1', 'FakeFilterClass2']))
+
+        self.stubs.Set(FakeFilterClass2, 'run_filter_batched', False)
+        self.assertFalse(self.host_manager.can_filter_batched(
+                ['FakeFilterClass1', 'FakeFilterClass2']))
+
     def _mock_get_filtered_hosts(self, info, specified_filters=None):
         self.mox.StubOutWithMock(self.host_manager, '_choose_host_filters')
 
@@ -417,6 +427,125 @@ class HostManagerChangedNodesTestCase(test.NoDBTestCase):
         host_states_map = self.host_manager.host_state_map
         self.assertEqual(len(host_states_map), 0)
 
+    def test_get_all_host_states_refresh_interval(self):
+        self.flags(scheduler_host_state_refresh_interval=60)
+        context = 'fake_context'
+        timeutils.set_time_override()
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES)
+        db.compute_node_get_all(context).AndReturn([])
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(30)
+        self.host_manager.get_all_host_states(context)
+        self.assertEqual(len(self.host_manager.host_state_map), 4)
+
+        timeutils.advance_time_seconds(31)
+        self.host_manager.get_all_host_states(context)
+        self.assertEqual(len(self.host_manager.host_state_map), 0)
+
+    def _compute_nodes_with_services(self, updated_at):
+        compute_nodes = []
+        for compute in fakes.COMPUTE_NODES[:4]:
+            compute = dict(compute, updated_at=updated_at, created_at=None,
+                           deleted_at=None, deleted=0)
+            compute['service'] = dict(compute['service'],
+                                      binary='nova-compute')
+            compute_nodes.append(compute)
+        return compute_nodes
+
+    def test_get_all_host_states_incremental(self):
+        self.flags(scheduler_incremental_host_state=True)
+        context = 'fake_context'
+        timeutils.set_time_override()
+        first_update = timeutils.utcnow()
+        compute_nodes = self._compute_nodes_with_services(first_update)
+        services = [compute['service'] for compute in compute_nodes]
+
+        timeutils.advance_time_seconds(10)
+        second_update = timeutils.utcnow()
+        node1 = dict(compute_nodes[0], free_ram_mb=256,
+                     updated_at=second_update)
+        node2 = dict(compute_nodes[1], deleted=2, deleted_at=second_update)
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'service_get_all')
+        db.compute_node_get_all(context).AndReturn(compute_nodes)
+        # host4 has lost its service
+        db.service_get_all(context).AndReturn(services[:3])
+        db.compute_node_get_all(context,
+                updated_since=first_update).AndReturn([node1, node2])
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(context)
+        host_state = self.host_manager.host_state_map[('host3', 'node3')]
+        host_state.consume_from_instance(dict(root_gb=0, ephemeral_gb=0,
+                                              memory_mb=1024, vcpus=1))
+        self.host_manager.get_all_host_states(context)
+
+        host_states_map = self.host_manager.host_state_map
+        self.assertEqual(set([('host1', 'node1'), ('host3', 'node3')]),
+                         set(host_states_map.keys()))
+        self.assertEqual(256, host_states_map[('host1', 'node1')].free_ram_mb)
+        # Locally consumed resources are kept for unchanged nodes
+        self.assertEqual(2048, host_states_map[('host3', 'node3')].free_ram_mb)
+        self.assertEqual(second_update, self.host_manager.changes_since)
+
+    def test_get_all_host_states_incremental_recreated_node(self):
+        self.flags(scheduler_incremental_host_state=True)
+        context = 'fake_context'
+        timeutils.set_time_override()
+        first_update = timeutils.utcnow()
+        compute_nodes = self._compute_nodes_with_services(first_update)
+        services = [compute['service'] for compute in compute_nodes]
+
+        timeutils.advance_time_seconds(10)
+        second_update = timeutils.utcnow()
+        # node1 is recreated with a new id, and its old row is deleted
+        new_node1 = dict(compute_nodes[0], id=100, free_ram_mb=256,
+                         created_at=second_update)
+        old_node1 = dict(compute_nodes[0], deleted=1,
+                         deleted_at=second_update)
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'service_get_all')
+        db.compute_node_get_all(context).AndReturn(compute_nodes)
+        db.service_get_all(context).MultipleTimes().AndReturn(services)
+        db.compute_node_get_all(context,
+                updated_since=first_update).AndReturn([new_node1])
+        db.compute_node_get_all(context,
+                updated_since=second_update).AndReturn([old_node1])
+        self.mox.ReplayAll()
+
+        for i in range(3):
+            self.host_manager.get_all_host_states(context)
+
+        host_state = self.host_manager.host_state_map[('host1', 'node1')]
+        self.assertEqual(256, host_state.free_ram_mb)
+        self.assertEqual(('host1', 'node1'),
+                         self.host_manager.compute_node_map[100])
+        self.assertNotIn(compute_nodes[0]['id'],
+                         self.host_manager.compute_node_map)
+
+    def test_get_all_host_states_incremental_full_refresh(self):
+        self.flags(scheduler_incremental_host_state=True,
+                   scheduler_host_state_full_refresh_interval=60)
+        context = 'fake_context'
+        timeutils.set_time_override()
+        compute_nodes = self._compute_nodes_with_services(timeutils.utcnow())
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(context).AndReturn(compute_nodes)
+        db.compute_node_get_all(context).AndReturn(compute_nodes[:2])
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(61)
+        self.host_manager.get_all_host_states(context)
+        self.assertEqual(len(self.host_manager.host_state_map), 2)
+
 
 class HostStateTestCase(test.NoDBTestCase):
     """Test case for HostState class."""
@@ -436,6 +565,8 @@ class HostStateTestCase(test.NoDBTestCase):
             dict(key='num_os_type_linux', value='4'),
             dict(key='num_os_type_windoze', value='1'),
             dict(key='io_workload', value='42'),
+            dict(key='cached_image_image-a', value='1'),
+            dict(key='cached_image_image-b', value='1'),
         ]
         hyper_ver_int = utils.convert_version_to_int('6.0.0')
         compute = dict(stats=stats, memory_mb=1, free_disk_gb=0, local_gb=0,
@@ -459,7 +590,8 @@ class HostStateTestCase(test.NoDBTestCase):
         self.assertEqual(4, host.num_instances_by_os_type['linux'])
         self.assertEqual(1, host.num_instances_by_os_type['windoze'])
         self.assertEqual(42, host.num_io_ops)
-        self.assertEqual(10, len(host.stats))
+        self.assertEqual(set(['image-a', 'image-b']), host.cached_images)
+        self.assertEqual(12, len(host.stats))
 
         self.assertEqual('127.0.0.1', host.host_ip)
         self.assertEqual('htype', host.hypervisor_type)
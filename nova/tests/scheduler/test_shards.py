@@ -0,0 +1,53 @@
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the scheduler hash ring.
+"""
+
+from nova.scheduler import shards
+from nova import test
+
+HOSTS = ['host%d' % i for i in xrange(1000)]
+
+
+class HashRingTestCase(test.NoDBTestCase):
+    """Test case for the scheduler hash ring."""
+
+    def _owners(self, ring):
+        return dict((host, ring.get_member(host)) for host in HOSTS)
+
+    def test_empty_ring(self):
+        self.assertIsNone(shards.HashRing([]).get_member('host1'))
+
+    def test_all_members_get_keys(self):
+        owners = self._owners(shards.HashRing(['sched1', 'sched2',
+                                               'sched3']))
+        for member in ('sched1', 'sched2', 'sched3'):
+            num_hosts = owners.values().count(member)
+            # Roughly a third of the hosts each
+            self.assertTrue(200 < num_hosts < 470, num_hosts)
+
+    def test_same_owners_on_every_scheduler(self):
+        self.assertEqual(self._owners(shards.HashRing(['sched1', 'sched2'])),
+                         self._owners(shards.HashRing(['sched2', 'sched1'])))
+
+    def test_member_joins(self):
+        before = self._owners(shards.HashRing(['sched1', 'sched2']))
+        after = self._owners(shards.HashRing(['sched1', 'sched2',
+                                              'sched3']))
+        for host in HOSTS:
+            # Hosts only move to the new member
+            if before[host] != after[host]:
+                self.assertEqual('sched3', after[host])
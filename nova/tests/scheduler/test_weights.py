@@ -36,9 +36,10 @@ class TestWeighedHost(test.NoDBTestCase):
     def test_all_weighers(self):
         classes = weights.all_weighers()
         class_names = [cls.__name__ for cls in classes]
-        self.assertEqual(len(classes), 2)
+        self.assertEqual(len(classes), 3)
         self.assertIn('RAMWeigher', class_names)
         self.assertIn('MetricsWeigher', class_names)
+        self.assertIn('ImageCacheWeigher', class_names)
 
 
 class RamWeigherTestCase(test.NoDBTestCase):
@@ -102,6 +103,22 @@ class RamWeigherTestCase(test.NoDBTestCase):
         self.assertEqual(weighed_host.weight, 1.0 * 2)
         self.assertEqual(weighed_host.obj.host, 'host4')
 
+    def test_reweigh_host(self):
+        hostinfo_list = list(self._get_all_hosts())
+        weighers = [cls() for cls in self.weight_classes]
+        weighed_hosts = self.weight_handler.weigh_with(weighers,
+                                                       hostinfo_list, {})
+        self.assertEqual('host4', weighed_hosts[0].obj.host)
+
+        # host4: free_ram_mb=8192 - 6144 = 2048
+        host_state = weighed_hosts[0].obj
+        host_state.free_ram_mb -= 6144
+        weighed_host = self.weight_handler.reweigh_object(weighers,
+                                                          host_state, {})
+        # Normalized against the max of the first pass
+        self.assertEqual(0.25, weighed_host.weight)
+        self.assertEqual(8192, weighers[0].maxval)
+
     def test_ram_filter_negative(self):
         self.flags(ram_weight_multiplier=1.0)
         hostinfo_list = self._get_all_hosts()
@@ -234,3 +251,49 @@ class MetricsWeigherTestCase(test.NoDBTestCase):
                           setting,
                           8192,
                           'host4')
+
+
+class ImageCacheWeigherTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(ImageCacheWeigherTestCase, self).setUp()
+        self.weight_handler = weights.HostWeightHandler()
+        self.weight_classes = self.weight_handler.get_matching_classes(
+                ['nova.scheduler.weights.image_cache.ImageCacheWeigher'])
+        self.hosts = [
+            fakes.FakeHostState('host1', 'node1',
+                                {'cached_images': set(['image-b'])}),
+            fakes.FakeHostState('host2', 'node2',
+                                {'cached_images': set(['image-a',
+                                                       'image-b'])}),
+            fakes.FakeHostState('host3', 'node3',
+                                {'cached_images': set()})]
+
+    def _get_weighed_hosts(self, image_id):
+        weight_properties = {'request_spec': {'image': {'id': image_id}}}
+        return self.weight_handler.get_weighed_objects(self.weight_classes,
+                self.hosts, weight_properties)
+
+    def test_default_multiplier(self):
+        weighed_hosts = self._get_weighed_hosts('image-a')
+        self.assertEqual([0.0, 0.0, 0.0],
+                         [host.weight for host in weighed_hosts])
+
+    def test_image_cached(self):
+        self.flags(image_cache_weight_multiplier=2.0)
+        weighed_hosts = self._get_weighed_hosts('image-a')
+        self.assertEqual('host2', weighed_hosts[0].obj.host)
+        self.assertEqual(2.0, weighed_hosts[0].weight)
+        self.assertEqual(0.0, weighed_hosts[1].weight)
+
+    def test_image_not_cached(self):
+        self.flags(image_cache_weight_multiplier=2.0)
+        weighed_hosts = self._get_weighed_hosts('image-c')
+        self.assertEqual([0.0, 0.0, 0.0],
+                         [host.weight for host in weighed_hosts])
+
+    def test_no_image(self):
+        self.flags(image_cache_weight_multiplier=2.0)
+        weighed_hosts = self.weight_handler.get_weighed_objects(
+                self.weight_classes, self.hosts, {})
+        self.assertEqual([0.0, 0.0, 0.0],
+                         [host.weight for host in weighed_hosts])
@@ -17,6 +17,9 @@
 #    under the License.
 """Unit Tests for network code."""
 
+import eventlet
+from eventlet import greenthread
+
 from nova.network import linux_net
 from nova import test
 
@@ -278,3 +281,81 @@ class IptablesManagerTestCase(test.NoDBTestCase):
                                                self.manager.ipv4['filter'],
                                                'filter')
         self.assertEqual(current_lines, new_lines)
+
+    def test_empty_chain_then_add_rule(self):
+        table = self.manager.ipv4['filter']
+        table.add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+        table.empty_chain('FORWARD')
+        table.dirty = False
+        table.add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+        self.assertTrue(table.dirty)
+        self.assertEqual(1, len([rule for rule in table.rules
+                                 if rule.chain == 'FORWARD' and rule.wrap]))
+
+    def test_remove_rules_from_saved_lines(self):
+        current_lines = list(self.sample_filter)
+        current_lines[12:12] = ['[5:42] -A FORWARD -j nova-test-rule',
+                                ':nova-test-chain - [0:0]']
+        table = self.manager.ipv4['filter']
+        table.add_chain('nova-test-chain', wrap=False)
+        table.add_rule('FORWARD', '-j nova-test-rule', wrap=False)
+        table.remove_rule('FORWARD', '-j nova-test-rule', wrap=False)
+        table.remove_chain('nova-test-chain', wrap=False)
+        new_lines = self.manager._modify_rules(current_lines, table,
+                                               'filter')
+        self.assertNotIn('[5:42] -A FORWARD -j nova-test-rule', new_lines)
+        self.assertNotIn(':nova-test-chain - [0:0]', new_lines)
+        self.assertEqual([], table.remove_rules)
+        self.assertEqual(set(), table.remove_chains)
+
+    def _fake_execute(self, calls):
+        def fake_execute(*cmd, **kwargs):
+            calls.append(cmd[0])
+            # Let the other greenthreads run, like a real command would
+            greenthread.sleep(0)
+            return '', ''
+        return fake_execute
+
+    def test_apply_coalesced(self):
+        self.flags(disable_process_locking=True, use_ipv6=False)
+        calls = []
+        self.manager.execute = self._fake_execute(calls)
+        threads = [eventlet.spawn(self.manager.apply) for i in xrange(5)]
+        for thread in threads:
+            thread.wait()
+        self.assertEqual(['iptables-save', 'iptables-restore'], calls)
+        self.assertEqual(5, self.manager.apply_stats['requested'])
+        self.assertEqual(1, self.manager.apply_stats['applied'])
+        self.assertEqual(4, self.manager.apply_stats['coalesced'])
+        self.assertFalse(self.manager.dirty())
+
+    def test_apply_waits_for_apply_in_progress(self):
+        for table in self.manager.ipv4.itervalues():
+            table.dirty = False
+        for table in self.manager.ipv6.itervalues():
+            table.dirty = False
+        # Another greenthread cleaned the tables, but has not restored them
+        self.manager._apply_requests = 1
+        self.mox.StubOutWithMock(self.manager, '_apply')
+        self.manager._apply()
+        self.mox.ReplayAll()
+        self.manager.apply()
+
+    def test_apply_after_restore_with_new_rules(self):
+        self.flags(disable_process_locking=True, use_ipv6=False)
+        calls = []
+        self.manager.execute = self._fake_execute(calls)
+        table = self.manager.ipv4['filter']
+
+        def add_rule_and_apply():
+            # Runs while the first apply waits for iptables-restore
+            greenthread.sleep(0)
+            table.add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+            self.manager.apply()
+
+        first = eventlet.spawn(self.manager.apply)
+        second = eventlet.spawn(add_rule_and_apply)
+        first.wait()
+        second.wait()
+        self.assertEqual(['iptables-save', 'iptables-restore'] * 2, calls)
+        self.assertEqual(2, self.manager.apply_stats['applied'])
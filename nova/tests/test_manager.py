@@ -18,7 +18,11 @@
 Unit Tests for nova.manager
 """
 
+import random
+
 from nova import manager
+from nova.openstack.common import periodic_task
+from nova.openstack.common import timeutils
 from nova import test
 
 
@@ -33,3 +37,112 @@ class ManagerTestCase(test.NoDBTestCase):
 
         self.assertEqual(len(dispatch.callbacks), 3)
         self.assertIn(api, dispatch.callbacks)
+
+
+class FakeManager(manager.Manager):
+    def __init__(self):
+        super(FakeManager, self).__init__()
+        self.ran = []
+        self.now = 0.0
+        self.durations = {}
+
+    def _run(self, name):
+        self.ran.append(name)
+        self.now += self.durations.get(name, 0.0)
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        pass
+
+    @periodic_task.periodic_task
+    def _every_pass(self, context):
+        self._run('every_pass')
+
+    @periodic_task.periodic_task(spacing=10, run_immediately=True)
+    def _spaced(self, context):
+        self._run('spaced')
+
+    @periodic_task.periodic_task(spacing=10, run_immediately=True)
+    def _failing(self, context):
+        self._run('failing')
+        raise test.TestingException()
+
+
+class PeriodicTasksTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(PeriodicTasksTestCase, self).setUp()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.manager = FakeManager()
+        self.stubs.Set(self.manager, '_periodic_last_run',
+                       dict(self.manager._periodic_last_run))
+        for task_name in ('_spaced', '_failing'):
+            self.manager._periodic_last_run[task_name] = None
+        # The manager keeps the time the tasks take.
+        self.stubs.Set(periodic_task, 'time', self.manager)
+
+    def test_run_periodic_tasks_stats(self):
+        self.manager.durations = {'spaced': 12, 'failing': 0.05}
+        self.manager.periodic_tasks('fake-context')
+
+        self.assertEqual(['every_pass', 'failing', 'spaced'],
+                         sorted(self.manager.ran))
+        stats = self.manager.get_periodic_task_stats()
+        self.assertEqual(['FakeManager._every_pass', 'FakeManager._failing',
+                          'FakeManager._spaced'], sorted(stats))
+        spaced = stats['FakeManager._spaced']
+        self.assertEqual(1, spaced['runs'])
+        self.assertEqual(0, spaced['errors'])
+        self.assertEqual(1, spaced['overruns'])
+        self.assertEqual(12, spaced['max_duration'])
+        self.assertEqual((30, 1), spaced['histogram'][5])
+        self.assertEqual(1, sum(n for bound, n in spaced['histogram']))
+        failing = stats['FakeManager._failing']
+        self.assertEqual(1, failing['errors'])
+        self.assertEqual(0, failing['overruns'])
+        self.assertEqual((0.1, 1), failing['histogram'][0])
+
+    def test_run_periodic_tasks_stats_logged(self):
+        self.flags(periodic_task_stats_interval=60)
+        self.manager.durations = {'spaced': 12}
+        logged = []
+
+        def fake_info(msg, kwargs):
+            logged.append(msg % kwargs)
+
+        self.stubs.Set(periodic_task.LOG, 'info', fake_info)
+        self.manager.periodic_tasks('fake-context')
+        self.assertEqual([], logged)
+
+        timeutils.advance_time_seconds(60)
+        self.manager.periodic_tasks('fake-context')
+        self.assertEqual(3, len(logged))
+        self.assertEqual('Periodic task FakeManager._spaced: 2 runs, '
+                         '0 errors, 2 overruns, average 12.00s, max 12.00s, '
+                         'durations <=30s: 2', logged[2])
+        # Not again before the interval
+        self.manager.periodic_tasks('fake-context')
+        self.assertEqual(3, len(logged))
+
+    def test_run_periodic_tasks_concurrently(self):
+        self.flags(periodic_task_concurrency=3)
+        # All the tasks run before the error is raised.
+        self.assertRaises(test.TestingException,
+                          self.manager.periodic_tasks, 'fake-context',
+                          raise_on_error=True)
+        self.assertEqual(['every_pass', 'failing', 'spaced'],
+                         sorted(self.manager.ran))
+
+    def test_run_periodic_tasks_jitter(self):
+        self.flags(periodic_task_jitter=0.5)
+        self.stubs.Set(random, 'uniform', lambda low, high: high)
+        idle_for = self.manager.periodic_tasks('fake-context')
+        # The spaced tasks are due in 5 seconds instead of now.
+        self.assertEqual(['every_pass'], self.manager.ran)
+        self.assertEqual(5, idle_for)
+        timeutils.advance_time_seconds(5)
+        self.manager.periodic_tasks('fake-context')
+        self.assertEqual(['every_pass', 'every_pass', 'failing', 'spaced'],
+                         sorted(self.manager.ran))
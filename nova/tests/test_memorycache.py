@@ -0,0 +1,105 @@
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the in process memcache client."""
+
+from nova.openstack.common import memorycache
+from nova.openstack.common import timeutils
+from nova import test
+
+
+class MemorycacheTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(MemorycacheTestCase, self).setUp()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.client = memorycache.Client([], max_items=3)
+
+    def _stats(self):
+        return self.client.get_stats()[0][1]
+
+    def test_get_set(self):
+        self.assertIsNone(self.client.get('foo'))
+        self.assertTrue(self.client.set('foo', 'bar'))
+        self.assertEqual('bar', self.client.get('foo'))
+
+        stats = self._stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['curr_items'])
+
+    def test_expiry(self):
+        self.client.set('foo', 'bar', time=10)
+        self.client.set('baz', 'qux')
+        timeutils.advance_time_seconds(9)
+        self.assertEqual('bar', self.client.get('foo'))
+
+        timeutils.advance_time_seconds(1)
+        self.assertIsNone(self.client.get('foo'))
+        self.assertEqual('qux', self.client.get('baz'))
+        self.assertEqual(1, self._stats()['expirations'])
+
+    def test_expiry_reset(self):
+        self.client.set('foo', 'bar', time=10)
+        timeutils.advance_time_seconds(5)
+        self.client.set('foo', 'baz', time=10)
+        timeutils.advance_time_seconds(5)
+        self.assertEqual('baz', self.client.get('foo'))
+
+        self.client.set('foo', 'qux')
+        timeutils.advance_time_seconds(60)
+        self.assertEqual('qux', self.client.get('foo'))
+
+    def test_lru_eviction(self):
+        for key in ('a', 'b', 'c'):
+            self.client.set(key, key)
+        self.client.get('a')
+        self.client.set('d', 'd')
+
+        self.assertIsNone(self.client.get('b'))
+        for key in ('a', 'c', 'd'):
+            self.assertEqual(key, self.client.get(key))
+        self.assertEqual(1, self._stats()['evictions'])
+
+    def test_add(self):
+        self.assertTrue(self.client.add('foo', 'bar'))
+        self.assertFalse(self.client.add('foo', 'baz'))
+        self.assertEqual('bar', self.client.get('foo'))
+
+    def test_incr(self):
+        self.assertIsNone(self.client.incr('foo'))
+        self.client.set('foo', '1', time=10)
+        self.assertEqual(3, self.client.incr('foo', delta=2))
+        self.assertEqual('3', self.client.get('foo'))
+
+        # The timeout is kept.
+        timeutils.advance_time_seconds(10)
+        self.assertIsNone(self.client.get('foo'))
+
+    def test_delete(self):
+        self.client.set('foo', 'bar', time=10)
+        self.client.delete('foo')
+        self.assertIsNone(self.client.get('foo'))
+
+        self.client.set('foo', 'baz')
+        timeutils.advance_time_seconds(10)
+        self.assertEqual('baz', self.client.get('foo'))
+
+    def test_timeouts_compacted(self):
+        client = memorycache.Client([], max_items=0)
+        for i in xrange(1000):
+            client.set('foo', i, time=10)
+        self.assertTrue(len(client._timeouts) < 100)
+        self.assertEqual(999, client.get('foo'))
@@ -24,6 +24,7 @@ import urllib2
 from nova import context
 from nova import exception
 from nova.openstack.common import policy as common_policy
+from nova.openstack.common import timeutils
 from nova import policy
 from nova import test
 from nova import utils
@@ -58,6 +59,30 @@ class PolicyFileTestCase(test.NoDBTestCase):
             self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
                               self.context, action, self.target)
 
+    def test_policy_file_check_interval(self):
+        self.flags(policy_file_check_interval=60)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        with utils.tempdir() as tmpdir:
+            tmpfilename = os.path.join(tmpdir, 'policy')
+            self.flags(policy_file=tmpfilename)
+            policy.reset()
+
+            action = "example:test"
+            with open(tmpfilename, "w") as policyfile:
+                policyfile.write('{"example:test": ""}')
+            policy.enforce(self.context, action, self.target)
+            with open(tmpfilename, "w") as policyfile:
+                policyfile.write('{"example:test": "!"}')
+            # Make the file look modified without sleeping.
+            policy._POLICY_CACHE['mtime'] = None
+
+            timeutils.advance_time_seconds(59)
+            policy.enforce(self.context, action, self.target)
+            timeutils.advance_time_seconds(1)
+            self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                              self.context, action, self.target)
+
 
 class PolicyTestCase(test.NoDBTestCase):
     def setUp(self):
@@ -147,6 +172,75 @@ class PolicyTestCase(test.NoDBTestCase):
         policy.enforce(admin_context, uppercase_action, self.target)
 
 
+class CompiledPolicyTestCase(PolicyTestCase):
+    def setUp(self):
+        super(CompiledPolicyTestCase, self).setUp()
+        self.flags(policy_compiled_rules=True)
+
+    def test_results_memoized(self):
+        action = "example:my_file"
+        policy.enforce(self.context, action, {'project_id': 'fake'})
+        self.assertFalse(policy.enforce(self.context, action,
+                                        {'project_id': 'another'}, False))
+        self.assertEqual({(action, 'fake'): True, (action, 'another'): False},
+                         self.context._policy_cache.results)
+
+        # Only the target keys the rule uses make the result.
+        self.assertTrue(policy.enforce(self.context, action,
+                                       {'project_id': 'fake', 'foo': 1}))
+        self.assertEqual(2, len(self.context._policy_cache.results))
+
+    def test_credentials_cached(self):
+        self.mox.StubOutWithMock(self.context, 'to_dict')
+        self.context.to_dict().AndReturn({'roles': ['member'],
+                                          'project_id': 'fake'})
+        self.mox.ReplayAll()
+
+        policy.enforce(self.context, "example:my_file",
+                       {'project_id': 'fake'})
+        policy.enforce(self.context, "example:allowed", {})
+
+    def test_http_not_memoized(self):
+        calls = []
+
+        def fakeurlopen(url, post_data):
+            calls.append(url)
+            return StringIO.StringIO("True")
+        self.stubs.Set(urllib2, 'urlopen', fakeurlopen)
+        policy.enforce(self.context, "example:get_http", {})
+        policy.enforce(self.context, "example:get_http", {})
+        self.assertEqual(2, len(calls))
+
+    def test_changed_context(self):
+        action = "example:lowercase_admin"
+        self.assertFalse(policy.enforce(self.context, action, {}, False))
+        self.assertTrue(policy.enforce(self.context.elevated(), action, {}))
+        self.context.roles.append('sysadmin')
+        self.assertTrue(policy.enforce(self.context, action, {}))
+
+    def test_changed_rules(self):
+        action = "example:allowed"
+        self.assertTrue(policy.enforce(self.context, action, {}))
+        self.policy.set_rules({action: '!'})
+        self.assertFalse(policy.enforce(self.context, action, {}, False))
+
+    def test_missing_target_key(self):
+        self.policy.set_rules({
+            "example:project": "project_id:%(project_id)s",
+            "example:project_or_allowed": "rule:example:project or @",
+            })
+        self.assertFalse(policy.enforce(self.context, "example:project",
+                                        {}, False))
+        self.assertTrue(policy.enforce(self.context,
+                                       "example:project_or_allowed", {}))
+
+    def test_unhashable_target(self):
+        action = "example:my_file"
+        self.assertFalse(policy.enforce(self.context, action,
+                                        {'project_id': ['fake']}, False))
+        self.assertEqual({}, self.context._policy_cache.results)
+
+
 class DefaultPolicyTestCase(test.NoDBTestCase):
 
     def setUp(self):
@@ -180,6 +274,12 @@ class DefaultPolicyTestCase(test.NoDBTestCase):
                 self.context, "example:noexist", {})
 
 
+class CompiledDefaultPolicyTestCase(DefaultPolicyTestCase):
+    def setUp(self):
+        super(CompiledDefaultPolicyTestCase, self).setUp()
+        self.flags(policy_compiled_rules=True)
+
+
 class IsAdminCheckTestCase(test.NoDBTestCase):
     def test_init_true(self):
         check = policy.IsAdminCheck('is_admin', 'True')
@@ -206,3 +306,14 @@ class IsAdminCheckTestCase(test.NoDBTestCase):
 
         self.assertEqual(check('target', dict(is_admin=True)), False)
         self.assertEqual(check('target', dict(is_admin=False)), True)
+
+    def test_compiled(self):
+        self.flags(policy_compiled_rules=True)
+        common_policy.set_rules(common_policy.Rules({
+            'context_is_admin': common_policy.parse_rule('is_admin:True'),
+            'example:admin': common_policy.parse_rule('is_admin:True')}))
+        ctxt = context.RequestContext('fake', 'fake', is_admin=False)
+
+        self.assertFalse(policy.check_is_admin(ctxt))
+        self.assertFalse(policy.enforce(ctxt, 'example:admin', {}, False))
+        self.assertTrue(policy.enforce(ctxt.elevated(), 'example:admin', {}))
@@ -0,0 +1,114 @@
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the pipelined casts of the AMQP RPC drivers."""
+
+from eventlet import greenthread
+from oslo.config import cfg
+
+from nova import context
+from nova.openstack.common.rpc import amqp as rpc_amqp
+from nova import test
+
+CONF = cfg.CONF
+
+
+class FakeConnection(object):
+    pool = None
+
+    def __init__(self, conf, server_params=None):
+        self.published = FakeConnection.published
+        self.resets = 0
+
+    def topic_send(self, topic, msg):
+        # Let the other greenthreads queue casts meanwhile.
+        greenthread.sleep(0)
+        if topic == 'fail':
+            raise test.TestingException()
+        self.published.append((topic, msg))
+
+    def fanout_send(self, topic, msg):
+        self.topic_send('%s_fanout' % topic, msg)
+
+    def reset(self):
+        self.resets += 1
+
+    def close(self):
+        pass
+
+
+class CastPipelineTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(CastPipelineTestCase, self).setUp()
+        FakeConnection.published = []
+        self.published = FakeConnection.published
+        self.pool = rpc_amqp.get_connection_pool(CONF, FakeConnection)
+        self.addCleanup(self.pool.empty)
+        self.pipeline = rpc_amqp.CastPipeline(CONF, self.pool)
+
+    def test_casts_published_in_order(self):
+        events = [self.pipeline.add('topic_send', 'topic', 'msg%d' % i)
+                  for i in xrange(3)]
+        events.append(self.pipeline.add('fanout_send', 'topic', 'msg3'))
+        for event in events:
+            self.assertIsNone(event.wait())
+        self.assertEqual([('topic', 'msg0'), ('topic', 'msg1'),
+                          ('topic', 'msg2'), ('topic_fanout', 'msg3')],
+                         self.published)
+        # All the casts were published on the same connection
+        connection = self.pool.get()
+        self.assertEqual(1, connection.resets)
+        self.assertIsNone(self.pipeline.sender)
+
+    def test_failed_cast(self):
+        events = [self.pipeline.add('topic_send', topic, msg)
+                  for topic, msg in [('topic', 'msg0'), ('fail', 'msg1'),
+                                     ('topic', 'msg2')]]
+        self.assertIsNone(events[0].wait())
+        self.assertRaises(test.TestingException, events[1].wait)
+        self.assertIsNone(events[2].wait())
+        self.assertEqual([('topic', 'msg0'), ('topic', 'msg2')],
+                         self.published)
+        # The cast after the failure was published after a reset
+        self.assertEqual(2, self.pool.get().resets)
+
+    def test_pipelined_casts(self):
+        ctxt = context.get_admin_context()
+        failed = []
+
+        def _cast(topic, i):
+            try:
+                rpc_amqp.cast(CONF, ctxt, topic, {'method': 'fake', 'i': i},
+                              self.pool, pipelined=True)
+            except test.TestingException:
+                failed.append(i)
+
+        threads = [greenthread.spawn(_cast, topic, i)
+                   for i, topic in enumerate(['topic', 'fail', 'topic'])]
+        for thread in threads:
+            thread.wait()
+        self.assertEqual([1], failed)
+        self.assertEqual(['topic', 'topic'],
+                         [topic for topic, msg in self.published])
+        self.assertIsNone(self.pool.cast_pipeline.sender)
+
+    def test_cleanup_waits_for_queued_casts(self):
+        pipeline = rpc_amqp._get_cast_pipeline(CONF, self.pool)
+        for i in xrange(3):
+            pipeline.add('topic_send', 'topic', 'msg%d' % i)
+        self.assertEqual([], self.published)
+        rpc_amqp.cleanup(self.pool)
+        self.assertEqual(3, len(self.published))
+        self.assertIsNone(FakeConnection.pool)
@@ -0,0 +1,97 @@
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the publisher cache of the kombu RPC driver."""
+
+from oslo.config import cfg
+
+from nova.openstack.common.rpc import impl_kombu
+from nova import test
+
+CONF = cfg.CONF
+
+
+class KombuPublisherCacheTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(KombuPublisherCacheTestCase, self).setUp()
+        self.flags(fake_rabbit=True, rabbit_publisher_cache_size=2)
+        self.conn = impl_kombu.Connection(CONF)
+        self.addCleanup(self.conn.close)
+
+    def test_get_publisher_cached(self):
+        publisher = self.conn.get_publisher(impl_kombu.TopicPublisher, 'a')
+        self.assertIs(publisher,
+                      self.conn.get_publisher(impl_kombu.TopicPublisher, 'a'))
+        self.assertIsNot(publisher,
+                         self.conn.get_publisher(impl_kombu.NotifyPublisher,
+                                                 'a'))
+
+    def test_get_publisher_lru(self):
+        get_publisher = self.conn.get_publisher
+        publisher_a = get_publisher(impl_kombu.TopicPublisher, 'a')
+        publisher_b = get_publisher(impl_kombu.TopicPublisher, 'b')
+        self.assertIs(publisher_a,
+                      get_publisher(impl_kombu.TopicPublisher, 'a'))
+        # b is the least recently used publisher
+        get_publisher(impl_kombu.TopicPublisher, 'c')
+        self.assertEqual(2, len(self.conn.publishers))
+        self.assertIs(publisher_a,
+                      get_publisher(impl_kombu.TopicPublisher, 'a'))
+        self.assertIsNot(publisher_b,
+                         get_publisher(impl_kombu.TopicPublisher, 'b'))
+
+    def test_get_publisher_cache_disabled(self):
+        self.flags(rabbit_publisher_cache_size=0)
+        self.assertIsNot(
+                self.conn.get_publisher(impl_kombu.TopicPublisher, 'a'),
+                self.conn.get_publisher(impl_kombu.TopicPublisher, 'a'))
+        self.assertEqual({}, self.conn.publishers)
+
+    def test_get_publisher_auto_delete_not_cached(self):
+        for cls in (impl_kombu.DirectPublisher, impl_kombu.FanoutPublisher):
+            self.assertIsNot(self.conn.get_publisher(cls, 'a'),
+                             self.conn.get_publisher(cls, 'a'))
+        self.assertEqual({}, self.conn.publishers)
+
+    def test_reset_keeps_publishing_channel(self):
+        self.conn.topic_send('a', 'msg')
+        channel = self.conn.channel
+        self.conn.reset()
+        self.assertIs(channel, self.conn.channel)
+        self.assertEqual(1, len(self.conn.publishers))
+
+    def test_reset_replaces_consuming_channel(self):
+        self.conn.topic_send('a', 'msg')
+        self.conn.declare_topic_consumer('b', lambda message: None)
+        channel = self.conn.channel
+        self.conn.reset()
+        self.assertIsNot(channel, self.conn.channel)
+        self.assertEqual({}, self.conn.publishers)
+
+    def test_publisher_send_error_clears_publishers(self):
+        self.conn.topic_send('a', 'msg')
+        channel = self.conn.channel
+
+        def fake_send(msg, timeout=None):
+            raise test.TestingException()
+
+        publisher = self.conn.get_publisher(impl_kombu.TopicPublisher, 'b')
+        self.stubs.Set(publisher, 'send', fake_send)
+        self.assertRaises(test.TestingException, self.conn.topic_send,
+                          'b', 'msg')
+        self.assertEqual({}, self.conn.publishers)
+        # The channel is not used again
+        self.conn.reset()
+        self.assertIsNot(channel, self.conn.channel)
@@ -21,8 +21,10 @@ import importlib
 import os
 import os.path
 import StringIO
+import sys
 import tempfile
 
+import fixtures
 import mox
 import netaddr
 from oslo.config import cfg
@@ -30,6 +32,7 @@ from oslo.config import cfg
 import nova
 from nova import exception
 from nova.openstack.common import processutils
+from nova.openstack.common.rootwrap import client as rootwrap_client
 from nova.openstack.common import timeutils
 from nova import test
 from nova import utils
@@ -568,6 +571,84 @@ class MkfsTestCase(test.NoDBTestCase):
         utils.mkfs('swap', '/my/swap/block/dev', 'swap-vol')
 
 
+class RootwrapDaemonTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(RootwrapDaemonTestCase, self).setUp()
+        self.flags(use_rootwrap_daemon=True)
+        self.stubs.Set(os, 'geteuid', lambda: 1000)
+
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        filters_path = os.path.join(tmpdir, 'rootwrap.d')
+        os.mkdir(filters_path)
+        with open(os.path.join(filters_path, 'test.filters'), 'w') as f:
+            f.write('[Filters]\n'
+                    'echo: CommandFilter, echo, root\n'
+                    'cat: CommandFilter, cat, root\n'
+                    'false: CommandFilter, false, root\n')
+        config = os.path.join(tmpdir, 'rootwrap.conf')
+        with open(config, 'w') as f:
+            f.write('[DEFAULT]\n'
+                    'filters_path=%s\n'
+                    'exec_dirs=/bin,/usr/bin\n' % filters_path)
+
+        # Run the daemon as the test user, rather than through sudo.
+        self.client = rootwrap_client.Client(
+            [sys.executable, '-c',
+             'from nova.openstack.common.rootwrap import cmd; cmd.daemon()',
+             config])
+        self.addCleanup(self.client.stop)
+        self.stubs.Set(utils, '_get_rootwrap_client', lambda: self.client)
+
+    def test_execute(self):
+        self.assertEqual(('foo\n', ''),
+                         utils.execute('echo', 'foo', run_as_root=True))
+        self.assertEqual(('bar', ''),
+                         utils.execute('cat', process_input='bar',
+                                       run_as_root=True))
+
+    def test_execute_exit_code(self):
+        exc = self.assertRaises(processutils.ProcessExecutionError,
+                                utils.execute, 'false', run_as_root=True)
+        self.assertEqual(1, exc.exit_code)
+        self.assertEqual(('', ''), utils.execute('false', run_as_root=True,
+                                                 check_exit_code=[1]))
+
+    def test_execute_unauthorized(self):
+        exc = self.assertRaises(processutils.ProcessExecutionError,
+                                utils.execute, 'ls', run_as_root=True)
+        self.assertEqual(99, exc.exit_code)
+        self.assertIn('Unauthorized command', exc.stderr)
+
+    def test_execute_unknown_argument(self):
+        self.assertRaises(processutils.UnknownArgumentError,
+                          utils.execute, 'echo', run_as_root=True, foo=True)
+
+    def test_trycmd(self):
+        self.assertEqual(('foo\n', ''),
+                         utils.trycmd('echo', 'foo', run_as_root=True))
+        out, err = utils.trycmd('false', run_as_root=True)
+        self.assertEqual('', out)
+        self.assertIn('Exit code: 1', err)
+
+    def test_execute_not_root(self):
+        self.mox.StubOutWithMock(processutils, 'execute')
+        processutils.execute('echo', 'foo', run_as_root=False,
+                             root_helper=utils._get_root_helper())
+        self.mox.ReplayAll()
+
+        utils.execute('echo', 'foo', run_as_root=False)
+
+    def test_execute_disabled(self):
+        self.flags(use_rootwrap_daemon=False)
+        self.mox.StubOutWithMock(processutils, 'execute')
+        processutils.execute('echo', 'foo', run_as_root=True,
+                             root_helper=utils._get_root_helper())
+        self.mox.ReplayAll()
+
+        utils.execute('echo', 'foo', run_as_root=True)
+
+
 class LastBytesTestCase(test.NoDBTestCase):
     """Test the last_bytes() utility method."""
 
@@ -74,6 +74,12 @@ VIR_DOMAIN_SHUTDOWN = 4
 VIR_DOMAIN_SHUTOFF = 5
 VIR_DOMAIN_CRASHED = 6
 
+# virConnectListAllDomainsFlags
+VIR_CONNECT_LIST_DOMAINS_RUNNING = 16
+VIR_CONNECT_LIST_DOMAINS_PAUSED = 32
+VIR_CONNECT_LIST_DOMAINS_SHUTOFF = 64
+VIR_CONNECT_LIST_DOMAINS_OTHER = 128
+
 VIR_DOMAIN_XML_SECURE = 1
 
 VIR_DOMAIN_EVENT_ID_LIFECYCLE = 0
@@ -588,6 +594,19 @@ class Connection(object):
     def listDomainsID(self):
         return self._running_vms.keys()
 
+    def listAllDomains(self, flags):
+        filters = {VIR_CONNECT_LIST_DOMAINS_RUNNING: VIR_DOMAIN_RUNNING,
+                   VIR_CONNECT_LIST_DOMAINS_PAUSED: VIR_DOMAIN_PAUSED,
+                   VIR_CONNECT_LIST_DOMAINS_SHUTOFF: VIR_DOMAIN_SHUTOFF}
+        if not flags:
+            return self._vms.values()
+        states = set(state for flag, state in filters.items()
+                     if flags & flag)
+        other = flags & VIR_CONNECT_LIST_DOMAINS_OTHER
+        return [vm for vm in self._vms.values()
+                if vm._state in states or
+                (other and vm._state not in filters.values())]
+
     def lookupByID(self, id):
         if id in self._running_vms:
             return self._running_vms[id]
@@ -23,6 +23,7 @@ import json
 import os
 import time
 
+import fixtures
 from oslo.config import cfg
 
 from nova import conductor
@@ -423,6 +424,41 @@ class ImageCacheManagerTestCase(test.NoDBTestCase):
             self.assertEqual(image_cache_manager.removable_base_files, [])
             self.assertEqual(image_cache_manager.corrupt_base_files, [])
 
+    def test_handle_base_image_prefetched(self):
+        self.stubs.Set(virtutils, 'chown', lambda x, y: None)
+        img = '123'
+
+        with self._make_base_file() as fname:
+            os.utime(fname, (-1, time.time() - 3601))
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager.unexplained_images = [fname]
+            image_cache_manager.prefetched_images = set(['123'])
+            image_cache_manager.used_images = {'123': (0, 0, [])}
+            image_cache_manager._handle_base_image(img, fname)
+
+            self.assertEqual(image_cache_manager.unexplained_images, [])
+            self.assertEqual(image_cache_manager.removable_base_files, [])
+            self.assertEqual(image_cache_manager.corrupt_base_files, [])
+
+    def test_get_cached_images(self):
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            base_dir = os.path.join(tmpdir, CONF.image_cache_subdirectory_name)
+            os.mkdir(base_dir)
+            for img in ['123', '456']:
+                open(os.path.join(base_dir, hashlib.sha1(img).hexdigest()),
+                     'w').close()
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            self.assertEqual([], image_cache_manager.get_cached_images())
+
+            image_cache_manager.used_images = {'123': (1, 0, ['inst-1']),
+                                               '789': (1, 0, ['inst-2'])}
+            image_cache_manager.prefetched_images = set(['456'])
+            self.assertEqual(['123', '456'],
+                             image_cache_manager.get_cached_images())
+
     def test_handle_base_image_used_remotely(self):
         self.stubs.Set(virtutils, 'chown', lambda x, y: None)
         img = '123'
@@ -867,3 +903,162 @@ class VerifyChecksumTestCase(test.NoDBTestCase):
             # Checksum requests for a file with no checksum now have the
             # side effect of creating the checksum
             self.assertTrue(os.path.exists(info_fname))
+
+
+class ImageCacheIndexTestCase(test.NoDBTestCase):
+
+    def setUp(self):
+        super(ImageCacheIndexTestCase, self).setUp()
+        self.instances_path = self.useFixture(fixtures.TempDir()).path
+        self.base_dir = os.path.join(self.instances_path, '_base')
+        os.mkdir(self.base_dir)
+        self.flags(instances_path=self.instances_path,
+                   image_cache_subdirectory_name='_base')
+        self.flags(image_cache_index=True, group='libvirt')
+        self.used = hashlib.sha1('1').hexdigest()
+        self.unused = hashlib.sha1('42').hexdigest()
+        self.all_instances = [{'image_ref': '1',
+                               'host': CONF.host,
+                               'name': 'instance-1',
+                               'uuid': '123',
+                               'vm_state': '',
+                               'task_state': ''}]
+
+    def _make_base_file(self, name, age=0):
+        base_file = os.path.join(self.base_dir, name)
+        with open(base_file, 'w') as f:
+            f.write('data')
+        mtime = time.time() - age
+        os.utime(base_file, (mtime, mtime))
+        return base_file
+
+    def _make_instance(self, name, base_file):
+        os.mkdir(os.path.join(self.instances_path, name))
+        disk_path = os.path.join(self.instances_path, name, 'disk')
+        open(disk_path, 'w').close()
+        imagecache.record_base_image_use(base_file, disk_path)
+        return disk_path
+
+    def test_journal(self):
+        used = self._make_base_file(self.used)
+        imagecache.record_base_image(used, checksum='abc')
+        imagecache.record_base_image_use(
+            used, os.path.join(self.instances_path, '123', 'disk'))
+        imagecache.record_base_image_use(
+            used, os.path.join(self.instances_path, '456', 'disk'))
+        imagecache.record_instance_release(
+            os.path.join(self.instances_path, '456'))
+
+        # Not base images
+        swap = self._make_base_file('swap_512')
+        imagecache.record_base_image(swap)
+        imagecache.record_base_image_use(swap, '/dev/nova/swap')
+
+        index = imagecache.ImageCacheIndex(self.base_dir)
+        with open(index.path, 'a') as f:
+            f.write('{"op": "add", "file": \n')
+
+        entries, scanned = index.load()
+        self.assertIsNone(scanned)
+        self.assertEqual([self.used], entries.keys())
+        self.assertEqual(4, entries[self.used]['size'])
+        self.assertEqual('abc', entries[self.used]['sha1'])
+        self.assertEqual(set(['123']), entries[self.used]['instances'])
+
+        index.rewrite(lambda entries: None, scanned=42)
+        self.assertEqual((entries, 42), index.load())
+        imagecache.record_base_image_use(used, '/dev/nova/disk')
+        self.assertEqual(set(['123']),
+                         index.load()[0][self.used]['instances'])
+
+    def test_update_from_index(self):
+        used = self._make_base_file(self.used, age=7 * 24 * 3600)
+        resized = self._make_base_file(self.used + '_10737418240',
+                                       age=7 * 24 * 3600)
+        unused = self._make_base_file(self.unused, age=7 * 24 * 3600)
+        self._make_instance('123', resized)
+        self.stubs.Set(virtutils, 'get_disk_backing_file',
+                       lambda path: resized)
+
+        # The first pass rebuilds the index from a full pass.
+        image_cache_manager = imagecache.ImageCacheManager()
+        image_cache_manager.update(None, self.all_instances)
+        self.assertEqual(sorted([used, resized]),
+                         sorted(image_cache_manager.active_base_files))
+        self.assertFalse(os.path.exists(unused))
+
+        index = imagecache.ImageCacheIndex(self.base_dir)
+        entries, scanned = index.load()
+        self.assertIsNotNone(scanned)
+        self.assertEqual(sorted([self.used, self.used + '_10737418240']),
+                         sorted(entries.keys()))
+        self.assertEqual(set(['123']),
+                         entries[self.used + '_10737418240']['instances'])
+
+        # The next passes do not list the image cache or instances.
+        def listdir(path):
+            self.fail('Unexpected directory listed: %s' % path)
+
+        self.useFixture(fixtures.MonkeyPatch('os.listdir', listdir))
+        unused = self._make_base_file(self.unused, age=7 * 24 * 3600)
+        imagecache.record_base_image(unused)
+        image_cache_manager.update(None, self.all_instances)
+        self.assertEqual(sorted([used, resized]),
+                         sorted(image_cache_manager.active_base_files))
+        self.assertEqual([unused], image_cache_manager.removable_base_files)
+        # Just added to the index
+        self.assertTrue(os.path.exists(unused))
+
+        # The resized image stays in use as long as its instance exists.
+        self.all_instances[0]['image_ref'] = '2'
+        image_cache_manager.update(None, self.all_instances)
+        self.assertEqual([resized], image_cache_manager.active_base_files)
+
+        imagecache.record_instance_release(
+            os.path.join(self.instances_path, '123'))
+        image_cache_manager.update(None, [])
+        self.assertEqual([], image_cache_manager.active_base_files)
+        self.assertEqual(sorted([used, resized, unused]),
+                         sorted(image_cache_manager.removable_base_files))
+
+        # Unused for long enough
+        def update_entries(entries):
+            for entry in entries.itervalues():
+                entry['last_used'] -= 7 * 24 * 3600
+
+        index.rewrite(update_entries)
+        image_cache_manager.update(None, [])
+        for base_file in (used, resized, unused):
+            self.assertFalse(os.path.exists(base_file))
+        self.assertEqual({}, index.load()[0])
+
+    def test_update_from_index_checksums(self):
+        self.flags(checksum_base_images=True, group='libvirt')
+        used = self._make_base_file(self.used)
+        imagecache.record_base_image(used,
+                                     checksum=hashlib.sha1('data').hexdigest())
+        index = imagecache.ImageCacheIndex(self.base_dir)
+        index.rewrite(lambda entries: None, scanned=time.time())
+
+        hashed = []
+        orig_hash_file = imagecache._hash_file
+
+        def hash_file(filename):
+            hashed.append(filename)
+            return orig_hash_file(filename)
+
+        self.stubs.Set(imagecache, '_hash_file', hash_file)
+        image_cache_manager = imagecache.ImageCacheManager()
+        image_cache_manager.update(None, self.all_instances)
+        self.assertEqual([used], hashed)
+        self.assertEqual([], image_cache_manager.corrupt_base_files)
+
+        # Verified recently
+        image_cache_manager.update(None, self.all_instances)
+        self.assertEqual([used], hashed)
+
+        with open(used, 'w') as f:
+            f.write('corrupt')
+        self.flags(checksum_interval_seconds=0, group='libvirt')
+        image_cache_manager.update(None, self.all_instances)
+        self.assertEqual([used], image_cache_manager.corrupt_base_files)
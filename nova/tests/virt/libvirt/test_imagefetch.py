@@ -0,0 +1,142 @@
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import eventlet
+import fixtures
+
+from nova import test
+from nova.virt.libvirt import imagefetch
+
+
+class ImageFetcherTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(ImageFetcherTestCase, self).setUp()
+        self.flags(disable_process_locking=True)
+        self.base_dir = self.useFixture(fixtures.TempDir()).path
+        self.fetches = []
+        self.running = 0
+        self.max_running = 0
+
+    def _fetch_func(self, target, image_id, max_size=0):
+        self.fetches.append(image_id)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            eventlet.sleep(0.01)
+            if image_id == 'bad' or 0 < max_size < 1024:
+                raise test.TestingException()
+            with open(target, 'wb') as f:
+                f.write('x' * 1024)
+        finally:
+            self.running -= 1
+        return 'checksum-%s' % image_id
+
+    def _fetch(self, fetcher, image_id, **kwargs):
+        target = os.path.join(self.base_dir, image_id)
+        return fetcher.fetch(self._fetch_func, target, image_id,
+                             self.base_dir, image_id=image_id, **kwargs)
+
+    def _fetch_all(self, fetcher, image_ids, max_sizes=None):
+        def fetch(image_id, max_size):
+            try:
+                return self._fetch(fetcher, image_id, max_size=max_size)
+            except test.TestingException:
+                return 'error'
+
+        max_sizes = max_sizes or [0] * len(image_ids)
+        threads = [eventlet.spawn(fetch, image_id, max_size)
+                   for image_id, max_size in zip(image_ids, max_sizes)]
+        return [thread.wait() for thread in threads]
+
+    def test_fetch_single_flight(self):
+        fetcher = imagefetch.ImageFetcher()
+        results = self._fetch_all(fetcher, ['a', 'a', 'b', 'a'])
+
+        self.assertEqual(['checksum-a', 'checksum-a', 'checksum-b',
+                          'checksum-a'], results)
+        self.assertEqual(['a', 'b'], sorted(self.fetches))
+        self.assertEqual(2, self.max_running)
+        stats = fetcher.get_stats()
+        self.assertEqual(2, stats['fetches'])
+        self.assertEqual(2, stats['shared'])
+        self.assertEqual(2048, stats['bytes'])
+        self.assertTrue(stats['bytes_per_sec'] > 0)
+
+        # Fetched already
+        self.assertIsNone(self._fetch(fetcher, 'a'))
+        self.assertEqual(['a', 'b'], sorted(self.fetches))
+        self.assertEqual(1, fetcher.get_stats()['hits'])
+
+    def test_fetch_error_not_shared(self):
+        fetcher = imagefetch.ImageFetcher()
+        results = self._fetch_all(fetcher, ['bad', 'bad'])
+
+        # The waiting request tried again
+        self.assertEqual(['error', 'error'], results)
+        self.assertEqual(['bad', 'bad'], self.fetches)
+        stats = fetcher.get_stats()
+        self.assertEqual(2, stats['errors'])
+        self.assertEqual(1, stats['shared'])
+
+        # The next request tries again.
+        self._fetch_all(fetcher, ['bad'])
+        self.assertEqual(['bad', 'bad', 'bad'], self.fetches)
+
+    def test_fetch_error_waiters_use_their_arguments(self):
+        fetcher = imagefetch.ImageFetcher()
+        # The image is too big for the first request only
+        results = self._fetch_all(fetcher, ['a', 'a', 'a'],
+                                  max_sizes=[512, 0, 2048])
+
+        self.assertEqual('error', results[0])
+        # One of the waiters fetched the image, the other found it fetched
+        self.assertEqual([None, 'checksum-a'], sorted(results[1:]))
+        self.assertEqual(['a', 'a'], self.fetches)
+        stats = fetcher.get_stats()
+        self.assertEqual(1, stats['errors'])
+        self.assertEqual(1, stats['fetches'])
+        self.assertEqual(1, stats['hits'])
+
+    def test_fetch_max_concurrent(self):
+        fetcher = imagefetch.ImageFetcher(max_concurrent=1)
+        self._fetch_all(fetcher, ['a', 'b', 'c'])
+
+        self.assertEqual(['a', 'b', 'c'], sorted(self.fetches))
+        self.assertEqual(1, self.max_running)
+        self.assertTrue(fetcher.get_stats()['queue_wait'] > 0)
+
+    def test_log_stats(self):
+        logged = []
+
+        def fake_info(msg, kwargs):
+            logged.append(kwargs)
+
+        self.stubs.Set(imagefetch.LOG, 'info', fake_info)
+        fetcher = imagefetch.ImageFetcher()
+        # Nothing is logged before the first fetch
+        fetcher.log_stats()
+        self.assertEqual([], logged)
+
+        self._fetch_all(fetcher, ['a', 'a'])
+        self._fetch_all(fetcher, ['a'])
+        fetcher.log_stats()
+        self.assertEqual(1, len(logged))
+        self.assertEqual(1, logged[0]['fetches'])
+        self.assertEqual(1024, logged[0]['bytes'])
+        self.assertEqual(1, logged[0]['shared'])
+        self.assertEqual(1, logged[0]['hits'])
+        self.assertTrue(logged[0]['rate'] > 0)
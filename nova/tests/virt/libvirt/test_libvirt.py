@@ -21,6 +21,7 @@ import errno
 import eventlet
 import fixtures
 import functools
+import hashlib
 import mox
 import os
 import re
@@ -1759,6 +1760,92 @@ class LibvirtConnTestCase(test.TestCase):
         # None should be listed, since we fake deleted the last one
         self.assertEqual(len(instances), 0)
 
+    def _fake_domain(self, name, domain_id,
+                     state=libvirt_driver.VIR_DOMAIN_RUNNING):
+        dom = mock.Mock()
+        dom.name.return_value = name
+        dom.ID.return_value = domain_id
+        dom.info.return_value = [state, 2048, 1024, 1, 100]
+        return dom
+
+    def test_get_info_many(self):
+        doms = {
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_RUNNING: [
+                self._fake_domain('Domain-0', 0),
+                self._fake_domain('instance-1', 1),
+                self._fake_domain('not-an-instance', 2)],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_PAUSED: [],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_SHUTOFF: [
+                self._fake_domain('instance-2', -1,
+                                  libvirt_driver.VIR_DOMAIN_SHUTOFF)],
+            libvirt_driver.VIR_CONNECT_LIST_DOMAINS_OTHER: [
+                self._fake_domain('instance-3', 3,
+                                  libvirt_driver.VIR_DOMAIN_CRASHED),
+                self._fake_domain('not-an-instance-2', 4,
+                                  libvirt_driver.VIR_DOMAIN_CRASHED)]}
+        # instance-4 changed state between two listings, instance-5 is gone
+        missing = {'instance-4': self._fake_domain(
+                       'instance-4', 5, libvirt_driver.VIR_DOMAIN_RUNNING)}
+
+        def fake_lookup_by_name(name):
+            if name not in missing:
+                raise libvirt.libvirtError('no domain')
+            return missing[name]
+
+        self.mox.StubOutWithMock(libvirt_driver.LibvirtDriver, '_conn')
+        libvirt_driver.LibvirtDriver._conn.listAllDomains = doms.get
+        libvirt_driver.LibvirtDriver._conn.lookupByName = fake_lookup_by_name
+        self.mox.StubOutWithMock(libvirt.libvirtError, "get_error_code")
+        libvirt.libvirtError.get_error_code().AndReturn(
+            libvirt.VIR_ERR_NO_DOMAIN)
+
+        self.mox.ReplayAll()
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        instances = [{'name': 'instance-%d' % i, 'uuid': 'uuid-%d' % i}
+                     for i in xrange(1, 6)]
+        infos = conn.get_info_many(instances)
+        self.assertEqual({'uuid-1': {'state': power_state.RUNNING, 'id': 1},
+                          'uuid-2': {'state': power_state.SHUTDOWN,
+                                     'id': -1},
+                          'uuid-3': {'state': power_state.CRASHED,
+                                     'id': 3},
+                          'uuid-4': {'state': power_state.RUNNING,
+                                     'id': 5}}, infos)
+        # Only the info of the instances in another state is read
+        for dom_list in doms.values():
+            for dom in dom_list:
+                self.assertEqual(dom.name() == 'instance-3',
+                                 dom.info.called)
+
+    def test_get_info_many_without_list_all_domains(self):
+        doms = {1: self._fake_domain('instance-1', 1),
+                'instance-2': self._fake_domain('instance-2', -1)}
+
+        def fake_list_all_domains(flags):
+            raise libvirt.libvirtError('not supported')
+
+        self.mox.StubOutWithMock(libvirt_driver.LibvirtDriver, '_conn')
+        conn = libvirt_driver.LibvirtDriver._conn
+        conn.listAllDomains = fake_list_all_domains
+        conn.numOfDomains = lambda: 2
+        conn.listDomainsID = lambda: [0, 1]
+        conn.lookupByID = doms.get
+        conn.listDefinedDomains = lambda: ['instance-2']
+        conn.lookupByName = doms.get
+
+        self.mox.StubOutWithMock(libvirt.libvirtError, "get_error_code")
+        libvirt.libvirtError.get_error_code().MultipleTimes().AndReturn(
+            libvirt.VIR_ERR_NO_SUPPORT)
+
+        self.mox.ReplayAll()
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        instances = [{'name': 'instance-1', 'uuid': 'uuid-1'},
+                     {'name': 'instance-2', 'uuid': 'uuid-2'}]
+        infos = conn.get_info_many(instances)
+        self.assertEqual(['uuid-1', 'uuid-2'], sorted(infos))
+        self.assertEqual({'state': power_state.RUNNING, 'id': 1},
+                         infos['uuid-1'])
+
     def test_list_instances_throws_nova_exception(self):
         def fake_lookup(instance_name):
             raise libvirt.libvirtError("we deleted an instance!")
@@ -4387,6 +4474,27 @@ class LibvirtConnTestCase(test.TestCase):
         self.assertFalse(conn.delete_instance_files(inst_obj))
         self.assertTrue(conn.delete_instance_files(inst_obj))
 
+    def test_prefetch_images(self):
+        fetched = []
+
+        def fake_fetch_base_image(fetch_func, filename, context, image_id,
+                                  user_id, project_id):
+            if image_id == 'bad':
+                raise test.TestingException()
+            fetched.append(filename)
+
+        self.stubs.Set(imagebackend, 'fetch_base_image',
+                       fake_fetch_base_image)
+        conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+        self.stubs.Set(conn.image_cache_manager, 'get_cached_images',
+                       lambda: ['cached', 'good'])
+
+        self.assertEqual(['cached', 'good'],
+                         conn.prefetch_images(self.context, ['good', 'bad']))
+        self.assertEqual([hashlib.sha1('good').hexdigest()], fetched)
+        self.assertEqual(set(['good']),
+                         conn.image_cache_manager.prefetched_images)
+
     def test_reboot_different_ids(self):
         class FakeLoopingCall:
             def start(self, *a, **k):
@@ -6825,6 +6933,110 @@ disk size: 4.4M''', ''))
         finally:
             os.unlink(dst_path)
 
+    def _make_sparse_image(self, path):
+        with open(path, 'wb') as f:
+            f.truncate(4 * unit.Mi)
+            f.write('a' * 5000)
+            f.seek(unit.Mi)
+            f.write('b' * 100)
+            f.seek(3 * unit.Mi - 10)
+            f.write('c' * 20)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_copy_image_streams(self):
+        self.flags(image_copy_streams=2, group='libvirt')
+        self.stubs.Set(libvirt_utils, 'COPY_CHUNK_SIZE', 8 * unit.Ki)
+        with utils.tempdir() as tmpdir:
+            src_path = os.path.join(tmpdir, 'src')
+            dst_path = os.path.join(tmpdir, 'dst')
+            data = self._make_sparse_image(src_path)
+
+            libvirt_utils.copy_image(src_path, dst_path)
+            with open(dst_path, 'rb') as fp:
+                self.assertEqual(data, fp.read())
+            self.assertTrue(os.stat(dst_path).st_blocks <=
+                            os.stat(src_path).st_blocks)
+
+    def test_data_extents_unsupported(self):
+        def fake_lseek(fd, offset, whence):
+            raise OSError(errno.EINVAL, 'Invalid argument')
+
+        self.stubs.Set(os, 'lseek', fake_lseek)
+        self.assertEqual([(0, 42)], list(libvirt_utils._data_extents(0, 42)))
+
+    def _stub_ssh(self):
+        """Run the commands sent to the remote host locally."""
+        ssh_commands = []
+        popen = libvirt_utils.subprocess.Popen
+
+        def fake_execute(*args, **kwargs):
+            self.assertEqual(('ssh', 'dest'), args[:2])
+            ssh_commands.append(args[2])
+            self.assertEqual(0, popen(map(str, args[2:])).wait())
+
+        def fake_popen(args, **kwargs):
+            self.assertEqual(['ssh', 'dest'], args[:2])
+            ssh_commands.append('dd')
+            return popen(['sh', '-c'] + args[2:], **kwargs)
+
+        self.stubs.Set(libvirt_utils, 'execute', fake_execute)
+        self.stubs.Set(libvirt_utils.subprocess, 'Popen', fake_popen)
+        return ssh_commands
+
+    def test_copy_image_streams_remote(self):
+        self.stubs.Set(libvirt_utils, 'COPY_CHUNK_SIZE', 8 * unit.Ki)
+        ssh_commands = self._stub_ssh()
+        with utils.tempdir() as tmpdir:
+            src_path = os.path.join(tmpdir, 'src')
+            dst_path = os.path.join(tmpdir, 'dst')
+            data = self._make_sparse_image(src_path)
+            # Left over by an earlier copy
+            with open(dst_path, 'wb') as f:
+                f.write('x' * (5 * unit.Mi))
+
+            copied = libvirt_utils._copy_image_streams(src_path, dst_path,
+                                                       'dest', 3)
+            with open(dst_path, 'rb') as fp:
+                self.assertEqual(data, fp.read())
+
+        self.assertTrue(copied < len(data))
+        # One ssh per stream
+        self.assertEqual(['truncate', 'truncate', 'dd', 'dd', 'dd'],
+                         ssh_commands)
+
+    def test_copy_image_streams_remote_padding(self):
+        self._stub_ssh()
+        with utils.tempdir() as tmpdir:
+            src_path = os.path.join(tmpdir, 'src')
+            dst_path = os.path.join(tmpdir, 'dst')
+            data = 'a' * 5000
+            with open(src_path, 'wb') as f:
+                f.write(data)
+
+            self.assertEqual(5000, libvirt_utils._copy_image_streams(
+                src_path, dst_path, 'dest', 2))
+            with open(dst_path, 'rb') as fp:
+                self.assertEqual(data, fp.read())
+
+    def test_copy_image_streams_remote_error(self):
+        self.stubs.Set(libvirt_utils, 'COPY_CHUNK_SIZE', 8 * unit.Ki)
+        self._stub_ssh()
+        with utils.tempdir() as tmpdir:
+            src_path = os.path.join(tmpdir, 'src')
+            dst_path = os.path.join(tmpdir, 'dst')
+            self._make_sparse_image(src_path)
+
+            def fake_execute(*args, **kwargs):
+                pass
+
+            # The destination is missing, so dd cannot write it
+            self.stubs.Set(libvirt_utils, 'execute', fake_execute)
+            self.assertRaises(processutils.ProcessExecutionError,
+                              libvirt_utils._copy_image_streams,
+                              src_path, os.path.join(dst_path, 'disk'),
+                              'dest', 3)
+
     def test_write_to_file(self):
         dst_fd, dst_path = tempfile.mkstemp()
         try:
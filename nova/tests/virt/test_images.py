@@ -13,6 +13,15 @@
 #    under the License.
 
 
+import hashlib
+import os
+
+import fixtures
+import mox
+
+from nova import exception
+from nova.image import glance
+from nova.openstack.common import imageutils
 from nova import test
 from nova.virt import images
 
@@ -22,3 +31,196 @@ class QemuTestCase(test.NoDBTestCase):
         image_info = images.qemu_img_info("/path/that/does/not/exist")
         self.assertTrue(image_info)
         self.assertTrue(str(image_info))
+
+    def test_detect_format(self):
+        self.assertEqual('raw', images.detect_format('\0' * 512))
+        self.assertEqual('raw', images.detect_format(''))
+        self.assertEqual('qcow2', images.detect_format(
+                         'QFI\xfb\0\0\0\x02' + '\0' * 504))
+        vdi_header = '<<< Oracle VM VirtualBox Disk Image >>>\n'
+        self.assertEqual('vdi', images.detect_format(
+                         vdi_header.ljust(64, '\0') + '\x7f\x10\xda\xbe'))
+
+
+class ImageInfoTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(ImageInfoTestCase, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'disk')
+        self.stubs.Set(images, '_image_info_cache', {})
+
+    def _write_qcow2(self, backing_file='', version=2, nb_snapshots=0):
+        header = images._QCOW2_HEADER.pack(
+            'QFI\xfb', version, 512 if backing_file else 0,
+            len(backing_file), 16, 10 * 1024 * 1024 * 1024, 0, 0, 0, 0, 0,
+            nb_snapshots)
+        with open(self.path, 'wb') as f:
+            f.write(header.ljust(512, '\0'))
+            f.write(backing_file)
+            f.write('\0' * 1024)
+
+    def test_image_info_qcow2(self):
+        self._write_qcow2(backing_file='/base/image')
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        self.mox.ReplayAll()
+
+        info = images.image_info(self.path)
+        self.assertEqual('qcow2', info.file_format)
+        self.assertEqual(10 * 1024 * 1024 * 1024, info.virtual_size)
+        self.assertEqual(65536, info.cluster_size)
+        self.assertEqual('/base/image', info.backing_file)
+
+    def test_image_info_qcow2_relative_backing_file(self):
+        self._write_qcow2(backing_file='base', version=3)
+        info = images.image_info(self.path)
+        self.assertEqual(os.path.join(os.path.dirname(self.path), 'base'),
+                         info.backing_file)
+
+    def test_image_info_raw(self):
+        with open(self.path, 'wb') as f:
+            f.write('x' * 2048)
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        self.mox.ReplayAll()
+
+        info = images.image_info(self.path)
+        self.assertEqual('raw', info.file_format)
+        self.assertEqual(2048, info.virtual_size)
+        self.assertIsNone(info.backing_file)
+
+    def test_image_info_falls_back_to_qemu_img(self):
+        self._write_qcow2(nb_snapshots=1)
+        info = imageutils.QemuImgInfo()
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        images.qemu_img_info(self.path).AndReturn(info)
+        images.qemu_img_info('/does/not/exist').AndReturn(info)
+        self.mox.ReplayAll()
+
+        self.assertEqual(info, images.image_info(self.path))
+        self.assertEqual(info, images.image_info('/does/not/exist'))
+
+    def test_image_info_cached_until_the_file_changes(self):
+        self._write_qcow2(backing_file='/base/image')
+        info = images.image_info(self.path)
+        self.assertIs(info, images.image_info(self.path))
+
+        self._write_qcow2()
+        st = os.stat(self.path)
+        os.utime(self.path, (st.st_atime, st.st_mtime + 1))
+        self.assertIsNone(images.image_info(self.path).backing_file)
+
+    def test_image_info_not_cached_for_devices(self):
+        info = imageutils.QemuImgInfo()
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        images.qemu_img_info('/dev/null').AndReturn(info)
+        images.qemu_img_info('/dev/null').AndReturn(info)
+        self.mox.ReplayAll()
+
+        self.assertEqual(info, images.image_info('/dev/null'))
+        self.assertEqual(info, images.image_info('/dev/null'))
+        self.assertEqual({}, images._image_info_cache)
+
+
+class FetchToRawTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(FetchToRawTestCase, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'image')
+
+    def _stub_fetch(self, image_data):
+        def fake_fetch(context, image_href, path, user_id, project_id,
+                       max_size=0):
+            with open(path, 'wb') as f:
+                f.write(image_data)
+            digest = glance.ImageDigest()
+            digest.update(image_data)
+            digest.verify(image_href)
+            return digest
+
+        self.stubs.Set(images, 'fetch', fake_fetch)
+
+    def _info(self, file_format, virtual_size=1024):
+        info = imageutils.QemuImgInfo()
+        info.file_format = file_format
+        info.virtual_size = virtual_size
+        return info
+
+    def test_fetch_to_raw_raw_image(self):
+        image_data = 'x' * 1024
+        self._stub_fetch(image_data)
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        images.qemu_img_info(self.path + '.part').AndReturn(self._info('raw'))
+        self.mox.ReplayAll()
+
+        checksum = images.fetch_to_raw('context', 'fake-image', self.path,
+                                       'fake', 'fake', max_size=1024)
+        self.assertEqual(hashlib.sha1(image_data).hexdigest(), checksum)
+        with open(self.path) as f:
+            self.assertEqual(image_data, f.read())
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+    def test_fetch_to_raw_raw_image_too_big(self):
+        self._stub_fetch('x' * 1024)
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        images.qemu_img_info(self.path + '.part').AndReturn(self._info('raw'))
+        self.mox.ReplayAll()
+
+        self.assertRaises(exception.FlavorDiskTooSmall, images.fetch_to_raw,
+                          'context', 'fake-image', self.path, 'fake', 'fake',
+                          max_size=512)
+        self.assertFalse(os.path.exists(self.path + '.part'))
+
+    def test_fetch_to_raw_vmdk_descriptor(self):
+        # No magic string qemu-img detects first, but still a vmdk image
+        image_data = 'version=1\nCID=fffffffe\nparentCID=ffffffff\n'
+        self.assertEqual('raw', images.detect_format(image_data))
+        self._stub_fetch(image_data)
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        self.mox.StubOutWithMock(images, 'convert_image')
+        images.qemu_img_info(self.path + '.part').AndReturn(
+                self._info('vmdk'))
+        images.convert_image(self.path + '.part', self.path + '.converted',
+                             'raw').WithSideEffects(
+                lambda source, dest, fmt: open(dest, 'wb').close())
+        images.qemu_img_info(self.path + '.converted').AndReturn(
+                self._info('raw'))
+        self.mox.ReplayAll()
+
+        checksum = images.fetch_to_raw('context', 'fake-image', self.path,
+                                       'fake', 'fake')
+        self.assertIsNone(checksum)
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_fetch_to_raw_checks_other_formats(self):
+        self._stub_fetch('QFI\xfb' + '\0' * 1020)
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        info = imageutils.QemuImgInfo()
+        info.file_format = 'qcow2'
+        info.backing_file = '/etc/shadow'
+        images.qemu_img_info(self.path + '.part').AndReturn(info)
+        self.mox.ReplayAll()
+
+        self.assertRaises(exception.ImageUnacceptable, images.fetch_to_raw,
+                          'context', 'fake-image', self.path, 'fake', 'fake')
+
+    def test_fetch_verifies_checksum(self):
+        image_service = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(glance, 'get_remote_image_service')
+        glance.get_remote_image_service('context', 'fake-image').AndReturn(
+            (image_service, 'fake-image'))
+        image_service.show('context', 'fake-image').AndReturn(
+            {'checksum': 'fake-checksum'})
+
+        def fake_download(context, image_id, dst_path=None, digest=None):
+            with open(dst_path, 'wb') as f:
+                f.write('data')
+            digest.update('data')
+            digest.verify(image_id)
+
+        image_service.download('context', 'fake-image', dst_path=self.path,
+                               digest=mox.IgnoreArg()).WithSideEffects(
+                                   fake_download)
+        self.mox.ReplayAll()
+
+        self.assertRaises(exception.ImageChecksumMismatch, images.fetch,
+                          'context', 'fake-image', self.path, 'fake', 'fake')
+        self.assertFalse(os.path.exists(self.path))
@@ -470,6 +470,16 @@ class _VirtDriverTestCase(_FakeDriverBackendTestCase):
         self.assertIn('num_cpu', info)
         self.assertIn('cpu_time', info)
 
+    @catch_notimplementederror
+    def test_get_info_many(self):
+        instance_ref, network_info = self._get_running_instance()
+        unknown = {'name': 'I just made this name up',
+                   'uuid': 'fake-uuid'}
+        infos = self.connection.get_info_many([instance_ref, unknown])
+        self.assertEqual([instance_ref['uuid']], infos.keys())
+        self.assertEqual(self.connection.get_info(instance_ref)['state'],
+                         infos[instance_ref['uuid']]['state'])
+
     @catch_notimplementederror
     def test_get_info_for_unknown_instance(self):
         self.assertRaises(exception.NotFound,
@@ -26,6 +26,7 @@ import sys
 
 from oslo.config import cfg
 
+from nova import exception
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
@@ -155,6 +156,30 @@ class ComputeDriver(object):
         # TODO(Vek): Need to pass context in for access to auth_token
         raise NotImplementedError()
 
+    def get_info_many(self, instances):
+        """Get the current status of several instances at once.
+
+        Returns a dict mapping the uuid of every instance found on the
+        hypervisor to a dict with at least the 'state' of the instance,
+        one of the power_state codes.  Drivers which can list the states
+        without the other keys returned by get_info() may leave them out.
+        Instances that are not found are left out.
+
+        .. note::
+
+            This implementation works for all drivers, but it calls
+            get_info() once per instance. Maintainers of the virt drivers
+            are encouraged to override this method with a single call to
+            the hypervisor.
+        """
+        infos = {}
+        for instance in instances:
+            try:
+                infos[instance['uuid']] = self.get_info(instance)
+            except exception.InstanceNotFound:
+                pass
+        return infos
+
     def get_num_instances(self):
         """Return the total number of virtual machines.
 
@@ -948,6 +973,14 @@ class ComputeDriver(object):
         """
         pass
 
+    def prefetch_images(self, context, image_ids):
+        """Download images into the driver's local image cache.
+
+        The images are kept in the cache, as if instances used them, until
+        the next call. Returns the ids of the images in the cache.
+        """
+        raise NotImplementedError()
+
     def add_to_aggregate(self, context, aggregate, host, **kwargs):
         """Add a compute host to an aggregate."""
         #NOTE(jogo) Currently only used for XenAPI-Pool
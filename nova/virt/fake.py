@@ -253,7 +253,16 @@ class FakeDriver(driver.ComputeDriver):
     def get_info(self, instance):
         if instance['name'] not in self.instances:
             raise exception.InstanceNotFound(instance_id=instance['name'])
-        i = self.instances[instance['name']]
+        return self._get_info(self.instances[instance['name']])
+
+    def get_info_many(self, instances):
+        uuids = dict((instance['name'], instance['uuid'])
+                     for instance in instances)
+        return dict((uuids[name], self._get_info(i))
+                    for name, i in self.instances.iteritems()
+                    if name in uuids)
+
+    def _get_info(self, i):
         return {'state': i.state,
                 'max_mem': 0,
                 'mem': 0,
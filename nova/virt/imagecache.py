@@ -39,6 +39,27 @@ imagecache_opts = [
                help='Unused unresized base images younger than this will not '
                     'be removed',
                deprecated_group='libvirt'),
+    cfg.IntOpt('image_prefetch_interval',
+               default=0,
+               help='Number of seconds between two pre-fetches of the images '
+                    'booted the most recently into the image cache, so that '
+                    'the instances booting from them do not wait for their '
+                    'download. 0 to disable'),
+    cfg.IntOpt('image_prefetch_count',
+               default=5,
+               help='Number of the images booted the most recently which '
+                    'are pre-fetched into the image cache'),
+    cfg.IntOpt('image_prefetch_window',
+               default=86400,
+               help='Number of seconds of instance boots counted to find the '
+                    'images booted the most recently'),
+    cfg.IntOpt('image_prefetch_disk_budget_gb',
+               default=20,
+               help='Maximum total size in GB of the images pre-fetched into '
+                    'the image cache. The pre-fetched images are kept in the '
+                    'image cache as long as they are among the images booted '
+                    'the most, and are then removed like any other unused '
+                    'base image'),
     ]
 
 CONF = cfg.CONF
@@ -22,6 +22,8 @@ Handling of VM disk images.
 """
 
 import os
+import stat
+import struct
 
 from oslo.config import cfg
 
@@ -44,6 +46,39 @@ image_opts = [
 CONF = cfg.CONF
 CONF.register_opts(image_opts)
 
+# The magic strings, and their offsets, of the image formats qemu-img
+# detects from the start of a file. qemu-img probes some formats further,
+# such as vmdk descriptors without the comment line, so a file without
+# any of these is not necessarily raw to qemu-img.
+_FORMAT_MAGICS = [
+    ('qcow2', 0, 'QFI\xfb'),
+    ('qed', 0, 'QED\x00'),
+    ('vmdk', 0, 'KDMV'),
+    ('vmdk', 0, '# Disk DescriptorFile'),
+    ('vmdk', 0, 'COWD'),
+    ('vdi', 64, '\x7f\x10\xda\xbe'),
+    ('vpc', 0, 'conectix'),
+    ('vhdx', 0, 'vhdxfile'),
+    ('cloop', 0, '#!/bin/sh\n#V2.0 Format\n'),
+    ('bochs', 0, 'Bochs Virtual HD Image'),
+    ('parallels', 0, 'WithoutFreeSpace'),
+    ('parallels', 0, 'WithouFreSpacExt'),
+    ('cow', 0, 'OOOM'),
+    ('luks', 0, 'LUKS\xba\xbe'),
+]
+
+# The qcow2 header fields up to nb_snapshots: magic, version,
+# backing_file_offset, backing_file_size, cluster_bits, size,
+# crypt_method, l1_size, l1_table_offset, refcount_table_offset,
+# refcount_table_clusters and nb_snapshots.
+_QCOW2_HEADER = struct.Struct('>4sIQIIQIIQQII')
+_QCOW2_MAX_BACKING_FILE_SIZE = 1023
+
+# The image infos read by image_info(), by path, with the stat fields
+# they are valid for.
+_image_info_cache = {}
+_IMAGE_INFO_CACHE_SIZE = 4096
+
 
 def qemu_img_info(path):
     """Return an object containing the parsed output from qemu-img info."""
@@ -57,6 +92,102 @@ def qemu_img_info(path):
     return imageutils.QemuImgInfo(out)
 
 
+def _read_qcow2_info(path, f, header, info):
+    if len(header) < _QCOW2_HEADER.size:
+        return None
+    (_magic, version, backing_file_offset, backing_file_size, cluster_bits,
+     size, crypt_method, _l1_size, _l1_table_offset,
+     _refcount_table_offset, _refcount_table_clusters,
+     nb_snapshots) = _QCOW2_HEADER.unpack_from(header)
+    # Leave the snapshot lists and encrypted images to qemu-img.
+    if version not in (2, 3) or crypt_method or nb_snapshots:
+        return None
+
+    if backing_file_offset:
+        if backing_file_size > _QCOW2_MAX_BACKING_FILE_SIZE:
+            return None
+        f.seek(backing_file_offset)
+        backing_file = f.read(backing_file_size)
+        if len(backing_file) != backing_file_size or ':' in backing_file:
+            return None
+        # Like the actual path qemu-img reports for relative backing files
+        info.backing_file = os.path.join(os.path.dirname(path),
+                                         backing_file)
+
+    info.file_format = 'qcow2'
+    info.virtual_size = size
+    info.cluster_size = 1 << cluster_bits
+    return info
+
+
+def _read_image_info(path, st):
+    """Read the info of a raw or qcow2 image from its header.
+
+    Returns None for the other formats.
+    """
+    info = imageutils.QemuImgInfo()
+    info.image = path
+    info.disk_size = st.st_blocks * 512
+    with open(path, 'rb') as f:
+        header = f.read(512)
+        fmt = detect_format(header)
+        if fmt == 'raw':
+            info.file_format = 'raw'
+            info.virtual_size = st.st_size
+            return info
+        elif fmt == 'qcow2':
+            return _read_qcow2_info(path, f, header, info)
+    return None
+
+
+def image_info(path):
+    """Return the format, virtual size and backing file of an image.
+
+    The headers of raw and qcow2 images are read here rather than by
+    forking qemu-img, and the results are kept until the file changes.
+    The other images are left to qemu_img_info(), as well as the paths
+    which are not regular files, like block devices, whose changes do not
+    show in their stat() results.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return qemu_img_info(path)
+    if not stat.S_ISREG(st.st_mode):
+        return qemu_img_info(path)
+    stamp = (st.st_mtime, st.st_ino, st.st_size)
+    cached = _image_info_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    try:
+        data = _read_image_info(path, st)
+    except IOError as e:
+        LOG.debug(_("Could not read the header of %(path)s: %(e)s"),
+                  {'path': path, 'e': e})
+        data = None
+    if data is None:
+        data = qemu_img_info(path)
+
+    if len(_image_info_cache) >= _IMAGE_INFO_CACHE_SIZE:
+        _image_info_cache.clear()
+    _image_info_cache[path] = (stamp, data)
+    return data
+
+
+def detect_format(header):
+    """Return the format of an image from its first 512 bytes.
+
+    The result is a hint: the headers of the formats found still need to
+    be checked by qemu-img, and 'raw' only means that none of the magic
+    strings above was found.
+    """
+    for fmt, offset, magic in _FORMAT_MAGICS:
+        if header[offset:offset + len(magic)] == magic:
+            return fmt
+    return 'raw'
+
+
 def convert_image(source, dest, out_format, run_as_root=False):
     """Convert image to other format."""
     cmd = ('qemu-img', 'convert', '-O', out_format, source, dest)
@@ -64,23 +195,39 @@ def convert_image(source, dest, out_format, run_as_root=False):
 
 
 def fetch(context, image_href, path, _user_id, _project_id, max_size=0):
+    """Download an image to path, returning the ImageDigest of its data."""
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
     #             checked before we got here.
     (image_service, image_id) = glance.get_remote_image_service(context,
                                                                 image_href)
+    image_meta = image_service.show(context, image_id)
+    digest = glance.ImageDigest(expected_md5=image_meta.get('checksum'))
     with fileutils.remove_path_on_error(path):
-        image_service.download(context, image_id, dst_path=path)
+        image_service.download(context, image_id, dst_path=path,
+                               digest=digest)
+    return digest
 
 
 def fetch_to_raw(context, image_href, path, user_id, project_id, max_size=0):
+    """Fetch an image and convert it to raw if needed.
+
+    Returns the sha1 of the image written to path when it was computed
+    while downloading, None otherwise.
+    """
     path_tmp = "%s.part" % path
-    fetch(context, image_href, path_tmp, user_id, project_id,
-          max_size=max_size)
+    digest = fetch(context, image_href, path_tmp, user_id, project_id,
+                   max_size=max_size)
 
     with fileutils.remove_path_on_error(path_tmp):
+        # NOTE: The downloaded images are always checked by qemu-img,
+        # which finds more than the headers read by image_info(), like
+        # the descriptors of vmdk images with extents in other files.
         data = qemu_img_info(path_tmp)
+        checksum = None
+        if digest is not None and digest.complete:
+            checksum = digest.sha1.hexdigest()
 
         fmt = data.file_format
         if fmt is None:
@@ -125,5 +272,8 @@ def fetch_to_raw(context, image_href, path, user_id, project_id, max_size=0):
                         data.file_format)
 
                 os.rename(staged, path)
+                checksum = None
         else:
             os.rename(path_tmp, path)
+
+    return checksum
@@ -300,6 +300,12 @@ VIR_DOMAIN_SHUTOFF = 5
 VIR_DOMAIN_CRASHED = 6
 VIR_DOMAIN_PMSUSPENDED = 7
 
+# Filters of listAllDomains() by domain state
+VIR_CONNECT_LIST_DOMAINS_RUNNING = 16
+VIR_CONNECT_LIST_DOMAINS_PAUSED = 32
+VIR_CONNECT_LIST_DOMAINS_SHUTOFF = 64
+VIR_CONNECT_LIST_DOMAINS_OTHER = 128
+
 LIBVIRT_POWER_STATE = {
     VIR_DOMAIN_NOSTATE: power_state.NOSTATE,
     VIR_DOMAIN_RUNNING: power_state.RUNNING,
@@ -3306,6 +3312,106 @@ class LibvirtDriver(driver.ComputeDriver):
                     'ex': ex})
             raise exception.NovaException(msg)
 
+    def _list_instance_domains(self):
+        """Return the domains of all the instances, running or not."""
+        # NOTE: listAllDomains() was added in libvirt 0.9.13 and
+        # returns every domain at once.
+        if hasattr(self._conn, 'listAllDomains'):
+            try:
+                return [virt_dom for virt_dom in self._conn.listAllDomains(0)
+                        if virt_dom.ID() != 0]
+            except libvirt.libvirtError as ex:
+                if ex.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                    raise
+
+        domains = []
+        for domain_id in self.list_instance_ids():
+            try:
+                # We skip domains with ID 0 (hypervisors).
+                if domain_id != 0:
+                    domains.append(self._lookup_by_id(domain_id))
+            except exception.InstanceNotFound:
+                # Ignore deleted instance while listing
+                continue
+        for domain_name in self._conn.listDefinedDomains():
+            try:
+                domains.append(self._lookup_by_name(domain_name))
+            except exception.InstanceNotFound:
+                continue
+        return domains
+
+    def get_info_many(self, instances):
+        """Retrieve the power state of several instances from libvirt.
+
+        With listAllDomains() (libvirt 0.9.13), the domains are listed
+        once per state, running, paused and shut off, which costs three
+        calls whatever the number of domains.  The domains in any other
+        state (crashed, suspended, being shut down) are listed with a
+        fourth call, and their info() is read one domain at a time.
+
+        On an older libvirt, every domain is looked up and its info() is
+        read, one domain at a time.
+
+        The listings are not atomic, so a domain changing state between two
+        of them may be in none.  The instances missing from the listings
+        are looked up one at a time before they are reported missing.
+        """
+        uuids = dict((instance['name'], instance['uuid'])
+                     for instance in instances)
+        infos = {}
+
+        def _add(virt_dom, state):
+            uuid = uuids.get(virt_dom.name())
+            if uuid is not None:
+                infos[uuid] = {'state': state, 'id': virt_dom.ID()}
+
+        # (domains, their power state or None if unknown)
+        domains_by_state = None
+        if hasattr(self._conn, 'listAllDomains'):
+            try:
+                domains_by_state = [
+                    (self._conn.listAllDomains(flag), state)
+                    for flag, state in (
+                        (VIR_CONNECT_LIST_DOMAINS_RUNNING,
+                         power_state.RUNNING),
+                        (VIR_CONNECT_LIST_DOMAINS_PAUSED,
+                         power_state.PAUSED),
+                        (VIR_CONNECT_LIST_DOMAINS_SHUTOFF,
+                         power_state.SHUTDOWN),
+                        (VIR_CONNECT_LIST_DOMAINS_OTHER, None))]
+            except libvirt.libvirtError as ex:
+                if ex.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                    raise
+        if domains_by_state is None:
+            domains_by_state = [(self._list_instance_domains(), None)]
+
+        def _add_info(virt_dom):
+            try:
+                _add(virt_dom, LIBVIRT_POWER_STATE[virt_dom.info()[0]])
+            except libvirt.libvirtError as ex:
+                # The domain may have been deleted since the listing.
+                if ex.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+
+        for domains, state in domains_by_state:
+            for virt_dom in domains:
+                if state is not None:
+                    _add(virt_dom, state)
+                elif virt_dom.name() in uuids:
+                    _add_info(virt_dom)
+
+        for name, uuid in uuids.iteritems():
+            if uuid in infos:
+                continue
+            try:
+                virt_dom = self._conn.lookupByName(name)
+            except libvirt.libvirtError as ex:
+                if ex.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+                continue
+            _add_info(virt_dom)
+        return infos
+
     def get_info(self, instance):
         """Retrieve information from libvirt for a specific instance name.
 
@@ -3899,6 +4005,7 @@ class LibvirtDriver(driver.ComputeDriver):
         stats = self.host_state.get_host_stats(refresh=True)
         stats['supported_instances'] = jsonutils.dumps(
                 stats['supported_instances'])
+        stats['cached_images'] = self.image_cache_manager.get_cached_images()
         return stats
 
     def check_instance_shared_storage_local(self, context, instance):
@@ -4566,6 +4673,28 @@ class LibvirtDriver(driver.ComputeDriver):
         """Manage the local cache of images."""
         self.image_cache_manager.update(context, all_instances)
 
+    def prefetch_images(self, context, image_ids):
+        """Download images into the local cache of images."""
+        prefetched = []
+        for image_id in image_ids:
+            fname = imagecache.get_cache_fname({'image_id': image_id},
+                                               'image_id')
+            try:
+                imagebackend.fetch_base_image(libvirt_utils.fetch_image,
+                                              fname,
+                                              context=context,
+                                              image_id=image_id,
+                                              user_id=context.user_id,
+                                              project_id=context.project_id)
+            except Exception as e:
+                LOG.warn(_('Failed to pre-fetch image %(image_id)s: '
+                           '%(error)s'),
+                         {'image_id': image_id, 'error': e})
+                continue
+            prefetched.append(image_id)
+        self.image_cache_manager.prefetched_images = set(prefetched)
+        return self.image_cache_manager.get_cached_images()
+
     def _cleanup_remote_migration(self, dest, inst_base, inst_base_resize,
                                   shared_storage=False):
         """Used only for cleanup in case migrate_disk_and_power_off fails."""
@@ -4895,6 +5024,7 @@ class LibvirtDriver(driver.ComputeDriver):
             return False
 
         LOG.info(_('Deletion of %s complete'), target, instance=instance)
+        imagecache.record_instance_release(target)
         return True
 
     @property
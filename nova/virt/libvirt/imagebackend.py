@@ -17,6 +17,7 @@
 
 import abc
 import contextlib
+import functools
 import os
 
 import six
@@ -34,6 +35,8 @@ from nova import utils
 from nova.virt.disk import api as disk
 from nova.virt import images
 from nova.virt.libvirt import config as vconfig
+from nova.virt.libvirt import imagecache
+from nova.virt.libvirt import imagefetch
 from nova.virt.libvirt import utils as libvirt_utils
 
 
@@ -89,6 +92,33 @@ CONF.import_opt('preallocate_images', 'nova.virt.driver')
 LOG = logging.getLogger(__name__)
 
 
+def _create_template(fetch_func, target, *args, **kwargs):
+    checksum = fetch_func(target=target, *args, **kwargs)
+    if checksum and CONF.libvirt.checksum_base_images:
+        imagecache.write_stored_checksum(target, checksum=checksum)
+    imagecache.record_base_image(target, checksum=checksum)
+
+
+def fetch_base_image(fetch_func, filename, *args, **kwargs):
+    """Fetch a base image into the image cache, unless it is there.
+
+    :fetch_func: Function that creates the base image
+    :filename: Name of the file in the image directory
+
+    Returns the path of the base image.
+    """
+    base_dir = os.path.join(CONF.instances_path,
+                            CONF.image_cache_subdirectory_name)
+    fileutils.ensure_tree(base_dir)
+    base = os.path.join(base_dir, filename)
+    if not os.path.exists(base):
+        lock_path = os.path.join(CONF.instances_path, 'locks')
+        imagefetch.get_fetcher().fetch(
+            functools.partial(_create_template, fetch_func), base, filename,
+            lock_path, *args, **kwargs)
+    return base
+
+
 @six.add_metaclass(abc.ABCMeta)
 class Image(object):
 
@@ -165,16 +195,30 @@ class Image(object):
 
         Ensures that template and image not already exists.
         Ensures that base directory exists.
-        Synchronizes on template fetching.
+        Synchronizes on template fetching, the requests for a template
+        being fetched by this host wait for that fetch.
 
         :fetch_func: Function that creates the base image
-                     Should accept `target` argument.
+                     Should accept `target` argument, and may return
+                     the sha1 of the image it created.
         :filename: Name of the file in the image directory
         :size: Size of created image in bytes (optional)
         """
+        def create_template(target, *args, **kwargs):
+            _create_template(fetch_func, target, *args, **kwargs)
+
         @utils.synchronized(filename, external=True, lock_path=self.lock_path)
+        def create_template_locked(target, *args, **kwargs):
+            create_template(target, *args, **kwargs)
+
         def fetch_func_sync(target, *args, **kwargs):
-            fetch_func(target=target, *args, **kwargs)
+            if target != base:
+                # Generated in place, nothing to share.
+                create_template_locked(target, *args, **kwargs)
+            else:
+                imagefetch.get_fetcher().fetch(create_template, target,
+                                               filename, self.lock_path,
+                                               *args, **kwargs)
 
         base_dir = os.path.join(CONF.instances_path,
                                 CONF.image_cache_subdirectory_name)
@@ -185,6 +229,7 @@ class Image(object):
         if not self.check_image_exists() or not os.path.exists(base):
             self.create_image(fetch_func_sync, base, size,
                               *args, **kwargs)
+            imagecache.record_base_image_use(base, self.path)
 
         if (size and self.preallocate and self._can_fallocate() and
                 os.access(self.path, os.W_OK)):
@@ -253,7 +298,7 @@ class Raw(Image):
 
     def correct_format(self):
         if os.path.exists(self.path):
-            data = images.qemu_img_info(self.path)
+            data = images.image_info(self.path)
             self.driver_format = data.file_format or 'raw'
 
     def create_image(self, prepare_template, base, size, *args, **kwargs):
@@ -22,6 +22,7 @@ http://wiki.openstack.org/nova-image-cache-management.
 
 """
 
+import errno
 import hashlib
 import json
 import os
@@ -36,6 +37,7 @@ from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova import utils
 from nova.virt import imagecache
+from nova.virt.libvirt import imagefetch
 from nova.virt.libvirt import utils as virtutils
 
 LOG = logging.getLogger(__name__)
@@ -67,6 +69,20 @@ imagecache_opts = [
                default=3600,
                help='How frequently to checksum base images',
                deprecated_group='DEFAULT'),
+    cfg.BoolOpt('image_cache_index',
+                default=False,
+                help='Keep an index of the base images, with their size, '
+                     'checksum, last use and the instances created from '
+                     'them, in a journal in the image cache directory. The '
+                     'index is updated as instances are spawned and '
+                     'destroyed, and the image cache manager works from it '
+                     'rather than listing the image cache and instance '
+                     'directories on every pass'),
+    cfg.IntOpt('image_cache_index_rescan_interval',
+               default=86400,
+               help='Number of seconds between two full scans of the image '
+                    'cache and instance directories rebuilding the image '
+                    'cache index'),
     ]
 
 CONF = cfg.CONF
@@ -74,6 +90,8 @@ CONF.register_opts(imagecache_opts, 'libvirt')
 CONF.import_opt('instances_path', 'nova.compute.manager')
 CONF.import_opt('image_cache_subdirectory_name', 'nova.virt.imagecache')
 
+INDEX_FILENAME = 'index.journal'
+
 
 def get_cache_fname(images, key):
     """Return a filename based on the SHA1 hash of a given image ID.
@@ -126,6 +144,17 @@ def is_valid_info_file(path):
     return False
 
 
+def _is_base_image(base_dir, ent):
+    """Test if a file of the image cache is named like a base image."""
+
+    digest_size = hashlib.sha1().digestsize * 2
+    if len(ent) == digest_size:
+        return True
+    return (len(ent) > digest_size + 2 and
+            ent[digest_size] == '_' and
+            not is_valid_info_file(os.path.join(base_dir, ent)))
+
+
 def _read_possible_json(serialized, info_file):
     try:
         d = jsonutils.loads(serialized)
@@ -232,15 +261,196 @@ def read_stored_checksum(target, timestamped=True):
     return read_stored_info(target, field='sha1', timestamped=timestamped)
 
 
-def write_stored_checksum(target):
-    """Write a checksum to disk for a file in _base."""
-    write_stored_info(target, field='sha1', value=_hash_file(target))
+def write_stored_checksum(target, checksum=None):
+    """Write a checksum to disk for a file in _base.
+
+    The file is only read to compute the checksum if it is not given.
+    """
+    if checksum is None:
+        checksum = _hash_file(target)
+    write_stored_info(target, field='sha1', value=checksum)
+
+
+def _new_index_entry():
+    return {'size': None,
+            'sha1': None,
+            'last_used': 0,
+            'verified': None,
+            'instances': set()}
+
+
+class ImageCacheIndex(object):
+    """The index of the base images of an image cache directory.
+
+    The index is a journal of JSON records, one per line: 'add' when a base
+    image is created, 'use' when an instance is created from one, 'release'
+    when the files of an instance are deleted and 'remove' when a base image
+    is removed. The image cache manager folds the journal into an entry per
+    base image, and writes it back as a 'scan' record with the time of the
+    last full scan followed by an 'entry' record per base image.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, INDEX_FILENAME)
+        self.lock_name = 'index-%s' % os.path.basename(base_dir)
+        self.lock_path = os.path.join(CONF.instances_path, 'locks')
+
+    def append(self, record):
+        """Append a record to the journal."""
+        record['time'] = time.time()
+
+        @utils.synchronized(self.lock_name, external=True,
+                            lock_path=self.lock_path)
+        def append_record():
+            with open(self.path, 'a') as f:
+                f.write(jsonutils.dumps(record) + '\n')
+
+        append_record()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.readlines()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return {}, None
+
+        entries = {}
+        scanned = None
+        for line in lines:
+            try:
+                record = jsonutils.loads(line)
+                if record['op'] == 'scan':
+                    scanned = record['time']
+                else:
+                    self._apply(entries, record)
+            except (ValueError, KeyError, TypeError) as e:
+                LOG.warning(_('Skipping invalid image cache index record '
+                              '%(record)r: %(error)s'),
+                            {'record': line.rstrip(), 'error': e})
+        return entries, scanned
+
+    @staticmethod
+    def _apply(entries, record):
+        op = record['op']
+        if op == 'release':
+            for entry in entries.itervalues():
+                entry['instances'].discard(record['instance'])
+        elif op == 'remove':
+            entries.pop(record['file'], None)
+        elif op == 'entry':
+            entry = _new_index_entry()
+            for key in ('size', 'sha1', 'last_used', 'verified'):
+                entry[key] = record[key]
+            entry['instances'] = set(record['instances'])
+            entries[record['file']] = entry
+        elif op in ('add', 'use'):
+            entry = entries.setdefault(record['file'], _new_index_entry())
+            entry['last_used'] = max(entry['last_used'], record['time'])
+            if op == 'add':
+                entry['size'] = record['size']
+                entry['sha1'] = record['sha1'] or entry['sha1']
+            elif record['instance']:
+                entry['instances'].add(record['instance'])
+        else:
+            raise ValueError(_('Unknown operation %s') % op)
+
+    def load(self):
+        """Fold the journal.
+
+        Returns the entries of the base images, keyed by file name, and the
+        time of the last full scan, or None if there was none. The entries
+        are dictionaries with the size and sha1 of the base image, when it
+        was last used and verified, and the set of the instance directories
+        created from it.
+        """
+
+        @utils.synchronized(self.lock_name, external=True,
+                            lock_path=self.lock_path)
+        def read_journal():
+            return self._read()
+
+        return read_journal()
+
+    def rewrite(self, update_func, scanned=None):
+        """Fold the journal, update its entries and write them back.
+
+        update_func is called with the entries while the index is locked,
+        and updates them in place. The time of the last full scan is kept
+        unless scanned is given.
+        """
+
+        @utils.synchronized(self.lock_name, external=True,
+                            lock_path=self.lock_path)
+        def rewrite_journal(scanned):
+            entries, last_scanned = self._read()
+            update_func(entries)
+
+            records = [{'op': 'scan', 'time': scanned or last_scanned}]
+            for name, entry in sorted(entries.iteritems()):
+                record = dict(entry, op='entry', file=name)
+                record['instances'] = sorted(entry['instances'])
+                records.append(record)
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for record in records:
+                    f.write(jsonutils.dumps(record) + '\n')
+            os.rename(tmp_path, self.path)
+
+        rewrite_journal(scanned)
+
+
+def _instance_dir(path):
+    """Return the instance directory a disk is in, if it is in one."""
+    instance_dir = os.path.dirname(os.path.normpath(path))
+    if os.path.dirname(instance_dir) == os.path.normpath(CONF.instances_path):
+        return os.path.basename(instance_dir)
+    return None
+
+
+def record_base_image(base_file, checksum=None):
+    """Record the creation of a base image in the image cache index."""
+    base_dir, name = os.path.split(base_file)
+    if not CONF.libvirt.image_cache_index or not _is_base_image(base_dir,
+                                                                  name):
+        return
+    ImageCacheIndex(base_dir).append({'op': 'add',
+                                      'file': name,
+                                      'size': os.path.getsize(base_file),
+                                      'sha1': checksum})
+
+
+def record_base_image_use(base_file, disk_path):
+    """Record the creation of a disk from a base image in the index."""
+    base_dir, name = os.path.split(base_file)
+    if not CONF.libvirt.image_cache_index or not _is_base_image(base_dir,
+                                                                  name):
+        return
+    ImageCacheIndex(base_dir).append({'op': 'use',
+                                      'file': name,
+                                      'instance': _instance_dir(disk_path)})
+
+
+def record_instance_release(instance_path):
+    """Record the deletion of the files of an instance in the index."""
+    if not CONF.libvirt.image_cache_index:
+        return
+    base_dir = os.path.join(CONF.instances_path,
+                            CONF.image_cache_subdirectory_name)
+    if os.path.exists(base_dir):
+        ImageCacheIndex(base_dir).append(
+            {'op': 'release', 'instance': os.path.basename(instance_path)})
 
 
 class ImageCacheManager(imagecache.ImageCacheManager):
     def __init__(self):
         super(ImageCacheManager, self).__init__()
         self.lock_path = os.path.join(CONF.instances_path, 'locks')
+        # The images kept in the cache as if they were in use.
+        self.prefetched_images = set()
         self._reset_state()
 
     def _reset_state(self):
@@ -249,6 +459,7 @@ class ImageCacheManager(imagecache.ImageCacheManager):
         self.used_images = {}
         self.image_popularity = {}
         self.instance_names = set()
+        self.backing_instances = {}
 
         self.active_base_files = []
         self.corrupt_base_files = []
@@ -274,13 +485,9 @@ class ImageCacheManager(imagecache.ImageCacheManager):
 
         digest_size = hashlib.sha1().digestsize * 2
         for ent in os.listdir(base_dir):
-            if len(ent) == digest_size:
-                self._store_image(base_dir, ent, original=True)
-
-            elif (len(ent) > digest_size + 2 and
-                  ent[digest_size] == '_' and
-                  not is_valid_info_file(os.path.join(base_dir, ent))):
-                self._store_image(base_dir, ent, original=False)
+            if _is_base_image(base_dir, ent):
+                self._store_image(base_dir, ent,
+                                  original=len(ent) == digest_size)
 
         return {'unexplained_images': self.unexplained_images,
                 'originals': self.originals}
@@ -307,6 +514,8 @@ class ImageCacheManager(imagecache.ImageCacheManager):
                             backing_file)
                         if backing_path not in inuse_images:
                             inuse_images.append(backing_path)
+                        self.backing_instances.setdefault(
+                            backing_path, set()).add(ent)
 
                         if backing_path in self.unexplained_images:
                             LOG.warning(_('Instance %(instance)s is using a '
@@ -398,8 +607,9 @@ class ImageCacheManager(imagecache.ImageCacheManager):
                           'base_file': base_file})
 
                 # NOTE(mikal): If the checksum file is missing, then we should
-                # create one. We don't create checksums when we download images
-                # from glance because that would delay VM startup.
+                # create one. Images downloaded from glance have their
+                # checksum written as they are fetched, unless they had
+                # to be converted.
                 if CONF.libvirt.checksum_base_images and create_if_missing:
                     LOG.info(_('%(id)s (%(base_file)s): generating checksum'),
                              {'id': img_id,
@@ -431,17 +641,28 @@ class ImageCacheManager(imagecache.ImageCacheManager):
             LOG.info(_('Base file too young to remove: %s'),
                      base_file)
         else:
-            LOG.info(_('Removing base file: %s'), base_file)
-            try:
-                os.remove(base_file)
-                signature = get_info_filename(base_file)
-                if os.path.exists(signature):
-                    os.remove(signature)
-            except OSError as e:
-                LOG.error(_('Failed to remove %(base_file)s, '
-                            'error was %(error)s'),
-                          {'base_file': base_file,
-                           'error': e})
+            self._delete_base_file(base_file)
+
+    def _delete_base_file(self, base_file):
+        """Remove a base file and its info file.
+
+        Returns True if the base file is gone.
+        """
+        LOG.info(_('Removing base file: %s'), base_file)
+        try:
+            os.remove(base_file)
+            signature = get_info_filename(base_file)
+            if os.path.exists(signature):
+                os.remove(signature)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return True
+            LOG.error(_('Failed to remove %(base_file)s, '
+                        'error was %(error)s'),
+                      {'base_file': base_file,
+                       'error': e})
+            return False
+        return True
 
     def _handle_base_image(self, img_id, base_file):
         """Handle the checks for a single base image."""
@@ -471,7 +692,7 @@ class ImageCacheManager(imagecache.ImageCacheManager):
         if img_id in self.used_images:
             local, remote, instances = self.used_images[img_id]
 
-            if local > 0 or remote > 0:
+            if local > 0 or remote > 0 or img_id in self.prefetched_images:
                 image_in_use = True
                 LOG.info(_('image %(id)s at (%(base_file)s): '
                            'in use: on this node %(local)d local, '
@@ -557,6 +778,150 @@ class ImageCacheManager(imagecache.ImageCacheManager):
         # That's it
         LOG.debug(_('Verification complete'))
 
+    def _verify_indexed_checksum(self, img_id, base_file, entry):
+        """Verify a base image against the checksum in its index entry.
+
+        The image is only read if it was not verified for
+        checksum_interval_seconds. Returns like _verify_checksum.
+        """
+        if not CONF.libvirt.checksum_base_images:
+            return None
+
+        if (entry['verified'] and time.time() - entry['verified'] <
+                CONF.libvirt.checksum_interval_seconds):
+            return True
+
+        if not entry['sha1']:
+            return self._verify_checksum(img_id, base_file)
+
+        if _hash_file(base_file) != entry['sha1']:
+            LOG.error(_('image %(id)s at (%(base_file)s): image '
+                        'verification failed'),
+                      {'id': img_id,
+                       'base_file': base_file})
+            return False
+        return True
+
+    def _age_and_verify_indexed_images(self, index, entries, base_dir):
+        """Age and verify the cached images from the image cache index.
+
+        Unlike _age_and_verify_cached_images, this neither lists the image
+        cache and instance directories nor touches the base images in use:
+        a base image is in use if an instance is running from its image,
+        or was created from it and still exists, and its age is the time
+        since it was last found in use.
+        """
+        LOG.debug(_('Verify base images from the image cache index'))
+        digest_size = hashlib.sha1().digestsize * 2
+        fingerprints = dict((hashlib.sha1(img).hexdigest(), img)
+                            for img in self.used_images)
+        now = time.time()
+        active = set()
+        removable = set()
+        released = {}
+        verified = {}
+
+        for name, entry in sorted(entries.iteritems()):
+            base_file = os.path.join(base_dir, name)
+            img_id = fingerprints.get(name[:digest_size])
+            instances = entry['instances'] & self.instance_names
+            released[name] = entry['instances'] - instances
+
+            if img_id is None and not instances:
+                LOG.debug(_('%s is not in use'), base_file)
+                removable.add(name)
+                self.removable_base_files.append(base_file)
+                continue
+
+            active.add(name)
+            self.active_base_files.append(base_file)
+            if img_id is not None:
+                checksum_result = self._verify_indexed_checksum(
+                    img_id, base_file, entry)
+                if checksum_result is False:
+                    self.corrupt_base_files.append(base_file)
+                elif checksum_result:
+                    verified[name] = now
+
+                # Give other threads a chance to run
+                time.sleep(0)
+
+        if self.active_base_files:
+            LOG.info(_('Active base files: %s'),
+                     ' '.join(self.active_base_files))
+        if self.corrupt_base_files:
+            LOG.info(_('Corrupt base files: %s'),
+                     ' '.join(self.corrupt_base_files))
+        if self.removable_base_files:
+            LOG.info(_('Removable base files: %s'),
+                     ' '.join(self.removable_base_files))
+
+        def update_entries(entries):
+            for name, entry in entries.items():
+                entry['instances'] -= released.get(name, set())
+                if name in verified:
+                    entry['verified'] = verified[name]
+                if name in active:
+                    entry['last_used'] = now
+                    continue
+                if name not in removable or not self.remove_unused_base_images:
+                    continue
+
+                # The entries were folded again with the index locked, so
+                # a base image used since the pass started is too young.
+                base_file = os.path.join(base_dir, name)
+                maxage = CONF.libvirt.remove_unused_resized_minimum_age_seconds
+                if len(name) == digest_size:
+                    maxage = CONF.remove_unused_original_minimum_age_seconds
+                if now - entry['last_used'] < maxage:
+                    LOG.info(_('Base file too young to remove: %s'),
+                             base_file)
+                elif self._delete_base_file(base_file):
+                    del entries[name]
+
+        index.rewrite(update_entries)
+        LOG.debug(_('Verification complete'))
+
+    def _rebuild_index(self, index, base_images, start):
+        """Rebuild the image cache index from a full pass.
+
+        The pass started at start, with base_images in the image cache.
+        """
+        active = set(self.active_base_files)
+        scanned_entries = {}
+        for base_file in base_images:
+            try:
+                stat = os.stat(base_file)
+            except OSError:
+                # Removed by the pass
+                continue
+            entry = _new_index_entry()
+            entry['size'] = stat.st_size
+            entry['last_used'] = stat.st_mtime
+            if base_file in active:
+                entry['last_used'] = start
+            entry['instances'] = self.backing_instances.get(base_file, set())
+            scanned_entries[os.path.basename(base_file)] = entry
+
+        def update_entries(entries):
+            for name, entry in entries.items():
+                scanned_entry = scanned_entries.get(name)
+                if scanned_entry is None:
+                    # Keep the images created since the pass started.
+                    if entry['last_used'] < start:
+                        del entries[name]
+                    continue
+                scanned_entry['sha1'] = entry['sha1']
+                scanned_entry['verified'] = entry['verified']
+                scanned_entry['last_used'] = max(scanned_entry['last_used'],
+                                                 entry['last_used'])
+                scanned_entry['instances'] |= (entry['instances'] &
+                                               self.instance_names)
+            entries.update(scanned_entries)
+
+        LOG.debug(_('Rebuilding the image cache index %s'), index.path)
+        index.rewrite(update_entries, scanned=start)
+
     def _get_base(self):
 
         # NOTE(mikal): The new scheme for base images is as follows -- an
@@ -577,18 +942,47 @@ class ImageCacheManager(imagecache.ImageCacheManager):
             return
         return base_dir
 
+    def get_cached_images(self):
+        """Return the ids of the images in the cache.
+
+        Only the images used by the instances found by the last pass, and
+        the pre-fetched ones, are looked for.
+        """
+        base_dir = self._get_base()
+        if not base_dir:
+            return []
+        image_ids = set(self.used_images) | self.prefetched_images
+        return sorted(img for img in image_ids
+                      if os.path.exists(os.path.join(
+                          base_dir, hashlib.sha1(img).hexdigest())))
+
     def update(self, context, all_instances):
         base_dir = self._get_base()
         if not base_dir:
             return
+        imagefetch.get_fetcher().log_stats()
         # reset the local statistics
         self._reset_state()
-        # read the cached images
-        self._list_base_images(base_dir)
+        start = time.time()
         # read running instances data
         running = self._list_running_instances(context, all_instances)
         self.used_images = running['used_images']
         self.image_popularity = running['image_popularity']
         self.instance_names = running['instance_names']
+        for img in self.prefetched_images:
+            self.used_images.setdefault(img, (0, 0, []))
+        index = None
+        if CONF.libvirt.image_cache_index:
+            index = ImageCacheIndex(base_dir)
+            entries, scanned = index.load()
+            if (scanned is not None and start - scanned <
+                    CONF.libvirt.image_cache_index_rescan_interval):
+                self._age_and_verify_indexed_images(index, entries, base_dir)
+                return
+        # read the cached images
+        base_images = list(self._list_base_images(base_dir)[
+            'unexplained_images'])
         # perform the aging and image verification
         self._age_and_verify_cached_images(context, all_instances, base_dir)
+        if index is not None:
+            self._rebuild_index(index, base_images, start)
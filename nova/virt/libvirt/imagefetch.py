@@ -0,0 +1,203 @@
+# Copyright 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Coordinate the fetches of the base images cached on this host.
+
+The instances booting from the same image at the same time share a single
+download of it, and the number of images downloaded at once is capped.
+"""
+
+import os
+import time
+
+import eventlet
+from eventlet import event
+from eventlet import semaphore
+from oslo.config import cfg
+
+from nova.openstack.common import excutils
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova import unit
+from nova import utils
+
+imagefetch_opts = [
+    cfg.IntOpt('max_concurrent_image_downloads',
+               default=0,
+               help='Maximum number of images downloaded to the image cache '
+                    'at the same time, 0 for no limit. The instances '
+                    'booting from an image being downloaded wait for that '
+                    'download rather than starting another one'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(imagefetch_opts, 'libvirt')
+
+LOG = logging.getLogger(__name__)
+
+# Seconds between two progress messages of the requests waiting for a
+# download.
+PROGRESS_INTERVAL = 10
+
+
+class ImageFetcher(object):
+    """Single flight fetches of the base images of this host."""
+
+    def __init__(self, max_concurrent=None):
+        if max_concurrent is None:
+            max_concurrent = CONF.libvirt.max_concurrent_image_downloads
+        self._semaphore = None
+        if max_concurrent > 0:
+            self._semaphore = semaphore.Semaphore(max_concurrent)
+        # The downloads in progress, by target path.
+        self._flights = {}
+        self.stats = {'fetches': 0,
+                      'shared': 0,
+                      'hits': 0,
+                      'errors': 0,
+                      'bytes': 0,
+                      'fetch_time': 0.0,
+                      'queue_wait': 0.0}
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['bytes_per_sec'] = 0.0
+        if stats['fetch_time']:
+            stats['bytes_per_sec'] = stats['bytes'] / stats['fetch_time']
+        return stats
+
+    def log_stats(self):
+        """Log the statistics of the fetches since this process started."""
+        stats = self.get_stats()
+        if not (stats['fetches'] or stats['shared'] or stats['hits'] or
+                stats['errors']):
+            return
+        LOG.info(_('Image fetches: %(fetches)d downloads of %(bytes)d bytes '
+                   'at %(rate).1f MB/s, %(shared)d shared, %(hits)d already '
+                   'cached, %(errors)d failed, %(queue_wait).1f seconds '
+                   'waited for a download slot'),
+                 {'fetches': stats['fetches'], 'bytes': stats['bytes'],
+                  'rate': stats['bytes_per_sec'] / unit.Mi,
+                  'shared': stats['shared'], 'hits': stats['hits'],
+                  'errors': stats['errors'],
+                  'queue_wait': stats['queue_wait']})
+
+    def fetch(self, fetch_func, target, lock_name, lock_path, *args,
+              **kwargs):
+        """Create target with fetch_func, unless it is being or was created.
+
+        The fetch holds the external lock_name lock, so that the processes
+        sharing the image cache do not fetch target at the same time. The
+        requests for a target this process is fetching wait for that
+        fetch, and get what fetch_func returned.  If that fetch failed,
+        they fetch target themselves with their own arguments, since the
+        failure may come from the arguments of the first request, like
+        its max_size or its context.
+        """
+        flight = self._flights.get(target)
+        if flight is not None:
+            self.stats['shared'] += 1
+            fetched, result = self._wait(flight, target)
+            if fetched:
+                return result
+            return self._fetch(fetch_func, target, lock_name, lock_path,
+                               *args, **kwargs)
+
+        flight = event.Event()
+        self._flights[target] = flight
+        try:
+            result = self._fetch(fetch_func, target, lock_name, lock_path,
+                                 *args, **kwargs)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                flight.send((False, None))
+        else:
+            flight.send((True, result))
+            return result
+        finally:
+            del self._flights[target]
+
+    def _wait(self, flight, target):
+        """Wait for the fetch of target in progress.
+
+        Returns whether it succeeded, and what fetch_func returned.
+        """
+        LOG.debug(_('Waiting for the download of %s in progress'), target)
+        while True:
+            with eventlet.Timeout(PROGRESS_INTERVAL, False):
+                return flight.wait()
+            LOG.debug(_('Still waiting for %(target)s, %(bytes)d bytes '
+                        'downloaded'),
+                      {'target': target, 'bytes': _downloaded(target)})
+
+    def _fetch(self, fetch_func, target, lock_name, lock_path, *args,
+               **kwargs):
+        @utils.synchronized(lock_name, external=True, lock_path=lock_path)
+        def fetch_locked():
+            # Fetched by another request, or process, while we queued.
+            if os.path.exists(target):
+                return False, None
+            return True, fetch_func(target=target, *args, **kwargs)
+
+        queued = time.time()
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        try:
+            start = time.time()
+            self.stats['queue_wait'] += start - queued
+            try:
+                fetched, result = fetch_locked()
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    self.stats['errors'] += 1
+            if not fetched:
+                self.stats['hits'] += 1
+                return result
+
+            elapsed = time.time() - start
+            size = _file_size(target)
+            self.stats['fetches'] += 1
+            self.stats['bytes'] += size
+            self.stats['fetch_time'] += elapsed
+            LOG.debug(_('Fetched %(target)s, %(bytes)d bytes in '
+                        '%(elapsed).1f seconds'),
+                      {'target': target, 'bytes': size, 'elapsed': elapsed})
+            return result
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _downloaded(target):
+    """Return how much of target was downloaded so far."""
+    return _file_size(target + '.part') or _file_size(target)
+
+
+_fetcher = None
+
+
+def get_fetcher():
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = ImageFetcher()
+    return _fetcher
@@ -22,9 +22,16 @@
 
 import errno
 import os
+import pipes
+import sys
+import time
 
+from eventlet.green import subprocess
+from eventlet import greenpool
+from eventlet import tpool
 from lxml import etree
 from oslo.config import cfg
+import six
 
 from nova import exception
 from nova.openstack.common.gettextutils import _
@@ -41,6 +48,12 @@ libvirt_opts = [
                      'currently applies exclusively to qcow2 images',
                 deprecated_group='DEFAULT',
                 deprecated_name='libvirt_snashot_compression'),
+    cfg.IntOpt('image_copy_streams',
+               default=0,
+               help='Number of parallel streams disk images are copied '
+                    'with, reading and sending only the data of sparse '
+                    'images. 0 copies them with cp, or rsync or scp to '
+                    'another host'),
     ]
 
 CONF = cfg.CONF
@@ -48,6 +61,19 @@ CONF.register_opts(libvirt_opts, 'libvirt')
 CONF.import_opt('instances_path', 'nova.compute.manager')
 LOG = logging.getLogger(__name__)
 
+# The lseek(2) whence values finding the data and the holes of sparse files,
+# which the os module does not define.
+SEEK_DATA = 3
+SEEK_HOLE = 4
+
+# Data is copied in chunks of COPY_CHUNK_SIZE bytes, starting at multiples
+# of COPY_BLOCK_SIZE bytes.
+COPY_BLOCK_SIZE = 4 * unit.Ki
+COPY_CHUNK_SIZE = 64 * unit.Mi
+
+# Seconds between two progress messages of a copy.
+COPY_PROGRESS_INTERVAL = 10
+
 
 def execute(*args, **kwargs):
     return utils.execute(*args, **kwargs)
@@ -191,7 +217,7 @@ def create_cow_image(backing_file, path, size=None):
     cow_opts = []
     if backing_file:
         cow_opts += ['backing_file=%s' % backing_file]
-        base_details = images.qemu_img_info(backing_file)
+        base_details = images.image_info(backing_file)
     else:
         base_details = None
     # This doesn't seem to get inherited so force it to...
@@ -429,7 +455,7 @@ def get_disk_size(path):
     :returns: Size (in bytes) of the given disk image as it would be seen
               by a virtual machine.
     """
-    size = images.qemu_img_info(path).virtual_size
+    size = images.image_info(path).virtual_size
     return int(size)
 
 
@@ -439,7 +465,7 @@ def get_disk_backing_file(path, basename=True):
     :param path: Path to the disk image
     :returns: a path to the image's backing store
     """
-    backing_file = images.qemu_img_info(path).backing_file
+    backing_file = images.image_info(path).backing_file
     if backing_file and basename:
         backing_file = os.path.basename(backing_file)
 
@@ -454,7 +480,9 @@ def copy_image(src, dest, host=None):
     :param host: Remote host
     """
 
-    if not host:
+    if CONF.libvirt.image_copy_streams > 0:
+        _copy_image_streams(src, dest, host, CONF.libvirt.image_copy_streams)
+    elif not host:
         # We shell out to cp because that will intelligently copy
         # sparse files.  I.E. holes will not be written to DEST,
         # rather recreated efficiently.  In addition, since
@@ -477,6 +505,195 @@ def copy_image(src, dest, host=None):
             execute('rsync', '--sparse', '--compress', src, dest)
 
 
+def _data_extents(fd, size):
+    """Yield the offset and length of the data extents of a file.
+
+    The whole file is a single extent if finding its holes is not supported.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Only a hole is left
+                return
+            if e.errno == errno.EINVAL and offset == 0:
+                yield 0, size
+                return
+            raise
+        end = min(os.lseek(fd, start, SEEK_HOLE), size)
+        yield start, end - start
+        offset = end
+
+
+def _copy_chunks(extents):
+    """Split data extents into the chunks copied by the streams."""
+    for offset, length in extents:
+        end = offset + length
+        offset -= offset % COPY_BLOCK_SIZE
+        while offset < end:
+            chunk_end = min(end, offset + COPY_CHUNK_SIZE)
+            yield offset, chunk_end - offset
+            offset = chunk_end
+
+
+def _read_block(f, offset, length):
+    """Read length bytes at offset, padded with zeros past the end."""
+    f.seek(offset)
+    data = f.read(length)
+    return data + '\0' * (length - len(data))
+
+
+def _send_chunks_remote(src, dest, host, chunks, copied):
+    """Send chunks of src into dest on host, over a single ssh stream.
+
+    A shell loop on host reads the position and the number of blocks of
+    each chunk, and runs dd to write the data that follows into dest.  The
+    data is read and sent in blocks of at most 1MB, padded with zeros to a
+    whole number of blocks past the end of src.
+    """
+    script = ('while read seek count; do '
+              'out=$(dd of=%(dest)s bs=%(bs)d seek=$seek count=$count '
+              'iflag=fullblock conv=notrunc 2>&1) || '
+              '{ echo "$out" >&2; exit 1; }; done' %
+              {'dest': pipes.quote(dest), 'bs': COPY_BLOCK_SIZE})
+    cmd = ['ssh', host, script]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                            stderr=subprocess.PIPE, close_fds=True)
+    try:
+        with open(src, 'rb') as f:
+            for offset, length in chunks:
+                count = (length + COPY_BLOCK_SIZE - 1) / COPY_BLOCK_SIZE
+                proc.stdin.write('%d %d\n' % (offset / COPY_BLOCK_SIZE,
+                                              count))
+                end = offset + count * COPY_BLOCK_SIZE
+                while offset < end:
+                    block = min(end - offset, unit.Mi)
+                    proc.stdin.write(tpool.execute(_read_block, f, offset,
+                                                   block))
+                    offset += block
+                copied(length)
+    except IOError as e:
+        # The remote dd failed, its error is reported below.
+        if e.errno != errno.EPIPE:
+            raise
+    finally:
+        try:
+            proc.stdin.close()
+        except IOError:
+            pass
+        stderr = proc.stderr.read()
+        proc.wait()
+    if proc.returncode:
+        raise processutils.ProcessExecutionError(exit_code=proc.returncode,
+                                                 stderr=stderr,
+                                                 cmd=' '.join(cmd))
+
+
+def _copy_chunk_local(src, dest, offset, length):
+    with open(src, 'rb') as src_file:
+        with open(dest, 'r+b') as dest_file:
+            src_file.seek(offset)
+            dest_file.seek(offset)
+            while length > 0:
+                data = src_file.read(min(length, unit.Mi))
+                if not data:
+                    break
+                dest_file.write(data)
+                length -= len(data)
+
+
+def _copy_image_streams(src, dest, host, streams):
+    """Copy the data of a disk image over parallel streams.
+
+    The destination is created as sparse as the source: only the data
+    extents of the source are read and written, the holes are skipped.
+    Local copies are made by native threads, remote ones by one dd over
+    ssh per stream.
+    """
+    size = os.path.getsize(src)
+    if host:
+        # Empty the destination first, so that no data left there by an
+        # earlier copy shows through the holes.
+        execute('ssh', host, 'truncate', '-s', 0, dest)
+        execute('ssh', host, 'truncate', '-s', size, dest)
+    else:
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(src))
+        with open(dest, 'wb') as f:
+            f.truncate(size)
+
+    fd = os.open(src, os.O_RDONLY)
+    try:
+        chunks = list(_copy_chunks(_data_extents(fd, size)))
+    finally:
+        os.close(fd)
+
+    target = '%s:%s' % (host, dest) if host else dest
+    progress = {'copied': 0, 'logged': time.time()}
+    errors = []
+    start = time.time()
+
+    def copied(length):
+        progress['copied'] += length
+        now = time.time()
+        if now - progress['logged'] >= COPY_PROGRESS_INTERVAL:
+            progress['logged'] = now
+            LOG.debug(_('Copying %(src)s to %(dest)s: %(copied)d of '
+                        '%(size)d bytes copied, %(rate).1f MB/s'),
+                      {'src': src, 'dest': target,
+                       'copied': progress['copied'], 'size': size,
+                       'rate': progress['copied'] / (now - start) / unit.Mi})
+
+    pool = greenpool.GreenPool(streams)
+    if host:
+        def pending_chunks():
+            for chunk in chunks:
+                if errors:
+                    return
+                yield chunk
+
+        # The streams take the chunks to send from the same iterator.
+        pending = pending_chunks()
+
+        def send():
+            try:
+                _send_chunks_remote(src, dest, host, pending, copied)
+            except Exception:
+                errors.append(sys.exc_info())
+
+        for i in xrange(min(streams, len(chunks))):
+            pool.spawn_n(send)
+    else:
+        def copy(offset, length):
+            try:
+                tpool.execute(_copy_chunk_local, src, dest, offset, length)
+            except Exception:
+                errors.append(sys.exc_info())
+                return
+            copied(length)
+
+        for offset, length in chunks:
+            if errors:
+                break
+            pool.spawn_n(copy, offset, length)
+    pool.waitall()
+    if errors:
+        six.reraise(*errors[0])
+    if host and size % COPY_BLOCK_SIZE:
+        # Drop the padding of the last block.
+        execute('ssh', host, 'truncate', '-s', size, dest)
+
+    elapsed = max(time.time() - start, 0.001)
+    LOG.info(_('Copied %(src)s to %(dest)s: %(copied)d bytes of data of '
+               '%(size)d in %(elapsed).1f seconds, %(rate).1f MB/s'),
+             {'src': src, 'dest': target, 'copied': progress['copied'],
+              'size': size, 'elapsed': elapsed,
+              'rate': progress['copied'] / elapsed / unit.Mi})
+    return progress['copied']
+
+
 def write_to_file(path, contents, umask=None):
     """Write the given contents to a file
 
@@ -590,7 +807,7 @@ def get_disk_type(path):
     elif path.startswith('rbd:'):
         return 'rbd'
 
-    return images.qemu_img_info(path).file_format
+    return images.image_info(path).file_format
 
 
 def get_fs_info(path):
@@ -613,9 +830,12 @@ def get_fs_info(path):
 
 
 def fetch_image(context, target, image_id, user_id, project_id, max_size=0):
-    """Grab image."""
-    images.fetch_to_raw(context, image_id, target, user_id, project_id,
-                        max_size=max_size)
+    """Grab image.
+
+    Returns the sha1 of the image if it was computed while downloading it.
+    """
+    return images.fetch_to_raw(context, image_id, target, user_id,
+                               project_id, max_size=max_size)
 
 
 def get_instance_path(instance, forceold=False, relative=False):
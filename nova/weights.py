@@ -123,13 +123,22 @@ class BaseWeightHandler(loadables.BaseLoader):
     def get_weighed_objects(self, weigher_classes, obj_list,
             weighing_properties):
         """Return a sorted (descending), normalized list of WeighedObjects."""
+        weighers = [weigher_cls() for weigher_cls in weigher_classes]
+        return self.weigh_with(weighers, obj_list, weighing_properties)
+
+    def weigh_with(self, weighers, obj_list, weighing_properties):
+        """Return a sorted (descending), normalized list of WeighedObjects
+        using already instantiated weighers.
+
+        The weighers keep the minval and maxval of this pass, which
+        reweigh_object() uses later on.
+        """
 
         if not obj_list:
             return []
 
         weighed_objs = [self.object_class(obj, 0.0) for obj in obj_list]
-        for weigher_cls in weigher_classes:
-            weigher = weigher_cls()
+        for weigher in weighers:
             weights = weigher.weigh_objects(weighed_objs, weighing_properties)
 
             # Normalize the weights
@@ -142,3 +151,27 @@ class BaseWeightHandler(loadables.BaseLoader):
                 obj.weight += weigher.weight_multiplier() * weight
 
         return sorted(weighed_objs, key=lambda x: x.weight, reverse=True)
+
+    def reweigh_object(self, weighers, obj, weighing_properties):
+        """Return a new WeighedObject for an object which changed since it
+        was weighed.
+
+        The weighers must be the ones passed to weigh_with() for the list
+        the object belongs to.  The weight is normalized against the
+        minval and maxval of that pass, even if it now falls outside of
+        them, or offset by minval when they were equal.  This keeps the
+        order of the objects a new pass would give only when a single
+        weigher has a multiplier; with several, the objects must all be
+        weighed again.
+        """
+        weighed_obj = self.object_class(obj, 0.0)
+        for weigher in weighers:
+            minval, maxval = weigher.minval, weigher.maxval
+            weight = weigher.weigh_objects([weighed_obj],
+                                           weighing_properties)[0]
+            weigher.minval, weigher.maxval = minval, maxval
+
+            range_ = float(maxval - minval) if maxval != minval else 1.0
+            weight = (weight - float(minval)) / range_
+            weighed_obj.weight += weigher.weight_multiplier() * weight
+        return weighed_obj
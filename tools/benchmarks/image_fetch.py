@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Boot --instances instances at the same time from --images images through
+the libvirt Raw image backend, with a fake image service serving every
+download at --rate MB/s, and report how many downloads were made and how
+long booting all the instances took.
+
+This is run once with every request fetching the base image behind the
+image lock, like before the image fetcher, and once with the requests for
+an image being downloaded sharing that download.
+
+Run like:
+
+    ./tools/benchmarks/image_fetch.py --instances 20 --images 2
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# Monkey patch like the nova services do, before eventlet is imported.
+import nova.cmd  # noqa
+
+import eventlet
+from oslo.config import cfg
+
+from nova import context
+from nova.image import glance
+from nova.openstack.common import uuidutils
+from nova.tests.image import fake as fake_image
+from nova import utils
+from nova.virt.libvirt import imagebackend
+from nova.virt.libvirt import imagefetch
+from nova.virt.libvirt import utils as libvirt_utils
+
+CONF = cfg.CONF
+
+CHUNK_SIZE = 64 * 1024
+
+
+class SlowImageService(fake_image._FakeImageService):
+    """Serve the image data in chunks, at a given rate."""
+
+    def __init__(self, rate):
+        super(SlowImageService, self).__init__()
+        self.rate = rate
+        self.downloads = 0
+
+    def download(self, context, image_id, dst_path=None, data=None,
+                 digest=None):
+        self.show(context, image_id)
+        self.downloads += 1
+        image_data = self._imagedata[image_id]
+        with open(dst_path, 'wb') as f:
+            for i in xrange(0, len(image_data), CHUNK_SIZE):
+                chunk = image_data[i:i + CHUNK_SIZE]
+                eventlet.sleep(len(chunk) / self.rate)
+                f.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+        if digest is not None:
+            digest.verify(image_id)
+
+
+class UnsharedFetcher(object):
+    """Fetch like before the image fetcher, every request behind the lock."""
+
+    def fetch(self, fetch_func, target, lock_name, lock_path, *args,
+              **kwargs):
+        @utils.synchronized(lock_name, external=True, lock_path=lock_path)
+        def fetch_locked():
+            fetch_func(target=target, *args, **kwargs)
+
+        fetch_locked()
+
+
+def boot(ctxt, image_id):
+    instance = {'uuid': uuidutils.generate_uuid(),
+                'name': 'instance', 'user_id': 'fake', 'project_id': 'fake'}
+    os.makedirs(libvirt_utils.get_instance_path(instance))
+    image = imagebackend.Raw(instance=instance, disk_name='disk')
+    image.cache(fetch_func=libvirt_utils.fetch_image,
+                context=ctxt,
+                filename=image_id,
+                image_id=image_id,
+                user_id='fake',
+                project_id='fake')
+
+
+def run(args, image_service, image_ids, fetcher):
+    instances_path = tempfile.mkdtemp()
+    CONF.set_override('instances_path', instances_path)
+    imagefetch._fetcher = fetcher
+    image_service.downloads = 0
+    ctxt = context.get_admin_context()
+    try:
+        start = time.time()
+        threads = [eventlet.spawn(boot, ctxt, image_ids[i % len(image_ids)])
+                   for i in xrange(args.instances)]
+        for thread in threads:
+            thread.wait()
+        return time.time() - start, image_service.downloads
+    finally:
+        shutil.rmtree(instances_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instances', type=int, default=20)
+    parser.add_argument('--images', type=int, default=2)
+    parser.add_argument('--size', type=int, default=16,
+                        help='Image size in MB')
+    parser.add_argument('--rate', type=float, default=64,
+                        help='Download rate in MB/s')
+    parser.add_argument('--max-concurrent', type=int, default=0)
+    args = parser.parse_args()
+
+    CONF([], project='nova')
+    image_service = SlowImageService(args.rate * 1024 * 1024)
+    image_ids = []
+    for i in xrange(args.images):
+        image_id = 'image%d' % i
+        image_service.images[image_id] = {'id': image_id}
+        image_service._imagedata[image_id] = (
+            chr(i + 1) * (args.size * 1024 * 1024))
+        image_ids.append(image_id)
+    glance.get_remote_image_service = (
+        lambda context, image_href: (image_service, image_href))
+
+    print('%-12s %10s %10s' % ('mode', 'downloads', 'time (s)'))
+    for mode, fetcher in (('unshared', UnsharedFetcher()),
+                          ('shared', imagefetch.ImageFetcher(
+                              args.max_concurrent))):
+        elapsed, downloads = run(args, image_service, image_ids, fetcher)
+        print('%-12s %10d %10.2f' % (mode, downloads, elapsed))
+    stats = fetcher.get_stats()
+    print('fetches %(fetches)d, shared %(shared)d, hits %(hits)d, '
+          'queue wait %(queue_wait).2fs, %(bytes_per_sec).0f bytes/s' % stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Time the regular expression filters of instance_get_all_by_filters over a
+sqlite database of --instances instances.
+
+The name filters are run once with the REGEXP operator, which calls back
+into python for every row, and once with the GLOB predicates the simple
+regular expressions are turned into.  The 'ip' filter is run once by
+scanning the network info caches in python, which is how the addresses of
+all the instances had to be searched before, and once from the
+instance_ip_addresses index.
+
+Run like:
+
+    ./tools/benchmarks/instance_filters.py --instances 100000
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from oslo.config import cfg
+
+from nova import context
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
+from nova.openstack.common.db.sqlalchemy import session as db_session
+from nova.openstack.common import jsonutils
+
+CONF = cfg.CONF
+
+NAME_FILTERS = ['^server-4242', '^server-4242$', 'server-999.*-a$']
+IP_FILTERS = ['^10\\.1\\.42\\.7$', '^10\\.1\\.42\\.']
+
+
+def _network_info(i):
+    address = '10.%d.%d.%d' % (i >> 16, (i >> 8) & 255, i & 255)
+    return jsonutils.dumps([{'network': {'subnets': [{'ips': [
+        {'address': address, 'version': 4, 'floating_ips': []}]}]}}])
+
+
+def populate(engine, num_instances):
+    models.BASE.metadata.create_all(engine,
+            tables=[models.Instance.__table__,
+                    models.InstanceInfoCache.__table__,
+                    models.InstanceIpAddress.__table__])
+    instances = []
+    info_caches = []
+    ip_addresses = []
+    for i in xrange(num_instances):
+        uuid = '%08x-0000-0000-0000-000000000000' % i
+        name = 'server-%d-%s' % (i, 'ab'[i % 2])
+        instances.append({'uuid': uuid, 'display_name': name,
+                          'project_id': 'fake', 'deleted': 0})
+        network_info = _network_info(i)
+        info_caches.append({'instance_uuid': uuid, 'deleted': 0,
+                            'network_info': network_info})
+        for address, version in sqlalchemy_api._network_info_addresses(
+                network_info):
+            ip_addresses.append({'instance_uuid': uuid, 'address': address,
+                                 'version': version, 'deleted': 0})
+    engine.execute(models.Instance.__table__.insert(), instances)
+    engine.execute(models.InstanceInfoCache.__table__.insert(), info_caches)
+    engine.execute(models.InstanceIpAddress.__table__.insert(),
+                   ip_addresses)
+
+
+def _uuids(ctxt, filters):
+    session = sqlalchemy_api.get_session()
+    query = session.query(models.Instance.uuid).filter_by(deleted=0)
+    query = sqlalchemy_api.ip_filter(query, filters)
+    query = sqlalchemy_api.regex_filter(query, models.Instance, filters)
+    return set(row[0] for row in query)
+
+
+def _scan_info_caches(ctxt, regex):
+    """Match the addresses of every info cache, like the network API."""
+    ip_filter = re.compile(regex)
+    session = sqlalchemy_api.get_session()
+    query = session.query(models.InstanceInfoCache.instance_uuid,
+                          models.InstanceInfoCache.network_info).\
+                    filter_by(deleted=0)
+    uuids = set()
+    for instance_uuid, network_info in query:
+        for address, version in sqlalchemy_api._network_info_addresses(
+                network_info):
+            if version == 4 and ip_filter.match(address):
+                uuids.add(instance_uuid)
+    return uuids
+
+
+def _time(func, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        result = func()
+    return (time.time() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instances', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    CONF([], project='nova')
+    CONF.set_override('connection', 'sqlite:///%s' % path, group='database')
+    try:
+        populate(db_session.get_engine(), args.instances)
+        ctxt = context.get_admin_context()
+        simple = sqlalchemy_api._regex_to_wildcards
+
+        print('%-30s %12s %12s %10s %8s' % ('filter', 'before (ms)',
+                                            'after (ms)', 'speedup',
+                                            'matches'))
+        for regex in NAME_FILTERS:
+            sqlalchemy_api._regex_to_wildcards = lambda regex: None
+            before, expected = _time(
+                lambda: _uuids(ctxt, {'display_name': regex}), args.repeat)
+            sqlalchemy_api._regex_to_wildcards = simple
+            after, result = _time(
+                lambda: _uuids(ctxt, {'display_name': regex}), args.repeat)
+            assert result == expected
+            print('%-30s %12.1f %12.1f %9.1fx %8d' % (
+                  'display_name=' + regex, before * 1000, after * 1000,
+                  before / after, len(result)))
+        for regex in IP_FILTERS:
+            before, expected = _time(
+                lambda: _scan_info_caches(ctxt, regex), args.repeat)
+            after, result = _time(
+                lambda: _uuids(ctxt, {'ip': regex}), args.repeat)
+            assert result == expected
+            print('%-30s %12.1f %12.1f %9.1fx %8d' % (
+                  'ip=' + regex, before * 1000, after * 1000,
+                  before / after, len(result)))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
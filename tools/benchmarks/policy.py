@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Run --requests requests through the policy engine with the policy.json of
+the repository, and report how long a policy check takes, with the rules
+evaluated like before, and with them compiled.
+
+A request checks each rule of the policy once against the project of the
+user, like the extensions of a server listing do, then checks
+compute:get for each of --instances instances of the project.
+
+Run like:
+
+    ./tools/benchmarks/policy.py --requests 200 --instances 50
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+
+TOPDIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, TOPDIR)
+
+from oslo.config import cfg
+
+from nova import context
+from nova import policy
+
+CONF = cfg.CONF
+
+POLICY_FILE = os.path.join(TOPDIR, 'etc', 'nova', 'policy.json')
+
+
+def run(actions, num_requests, num_instances):
+    checks = 0
+    start = time.time()
+    for i in xrange(num_requests):
+        ctxt = context.RequestContext('user%d' % i, 'project%d' % i,
+                                      roles=['member'])
+        target = {'project_id': ctxt.project_id, 'user_id': ctxt.user_id}
+        for action in actions:
+            policy.enforce(ctxt, action, target, do_raise=False)
+        for j in xrange(num_instances):
+            instance = {'uuid': 'instance%d' % j,
+                        'project_id': ctxt.project_id,
+                        'user_id': ctxt.user_id}
+            policy.enforce(ctxt, 'compute:get', instance)
+        checks += len(actions) + num_instances
+    return time.time() - start, checks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--instances', type=int, default=50)
+    args = parser.parse_args()
+
+    CONF([], project='nova')
+    CONF.set_override('policy_file', POLICY_FILE)
+    with open(POLICY_FILE) as f:
+        actions = sorted(json.load(f))
+
+    print('%-10s %10s %14s' % ('mode', 'checks', 'us per check'))
+    for mode, compiled, interval in (('legacy', False, 0),
+                                     ('compiled', True, 60)):
+        CONF.set_override('policy_compiled_rules', compiled)
+        CONF.set_override('policy_file_check_interval', interval)
+        policy.reset()
+        elapsed, checks = run(actions, args.requests, args.instances)
+        print('%-10s %10d %14.2f' % (mode, checks,
+                                     elapsed * 1000000 / checks))
+
+
+if __name__ == '__main__':
+    main()
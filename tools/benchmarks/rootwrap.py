@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Run --commands commands through nova-rootwrap, one process per command,
+and through nova-rootwrap-daemon, and report the latency of a command in
+both modes.
+
+The rootwrap configuration of the repository is used, with its filters,
+plus a filter for the command which is run. Both run as the current
+user, pass --sudo to run them through sudo like nova does.
+
+Run like:
+
+    ./tools/benchmarks/rootwrap.py --commands 200 -- ip link show lo
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOPDIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, TOPDIR)
+
+from nova.openstack.common.rootwrap import client as rootwrap_client
+
+ROOTWRAP = 'from nova.openstack.common.rootwrap import cmd; cmd.%s()'
+
+
+def make_config(tmpdir, command):
+    filters_path = os.path.join(tmpdir, 'rootwrap.d')
+    shutil.copytree(os.path.join(TOPDIR, 'etc', 'nova', 'rootwrap.d'),
+                    filters_path)
+    with open(os.path.join(filters_path, 'benchmark.filters'), 'w') as f:
+        f.write('[Filters]\n%s: CommandFilter, %s, root\n' % (
+            os.path.basename(command), command))
+    config = os.path.join(tmpdir, 'rootwrap.conf')
+    with open(config, 'w') as f:
+        f.write('[DEFAULT]\n'
+                'filters_path=%s\n'
+                'exec_dirs=/sbin,/usr/sbin,/bin,/usr/bin\n' % filters_path)
+    return config
+
+
+def run_forked(helper, command, num_commands):
+    latencies = []
+    for i in xrange(num_commands):
+        start = time.time()
+        subprocess.check_call(helper + command, stdout=subprocess.PIPE)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def run_daemon(daemon_cmd, command, num_commands):
+    client = rootwrap_client.Client(daemon_cmd)
+    try:
+        # Do not count the start of the daemon.
+        client.execute(command)
+        latencies = []
+        for i in xrange(num_commands):
+            start = time.time()
+            returncode, out, err = client.execute(command)
+            latencies.append(time.time() - start)
+            assert returncode == 0, err
+        return latencies
+    finally:
+        client.stop()
+
+
+def report(mode, latencies):
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    p50 = latencies[len(latencies) / 2]
+    p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 / 100)]
+    print('%-10s %10.2f %10.2f %10.2f' % (mode, mean * 1000, p50 * 1000,
+                                          p99 * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commands', type=int, default=200)
+    parser.add_argument('--sudo', action='store_true')
+    parser.add_argument('command', nargs='*', default=['true'])
+    args = parser.parse_args()
+
+    # Let the rootwrap processes import nova from this tree.
+    os.environ['PYTHONPATH'] = TOPDIR
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config = make_config(tmpdir, args.command[0])
+        command = [os.path.basename(args.command[0])] + args.command[1:]
+        prefix = ['sudo'] if args.sudo else []
+
+        print('%-10s %10s %10s %10s' % ('mode', 'mean (ms)', 'p50 (ms)',
+                                         'p99 (ms)'))
+        report('fork', run_forked(
+            prefix + [sys.executable, '-c', ROOTWRAP % 'main', config],
+            command, args.commands))
+        report('daemon', run_daemon(
+            prefix + [sys.executable, '-c', ROOTWRAP % 'daemon', config],
+            command, args.commands))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measure how many casts and replies per second the kombu RPC driver
+publishes on the in-memory kombu transport, without the publisher cache,
+with it, and with the cast pipeline on top of it.  The casts are made by
+--concurrency greenthreads, whose casts the pipeline publishes together.
+The replies are not cached, their exchanges are auto_delete.
+
+The memory transport declares the exchanges in the process, so this only
+shows the client side work that is saved.  With a real broker, every
+exchange declaration saved is also a round trip to the broker.
+
+Run like:
+
+    ./tools/benchmarks/rpc_kombu.py --messages 10000
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+from eventlet import greenpool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from oslo.config import cfg
+
+from nova import context
+from nova.openstack.common.rpc import amqp as rpc_amqp
+from nova.openstack.common.rpc import impl_kombu
+
+CONF = cfg.CONF
+
+TOPIC = 'benchmark'
+REPLY_Q = 'reply_benchmark'
+
+MODES = [('no cache', 0, False),
+         ('cache', 256, False),
+         ('cache + pipeline', 256, True)]
+
+
+def _casts(ctxt, num_messages, concurrency):
+    def _cast(i):
+        impl_kombu.cast(CONF, ctxt, TOPIC,
+                        {'method': 'ping', 'args': {'i': i}})
+
+    pool = greenpool.GreenPool(concurrency)
+    for _ in pool.imap(_cast, xrange(num_messages)):
+        pass
+
+
+def _replies(ctxt, num_messages, concurrency):
+    pool = rpc_amqp.get_connection_pool(CONF, impl_kombu.Connection)
+    for i in xrange(num_messages):
+        rpc_amqp.msg_reply(CONF, 'msg-%d' % i, REPLY_Q, pool,
+                           reply={'i': i})
+
+
+def _rate(func, ctxt, num_messages, concurrency, queues, queue):
+    start = time.time()
+    func(ctxt, num_messages, concurrency)
+    elapsed = time.time() - start
+    published = queues.channel.queue_purge(queue)
+    assert published == num_messages, published
+    return num_messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Number of greenthreads making casts')
+    args = parser.parse_args()
+
+    CONF([], project='nova')
+    CONF.set_override('fake_rabbit', True)
+    ctxt = context.get_admin_context()
+
+    # Bind the queues, so that the messages are routed somewhere.
+    queues = impl_kombu.Connection(CONF)
+    queues.declare_topic_consumer(TOPIC, lambda message: None)
+    queues.declare_direct_consumer(REPLY_Q, lambda message: None)
+
+    print('%-20s %14s %14s' % ('mode', 'casts/sec', 'replies/sec'))
+    try:
+        for mode, cache_size, pipeline in MODES:
+            CONF.set_override('rabbit_publisher_cache_size', cache_size)
+            CONF.set_override('rabbit_pipeline_casts', pipeline)
+            casts = _rate(_casts, ctxt, args.messages, args.concurrency,
+                          queues, TOPIC)
+            replies = _rate(_replies, ctxt, args.messages, args.concurrency,
+                            queues, REPLY_Q)
+            print('%-20s %14.0f %14.0f' % (mode, casts, replies))
+            impl_kombu.cleanup()
+    finally:
+        queues.close()
+
+
+if __name__ == '__main__':
+    main()
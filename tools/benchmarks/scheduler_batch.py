@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark the placement of the instances of one multi-instance request
+by the filter scheduler with and without scheduler_batch_placement.
+
+Run like:
+
+    ./tools/benchmarks/scheduler_batch.py --hosts 5000 --instances 500
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+from oslo.config import cfg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from nova import config
+from nova.scheduler import filter_scheduler
+from nova.scheduler import host_manager
+
+CONF = cfg.CONF
+CONF.import_opt('service_down_time', 'nova.service')
+
+FILTERS = ['RamFilter', 'CoreFilter', 'DiskFilter', 'IoOpsFilter',
+           'NumInstancesFilter']
+
+INSTANCE = {'memory_mb': 2048, 'root_gb': 20, 'ephemeral_gb': 0,
+            'swap': 0, 'vcpus': 2, 'project_id': 'fake'}
+
+
+def make_hosts(count):
+    hosts = []
+    for i in xrange(count):
+        host_state = host_manager.HostState('host%d' % i, 'node%d' % i)
+        host_state.total_usable_ram_mb = 131072
+        host_state.free_ram_mb = random.randint(0, 131072)
+        host_state.total_usable_disk_gb = 2048
+        host_state.free_disk_mb = random.randint(0, 2048 * 1024)
+        host_state.vcpus_total = 32
+        host_state.vcpus_used = random.randint(0, 512)
+        host_state.num_io_ops = random.randint(0, 10)
+        host_state.num_instances = random.randint(0, 60)
+        hosts.append(host_state)
+    return hosts
+
+
+def run(hosts, num_instances, repeat, batched):
+    CONF.set_override('scheduler_batch_placement', batched)
+    scheduler = filter_scheduler.FilterScheduler()
+    elapsed = 0.0
+    for _ in xrange(repeat):
+        # Placing the instances consumes resources on the host states.
+        host_states = copy.deepcopy(hosts)
+        filter_properties = {'instance_type': INSTANCE}
+        start = time.time()
+        selected = scheduler._choose_hosts(host_states, filter_properties,
+                                           INSTANCE, num_instances, False)
+        elapsed += time.time() - start
+    return elapsed / repeat, [h.obj.host for h in selected]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=5000)
+    parser.add_argument('--instances', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    config.parse_args([sys.argv[0]])
+    CONF.set_override('scheduler_default_filters', FILTERS)
+    CONF.set_override('scheduler_weight_classes',
+                      ['nova.scheduler.weights.ram.RAMWeigher'])
+
+    hosts = make_hosts(args.hosts)
+    per_instance, expected = run(hosts, args.instances, args.repeat, False)
+    batched, result = run(hosts, args.instances, args.repeat, True)
+    assert result == expected, 'batched placement differs'
+    print('%d instances on %d hosts: per-instance %.1f ms, batched %.1f ms '
+          '(%.1fx)' % (len(result), args.hosts, per_instance * 1000,
+                       batched * 1000, per_instance / batched))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark the scheduler filters and weighers with and without the
+vectorized engine (scheduler_use_vectorized_engine, requires NumPy).
+
+Run like:
+
+    ./tools/benchmarks/scheduler_filters.py --hosts 10000
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from oslo.config import cfg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from nova import config
+from nova.scheduler import columns
+from nova.scheduler import filters
+from nova.scheduler import host_manager
+from nova.scheduler import weights
+
+CONF = cfg.CONF
+
+FILTERS = ['RamFilter', 'CoreFilter', 'DiskFilter', 'IoOpsFilter',
+           'NumInstancesFilter']
+
+
+def make_hosts(count):
+    hosts = []
+    for i in xrange(count):
+        host_state = host_manager.HostState('host%d' % i, 'node%d' % i)
+        host_state.total_usable_ram_mb = 131072
+        host_state.free_ram_mb = random.randint(0, 131072)
+        host_state.total_usable_disk_gb = 2048
+        host_state.free_disk_mb = random.randint(0, 2048 * 1024)
+        host_state.vcpus_total = 32
+        host_state.vcpus_used = random.randint(0, 512)
+        host_state.num_io_ops = random.randint(0, 10)
+        host_state.num_instances = random.randint(0, 60)
+        hosts.append(host_state)
+    return hosts
+
+
+def run(hosts, requests, vectorized):
+    CONF.set_override('scheduler_use_vectorized_engine', vectorized)
+    filter_handler = filters.HostFilterHandler()
+    filter_classes = [cls for cls in filters.all_filters()
+                      if cls.__name__ in FILTERS]
+    weight_handler = weights.HostWeightHandler()
+    weight_classes = weight_handler.get_matching_classes(
+            ['nova.scheduler.weights.ram.RAMWeigher'])
+    filter_properties = {'instance_type': {'memory_mb': 2048, 'root_gb': 20,
+                                           'ephemeral_gb': 0, 'swap': 0,
+                                           'vcpus': 2}}
+
+    start = time.time()
+    for _ in xrange(requests):
+        filtered = filter_handler.get_filtered_objects(filter_classes,
+                hosts, filter_properties)
+        weighed = weight_handler.get_weighed_objects(weight_classes,
+                filtered, filter_properties)
+    elapsed = (time.time() - start) / requests
+    return elapsed, [(h.obj.host, h.weight) for h in weighed]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=10)
+    args = parser.parse_args()
+
+    config.parse_args([sys.argv[0]])
+    if columns.numpy is None:
+        sys.exit('NumPy is required for the vectorized engine')
+
+    hosts = make_hosts(args.hosts)
+    per_host, expected = run(hosts, args.requests, False)
+    vectorized, result = run(hosts, args.requests, True)
+    assert result == expected, 'vectorized results differ'
+    print('%d hosts: per-host %.1f ms, vectorized %.1f ms (%.1fx)' %
+          (args.hosts, per_host * 1000, vectorized * 1000,
+           per_host / vectorized))
+
+
+if __name__ == '__main__':
+    main()
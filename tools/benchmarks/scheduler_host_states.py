@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark HostManager.get_all_host_states() with and without the
+incremental host state cache.
+
+An in-memory sqlite database is populated with N compute nodes (and their
+services and stats).  Between two scheduling requests a small fraction of
+the compute nodes report new usage, as they would on a busy cloud.
+
+Run like:
+
+    ./tools/benchmarks/scheduler_host_states.py --nodes 1000 5000 10000
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+from oslo.config import cfg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from nova import config
+from nova import context
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
+from nova.openstack.common import timeutils
+from nova.scheduler import host_manager
+
+CONF = cfg.CONF
+
+STATS_PER_NODE = 10
+
+
+def populate(engine, num_nodes):
+    now = timeutils.utcnow()
+    services = models.Service.__table__
+    compute_nodes = models.ComputeNode.__table__
+    stats = models.ComputeNodeStat.__table__
+    with engine.begin() as conn:
+        conn.execute(services.insert(), [
+            dict(id=i, host='host%d' % i, binary='nova-compute',
+                 topic='compute', report_count=0, disabled=False,
+                 created_at=now, updated_at=now, deleted=0)
+            for i in xrange(1, num_nodes + 1)])
+        conn.execute(compute_nodes.insert(), [
+            dict(id=i, service_id=i, vcpus=32, memory_mb=131072,
+                 local_gb=2048, vcpus_used=0, memory_mb_used=0,
+                 local_gb_used=0, free_ram_mb=131072, free_disk_gb=2048,
+                 disk_available_least=2048, hypervisor_type='QEMU',
+                 hypervisor_version=1000000, hypervisor_hostname='node%d' % i,
+                 cpu_info='{}', host_ip='10.0.0.1', created_at=now,
+                 updated_at=now, deleted=0)
+            for i in xrange(1, num_nodes + 1)])
+        conn.execute(stats.insert(), [
+            dict(compute_node_id=i, key='num_proj_%d' % j, value='1',
+                 created_at=now, deleted=0)
+            for i in xrange(1, num_nodes + 1)
+            for j in xrange(STATS_PER_NODE)])
+
+
+def touch_nodes(engine, num_nodes, churn):
+    """Simulate compute nodes reporting new usage."""
+    compute_nodes = models.ComputeNode.__table__
+    node_ids = random.sample(xrange(1, num_nodes + 1),
+                             max(1, int(num_nodes * churn)))
+    timeutils.advance_time_seconds(1)
+    with engine.begin() as conn:
+        conn.execute(compute_nodes.update().
+                         where(compute_nodes.c.id.in_(node_ids)).
+                         values(free_ram_mb=65536,
+                                updated_at=timeutils.utcnow()))
+
+
+def run(num_nodes, requests, churn, incremental):
+    engine = sqlalchemy_api.get_engine()
+    models.BASE.metadata.drop_all(engine)
+    models.BASE.metadata.create_all(engine)
+    populate(engine, num_nodes)
+
+    CONF.set_override('scheduler_incremental_host_state', incremental)
+    ctxt = context.get_admin_context()
+    manager = host_manager.HostManager()
+    # The first refresh is always a full one.
+    list(manager.get_all_host_states(ctxt))
+
+    elapsed = 0.0
+    for _ in xrange(requests):
+        touch_nodes(engine, num_nodes, churn)
+        start = time.time()
+        host_states = list(manager.get_all_host_states(ctxt))
+        elapsed += time.time() - start
+        assert len(host_states) == num_nodes
+    return elapsed / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, nargs='+',
+                        default=[1000, 5000, 10000])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--churn', type=float, default=0.01,
+                        help='Fraction of nodes updated between requests')
+    args = parser.parse_args()
+
+    config.parse_args([sys.argv[0]])
+    CONF.set_override('connection', 'sqlite://', group='database')
+    timeutils.set_time_override(datetime.datetime(2013, 1, 1))
+
+    print('%8s %14s %14s %8s' % ('nodes', 'full (ms)', 'incr. (ms)',
+                                 'speedup'))
+    for num_nodes in args.nodes:
+        full = run(num_nodes, args.requests, args.churn, False)
+        incremental = run(num_nodes, args.requests, args.churn, True)
+        print('%8d %14.1f %14.1f %7.1fx' % (num_nodes, full * 1000,
+                                             incremental * 1000,
+                                             full / incremental))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Simulate several schedulers placing instances with and without
+scheduler_sharding, and report the retry rate and placement time as the
+number of schedulers grows.
+
+Every scheduler picks the host with the most free RAM from its own copy of
+the host states, which is only refreshed every --refresh requests, like
+the copies of the real schedulers between two compute node updates.  A
+placement on a host that turns out to be full is retried, like a failed
+claim on the compute node would be.  By default the requests fill all
+the hosts, most of the retries happen as the hosts get full.
+
+Run like:
+
+    ./tools/benchmarks/scheduler_shards.py --schedulers 1 2 4 8 16
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from nova.scheduler import shards
+
+INSTANCE_MB = 2048
+
+
+class Scheduler(object):
+    def __init__(self, name, hosts, owners):
+        self.name = name
+        self.hosts = hosts
+        self.owners = owners
+        self.view = {}
+        self.requests = 0
+
+    def refresh(self, free_ram_mb):
+        self.view = dict(free_ram_mb)
+
+    def _best(self, hosts, exclude):
+        best = None
+        for host in hosts:
+            free = self.view[host]
+            if free >= INSTANCE_MB and host not in exclude:
+                if best is None or free > self.view[best]:
+                    best = host
+        return best
+
+    def choose(self, exclude, sharded):
+        if not sharded:
+            host = self._best(self.hosts, exclude)
+        else:
+            host = self._best(self.owners[self.name], exclude)
+            if host is None:
+                others = [h for name, hosts in self.owners.items()
+                          if name != self.name for h in hosts]
+                host = self._best(others, exclude)
+        if host is not None:
+            self.view[host] -= INSTANCE_MB
+        return host
+
+
+def run(num_schedulers, num_hosts, num_requests, refresh, sharded):
+    hosts = ['host%d' % i for i in xrange(num_hosts)]
+    free_ram_mb = dict((host, 32 * INSTANCE_MB) for host in hosts)
+    names = ['scheduler%d' % i for i in xrange(num_schedulers)]
+    ring = shards.HashRing(names)
+    owners = dict((name, []) for name in names)
+    for host in hosts:
+        owners[ring.get_member(host)].append(host)
+    schedulers = [Scheduler(name, hosts, owners) for name in names]
+    for scheduler in schedulers:
+        scheduler.refresh(free_ram_mb)
+
+    retries = 0
+    placed = 0
+    elapsed = 0.0
+    for request in xrange(num_requests):
+        tried = set()
+        scheduler = schedulers[request % num_schedulers]
+        while True:
+            if scheduler.requests % refresh == 0:
+                scheduler.refresh(free_ram_mb)
+            scheduler.requests += 1
+            start = time.time()
+            host = scheduler.choose(tried, sharded)
+            elapsed += time.time() - start
+            if host is None:
+                break
+            if free_ram_mb[host] >= INSTANCE_MB:
+                free_ram_mb[host] -= INSTANCE_MB
+                placed += 1
+                break
+            # The claim failed, the next scheduler retries the request.
+            retries += 1
+            tried.add(host)
+            scheduler = schedulers[(request + retries) % num_schedulers]
+    return (float(retries) / num_requests, placed,
+            elapsed / (num_requests + retries))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--schedulers', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16])
+    parser.add_argument('--hosts', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=16000,
+                        help='Each host has room for 32 instances')
+    parser.add_argument('--refresh', type=int, default=20,
+                        help='Requests between two host state refreshes')
+    args = parser.parse_args()
+
+    print('%10s %8s %12s %12s %10s %10s' % ('schedulers', 'sharded',
+                                            'retry rate', 'placed',
+                                            'time (ms)', 'speedup'))
+    for num_schedulers in args.schedulers:
+        results = {}
+        for sharded in (False, True):
+            results[sharded] = run(num_schedulers, args.hosts,
+                                   args.requests, args.refresh, sharded)
+            retry_rate, placed, elapsed = results[sharded]
+            print('%10d %8s %12.3f %12d %10.3f %10s' % (
+                  num_schedulers, sharded, retry_rate, placed,
+                  elapsed * 1000,
+                  '%.1fx' % (results[False][2] / elapsed) if sharded else ''))
+
+
+if __name__ == '__main__':
+    main()
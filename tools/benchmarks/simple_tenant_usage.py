@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# Copyright 2013 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Fill a SQLite database with --instances instances of --projects projects,
+launched over the last 60 days, and report how long getting the usage of
+all the projects over the last 30 days takes: by loading the instances
+and summing their usage in Python like the simple tenant usage API did,
+with the database summing it, and reading the usage of every instance.
+Loading 200000 instances like before takes several GB of memory, pass
+--no-legacy to skip it.
+
+Run like:
+
+    ./tools/benchmarks/simple_tenant_usage.py --instances 200000
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from oslo.config import cfg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from nova.compute import flavors
+from nova import config
+from nova import context
+from nova import db
+from nova.db import migration
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
+from nova.openstack.common import timeutils
+from nova.openstack.common import uuidutils
+
+CONF = cfg.CONF
+
+BATCH_SIZE = 10000
+
+FLAVORS = [
+    dict(id=100 + i, name='bench%d' % i, flavorid='bench%d' % i,
+         memory_mb=512 * 2 ** i, vcpus=2 ** i, root_gb=10 * 2 ** i,
+         ephemeral_gb=i * 10, swap=0, rxtx_factor=1.0, vcpu_weight=None,
+         disabled=False, is_public=True)
+    for i in xrange(5)]
+
+
+def fill_database(num_instances, num_projects, now):
+    engine = sqlalchemy_api.get_engine()
+    # Migrate the database for the indexes of the real schema.
+    migration.db_sync()
+    engine.execute(models.InstanceTypes.__table__.insert(), FLAVORS)
+
+    instances = []
+    sys_meta = []
+    for i in xrange(num_instances):
+        flavor = random.choice(FLAVORS)
+        uuid = uuidutils.generate_uuid()
+        launched_at = now - datetime.timedelta(
+            seconds=random.randint(0, 60 * 24 * 3600))
+        terminated_at = None
+        if random.random() < 0.4:
+            terminated_at = launched_at + datetime.timedelta(
+                seconds=random.randint(0, 30 * 24 * 3600))
+        instances.append({'uuid': uuid,
+                          'project_id': 'project%d' % (i % num_projects),
+                          'user_id': 'user',
+                          'display_name': 'server%d' % i,
+                          'vm_state': 'active',
+                          'instance_type_id': flavor['id'],
+                          'launched_at': launched_at,
+                          'terminated_at': terminated_at,
+                          'deleted': 0})
+        for key, value in flavors.save_flavor_info({}, flavor).items():
+            if value is not None:
+                value = str(value)
+            sys_meta.append({'instance_uuid': uuid, 'key': key,
+                             'value': value, 'deleted': 0})
+
+        if len(instances) == BATCH_SIZE or i == num_instances - 1:
+            engine.execute(models.Instance.__table__.insert(), instances)
+            engine.execute(models.InstanceSystemMetadata.__table__.insert(),
+                           sys_meta)
+            instances = []
+            sys_meta = []
+
+
+def legacy_usage(ctxt, begin, end):
+    """Sum the usage like the simple tenant usage API did."""
+    usages = {}
+    for instance in db.instance_get_active_by_window_joined(ctxt, begin,
+                                                            end):
+        start = max(instance['launched_at'], begin)
+        stop = min(end, instance['terminated_at'] or end)
+        hours = timeutils.delta_seconds(start, stop) / 3600.0
+        flavor = flavors.extract_flavor(instance)
+        usage = usages.setdefault(instance['project_id'], [0, 0, 0, 0])
+        usage[0] += hours
+        usage[1] += hours * flavor['vcpus']
+        usage[2] += hours * flavor['memory_mb']
+        usage[3] += hours * (flavor['root_gb'] + flavor['ephemeral_gb'])
+    return usages
+
+
+def sql_usage(ctxt, begin, end):
+    return db.instance_usage_get_totals_by_window(ctxt, begin, end)
+
+
+def sql_detailed_usage(ctxt, begin, end):
+    return sum(1 for usage in db.instance_usage_get_by_window(ctxt, begin,
+                                                              end))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instances', type=int, default=200000)
+    parser.add_argument('--projects', type=int, default=500)
+    parser.add_argument('--no-legacy', action='store_true',
+                        help='Do not load all the instances in memory')
+    args = parser.parse_args()
+
+    config.parse_args([sys.argv[0]])
+    tmpdir = tempfile.mkdtemp()
+    try:
+        CONF.set_override('connection',
+                          'sqlite:///%s' % os.path.join(tmpdir, 'nova.sqlite'),
+                          group='database')
+        now = timeutils.utcnow()
+        start = time.time()
+        fill_database(args.instances, args.projects, now)
+        print('Filled the database in %.1f s' % (time.time() - start))
+
+        ctxt = context.get_admin_context()
+        begin = now - datetime.timedelta(days=30)
+        print('%-10s %10s' % ('mode', 'time (s)'))
+        modes = [('sql', sql_usage), ('detailed', sql_detailed_usage)]
+        if not args.no_legacy:
+            modes.append(('legacy', legacy_usage))
+        for mode, func in modes:
+            start = time.time()
+            func(ctxt, begin, now)
+            print('%-10s %10.2f' % (mode, time.time() - start))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()